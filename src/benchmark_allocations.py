@@ -0,0 +1,107 @@
+# CHROMA CHORD GENERATOR - ALLOCATION BENCHMARK
+# --------------------------
+# This script profiles the memory allocated and the GC pauses while generating
+# each chord, as OSCHandler does for each melody note, and checks that a steady
+# state note stays within an allocation budget, exiting with an error if not,
+# so that changes allocating more on the per-note hot path are caught:
+#
+#   python ./src/benchmark_allocations.py --notes 1000 --peak-budget-kb 8 --net-budget-bytes 0
+#
+# By default the model is replaced by one returning a fixed chord, so that only
+# the code around the model is measured. Add --model-path to include a real
+# model, whose allocations within TensorFlow aren't traced.
+# --------------------------
+
+import argparse
+import json
+import os
+import sys
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+import numpy as np
+
+from chord_generation_utils.allocation_profiler import AllocationProfiler
+from chord_generation_utils.chord_generator import ChordGenerator
+from chord_generation_utils.chord_transitions import get_chord_transition
+
+class FixedChordModel:
+    """Stands in for the model, always predicting the same chord, so that the benchmark measures the code around the model."""
+
+    CHROMA_HISTOGRAM = np.asarray([[0.4, 0, 0, 0, 0.3, 0, 0, 0.3, 0, 0, 0, 0]], dtype=np.float32)
+
+    def __call__(self, input_sequences: np.ndarray) -> np.ndarray:
+        return self.CHROMA_HISTOGRAM
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Profile the allocations of each note, and check a steady state note stays within a budget.")
+    parser.add_argument("--notes", type=int, default=1000, help="Notes to profile after warming up.")
+    parser.add_argument("--warm-up-notes", type=int, default=100, help="Notes to generate before profiling, so that caches and lazily created objects are in place.")
+    parser.add_argument("--model-path", default=None, help="Model to generate chords with, instead of a fixed chord.")
+    parser.add_argument("--peak-budget-kb", type=float, default=8, help="Largest median peak KB allocated by a note.")
+    parser.add_argument("--net-budget-bytes", type=float, default=0, help="Largest median bytes a note may leave allocated.")
+    parser.add_argument("--output-path", default=None, help="Also write the report to this JSON file.")
+    return parser.parse_args()
+
+def play_note(chord_generator: ChordGenerator, melody_note_midi_number: int, intensity: float, state: dict) -> None:
+    """Generate and voice the chord of a note as OSCHandler.handle_melody_note() does, with the same stages, keeping the notes sounding in the state."""
+    with chord_generator.profile_note():
+        __play_note(chord_generator, melody_note_midi_number, intensity, state)
+
+def __play_note(chord_generator: ChordGenerator, melody_note_midi_number: int, intensity: float, state: dict) -> None:
+    # Within its own function, so that the note's objects are freed before the note is recorded, as in OSCHandler
+    chord = chord_generator.get_chord(melody_note_midi_number)
+    with chord_generator.profile("voicing"):
+        voiced_chord = chord.get_voiced_chord(intensity=intensity)
+    with chord_generator.profile("send"):
+        _, _, state["sounding_notes"] = get_chord_transition(state["sounding_notes"], voiced_chord)
+        chord.get_thresholded_chroma_histogram().tolist()
+
+def main() -> None:
+    args = parse_args()
+
+    chord_generator = ChordGenerator(
+        model_path=args.model_path or "fixed_chord",
+        sequence_length=8,
+        tonic=0,
+        chord_note_threshold=0.14,
+        threshold_input_sequence=True,
+        update_direction="append",
+        seed=0,
+        model=None if args.model_path is not None else FixedChordModel()
+    )
+
+    # The same melody for every run, so that the budget is checked against the same notes
+    rng = np.random.default_rng(0)
+    melody = rng.integers(48, 84, args.warm_up_notes + args.notes)
+    intensities = rng.uniform(0, 1, args.warm_up_notes + args.notes)
+
+    state = {"sounding_notes": None}
+    for melody_note_midi_number, intensity in zip(melody[:args.warm_up_notes], intensities[:args.warm_up_notes]):
+        play_note(chord_generator, int(melody_note_midi_number), float(intensity), state)
+
+    profiler = AllocationProfiler()
+    chord_generator.profiler = profiler
+    profiler.start()
+    for melody_note_midi_number, intensity in zip(melody[args.warm_up_notes:], intensities[args.warm_up_notes:]):
+        play_note(chord_generator, int(melody_note_midi_number), float(intensity), state)
+    profiler.stop()
+    profiler.print_report()
+
+    # Check the budget against the median note, which is steady state, as the occasional note collecting garbage isn't representative
+    notes = profiler.get_note_records()
+    median_peak_kb = float(np.median([note["peak_bytes"] for note in notes])) / 1024
+    median_net_bytes = float(np.median([note["net_bytes"] for note in notes]))
+    within_budget = median_peak_kb <= args.peak_budget_kb and median_net_bytes <= args.net_budget_bytes
+    print(f"Steady state note: {round(median_peak_kb, 2)} KB peak (budget {args.peak_budget_kb} KB), {round(median_net_bytes)} bytes net (budget {args.net_budget_bytes} bytes): {'WITHIN' if within_budget else 'OVER'} BUDGET")
+
+    if args.output_path is not None:
+        with open(args.output_path, "w") as output_file:
+            json.dump(dict(profiler.get_report(), median_peak_kb=median_peak_kb, median_net_bytes=median_net_bytes, within_budget=within_budget, args=vars(args)), output_file, indent=2)
+        print(f"Saved report to {args.output_path}")
+
+    if not within_budget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,182 @@
+# CHROMA CHORD GENERATOR - TRANSPORT BENCHMARK
+# --------------------------
+# This script compares the round trip latency of a melody note and its chord
+# through the OSC transport and the shared memory transport, each served by a
+# chord generator in its own process, as for a client on the same host:
+#
+#   python ./src/benchmark_transports.py --notes 2000
+#
+# By default the model is replaced by one returning a fixed chord, so that only
+# the transports are measured. Add --model-path to include a real model.
+# --------------------------
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+import numpy as np
+from pythonosc import udp_client, osc_server
+from pythonosc.dispatcher import Dispatcher
+
+from chord_generation_utils.chord_generator import ChordGenerator
+from chord_generation_utils.osc import OSCHandler
+from chord_generation_utils.shared_memory_handler import SharedMemoryHandler
+from chord_generation_utils.shared_memory_client import SharedMemoryClient
+
+class FixedChordModel:
+    """Stands in for the model, always predicting the same chord, so that the benchmark measures the transports alone."""
+
+    CHROMA_HISTOGRAM = np.asarray([0.4, 0, 0, 0, 0.3, 0, 0, 0.3, 0, 0, 0, 0], dtype=np.float32)
+
+    def __call__(self, input_sequences: np.ndarray) -> np.ndarray:
+        return np.tile(self.CHROMA_HISTOGRAM, (len(input_sequences), 1))
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare the round trip latency of the OSC and shared memory transports.")
+    parser.add_argument("--notes", type=int, default=2000, help="Melody notes sent through each transport.")
+    parser.add_argument("--warm-up-notes", type=int, default=50, help="Notes sent before measuring, left out of the results.")
+    parser.add_argument("--model-path", default=None, help="Model to generate chords with, by default a fixed chord to measure the transports alone.")
+    parser.add_argument("--poll-interval", type=float, default=0.0001, help="Secs the shared memory handler sleeps when no requests are waiting.")
+    parser.add_argument("--output-path", default=None, help="Also write the results to this JSON file.")
+
+    return parser.parse_args(argv)
+
+def make_chord_generator(model_path: str | None) -> ChordGenerator:
+    return ChordGenerator(
+        model_path=model_path if model_path is not None else "fixed_chord",
+        sequence_length=8,
+        tonic=0,
+        chord_note_threshold=0.14,
+        threshold_input_sequence=True,
+        update_direction="append",
+        seed=0,
+        model=None if model_path is not None else FixedChordModel()
+    )
+
+def serve_osc(model_path: str | None, server_port: int, client_port: int) -> None:
+    OSCHandler(make_chord_generator(model_path), server_port=server_port, client_port=client_port)
+
+def serve_shared_memory(model_path: str | None, name: str, poll_interval: float) -> None:
+    # Stopped with an interrupt, which closes and removes the rings
+    try:
+        SharedMemoryHandler(make_chord_generator(model_path), name=name, poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+def get_free_udp_ports(count: int) -> list[int]:
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(count)]
+    for port_socket in sockets:
+        port_socket.bind(("127.0.0.1", 0))
+    ports = [port_socket.getsockname()[1] for port_socket in sockets]
+    for port_socket in sockets:
+        port_socket.close()
+    return ports
+
+def get_latency_stats(transport: str, latencies_us: list[float], total_secs: float) -> dict:
+    return {
+        "transport": transport,
+        "notes": len(latencies_us),
+        "mean_us": float(np.mean(latencies_us)),
+        "p50_us": float(np.percentile(latencies_us, 50)),
+        "p99_us": float(np.percentile(latencies_us, 99)),
+        "max_us": float(np.max(latencies_us)),
+        "notes_per_sec": len(latencies_us) / total_secs
+    }
+
+def benchmark_osc(args: argparse.Namespace, melody_notes: np.ndarray) -> dict:
+    server_port, client_port = get_free_udp_ports(2)
+    server_process = multiprocessing.get_context("spawn").Process(target=serve_osc, args=(args.model_path, server_port, client_port), daemon=True)
+    server_process.start()
+
+    # Receive chords, which end with their histogram message
+    histograms = queue.Queue()
+    dispatcher = Dispatcher()
+    dispatcher.map("/histogram", lambda address, *values: histograms.put(values))
+    receiver = osc_server.BlockingOSCUDPServer(("127.0.0.1", client_port), dispatcher)
+    threading.Thread(target=receiver.serve_forever, daemon=True).start()
+    client = udp_client.SimpleUDPClient("127.0.0.1", server_port)
+
+    try:
+        # Wait for the server to start, as messages sent before then are lost
+        while True:
+            client.send_message("/melody_note", [60, 0.5])
+            try:
+                histograms.get(timeout=1)
+                break
+            except queue.Empty:
+                if not server_process.is_alive():
+                    raise RuntimeError("OSC server process failed to start")
+
+        latencies_us = []
+        for i, melody_note in enumerate(melody_notes):
+            note_start_time = time.perf_counter()
+            client.send_message("/melody_note", [int(melody_note), 0.5])
+            histograms.get(timeout=10)
+            if i == args.warm_up_notes:
+                benchmark_start_time = note_start_time
+            if i >= args.warm_up_notes:
+                latencies_us.append((time.perf_counter() - note_start_time) * 1e6)
+        total_secs = time.perf_counter() - benchmark_start_time
+
+    finally:
+        receiver.shutdown()
+        receiver.server_close()
+        server_process.terminate()
+        server_process.join()
+
+    return get_latency_stats("osc", latencies_us, total_secs)
+
+def benchmark_shared_memory(args: argparse.Namespace, melody_notes: np.ndarray) -> dict:
+    name = f"chroma_chord_generator_benchmark_{os.getpid()}"
+    server_process = multiprocessing.get_context("spawn").Process(target=serve_shared_memory, args=(args.model_path, name, args.poll_interval), daemon=True)
+    server_process.start()
+
+    client = SharedMemoryClient(name, connect_timeout=60)
+    try:
+        latencies_us = []
+        for i, melody_note in enumerate(melody_notes):
+            note_start_time = time.perf_counter()
+            client.get_chord(int(melody_note), 0.5, timeout=60 if i == 0 else 10)
+            if i == args.warm_up_notes:
+                benchmark_start_time = note_start_time
+            if i >= args.warm_up_notes:
+                latencies_us.append((time.perf_counter() - note_start_time) * 1e6)
+        total_secs = time.perf_counter() - benchmark_start_time
+
+    finally:
+        client.close()
+        # Stopping the handler with SIGTERM would leave its rings behind, so interrupt it instead
+        os.kill(server_process.pid, signal.SIGINT)
+        server_process.join()
+
+    return get_latency_stats("shared_memory", latencies_us, total_secs)
+
+def main(argv: list[str] = None) -> None:
+    args = parse_args(argv)
+
+    melody_notes = np.random.RandomState(0).randint(48, 84, size=args.warm_up_notes + args.notes)
+
+    results = []
+    for transport, benchmark in [("OSC", benchmark_osc), ("shared memory", benchmark_shared_memory)]:
+        print(f"Benchmarking {transport} transport with {args.notes} notes...")
+        results.append(benchmark(args, melody_notes))
+
+    print(f"{'transport':<15} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'max us':>10} {'notes/sec':>10}")
+    for result in results:
+        print(f"{result['transport']:<15} {result['mean_us']:>10.1f} {result['p50_us']:>10.1f} {result['p99_us']:>10.1f} {result['max_us']:>10.1f} {result['notes_per_sec']:>10.1f}")
+
+    if args.output_path is not None:
+        with open(args.output_path, "w") as output_file:
+            json.dump({"model_path": args.model_path, "results": results}, output_file, indent=2)
+        print(f"Saved results to {args.output_path}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,5 +1,34 @@
-from .chord import Chord
-from .input_sequence import InputSequence
-from .chord_generator import ChordGenerator
-from .osc import OSCHandler
-from .chord_voicing_engine import ChordVoicingEngine
\ No newline at end of file
+import importlib
+
+# Module of each class, imported when the class is first used, so that e.g. the histogram kernels can be
+# imported by dataset processing without also importing TensorFlow
+_CLASS_MODULES = {
+    "Chord": ".chord",
+    "InputSequence": ".input_sequence",
+    "ChordGenerator": ".chord_generator",
+    "OSCHandler": ".osc",
+    "ChordVoicingEngine": ".chord_voicing_engine",
+    "BatchHarmonizer": ".batch_harmonizer",
+    "ChordDecoder": ".chord_decoder",
+    "SessionLogWriter": ".session_log",
+    "SessionLogReader": ".session_log",
+    "SharedMemoryHandler": ".shared_memory_handler",
+    "SharedMemoryClient": ".shared_memory_client",
+    "InferencePool": ".inference_pool",
+    "DeadlineScheduler": ".note_scheduler",
+    "SharedPredictionCache": ".shared_prediction_cache",
+    "NumpyChordGeneratorModel": ".numpy_chord_generator_model",
+    "AllocationProfiler": ".allocation_profiler",
+    "ChromaCodebook": ".chroma_codebook",
+    "NeighbourChordModel": ".neighbour_chord_model"
+}
+
+__all__ = list(_CLASS_MODULES)
+
+def __getattr__(name: str) -> any:
+    if name in _CLASS_MODULES:
+        return getattr(importlib.import_module(_CLASS_MODULES[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__() -> list[str]:
+    return sorted(list(globals()) + __all__)
\ No newline at end of file
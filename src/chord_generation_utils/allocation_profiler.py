@@ -0,0 +1,247 @@
+import gc
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+
+# Columns of the stage records
+CALLS = 0
+PEAK_BYTES = 1
+NET_BYTES = 2
+GC_COLLECTIONS = 3
+GC_PAUSE_MS = 4
+MAX_PEAK_BYTES = 5
+MAX_GC_PAUSE_MS = 6
+
+# Columns of the open stages
+STAGE_INDEX = 0
+START_BYTES = 1
+STAGE_PEAK_BYTES = 2
+STAGE_GC_COLLECTIONS = 3
+STAGE_GC_PAUSE_MS = 4
+
+class AllocationProfiler:
+    def __init__(self, max_notes: int = 2000, max_stages: int = 32, max_depth: int = 16) -> None:
+
+        """
+        Records the memory allocated while generating each chord, and the garbage collector pauses it triggers, for
+        keeping the per-note hot path from allocating enough short-lived objects to cause GC pauses during performance.
+
+        Code being profiled wraps each note in profiler.note(), and each stage of it in profiler.stage("<name>"), as
+        ChordGenerator and OSCHandler do when the chord generator has a profiler. For each stage and note, it records:
+
+        - Peak bytes: the most memory allocated at once above that at the start, i.e., the short-lived allocations.
+        - Net bytes: the memory still allocated at the end, i.e., the allocations kept, e.g., by a growing list.
+        - GC collections and pause time, counted for every stage open while the collector ran.
+
+        Memory is traced with tracemalloc, which only sees allocations made through Python's allocators, including NumPy
+        arrays, but not those made internally by TensorFlow. Tracing slows everything down, so only profile when needed.
+        Records are kept in preallocated arrays rather than Python objects, so that profiling doesn't itself allocate
+        objects tracked by the garbage collector and trigger collections. Stage names are dotted, e.g. "get_chord.predict"
+        is within "get_chord", so a nested stage is also included in its parent.
+
+        Parameters:
+            max_notes:  int (default 2000). Number of the latest notes to keep the records of.
+            max_stages: int (default 32). Number of differently named stages which can be recorded.
+            max_depth:  int (default 16). Number of stages which can be open at once, including the note.
+        """
+
+        self.MAX_NOTES = max_notes
+        self.MAX_STAGES = max_stages
+        self.MAX_DEPTH = max_depth
+        self.is_profiling = False
+        self.__started_tracemalloc = False
+        self.reset()
+
+    def reset(self) -> None:
+        """Clears all recorded notes and stages."""
+        # Stage name -> row of the stage records, the note itself being the first
+        self.__stage_indices = {"note": 0}
+
+        # Totals of each stage over all calls, and of each stage within each of the latest notes, in a ring
+        self.__stage_totals = np.zeros((self.MAX_STAGES, 7))
+        self.__note_records = np.zeros((self.MAX_NOTES, self.MAX_STAGES, 7))
+        self.__notes_recorded = 0
+
+        # Open stages, innermost last
+        self.__open_stages = np.zeros((self.MAX_DEPTH, 5))
+        self.__depth = 0
+        self.__gc_start_time = None
+
+    def start(self) -> None:
+        """Start tracing allocations and GC pauses."""
+        if self.is_profiling:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started_tracemalloc = True
+        gc.callbacks.append(self.__on_gc)
+        self.is_profiling = True
+
+    def stop(self) -> None:
+        """Stop tracing allocations and GC pauses, keeping what was recorded."""
+        if not self.is_profiling:
+            return
+        gc.callbacks.remove(self.__on_gc)
+        if self.__started_tracemalloc:
+            tracemalloc.stop()
+            self.__started_tracemalloc = False
+        self.is_profiling = False
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the allocations and GC pauses within the with block as the given stage, including if it raises."""
+        if not self.is_profiling or self.__depth == self.MAX_DEPTH:
+            yield
+            return
+
+        stage_index = self.__stage_indices.get(name)
+        if stage_index is None:
+            if len(self.__stage_indices) == self.MAX_STAGES:
+                raise ValueError(f"Can't record more than {self.MAX_STAGES} differently named stages. Received stage {name}.")
+            stage_index = self.__stage_indices[name] = len(self.__stage_indices)
+
+        # A note starts a new record, cleared in place
+        is_note = stage_index == 0 and self.__depth == 0
+        if is_note:
+            self.__note_records[self.__notes_recorded % self.MAX_NOTES] = 0
+
+        # Take the stage's row before measuring, so that the view isn't counted in the stage
+        open_stage = self.__open_stages[self.__depth]
+
+        # tracemalloc only keeps one peak, so save the peak of the enclosing stage before resetting it for this one
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        if self.__depth > 0:
+            self.__open_stages[self.__depth - 1, STAGE_PEAK_BYTES] = max(self.__open_stages[self.__depth - 1, STAGE_PEAK_BYTES], peak_bytes)
+        tracemalloc.reset_peak()
+        open_stage[:] = [stage_index, current_bytes, current_bytes, 0, 0]
+        self.__depth += 1
+        try:
+            yield
+        finally:
+            end_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            self.__depth -= 1
+            peak_bytes = max(open_stage[STAGE_PEAK_BYTES], peak_bytes)
+            if self.__depth > 0:
+                self.__open_stages[self.__depth - 1, STAGE_PEAK_BYTES] = max(self.__open_stages[self.__depth - 1, STAGE_PEAK_BYTES], peak_bytes)
+
+            # Add to the totals of the stage, and of the stage within the current note if there is one
+            self.__add_to_record(self.__stage_totals[stage_index], open_stage, peak_bytes, end_bytes)
+            if is_note or self.__depth > 0 and self.__open_stages[0, STAGE_INDEX] == 0:
+                self.__add_to_record(self.__note_records[self.__notes_recorded % self.MAX_NOTES, stage_index], open_stage, peak_bytes, end_bytes)
+            if is_note:
+                self.__notes_recorded += 1
+
+    def note(self):
+        """Record the allocations and GC pauses within the with block as one note, with the stages within it."""
+        return self.stage("note")
+
+    def get_note_records(self) -> list[dict]:
+        """
+        Get the records of the latest notes, oldest first, each with the peak and net bytes, GC collections and pause time
+        of the note, and of each stage within it, summed over the stage's calls within the note.
+        """
+        num_notes = min(self.__notes_recorded, self.MAX_NOTES)
+        note_rows = np.arange(self.__notes_recorded - num_notes, self.__notes_recorded) % self.MAX_NOTES
+        return [
+            dict(self.__get_stage_record(self.__note_records[row, 0]), stages={
+                name: self.__get_stage_record(self.__note_records[row, stage_index])
+                for name, stage_index in self.__stage_indices.items()
+                if stage_index > 0 and self.__note_records[row, stage_index, CALLS] > 0
+            })
+            for row in note_rows
+        ]
+
+    def get_report(self) -> dict[str, any]:
+        """Get the recorded allocations and GC pauses as a JSON serialisable dict."""
+        notes = self.get_note_records()
+        note_peak_bytes = np.asarray([note["peak_bytes"] for note in notes], dtype=float)
+        note_gc_pause_ms = np.asarray([note["gc_pause_ms"] for note in notes], dtype=float)
+        return {
+            "notes": {
+                "count": len(notes),
+                "mean_peak_bytes": float(note_peak_bytes.mean()) if len(notes) > 0 else 0.0,
+                "p99_peak_bytes": float(np.percentile(note_peak_bytes, 99)) if len(notes) > 0 else 0.0,
+                "mean_net_bytes": float(np.mean([note["net_bytes"] for note in notes])) if len(notes) > 0 else 0.0,
+                "notes_with_gc": int(np.count_nonzero(note_gc_pause_ms)),
+                "max_gc_pause_ms": float(note_gc_pause_ms.max()) if len(notes) > 0 else 0.0
+            },
+            "stages": {
+                name: self.__get_stage_record(self.__stage_totals[stage_index])
+                for name, stage_index in sorted(self.__stage_indices.items())
+                if self.__stage_totals[stage_index, CALLS] > 0
+            }
+        }
+
+    def print_report(self) -> None:
+        report = self.get_report()
+        notes = report["notes"]
+        print(f"ALLOCATION PROFILE ({notes['count']} notes)")
+        print(f"Per note: {round(notes['mean_peak_bytes'] / 1024, 2)} KB peak (p99 {round(notes['p99_peak_bytes'] / 1024, 2)} KB), {round(notes['mean_net_bytes'])} bytes net, "
+              f"GC in {notes['notes_with_gc']} notes (longest pause {round(notes['max_gc_pause_ms'], 3)} ms)")
+        print(f"  {'stage'.ljust(28)} {'calls':>8} {'peak KB':>9} {'max KB':>9} {'net B':>9} {'GCs':>6} {'GC ms':>9} {'max GC ms':>10}")
+        for name, stage in report["stages"].items():
+            print(f"  {name.ljust(28)} {stage['calls']:>8} {stage['mean_peak_bytes'] / 1024:>9.2f} {stage['max_peak_bytes'] / 1024:>9.2f} "
+                  f"{stage['mean_net_bytes']:>9.1f} {stage['gc_collections']:>6} {stage['gc_pause_ms']:>9.3f} {stage['max_gc_pause_ms']:>10.3f}")
+
+    @staticmethod
+    def __add_to_record(stage_record: np.ndarray[float], open_stage: np.ndarray[float], peak_bytes: int, end_bytes: int) -> None:
+        stage_record[CALLS] += 1
+        stage_record[PEAK_BYTES] += peak_bytes - open_stage[START_BYTES]
+        stage_record[NET_BYTES] += end_bytes - open_stage[START_BYTES]
+        stage_record[GC_COLLECTIONS] += open_stage[STAGE_GC_COLLECTIONS]
+        stage_record[GC_PAUSE_MS] += open_stage[STAGE_GC_PAUSE_MS]
+        stage_record[MAX_PEAK_BYTES] = max(stage_record[MAX_PEAK_BYTES], peak_bytes - open_stage[START_BYTES])
+        stage_record[MAX_GC_PAUSE_MS] = max(stage_record[MAX_GC_PAUSE_MS], open_stage[STAGE_GC_PAUSE_MS])
+
+    @staticmethod
+    def __get_stage_record(stage_record: np.ndarray[float]) -> dict[str, any]:
+        calls = max(stage_record[CALLS], 1)
+        return {
+            "calls": int(stage_record[CALLS]),
+            "peak_bytes": int(stage_record[PEAK_BYTES]),
+            "net_bytes": int(stage_record[NET_BYTES]),
+            "mean_peak_bytes": float(stage_record[PEAK_BYTES] / calls),
+            "mean_net_bytes": float(stage_record[NET_BYTES] / calls),
+            "max_peak_bytes": int(stage_record[MAX_PEAK_BYTES]),
+            "gc_collections": int(stage_record[GC_COLLECTIONS]),
+            "gc_pause_ms": float(stage_record[GC_PAUSE_MS]),
+            "max_gc_pause_ms": float(stage_record[MAX_GC_PAUSE_MS])
+        }
+
+    def __on_gc(self, phase: str, info: dict) -> None:
+        """Attribute each collection and its pause to every stage open while it ran."""
+        if phase == "start":
+            self.__gc_start_time = time.perf_counter()
+        elif self.__gc_start_time is not None:
+            pause_ms = (time.perf_counter() - self.__gc_start_time) * 1000
+            self.__gc_start_time = None
+            self.__open_stages[:self.__depth, STAGE_GC_COLLECTIONS] += 1
+            self.__open_stages[:self.__depth, STAGE_GC_PAUSE_MS] += pause_ms
+
+if __name__ == "__main__":
+
+    # Simple test with allocations standing in for the stages of a note
+
+    profiler = AllocationProfiler()
+    profiler.start()
+    kept = []
+    for note_index in range(100):
+        with profiler.note():
+            with profiler.stage("short_lived"):
+                temporary = np.zeros(10000) # 80 KB, freed when the stage ends
+                del temporary
+            with profiler.stage("kept"):
+                kept.append(np.zeros(1000)) # 8 KB, kept
+            with profiler.stage("cycles"):
+                for _ in range(2000):
+                    cycle = []
+                    cycle.append(cycle) # Only freed by the garbage collector
+    profiler.stop()
+
+    profiler.print_report()
+    report = profiler.get_report()
+    notes = profiler.get_note_records()
+    print(report["stages"]["short_lived"]["mean_peak_bytes"] >= 80000, report["stages"]["short_lived"]["mean_net_bytes"] < 1000,
+          report["stages"]["kept"]["mean_net_bytes"] >= 8000, report["stages"]["cycles"]["gc_collections"] > 0,
+          len(notes) == 100, notes[-1]["stages"]["kept"]["net_bytes"] >= 8000)
\ No newline at end of file
@@ -0,0 +1,140 @@
+import numpy as np
+import time
+from .chord_generator import ChordGenerator
+from .input_sequence import InputSequence, update_histories
+from .chord import Chord
+from .histogram_kernels import threshold_histograms
+
+class BatchHarmonizer:
+    def __init__(self, chord_generator: ChordGenerator, batch_size: int = 256, seed: int = None) -> None:
+
+        """
+        An action-focussed class which harmonizes whole melodies offline, generating the chords of many
+        independent songs together with a single model call per step for all of them.
+
+        Each song is harmonized exactly as ChordGenerator.get_chord() would harmonize its notes received live,
+        one at a time, by a ChordGenerator with the same settings and seed. When a song ends, the next waiting
+        song takes its place in the batch, so the batch stays full until the last songs.
+
+        Parameters:
+            chord_generator:    ChordGenerator. Provides the model, tonic, chord note threshold and input sequence settings.
+            batch_size:         int (default 256). The maximum number of songs generated together in each model call.
+            seed:               int (default None). Seed for the initial input sequence of every song, None for a different one per song.
+        """
+
+        self.chord_generator = chord_generator
+        self.BATCH_SIZE = batch_size
+        self.SEED = seed
+
+    def harmonize(self, melodies: list[list[int]]) -> list[list[Chord]]:
+        """
+        Generate a chord for every note of every melody.
+
+        Parameters:
+            melodies:   list[list[int]]. The MIDI note numbers of each melody, in order.
+
+        Returns:
+            list[list[Chord]]. The chord of each note of each melody.
+        """
+
+        harmonize_start_time = time.time()
+
+        chords = [[] for _ in melodies]
+        waiting_songs = [song for song, melody in enumerate(melodies) if len(melody) > 0][::-1]
+
+        # Song index, note position and input sequence of each song currently in the batch
+        active_songs = np.zeros(0, dtype=int)
+        positions = np.zeros(0, dtype=int)
+        input_sequences = np.zeros((0, self.chord_generator.INPUT_SEQUENCE_LENGTH, 13))
+
+        num_steps = 0
+        while len(waiting_songs) > 0 or len(active_songs) > 0:
+
+            # Fill free places in the batch with waiting songs
+            new_songs = [waiting_songs.pop() for _ in range(min(self.BATCH_SIZE - len(active_songs), len(waiting_songs)))]
+            if len(new_songs) > 0:
+                active_songs = np.append(active_songs, new_songs)
+                positions = np.append(positions, np.zeros(len(new_songs), dtype=int))
+                input_sequences = np.append(input_sequences, self.__get_initial_input_sequences(len(new_songs)), axis=0)
+
+            # Get melody chroma of the current note of each song
+            melody_notes = np.asarray([melodies[song][position] for song, position in zip(active_songs, positions)])
+            melody_chromas = (melody_notes - self.chord_generator.TONIC) % 12
+
+            # Update input sequences with new melody chromas
+            update_histories(input_sequences[:, :, 0], melody_chromas, self.chord_generator.UPDATE_DIRECTION)
+
+            # Predict the chroma histograms of all songs in one model call
+            chroma_histograms = self.chord_generator.predict_chroma_histograms(input_sequences)
+
+            # Create Chord objects
+            step_chords = [self.chord_generator.make_chord(chroma_histogram) for chroma_histogram in chroma_histograms]
+            for song, chord in zip(active_songs, step_chords):
+                chords[song].append(chord)
+
+            # Get the histograms to feed back into each input sequence, either thresholded or not, as ChordGenerator.get_input_chroma_histogram(),
+            # from the chords if they were snapped to a codebook, as they no longer hold the predicted histograms
+            if self.chord_generator.codebook is not None:
+                input_chroma_histograms = np.asarray([self.chord_generator.get_input_chroma_histogram(chord) for chord in step_chords])
+            elif self.chord_generator.THRESHOLD_INPUT_SEQUENCE:
+                input_chroma_histograms = threshold_histograms(chroma_histograms, self.chord_generator.CHORD_NOTE_THRESHOLD, out=np.zeros((len(active_songs), 12)))
+            else:
+                input_chroma_histograms = chroma_histograms
+
+            # Update input sequences with the new chroma histograms
+            update_histories(input_sequences[:, :, 1:], input_chroma_histograms, self.chord_generator.UPDATE_DIRECTION)
+
+            # Move to the next note, dropping songs which have reached their end from the batch
+            positions += 1
+            unfinished = positions < np.asarray([len(melodies[song]) for song in active_songs], dtype=int)
+            active_songs = active_songs[unfinished]
+            positions = positions[unfinished]
+            input_sequences = input_sequences[unfinished]
+
+            num_steps += 1
+
+        num_chords = sum(len(song_chords) for song_chords in chords)
+        harmonize_secs = time.time() - harmonize_start_time
+        print(f"Generated {num_chords} chords for {len(melodies)} melodies in {num_steps} model steps, taking {round(harmonize_secs, 3)} secs ({round(num_chords / max(harmonize_secs, 1e-9), 1)} chords/sec)")
+
+        return chords
+
+    def __get_initial_input_sequences(self, count: int) -> np.ndarray[float]:
+        """Get count initial input sequences, as ChordGenerator would start from, as an array of shape (count, sequence length, 13)."""
+        return np.concatenate([
+            InputSequence(sequence_length=self.chord_generator.INPUT_SEQUENCE_LENGTH,
+                          init_type="rand",
+                          update_direction=self.chord_generator.UPDATE_DIRECTION,
+                          seed=self.SEED).get()
+            for _ in range(count)
+        ], axis=0)
+
+if __name__ == "__main__":
+
+    import sys
+    from .chroma_codebook import ChromaCodebook
+
+    # Check that batched harmonization gives the same chords as the live get_chord path with the same seed,
+    # without a codebook and, if the path of one is given, with it
+    model_path = sys.argv[1] if len(sys.argv) > 1 else "./src/trained_model/chroma_histogram_generator_model"
+    codebooks = [None] + ([ChromaCodebook.load(sys.argv[2])] if len(sys.argv) > 2 else [])
+    melodies = [list(np.random.randint(48, 84, size=length)) for length in [32, 5, 0, 17, 64, 1]]
+
+    for codebook in codebooks:
+        chord_generator = ChordGenerator(model_path,
+                                         sequence_length=8,
+                                         tonic=0,
+                                         chord_note_threshold=0.14,
+                                         threshold_input_sequence=True,
+                                         seed=0,
+                                         codebook=codebook)
+
+        batch_harmonizer = BatchHarmonizer(chord_generator, batch_size=4, seed=0)
+        batch_chords = batch_harmonizer.harmonize(melodies)
+
+        for melody, song_chords in zip(melodies, batch_chords):
+            chord_generator.input_sequence = InputSequence(sequence_length=8, update_direction="append", seed=0)
+            live_chords = [chord_generator.get_chord(note) for note in melody]
+            assert all(np.array_equal(live_chord.get_unthresholded_chroma_histogram(), batch_chord.get_unthresholded_chroma_histogram()) and live_chord.CODE_ID == batch_chord.CODE_ID
+                       for live_chord, batch_chord in zip(live_chords, song_chords))
+        print(f"Batched chords match the live chords {'with' if codebook is not None else 'without'} a codebook")
\ No newline at end of file
@@ -1,11 +1,13 @@
 import numpy as np
 from .chord_voicing_engine import ChordVoicingEngine
+from .histogram_kernels import threshold_histograms
 
 class Chord:
     def __init__(self,
                  chroma_histogram: np.ndarray,
                  tonic: int = 0,
-                 chord_note_threshold: float = 0.1
+                 chord_note_threshold: float = 0.1,
+                 code_id: int = None
         ) -> None:
         
         """
@@ -16,6 +18,7 @@ class Chord:
             chroma_histogram:       np.array of size 12. The unnormalised chroma histogram for this chord
             tonic:                  int (0-11) (default 0). The tonic associated with this chord, used when voicing the chord.
             chord_note_threshold:   float (0-1) (default 0.1). The amount above which a chroma pitch must be present in the histogram to be present in the voiced chord, or thresholded histogram.
+            code_id:                int (default None). The ChromaCodebook code ID of the chroma histogram, if it is a codeword. The thresholded histogram and voiced pitches of such a chord, whose histogram is never changed, are only computed once.
 
         Returns:
             An instance of the chord object.
@@ -44,28 +47,42 @@ class Chord:
         
         self.chord_voicing_engine = ChordVoicingEngine()
 
+        # Kept for chords of codes, which are reused for every prediction of the code
+        self.CODE_ID = code_id
+        self.__thresholded_chroma_histogram = None
+        self.__voiced_pitches = {}
+
     def get_voiced_chord(self, intensity: float = 0) -> list[list[int, int]]:
         """Voices the chord using self.chord_voicing_engine and returns it as an a list of [pitch, velocity] pairs."""
 
-        return self.chord_voicing_engine.get_voiced_chord(self, intensity=intensity)
+        if self.CODE_ID is None:
+            return self.chord_voicing_engine.get_voiced_chord(self, intensity=intensity)
+
+        # The pitches of a code's chord only depend on the intensity band, so are voiced once per band
+        intensity_band = self.chord_voicing_engine.get_intensity_band(intensity)
+        if intensity_band not in self.__voiced_pitches:
+            self.__voiced_pitches[intensity_band] = self.chord_voicing_engine.get_chord_pitches(self, intensity)
+
+        velocity = self.chord_voicing_engine.get_velocity(intensity)
+        return [[midi_note_number, velocity] for midi_note_number in self.__voiced_pitches[intensity_band]]
     
     def get_thresholded_chroma_histogram(self) -> np.ndarray[float]:
         """Returns the thresholded version of the chroma histogram based on self.CHORD_NOTE_THRESHOLD."""
-        
-        # Init array to hold thresholded chroma histogram
-        thresholded_chroma_histogram = np.zeros(12)
-        
-        # Iterate over chroma histogram to find notes that are above the threshold
-        # When found, add values to thresholded chroma histogram array
-        for i, chroma_amount in enumerate(self.chroma_histogram):
-            if chroma_amount > self.CHORD_NOTE_THRESHOLD:
-                thresholded_chroma_histogram[i] = chroma_amount
-        
-        # Normalise thresholded array to sum to 1
-        if thresholded_chroma_histogram.sum() != 0:
-            thresholded_chroma_histogram = thresholded_chroma_histogram / thresholded_chroma_histogram.sum()
 
-        return thresholded_chroma_histogram
+        # Chords of codes threshold their histogram once, returning a copy so the kept one can't be changed
+        if self.CODE_ID is not None:
+            if self.__thresholded_chroma_histogram is None:
+                self.__thresholded_chroma_histogram = self.__threshold_chroma_histogram()
+            return self.__thresholded_chroma_histogram.copy()
+
+        return self.__threshold_chroma_histogram()
+
+    def __threshold_chroma_histogram(self) -> np.ndarray[float]:
+        # Keep notes that are above the threshold, normalised to sum to 1, in a new array to leave the chroma histogram unchanged
+        thresholded_chroma_histogram = np.zeros((1, 12))
+        threshold_histograms(self.chroma_histogram.reshape(1, 12), self.CHORD_NOTE_THRESHOLD, out=thresholded_chroma_histogram)
+
+        return thresholded_chroma_histogram[0]
 
     def get_unthresholded_chroma_histogram(self) -> np.ndarray[float]:
         """Returns the un-thresholded version of the chroma histogram, i.e., that provided when creating the instance."""
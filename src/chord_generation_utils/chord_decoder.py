@@ -0,0 +1,265 @@
+import heapq
+import numpy as np
+from .chord_generator import ChordGenerator
+from .input_sequence import InputSequence, update_histories
+from .chord import Chord
+
+# Ways of choosing between candidate chords
+GREEDY = "greedy"
+SAMPLE = "sample"
+BEAM = "beam"
+
+class ChordDecoder:
+    def __init__(
+            self,
+            chord_generator: ChordGenerator,
+            strategy: str = SAMPLE,
+            num_candidates: int = 4,
+            temperature: float = 1.0,
+            softness: float = 0.05,
+            lookahead: int = 1,
+            beam_width: int = 2,
+            seed: int = None
+        ) -> None:
+
+        """
+        An action-focussed class which generates chords with more variety and look-ahead than ChordGenerator.get_chord,
+        which always plays the chord notes above the threshold of the predicted chroma histogram.
+
+        Each chroma is treated as a chord note with probability sigmoid((amount - chord note threshold) / softness), so the
+        usual thresholded chord is the most likely set of chord notes. The num_candidates most likely sets are the candidates,
+        and each is fed back as the thresholded continuation of the input sequence to look ahead over the next lookahead
+        melody notes, keeping the beam_width most likely chords of each candidate at every step. All candidates are evaluated
+        together, in one batched model call per look-ahead note, which takes about as long as a single prediction.
+        A candidate's score is the log probability of its chord notes plus that of its best path through the look-ahead.
+
+        - "greedy":  Always the usual thresholded chord, exactly as ChordGenerator.get_chord.
+        - "sample":  A candidate sampled with probabilities softmax(score / temperature).
+        - "beam":    The candidate with the best score.
+
+        The next melody notes are known when harmonizing offline. When they are not given, as when playing live,
+        the current melody note is assumed to repeat for the look-ahead.
+
+        Parameters:
+            chord_generator:    ChordGenerator. The chord generator whose model, settings and input sequence are used.
+            strategy:           str (default "sample"). How to choose between candidates, "greedy", "sample" or "beam".
+            num_candidates:     int (default 4). Number of candidate chords for each melody note.
+            temperature:        float (default 1.0). Temperature of sampling, higher for more variety, 0 to always choose the best score.
+            softness:           float (default 0.05). How far from the threshold a chroma amount must be to surely be, or not be, a chord note.
+            lookahead:          int (default 1). Number of next melody notes to look ahead over, 0 to score candidates by their own probability.
+            beam_width:         int (default 2). Number of paths kept for each candidate at each look-ahead step.
+            seed:               int (default None). Seed for sampling, None for different choices every time.
+        """
+
+        if strategy not in [GREEDY, SAMPLE, BEAM]:
+            raise ValueError(f"Strategy must be '{GREEDY}', '{SAMPLE}' or '{BEAM}'. Received {strategy}.")
+
+        self.chord_generator = chord_generator
+        self.STRATEGY = strategy
+        self.NUM_CANDIDATES = num_candidates
+        self.TEMPERATURE = temperature
+        self.SOFTNESS = softness
+        self.LOOKAHEAD = lookahead
+        self.BEAM_WIDTH = beam_width
+        self.rng = np.random.default_rng(seed)
+
+        # Candidate chords and scores of the last melody note, for inspection
+        self.last_candidates = None
+
+    def get_chord(self, melody_note_midi_number: int, next_melody_note_midi_numbers: list[int] = None) -> Chord:
+        """Generate the chord for a melody note, and update the chord generator's input sequence with it, as ChordGenerator.get_chord."""
+
+        chord_generator = self.chord_generator
+        if self.STRATEGY == GREEDY:
+            return chord_generator.get_chord(melody_note_midi_number)
+
+        # Assume the current note repeats if the next notes are not known
+        if next_melody_note_midi_numbers is None:
+            next_melody_note_midi_numbers = [melody_note_midi_number] * self.LOOKAHEAD
+        next_melody_chromas = [(midi_number - chord_generator.TONIC) % 12 for midi_number in next_melody_note_midi_numbers[:self.LOOKAHEAD]]
+
+        with chord_generator.model_lock:
+            chord_generator.last_chord_model_path = chord_generator.MODEL_PATH
+
+            # Predict the chroma histogram of the note without changing the input sequence yet
+            input_sequence = chord_generator.input_sequence.get().copy()
+            update_histories(input_sequence[:, :, 0], (melody_note_midi_number - chord_generator.TONIC) % 12, chord_generator.UPDATE_DIRECTION)
+            chroma_histogram = chord_generator.predict_chroma_histograms(input_sequence)[0]
+
+            # Score each candidate by its own probability and its best path through the next melody notes
+            chords, log_probabilities = self.get_candidate_chords(chroma_histogram)
+            scores = log_probabilities + self.__get_lookahead_scores(input_sequence, chords, next_melody_chromas)
+
+        chord = chords[self.__choose(scores)]
+        self.last_candidates = list(zip(chords, scores))
+
+        # Update the input sequence with the chosen chord
+        chord_generator.record_chord(melody_note_midi_number, chord)
+
+        return chord
+
+    def harmonize(self, melody_note_midi_numbers: list[int]) -> list[Chord]:
+        """
+        Generate the chords of a whole melody, looking ahead over the melody's own next notes. Each melody starts from
+        a new input sequence with the chord generator's seed, as a new live session would.
+        """
+        chord_generator = self.chord_generator
+        chord_generator.input_sequence = InputSequence(sequence_length=chord_generator.INPUT_SEQUENCE_LENGTH,
+                                                       init_type="rand",
+                                                       update_direction=chord_generator.UPDATE_DIRECTION,
+                                                       seed=chord_generator.SEED)
+
+        return [self.get_chord(melody_note_midi_number, melody_note_midi_numbers[i+1:i+1+self.LOOKAHEAD])
+                for i, melody_note_midi_number in enumerate(melody_note_midi_numbers)]
+
+    def get_candidate_chords(self, chroma_histogram: np.ndarray[float], count: int = None) -> tuple[list[Chord], np.ndarray[float]]:
+        """
+        Get the count (default num_candidates) most likely chords of a predicted chroma histogram, most likely first, and the
+        log probabilities of their sets of chord notes. The first is always the chord ChordGenerator.make_chord would create.
+        """
+
+        count = count if count is not None else self.NUM_CANDIDATES
+
+        # Log odds of each chroma being a chord note, the most likely set being those above the threshold
+        logits = (chroma_histogram - self.chord_generator.CHORD_NOTE_THRESHOLD) / self.SOFTNESS
+        most_likely_chord_notes = logits > 0
+        most_likely_log_probability = -np.logaddexp(0, -np.abs(logits)).sum()
+
+        # Changing whether a chroma is a chord note lowers the log probability by the absolute log odds, so the next most
+        # likely sets are found by searching the sets of chromas to change in order of their total cost
+        change_costs = np.abs(logits)
+        change_order = np.argsort(change_costs)
+        chords = [self.chord_generator.make_chord(chroma_histogram)]
+        log_probabilities = [most_likely_log_probability]
+        changes_to_try = [(change_costs[change_order[0]], 0, (0,))]
+        while len(changes_to_try) > 0 and len(chords) < count:
+            total_cost, last_change, changes = heapq.heappop(changes_to_try)
+
+            # Only keep sets of chord notes which can be voiced
+            chord_notes = most_likely_chord_notes.copy()
+            chord_notes[change_order[list(changes)]] ^= True
+            if chord_notes.any() and (chroma_histogram[chord_notes] > 0).all():
+                chords.append(self.__make_candidate_chord(chroma_histogram, chord_notes))
+                log_probabilities.append(most_likely_log_probability - total_cost)
+
+            # Try adding the next chroma to the changes, or changing the next chroma instead of the last
+            if last_change + 1 < 12:
+                next_cost = change_costs[change_order[last_change + 1]]
+                heapq.heappush(changes_to_try, (total_cost + next_cost, last_change + 1, changes + (last_change + 1,)))
+                heapq.heappush(changes_to_try, (total_cost - change_costs[change_order[last_change]] + next_cost, last_change + 1, changes[:-1] + (last_change + 1,)))
+
+        return chords, np.asarray(log_probabilities)
+
+    def __make_candidate_chord(self, chroma_histogram: np.ndarray[float], chord_notes: np.ndarray[bool]) -> Chord:
+        """Create a Chord object with the given chord notes, keeping their amounts in the predicted chroma histogram."""
+        candidate_chroma_histogram = np.where(chord_notes, chroma_histogram, 0)
+        candidate_chroma_histogram = candidate_chroma_histogram / candidate_chroma_histogram.sum()
+
+        # Lower the threshold for chord notes below it, so that they are all voiced
+        chord_note_threshold = self.chord_generator.CHORD_NOTE_THRESHOLD
+        smallest_amount = float(candidate_chroma_histogram[chord_notes].min())
+        if smallest_amount <= chord_note_threshold:
+            chord_note_threshold = smallest_amount / 2
+
+        return Chord(candidate_chroma_histogram,
+                     tonic=self.chord_generator.TONIC,
+                     chord_note_threshold=chord_note_threshold)
+
+    def __get_lookahead_scores(self, input_sequence: np.ndarray[float], chords: list[Chord], next_melody_chromas: list[int]) -> np.ndarray[float]:
+        """
+        Get the log probability of the best path of chords through the next melody chromas after each candidate chord,
+        keeping the beam_width most likely paths of each candidate at each step, with one batched model call per step.
+        """
+
+        chord_generator = self.chord_generator
+        if len(next_melody_chromas) == 0:
+            return np.zeros(len(chords))
+
+        # Continue the input sequence with each candidate
+        input_sequences = np.repeat(input_sequence, len(chords), axis=0)
+        update_histories(input_sequences[:, :, 1:], np.asarray([chord_generator.get_input_chroma_histogram(chord) for chord in chords]), chord_generator.UPDATE_DIRECTION)
+        candidates = np.arange(len(chords))
+        path_scores = np.zeros(len(chords))
+
+        for step, melody_chroma in enumerate(next_melody_chromas):
+            update_histories(input_sequences[:, :, 0], melody_chroma, chord_generator.UPDATE_DIRECTION)
+            chroma_histograms = chord_generator.predict_chroma_histograms(input_sequences)
+
+            # Only the most likely chord of each path matters at the last step
+            if step == len(next_melody_chromas) - 1:
+                logits = (chroma_histograms - chord_generator.CHORD_NOTE_THRESHOLD) / self.SOFTNESS
+                path_scores = path_scores - np.logaddexp(0, -np.abs(logits)).sum(axis=1)
+                break
+
+            # Extend each path with its most likely chords
+            parents, extended_scores, extended_input_chroma_histograms = [], [], []
+            for i, chroma_histogram in enumerate(chroma_histograms):
+                step_chords, step_log_probabilities = self.get_candidate_chords(chroma_histogram, self.BEAM_WIDTH)
+                for step_chord, step_log_probability in zip(step_chords, step_log_probabilities):
+                    parents.append(i)
+                    extended_scores.append(path_scores[i] + step_log_probability)
+                    extended_input_chroma_histograms.append(chord_generator.get_input_chroma_histogram(step_chord))
+            parents, extended_scores = np.asarray(parents), np.asarray(extended_scores)
+
+            # Keep the beam_width best paths of each candidate, sorting paths by candidate and then by score
+            order = np.lexsort((-extended_scores, candidates[parents]))
+            sorted_candidates = candidates[parents][order]
+            rank_within_candidate = np.arange(len(order)) - np.searchsorted(sorted_candidates, sorted_candidates)
+            kept = order[rank_within_candidate < self.BEAM_WIDTH]
+
+            input_sequences = input_sequences[parents[kept]]
+            update_histories(input_sequences[:, :, 1:], np.asarray(extended_input_chroma_histograms)[kept], chord_generator.UPDATE_DIRECTION)
+            candidates = candidates[parents[kept]]
+            path_scores = extended_scores[kept]
+
+        # Score each candidate by its best path
+        candidate_scores = np.full(len(chords), -np.inf)
+        np.maximum.at(candidate_scores, candidates, path_scores)
+        return candidate_scores
+
+    def __choose(self, scores: np.ndarray[float]) -> int:
+        if self.STRATEGY == BEAM or self.TEMPERATURE == 0:
+            return int(np.argmax(scores))
+
+        # Sample with probabilities softmax(scores / temperature)
+        probabilities = np.exp((scores - scores.max()) / self.TEMPERATURE)
+        return int(self.rng.choice(len(scores), p=probabilities / probabilities.sum()))
+
+if __name__ == "__main__":
+
+    import time
+
+    def make_chord_generator() -> ChordGenerator:
+        return ChordGenerator("./src/trained_model/chroma_histogram_generator_model",
+                              sequence_length=8,
+                              tonic=0,
+                              chord_note_threshold=0.14,
+                              threshold_input_sequence=True,
+                              seed=0)
+
+    melody = list(np.random.randint(48, 84, size=32))
+
+    # Check that greedy decoding, and beam decoding with a single candidate, give the same chords as get_chord
+    chord_generator = make_chord_generator()
+    expected = [chord_generator.get_chord(melody_note).get_thresholded_chroma_histogram() for melody_note in melody]
+    for strategy, num_candidates in [(GREEDY, 4), (BEAM, 1)]:
+        chords = ChordDecoder(make_chord_generator(), strategy=strategy, num_candidates=num_candidates).harmonize(melody)
+        mismatches = sum(not np.allclose(chord.get_thresholded_chroma_histogram(), histogram) for chord, histogram in zip(chords, expected))
+        print(f"{strategy} with {num_candidates} candidates: {mismatches} mismatches in {len(melody)} chords")
+
+    # Check that candidates are distinct, most likely first, and can be voiced
+    chord_decoder = ChordDecoder(make_chord_generator(), strategy=SAMPLE, num_candidates=8, lookahead=2, seed=0)
+    chords = chord_decoder.harmonize(melody)
+    candidate_chords, candidate_scores = zip(*chord_decoder.last_candidates)
+    candidate_chord_notes = [tuple(candidate_chord.get_thresholded_chroma_histogram() > 0) for candidate_chord in candidate_chords]
+    print(f"Sampled chords differing from greedy: {sum(not np.allclose(chord.get_thresholded_chroma_histogram(), histogram) for chord, histogram in zip(chords, expected))} of {len(melody)}")
+    print(f"Distinct candidates: {len(set(candidate_chord_notes))} of {len(candidate_chords)}, voiced: {[len(candidate_chord.get_voiced_chord()) for candidate_chord in candidate_chords]}")
+
+    # Compare the time of a batched model call for all candidates with that of a single prediction
+    input_sequences = np.repeat(chord_decoder.chord_generator.input_sequence.get(), chord_decoder.NUM_CANDIDATES, axis=0)
+    for batch_size in [1, chord_decoder.NUM_CANDIDATES]:
+        chord_decoder.chord_generator.predict_chroma_histograms(input_sequences[:batch_size])
+        prediction_start_time = time.perf_counter()
+        for _ in range(50):
+            chord_decoder.chord_generator.predict_chroma_histograms(input_sequences[:batch_size])
+        print(f"Batch of {batch_size}: {round((time.perf_counter() - prediction_start_time) / 50 * 1000, 3)} ms per model call")
\ No newline at end of file
@@ -1,13 +1,19 @@
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
 import numpy as np
-import tensorflow as tf
 import logging
 from .input_sequence import InputSequence
 from .chord import Chord
+from .histogram_kernels import normalise_histograms
+from .shared_prediction_cache import SharedPredictionCache
+from .allocation_profiler import AllocationProfiler
+from .chroma_codebook import ChromaCodebook
+from contextlib import nullcontext
+import threading
 import time
 
-import os
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
-
 class ChordGenerator:
     def __init__(
             self,
@@ -17,7 +23,12 @@ class ChordGenerator:
             chord_note_threshold: float = 0.1,
             threshold_input_sequence: bool = True,
             update_direction: str = "append",
-            log_level = logging.INFO
+            log_level = logging.INFO,
+            seed: int = None,
+            model: any = None,
+            prediction_cache: SharedPredictionCache = None,
+            profiler: AllocationProfiler = None,
+            codebook: ChromaCodebook = None
         ) -> None:
 
         # Handle creation parameters
@@ -26,28 +37,134 @@ class ChordGenerator:
         self.TONIC = tonic
         self.CHORD_NOTE_THRESHOLD = chord_note_threshold
         self.THRESHOLD_INPUT_SEQUENCE = threshold_input_sequence
+        self.UPDATE_DIRECTION = update_direction
+
+        # Draw a seed if none is given, so the session can still be replayed from a session log
+        self.SEED = seed if seed is not None else int(np.random.randint(0, 2**31))
+
+        # Cache of predictions shared with the other chord generators on the host, if any
+        self.prediction_cache = prediction_cache
+
+        # Optional profiler recording the allocations and GC pauses of each stage of generating a chord
+        self.profiler = profiler
+
+        # Optional codebook which predictions are snapped to, so that the chord of each code is made and voiced once and looked up by code ID
+        self.codebook = codebook
+        self.__code_chords = {}
 
         # Create internal logger
         self.logger = logging.Logger("chord_generator", log_level)
 
-        # Setup methods
-        self.load_model(self.MODEL_PATH)
+        # Held while generating a chord, so a model loaded in the background is only swapped in between notes
+        self.model_lock = threading.Lock()
+        self.model_swap_report = None
+        self.last_chord_model_path = model_path
+
+        # Setup methods, using the given model or backend if any instead of loading one
+        if model is None:
+            self.load_model(self.MODEL_PATH)
+        else:
+            self.model = model
         
         # Initialise the InputSequence object
         self.input_sequence = InputSequence(sequence_length=self.INPUT_SEQUENCE_LENGTH,
-                                            init_type = "rand", update_direction=update_direction)
+                                            init_type = "rand", update_direction=update_direction, seed=self.SEED)
 
     def load_model(self, model_path) -> None:
         model_load_start_time = time.time()
         try:
-            self.model = tf.keras.models.load_model(model_path)
+            # Imported here, so that chord generators given a model, e.g. a NumPy one in a forked process, never start TensorFlow
+            import tensorflow as tf
+            model = tf.keras.models.load_model(model_path)
+            with self.model_lock:
+                self.model = model
+                self.MODEL_PATH = model_path
             self.logger.info(f"Took {round(time.time() - model_load_start_time, 3)} secs to successfully loaded model from: {model_path}")
 
         except Exception as e:
             self.logger.error(f"Unable to load model from: {model_path}")
             raise e
 
-    def get_chord(self, melody_note_midi_number: int) -> Chord:
+    def load_model_in_background(self, model_path: str, on_swapped: callable = None) -> threading.Thread:
+        """
+        Load a model in a background thread while chords keep being generated with the current one, then warm it up
+        and swap it in between two notes, keeping the current input sequence. on_swapped is called from the background
+        thread with the swap report (see swap_model()), or with the exception if the model could not be loaded.
+        """
+
+        def load_and_swap_model() -> None:
+            model_load_start_time = time.time()
+            try:
+                import tensorflow as tf
+                model = tf.keras.models.load_model(model_path)
+                model_load_secs = time.time() - model_load_start_time
+                report = self.swap_model(model, model_path)
+                report["load_secs"] = model_load_secs
+            except Exception as e:
+                self.logger.error(f"Unable to load model from: {model_path}, keeping model from: {self.MODEL_PATH}")
+                report = e
+            else:
+                self.logger.info(f"Took {round(model_load_secs, 3)} secs to load model in the background from: {model_path}")
+
+            if on_swapped is not None:
+                on_swapped(report)
+
+        model_load_thread = threading.Thread(target=load_and_swap_model, name="model_loader", daemon=True)
+        model_load_thread.start()
+        return model_load_thread
+
+    def swap_model(self, model: any, model_path: str = None) -> dict:
+        """
+        Warm up a loaded model (or any backend called like one) with an input of the shape used for generating chords,
+        so the first chord is not slowed down by tracing, then swap it in between two notes, keeping the current input sequence.
+
+        Returns a report of the model path, the first inference (warm-up) time in ms, and the time waited for the current note in ms.
+        """
+
+        # Warm up the new model, which includes tracing the model call for the input shape
+        warm_up_start_time = time.time()
+        model(np.zeros((1, self.INPUT_SEQUENCE_LENGTH, 13)))
+        first_inference_ms = (time.time() - warm_up_start_time) * 1000
+
+        # Swap the model once the current note, if any, is done
+        swap_start_time = time.time()
+        with self.model_lock:
+            self.model = model
+            self.MODEL_PATH = model_path
+        swap_wait_ms = (time.time() - swap_start_time) * 1000
+
+        self.model_swap_report = {"model_path": model_path, "first_inference_ms": first_inference_ms, "swap_wait_ms": swap_wait_ms}
+        self.logger.info(f"Swapped in model from: {model_path}, first inference took {round(first_inference_ms, 3)} ms")
+
+        return self.model_swap_report
+
+    def get_chord(self, melody_note_midi_number: int, model: any = None) -> Chord:
+        """Generate the chord for a melody note, with the current model, or another given one, e.g., a smaller fallback model."""
+        # The model is only swapped between notes
+        with self.model_lock:
+            self.last_chord_model_path = self.MODEL_PATH
+            with self.profile("get_chord"):
+                return self.__get_chord(melody_note_midi_number, model)
+
+    def profile(self, stage: str) -> any:
+        """Record the allocations and GC pauses of the with block as the given stage if there is a profiler, otherwise do nothing."""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(stage)
+
+    def profile_note(self) -> any:
+        """Record the allocations and GC pauses of the with block as one note if there is a profiler, otherwise do nothing."""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.note()
+
+    def record_chord(self, melody_note_midi_number: int, chord: Chord) -> None:
+        """Update the input sequence with a melody note and a chord chosen for it without the model, e.g., a fallback chord."""
+        with self.model_lock:
+            self.input_sequence.update_melody_chroma_history((melody_note_midi_number - self.TONIC) % 12)
+            self.input_sequence.update_chroma_histogram_history(self.get_input_chroma_histogram(chord))
+
+    def __get_chord(self, melody_note_midi_number: int, model: any = None) -> Chord:
         
         chord_prediction_start_time = time.time()
 
@@ -55,34 +172,87 @@ class ChordGenerator:
         melody_chroma = (melody_note_midi_number - self.TONIC) % 12
 
         # Update input sequence with new melody chroma
-        self.input_sequence.update_melody_chroma_history(melody_chroma)
+        with self.profile("get_chord.input"):
+            self.input_sequence.update_melody_chroma_history(melody_chroma)
+            input_sequence = self.input_sequence.get()
 
         # Predict chroma histogram using updated input_sequence
-        chroma_histogram = self.model(self.input_sequence.get()).numpy()[0]
-
-        # Normalise to ensure histogram sums to as expected
-        chroma_histogram = chroma_histogram / chroma_histogram.sum()
+        with self.profile("get_chord.predict"):
+            chroma_histogram = self.__predict_chroma_histogram(input_sequence, model)
         
         #Create Chord object to hold the new chroma histogram
-        chord = Chord(chroma_histogram,
-                      tonic=self.TONIC,
-                      chord_note_threshold=self.CHORD_NOTE_THRESHOLD)
+        with self.profile("get_chord.chord"):
+            chord = self.make_chord(chroma_histogram)
         
         # Update input sequence with the new chroma histogram, either thresholded or not
-        if self.THRESHOLD_INPUT_SEQUENCE:
-            self.input_sequence.update_chroma_histogram_history(chord.get_thresholded_chroma_histogram())
-        else:
-            self.input_sequence.update_chroma_histogram_history(chord.get_unthresholded_chroma_histogram())
+        with self.profile("get_chord.feedback"):
+            self.input_sequence.update_chroma_histogram_history(self.get_input_chroma_histogram(chord))
         
         self.logger.info(f"Generated new chord in {round((time.time() - chord_prediction_start_time)/1000, 3)} ms")
 
         return chord
     
+    def predict_chroma_histograms(self, input_sequences: np.ndarray[float], model: any = None) -> np.ndarray[float]:
+        """
+        Predict the chroma histograms for a batch of input sequences of shape (batch size, sequence length, 13) in one call
+        of the current model, or another given one, each normalised to sum to 1, or all zeros if the model predicts none of any chroma.
+        Returns a Numpy array of shape (batch size, 12).
+        """
+        chroma_histograms = np.array((model if model is not None else self.model)(input_sequences))
+
+        # Normalise to ensure histograms sum to as expected
+        return normalise_histograms(chroma_histograms)
+
+    def __predict_chroma_histogram(self, input_sequence: np.ndarray[float], model: any = None) -> np.ndarray[float]:
+        """
+        Predict the chroma histogram for the input sequence, looking it up in the shared prediction cache first if there is one.
+        Predictions with another given model, e.g., a smaller fallback model, aren't cached.
+        """
+        if self.prediction_cache is None or model is not None:
+            return self.predict_chroma_histograms(input_sequence, model)[0]
+
+        # Predict the quantized window the cache is keyed by, so the chord is the same whether or not it was cached
+        key, quantized_window = self.prediction_cache.quantize_window(input_sequence[0], self.MODEL_PATH)
+        chroma_histogram = self.prediction_cache.get(key)
+        if chroma_histogram is None:
+            chroma_histogram = self.predict_chroma_histograms(quantized_window[np.newaxis])[0]
+            self.prediction_cache.put(key, chroma_histogram)
+        return chroma_histogram
+
+    def make_chord(self, chroma_histogram: np.ndarray[float]) -> Chord:
+        """
+        Create a Chord object holding a predicted chroma histogram, using the current tonic and chord note threshold.
+        If there is a codebook, the histogram is snapped to its nearest codeword, normalised, and the chord of the code is reused.
+        """
+        if self.codebook is None:
+            return Chord(chroma_histogram,
+                         tonic=self.TONIC,
+                         chord_note_threshold=self.CHORD_NOTE_THRESHOLD)
+
+        code_id = self.codebook.encode_histogram(chroma_histogram)
+        chord = self.__code_chords.get(code_id)
+        if chord is None:
+            chord = Chord(self.codebook.normalised_codewords[code_id],
+                          tonic=self.TONIC,
+                          chord_note_threshold=self.CHORD_NOTE_THRESHOLD,
+                          code_id=code_id)
+            self.__code_chords[code_id] = chord
+        return chord
+
+    def get_input_chroma_histogram(self, chord: Chord) -> np.ndarray[float]:
+        """Get the chroma histogram of a chord to feed back into the input sequence, either thresholded or not."""
+        if self.THRESHOLD_INPUT_SEQUENCE:
+            return chord.get_thresholded_chroma_histogram()
+        else:
+            return chord.get_unthresholded_chroma_histogram()
+
     def set_tonic(self, new_tonic: int) -> None:
         self.TONIC = new_tonic
+        self.__code_chords.clear()
 
     def set_chord_note_threshold(self, new_threshold: float) -> None:
         self.CHORD_NOTE_THRESHOLD = new_threshold
+        self.__code_chords.clear()
     
     def set_threshold_input_sequence(self, new_state: bool) -> None:
         self.THRESHOLD_INPUT_SEQUENCE = new_state
@@ -0,0 +1,69 @@
+# Ways of handling common tones of two chords whose velocity changes
+SUSTAIN = "sustain"         # Keep sounding at the velocity they were started with
+RETRIGGER = "retrigger"     # Restart at the new velocity, if it changed by more than the velocity tolerance
+
+def get_chord_transition(
+        sounding_notes: list[list[int, int]] | None,
+        voiced_chord: list[list[int, int]],
+        velocity_policy: str = SUSTAIN,
+        velocity_tolerance: int = 0
+    ) -> tuple[list[int], list[list[int, int]], list[list[int, int]]]:
+
+    """
+    Get the notes to stop and start to move from the notes sounding to a new voiced chord, keeping the common tones
+    of both sounding instead of stopping and restarting every note.
+
+    Parameters:
+        sounding_notes:     list[list[int, int]] | None. The [pitch, velocity] pairs sounding, None if there are none.
+        voiced_chord:       list[list[int, int]]. The [pitch, velocity] pairs of the new chord.
+        velocity_policy:    str (default "sustain"). How to handle common tones whose velocity changes, "sustain" or "retrigger".
+        velocity_tolerance: int (default 0). Largest velocity change of a common tone which doesn't retrigger it with the "retrigger" policy.
+
+    Returns:
+        tuple of the pitches to stop, the [pitch, velocity] pairs to start, and the [pitch, velocity] pairs sounding afterwards.
+    """
+
+    if velocity_policy not in [SUSTAIN, RETRIGGER]:
+        raise ValueError(f"Velocity policy must be '{SUSTAIN}' or '{RETRIGGER}'. Received {velocity_policy}.")
+
+    sounding_velocities = {pitch: velocity for pitch, velocity in (sounding_notes or [])}
+    new_velocities = {pitch: velocity for pitch, velocity in voiced_chord}
+
+    # Stop notes not in the new chord, and common tones to be restarted at a new velocity
+    retriggered_pitches = [pitch for pitch in new_velocities if pitch in sounding_velocities and velocity_policy == RETRIGGER
+                           and abs(new_velocities[pitch] - sounding_velocities[pitch]) > velocity_tolerance]
+    note_offs = [pitch for pitch in sounding_velocities if pitch not in new_velocities] + retriggered_pitches
+
+    # Start notes not sounding yet, and restarted common tones
+    note_ons = [[pitch, velocity] for pitch, velocity in voiced_chord if pitch not in sounding_velocities or pitch in retriggered_pitches]
+
+    # Sustained common tones keep the velocity they were started with
+    sounding_notes = [[pitch, velocity if pitch not in sounding_velocities or pitch in retriggered_pitches else sounding_velocities[pitch]]
+                      for pitch, velocity in voiced_chord]
+
+    return note_offs, note_ons, sounding_notes
+
+if __name__ == "__main__":
+
+    import numpy as np
+    from .chord import Chord
+
+    print(get_chord_transition([[48, 60], [64, 60], [67, 60]], [[48, 80], [65, 80], [69, 80]]))
+    print(get_chord_transition([[48, 60], [64, 60], [67, 60]], [[48, 80], [65, 80], [69, 80]], velocity_policy=RETRIGGER, velocity_tolerance=10))
+
+    # Compare the note messages sent for sustained harmony, changing a little with every note, when restarting every note and when only sending changes
+    rng = np.random.default_rng(0)
+    chroma_histogram = rng.dirichlet(np.full(12, 0.3))
+    voiced_chords = []
+    for _ in range(1000):
+        chroma_histogram = 0.9 * chroma_histogram + 0.1 * rng.dirichlet(np.full(12, 0.3))
+        voiced_chords.append(Chord(chroma_histogram, tonic=0, chord_note_threshold=0.14).get_voiced_chord(intensity=rng.uniform(0.4, 0.6)))
+
+    restart_messages = sum(len(previous_voiced_chord) + len(voiced_chord) for previous_voiced_chord, voiced_chord in zip([[]] + voiced_chords, voiced_chords))
+    print(f"Note messages for {len(voiced_chords)} chords, restarting every note: {restart_messages}")
+    for velocity_policy, velocity_tolerance in [(SUSTAIN, 0), (RETRIGGER, 10), (RETRIGGER, 0)]:
+        sounding_notes, messages = None, 0
+        for voiced_chord in voiced_chords:
+            note_offs, note_ons, sounding_notes = get_chord_transition(sounding_notes, voiced_chord, velocity_policy, velocity_tolerance)
+            messages += len(note_offs) + len(note_ons)
+        print(f"Only sending changes, {velocity_policy} with tolerance {velocity_tolerance}: {messages} ({round(100 * messages / restart_messages, 1)} %)")
\ No newline at end of file
@@ -26,10 +26,22 @@ class ChordVoicingEngine:
         Returns:
             list[list[int, int]] - a list of MIDI notes as [MIDI pitch, MIDI velocity] pairs
         """
-        
-        voiced_chord = []
+
+        # Calculate velocity
+        velocity = self.get_velocity(intensity)
+
+        return [[midi_note_number, velocity] for midi_note_number in self.get_chord_pitches(chord, intensity)]
+
+    def get_chord_pitches(self, chord: any, intensity: float) -> list[int]:
+        """
+        Get the MIDI pitches of a Chord object's voiced notes, which only depend on the intensity band of the
+        intensity (see get_intensity_band()), so that they can be kept for each band of a chord that doesn't change.
+        """
+
+        midi_note_numbers = []
 
         chroma_histogram = chord.get_thresholded_chroma_histogram()
+        intensity_band = self.get_intensity_band(intensity)
 
         # root_chroma = np.argmax(chroma_histogram)[0]
 
@@ -37,14 +49,14 @@ class ChordVoicingEngine:
 
             if chroma_amount >= chord.CHORD_NOTE_THRESHOLD: # Only do code block for valid chord notes above the threshold
 
-                if intensity >= 0.45:
+                if intensity_band == 0:
                     # Calculate actual pitch
                     if chroma_amount > self.LOWER_OCTAVE_THESHOLD:
                         midi_note_number = 36 + chroma_pitch + chord.TONIC
                     else:
                         midi_note_number = 60 + chroma_pitch + chord.TONIC
                 
-                elif intensity >= 0.25:
+                elif intensity_band == 1:
                     # Calculate actual pitch
                     if chroma_amount > self.LOWER_OCTAVE_THESHOLD:
                         midi_note_number = 48 + chroma_pitch + chord.TONIC
@@ -58,10 +70,22 @@ class ChordVoicingEngine:
                     else:
                         midi_note_number = 72 + chroma_pitch + chord.TONIC
                 
-                # Calculate velocity
-                velocity = 30 + int(intensity * 97)
-                
-                # Add to voiced_chord list of lists
-                voiced_chord.append([midi_note_number, velocity])
+                # Add to list of pitches
+                midi_note_numbers.append(midi_note_number)
+
+        return midi_note_numbers
+
+    @staticmethod
+    def get_intensity_band(intensity: float) -> int:
+        """Get the band of an intensity which the octaves of voiced notes depend on: 0 for loud (>= 0.45), 1 for medium (>= 0.25), 2 for soft."""
+        if intensity >= 0.45:
+            return 0
+        elif intensity >= 0.25:
+            return 1
+        else:
+            return 2
 
-        return voiced_chord
\ No newline at end of file
+    @staticmethod
+    def get_velocity(intensity: float) -> int:
+        """Get the MIDI velocity of every voiced note of a chord played at an intensity."""
+        return 30 + int(intensity * 97)
\ No newline at end of file
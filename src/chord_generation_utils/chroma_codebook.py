@@ -0,0 +1,220 @@
+import numpy as np
+from .histogram_kernels import normalise_histograms
+
+class ChromaCodebook:
+    def __init__(self, codewords: np.ndarray[float], cell_keys: np.ndarray[int], max_error: float, counts: np.ndarray[int] = None) -> None:
+
+        """
+        A codebook of representative chroma histograms, each identified by an integer code ID, with a bound on the error
+        of every histogram it was learnt from, so that histograms can be stored as compact codes plus small residuals, and
+        chords looked up by code ID instead of hashing float vectors. Learn a codebook with ChromaCodebook.fit().
+
+        Each chroma amount is divided into cells of width 2 * max_error, and each cell of 12 amounts holding any of the
+        histograms learnt from gets one codeword, the midpoint between the smallest and largest amount of each chroma in
+        the cell, so that no amount of those histograms is further than max_error from its codeword. Histograms are
+        encoded by looking up their cell, falling back to the nearest codeword for cells not seen when learning, or for
+        histograms further than max_error from their cell's codeword, whose error may then be larger than max_error. Code IDs are ordered by how many histograms were learnt from each code.
+
+        Parameters:
+            codewords:  np.ndarray[float] of shape (num codes, 12). Representative histogram of each code.
+            cell_keys:  np.ndarray[int] of shape (num codes, 12). Cell of each code, the index of each amount's cell.
+            max_error:  float. Largest difference of any amount of a histogram learnt from from its codeword.
+            counts:     np.ndarray[int] of shape (num codes,) (default None). Number of histograms learnt from of each code.
+        """
+
+        self.MAX_ERROR = max_error
+        self.CELL_SIZE = 2 * max_error
+        self.NUM_CELLS = self.get_num_cells(max_error)
+
+        self.codewords = np.ascontiguousarray(codewords, dtype=np.float64).reshape(-1, 12)
+        self.cell_keys = np.ascontiguousarray(cell_keys, dtype=np.uint8).reshape(-1, 12)
+        self.counts = np.asarray(counts, dtype=np.int64) if counts is not None else np.zeros(len(self.codewords), dtype=np.int64)
+
+        # Codewords normalised to sum to 1, as predictions are, for chords made from codes
+        self.normalised_codewords = normalise_histograms(self.codewords.copy())
+
+        # Code ID of each cell, as a dict for single histograms and sorted keys for batches
+        self.__code_ids = {cell_key.tobytes(): code_id for code_id, cell_key in enumerate(self.cell_keys)}
+        cell_key_values = self.__get_key_values(self.cell_keys)
+        self.__sorted_order = np.argsort(cell_key_values)
+        self.__sorted_cell_key_values = cell_key_values[self.__sorted_order]
+
+        # Residuals are stored as int8 multiples of a step, so that they add at most RESIDUAL_STEP / 2 of error
+        self.RESIDUAL_STEP = max_error / 127
+
+    @staticmethod
+    def get_num_cells(max_error: float) -> int:
+        """Number of cells each amount between 0 and 1 is divided into for an error bound, which has to fit in a uint8."""
+        num_cells = int(np.ceil(1 / (2 * max_error)))
+        if not 0 < max_error <= 0.5 or num_cells > 256:
+            raise ValueError(f"Max error must be between 1/512 and 0.5, so that cells fit in a uint8. Received {max_error}.")
+        return num_cells
+
+    @classmethod
+    def fit(cls, histograms: np.ndarray[float], max_error: float = 0.02, max_codes: int = 65536) -> "ChromaCodebook":
+        """Learn a codebook from an array of histograms of shape (N, 12). See fit_chunks()."""
+        return cls.fit_chunks([histograms], max_error=max_error, max_codes=max_codes)
+
+    @classmethod
+    def fit_chunks(cls, histogram_chunks: any, max_error: float = 0.02, max_codes: int = 65536) -> "ChromaCodebook":
+        """
+        Learn a codebook from an iterable of arrays of histograms of shape (N, 12), e.g., the chunks of a dataset read
+        in turn, so that only the smallest and largest amounts and the count of each cell seen are held in memory.
+        Rows with NaN values are skipped. Raises a ValueError if more than max_codes cells are needed for max_error.
+        """
+        num_cells = cls.get_num_cells(max_error)
+        cell_keys = np.zeros((0, 12), dtype=np.uint8)
+        minimums = np.zeros((0, 12))
+        maximums = np.zeros((0, 12))
+        counts = np.zeros(0, dtype=np.int64)
+
+        for histograms in histogram_chunks:
+            histograms = np.asarray(histograms, dtype=np.float64).reshape(-1, 12)
+            histograms = histograms[~np.isnan(histograms).any(axis=1)]
+
+            # Merge the cells of the chunk with those seen so far
+            cell_keys, minimums, maximums, counts = cls.__reduce_cells(
+                np.concatenate([cell_keys, cls.__get_cell_keys(histograms, max_error, num_cells)]),
+                np.concatenate([minimums, histograms]),
+                np.concatenate([maximums, histograms]),
+                np.concatenate([counts, np.ones(len(histograms), dtype=np.int64)])
+            )
+            if len(counts) > max_codes:
+                raise ValueError(f"More than {max_codes} codes are needed for a max error of {max_error}. Increase max_error or max_codes.")
+
+        # Most common codes first
+        order = np.argsort(-counts, kind="stable")
+        return cls((minimums[order] + maximums[order]) / 2, cell_keys[order], max_error, counts[order])
+
+    @staticmethod
+    def __get_cell_keys(histograms: np.ndarray[float], max_error: float, num_cells: int) -> np.ndarray[int]:
+        return np.clip(np.floor(histograms / (2 * max_error)), 0, num_cells - 1).astype(np.uint8)
+
+    @staticmethod
+    def __get_key_values(cell_keys: np.ndarray[int]) -> np.ndarray:
+        """View each row of 12 cell indices as a single value, which can be sorted and searched."""
+        return np.ascontiguousarray(cell_keys, dtype=np.uint8).view(np.dtype((np.void, 12))).ravel()
+
+    @classmethod
+    def __reduce_cells(cls, cell_keys: np.ndarray[int], minimums: np.ndarray[float], maximums: np.ndarray[float], counts: np.ndarray[int]) -> tuple:
+        """Combine the rows of the same cell, keeping the smallest and largest amounts and the total count of each."""
+        _, first_rows, inverse = np.unique(cls.__get_key_values(cell_keys), return_index=True, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        starts = np.flatnonzero(np.diff(inverse[order], prepend=-1))
+        return (
+            cell_keys[first_rows],
+            np.minimum.reduceat(minimums[order], starts),
+            np.maximum.reduceat(maximums[order], starts),
+            np.add.reduceat(counts[order], starts)
+        )
+
+    def encode(self, histograms: np.ndarray[float]) -> tuple[np.ndarray[int], np.ndarray[float]]:
+        """Get the code ID of each histogram of an array of shape (N, 12), and the largest difference of any of its amounts from the codeword."""
+        histograms = np.asarray(histograms, dtype=np.float64).reshape(-1, 12)
+
+        # Look up each histogram's cell among the sorted cells of the codebook
+        key_values = self.__get_key_values(self.__get_cell_keys(histograms, self.MAX_ERROR, self.NUM_CELLS))
+        positions = np.minimum(np.searchsorted(self.__sorted_cell_key_values, key_values), len(self.__sorted_cell_key_values) - 1)
+        codes = self.__sorted_order[positions]
+
+        errors = np.abs(histograms - self.codewords[codes]).max(axis=1)
+
+        # Histograms of cells not seen when learning, or further than max error from their cell's codeword, take the nearest codeword,
+        # compared in blocks of about a million amounts
+        far_rows = np.flatnonzero((self.__sorted_cell_key_values[positions] != key_values) | (errors > self.MAX_ERROR))
+        block_rows = max(1, 2**20 // (12 * len(self.codewords)))
+        for start in range(0, far_rows.size, block_rows):
+            rows = far_rows[start:start + block_rows]
+            distances = np.abs(histograms[rows, np.newaxis] - self.codewords).max(axis=2)
+            codes[rows] = distances.argmin(axis=1)
+            errors[rows] = distances.min(axis=1)
+
+        return codes, errors
+
+    def encode_histogram(self, histogram: np.ndarray[float]) -> int:
+        """Get the code ID of a single histogram, e.g., of a prediction, by a dict lookup of its cell, or the nearest codeword as encode() does."""
+        histogram = np.asarray(histogram, dtype=np.float64).ravel()
+
+        code_id = self.__code_ids.get(self.__get_cell_keys(histogram, self.MAX_ERROR, self.NUM_CELLS).tobytes())
+        if code_id is None or np.abs(histogram - self.codewords[code_id]).max() > self.MAX_ERROR:
+            code_id = int(np.abs(histogram - self.codewords).max(axis=1).argmin())
+        return code_id
+
+    def decode(self, codes: np.ndarray[int]) -> np.ndarray[float]:
+        """Get the codewords of an array of code IDs."""
+        return self.codewords[np.asarray(codes)]
+
+    def compress(self, histograms: np.ndarray[float]) -> tuple[np.ndarray[int], np.ndarray[int]]:
+        """
+        Compress histograms of shape (N, 12) to their code IDs, as uint16 if there are at most 65536 codes, and the int8 residual
+        from each codeword in steps of self.RESIDUAL_STEP, which decompress() restores to within RESIDUAL_STEP / 2 of each amount,
+        for histograms whose error is within self.MAX_ERROR. Larger residuals, of cells not seen when learning, are clipped.
+        """
+        histograms = np.asarray(histograms, dtype=np.float64).reshape(-1, 12)
+        codes, _ = self.encode(histograms)
+        residuals = np.clip(np.rint((histograms - self.codewords[codes]) / self.RESIDUAL_STEP), -127, 127).astype(np.int8)
+        return codes.astype(np.uint16 if len(self.codewords) <= 2**16 else np.uint32), residuals
+
+    def decompress(self, codes: np.ndarray[int], residuals: np.ndarray[int] = None) -> np.ndarray[float]:
+        """Restore histograms from their code IDs and residuals, or to their codewords if there are no residuals."""
+        histograms = self.decode(codes)
+        if residuals is not None:
+            histograms += residuals * self.RESIDUAL_STEP
+        return histograms
+
+    def save(self, npz_path: str) -> None:
+        np.savez(npz_path, codewords=self.codewords, cell_keys=self.cell_keys, counts=self.counts, max_error=np.array(self.MAX_ERROR))
+
+    @classmethod
+    def load(cls, npz_path: str) -> "ChromaCodebook":
+        """Load a codebook saved with save()."""
+        with np.load(npz_path, allow_pickle=False) as arrays:
+            return cls(arrays["codewords"], arrays["cell_keys"], float(arrays["max_error"]), arrays["counts"])
+
+    def __len__(self) -> int:
+        return len(self.codewords)
+
+if __name__ == "__main__":
+
+    # Check the error bounds and lookups on histograms clustered around chords, as in datasets: python -m chord_generation_utils.chroma_codebook
+
+    import time
+
+    rng = np.random.default_rng(0)
+    # Chords of 1 to 4 notes, some far more common than others, each played with varying note durations
+    templates = np.zeros((300, 12))
+    for template in templates:
+        template[rng.choice(12, rng.integers(1, 5), replace=False)] = 1
+    histograms = templates[rng.zipf(1.5, 200000) % len(templates)] * rng.choice([0.5, 0.75, 1], (200000, 12))
+    normalise_histograms(histograms)
+    histograms[::1000] = 0 # Empty bars
+
+    for max_error in [0.01, 0.02, 0.05]:
+        start_time = time.perf_counter()
+        codebook = ChromaCodebook.fit_chunks(np.array_split(histograms, 20), max_error=max_error)
+        fit_secs = time.perf_counter() - start_time
+
+        codes, errors = codebook.encode(histograms)
+        compressed_codes, residuals = codebook.compress(histograms)
+        decompressed = codebook.decompress(compressed_codes, residuals)
+        single_codes = [codebook.encode_histogram(histogram) for histogram in histograms[:2000]]
+        print(f"Max error {max_error}: {len(codebook)} codes learnt in {round(fit_secs, 3)} secs, "
+              f"largest error {errors.max():.4f} (within bound: {errors.max() <= max_error + 1e-6}), mean error {errors.mean():.4f}, "
+              f"largest error after decompressing {np.abs(decompressed - histograms).max():.5f} (within bound: {np.abs(decompressed - histograms).max() <= codebook.RESIDUAL_STEP / 2 + 1e-6}), "
+              f"single lookups match: {np.array_equal(single_codes, codes[:2000])}")
+
+    # Unseen histograms take the nearest codeword
+    unseen_histograms = normalise_histograms(rng.dirichlet(np.full(12, 0.1), 1000))
+    unseen_codes, unseen_errors = codebook.encode(unseen_histograms)
+    nearest_errors = np.abs(unseen_histograms[:, np.newaxis] - codebook.codewords).max(axis=2).min(axis=1)
+    print(f"New histograms: {np.count_nonzero(unseen_errors > max_error)} of {len(unseen_histograms)} beyond the bound, "
+          f"those beyond it given the nearest codeword: {np.all((unseen_errors <= max_error) | (unseen_errors == nearest_errors))}, "
+          f"single lookups match: {np.array_equal([codebook.encode_histogram(histogram) for histogram in unseen_histograms], unseen_codes)}")
+
+    # Bytes per histogram, against 12 float64 amounts
+    print(f"Bytes per histogram: {12 * 8} as float64, {compressed_codes.itemsize + residuals.itemsize * 12} as a code and residuals, {compressed_codes.itemsize} as a code")
+
+    start_time = time.perf_counter()
+    for histogram in histograms[:20000]:
+        codebook.encode_histogram(histogram)
+    print(f"Single histogram lookup: {round((time.perf_counter() - start_time) / 20000 * 1e6, 2)} µs")
\ No newline at end of file
@@ -0,0 +1,76 @@
+import numpy as np
+
+# Thresholding and normalisation of chroma histograms, shared by chord generation, offline harmonization and dataset extraction.
+# Each works on a batch of histograms of shape (N, 12) in place, which may be a view, e.g., input_sequences[:, -1, 1:] or
+# chords_array[:, 1:]. A single histogram is passed as histogram[np.newaxis].
+
+def normalise_histograms(histograms: np.ndarray[float]) -> np.ndarray[float]:
+    """Normalise each histogram of an (N, 12) array to sum to 1 in place, leaving histograms summing to 0 as all zeros. Returns the array."""
+    sums = histograms.sum(axis=1, keepdims=True)
+    np.divide(histograms, sums, out=histograms, where=sums != 0)
+    return histograms
+
+def threshold_histograms(histograms: np.ndarray[float], threshold: float | np.ndarray[float], out: np.ndarray[float] = None) -> np.ndarray[float]:
+    """
+    Set the amounts of each histogram of an (N, 12) array which are not above the threshold to 0, and then normalise
+    what remains to sum to 1, as Chord.get_thresholded_chroma_histogram() does for a single histogram.
+
+    Parameters:
+        histograms:     np.ndarray[float] of shape (N, 12). The histograms to threshold.
+        threshold:      float | np.ndarray[float]. The amount a chroma must be above to be kept, or one per histogram of shape (N, 1).
+        out:            np.ndarray[float] of shape (N, 12) (default None). Array to write the result to, by default histograms itself.
+                        Amounts are compared with the threshold in the dtype of histograms, so a float64 out keeps the comparison of float32 histograms unchanged.
+
+    Returns:
+        np.ndarray[float]. out, or histograms if out is None.
+    """
+    # Find amounts to remove before writing to out, in case it is histograms
+    removed = ~(histograms > threshold)
+    if out is None:
+        out = histograms
+    elif out is not histograms:
+        np.copyto(out, histograms)
+
+    out[removed] = 0
+    return normalise_histograms(out)
+
+if __name__ == "__main__":
+
+    # Check that the kernels give the same results as the single histogram implementations they replace
+    rng = np.random.default_rng(0)
+    histograms = rng.random((10000, 12)).astype(np.float32) ** 3
+    histograms[::7] = 0 # Rows summing to 0
+    histograms[1::11, :6] = 0 # Rows with no amounts above the threshold
+    histograms[2::13, 3] = np.float32(0.14) # Amounts equal to the threshold
+
+    def threshold_histogram(chroma_histogram: np.ndarray[float], chord_note_threshold: float) -> np.ndarray[float]:
+        # Previous Chord.get_thresholded_chroma_histogram()
+        thresholded_chroma_histogram = np.zeros(12)
+        for i, chroma_amount in enumerate(chroma_histogram):
+            if chroma_amount > chord_note_threshold:
+                thresholded_chroma_histogram[i] = chroma_amount
+        if thresholded_chroma_histogram.sum() != 0:
+            thresholded_chroma_histogram = thresholded_chroma_histogram / thresholded_chroma_histogram.sum()
+        return thresholded_chroma_histogram
+
+    for threshold in [0.1, 0.14, 0.3]:
+        expected = np.asarray([threshold_histogram(histogram, threshold) for histogram in histograms])
+        thresholded = threshold_histograms(histograms, threshold, out=np.zeros(histograms.shape))
+        print(f"Threshold {threshold}: thresholding identical: {np.array_equal(thresholded, expected)}")
+
+    # Normalisation of model outputs, which previously gave NaN for rows summing to 0
+    with np.errstate(invalid="ignore"):
+        expected = histograms / histograms.sum(axis=1, keepdims=True)
+    normalised = normalise_histograms(histograms.copy())
+    nonzero = histograms.sum(axis=1) != 0
+    print(f"Normalisation identical for non-zero rows: {np.array_equal(normalised[nonzero], expected[nonzero])}, zero rows kept as zeros: {not normalised[~nonzero].any()}")
+
+    # In place normalisation of a strided view, as of the chroma histograms of a chords array
+    chords_array = np.concatenate([rng.integers(0, 12, (len(histograms), 1)), histograms], axis=1).astype(float)
+    normalise_histograms(chords_array[:, 1:])
+    print(f"Strided view normalised in place: {np.allclose(chords_array[nonzero, 1:].sum(axis=1), 1) and not chords_array[~nonzero, 1:].any()}")
+
+    # Per histogram thresholds
+    thresholds = rng.uniform(0.05, 0.3, (len(histograms), 1))
+    expected = np.asarray([threshold_histogram(histogram, float(threshold)) for histogram, threshold in zip(histograms, thresholds[:, 0])])
+    print(f"Per histogram thresholds identical: {np.array_equal(threshold_histograms(histograms, thresholds, out=np.zeros(histograms.shape)), expected)}")
\ No newline at end of file
@@ -0,0 +1,351 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+import numpy as np
+
+# Environment variables bounding the threads of the math libraries TensorFlow may use, set for each worker process
+THREAD_COUNT_ENVIRONMENT_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"]
+
+def get_cpu_sets(num_workers: int, cpus: list[int] = None) -> list[list[int]]:
+    """Split the given CPUs, by default those this process may run on, into num_workers contiguous sets, sharing CPUs round-robin if there are fewer CPUs than workers."""
+    if cpus is None:
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    if num_workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(num_workers)]
+    return [[int(cpu) for cpu in cpu_set] for cpu_set in np.array_split(cpus, num_workers)]
+
+def _run_worker(worker_index: int, cpus: list[int], intra_op_threads: int, inter_op_threads: int, model_path: str, model_factory: callable, generator_settings: dict, request_queue: multiprocessing.Queue, response_queue: multiprocessing.Queue) -> None:
+    """Main loop of a worker process, generating chords for the sessions it owns until it receives None."""
+
+    # Pin to the worker's CPUs before any thread pools are created, so their threads inherit the affinity
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    import tensorflow as tf
+    from .chord_generator import ChordGenerator
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+    # Load the model once, shared by all sessions of the worker, or send back why it couldn't be loaded and exit
+    try:
+        model = model_factory() if model_factory is not None else tf.keras.models.load_model(model_path)
+    except Exception:
+        response_queue.put((None, RuntimeError(f"Inference worker {worker_index} failed to load its model:\n{traceback.format_exc()}")))
+        return
+    sessions = {}
+
+    busy_secs = 0.0
+    num_notes = 0
+    service_ms = []
+
+    response_queue.put((None, worker_index))
+    while (request := request_queue.get()) is not None:
+        request_id, request_type, session_id, values = request
+        request_start_time = time.perf_counter()
+        try:
+            if request_type == "note":
+                melody_note_midi_number, intensity = values
+                chord = sessions[session_id].get_chord(melody_note_midi_number)
+                result = {
+                    "chroma_histogram": chord.get_unthresholded_chroma_histogram().tolist(),
+                    "thresholded_chroma_histogram": chord.get_thresholded_chroma_histogram().tolist(),
+                    "voiced_chord": chord.get_voiced_chord(intensity=intensity)
+                }
+                num_notes += 1
+            elif request_type == "create_session":
+                sessions[session_id] = ChordGenerator(model_path, seed=values[0], model=model, **generator_settings)
+                result = sessions[session_id].SEED
+            elif request_type == "close_session":
+                result = sessions.pop(session_id, None) is not None
+            elif request_type == "set_tonic":
+                result = sessions[session_id].set_tonic(values[0])
+            elif request_type == "set_chord_note_threshold":
+                result = sessions[session_id].set_chord_note_threshold(values[0])
+            elif request_type == "set_threshold_input_sequence":
+                result = sessions[session_id].set_threshold_input_sequence(values[0])
+            elif request_type == "stats":
+                result = {"busy_secs": busy_secs, "notes": num_notes, "sessions": len(sessions), "service_ms": service_ms}
+                service_ms = []
+            else:
+                raise ValueError(f"Unknown request type {request_type}")
+        except Exception as e:
+            result = e
+
+        request_secs = time.perf_counter() - request_start_time
+        if request_type == "note":
+            busy_secs += request_secs
+            service_ms.append(request_secs * 1000)
+        response_queue.put((request_id, result))
+
+class InferencePool:
+    def __init__(
+            self,
+            model_path: str,
+            num_workers: int = None,
+            cpu_sets: list[list[int]] = None,
+            intra_op_threads: int = 1,
+            inter_op_threads: int = 1,
+            model_factory: callable = None,
+            startup_timeout_secs: float = 300,
+            **generator_settings
+        ) -> None:
+
+        """
+        Owns a pool of inference worker processes, each pinned to its own set of CPUs with TensorFlow's and the math
+        libraries' thread pools bounded, so that many sessions on one host don't oversubscribe the cores.
+        Each session is a ChordGenerator with its own input sequence, owned by one worker, and new sessions go
+        to the worker with the fewest. The sessions of a worker share one copy of the model.
+
+        Workers are processes rather than threads, as TensorFlow's thread pools are shared by a whole process.
+        If a worker fails to start, the pool stops the others and raises a RuntimeError with the worker's error, and if
+        a worker exits while running, its pending and later requests fail with a RuntimeError instead of never resolving.
+
+        Parameters:
+            model_path:         str. Path of the model to load in each worker.
+            num_workers:        int (default None). Number of worker processes, by default one per CPU set, or one per CPU.
+            cpu_sets:           list[list[int]] (default None). CPUs of each worker, by default the available CPUs split evenly.
+            intra_op_threads:   int (default 1). Threads each worker may use within a single op.
+            inter_op_threads:   int (default 1). Threads each worker may use to run independent ops in parallel.
+            model_factory:      callable (default None). Picklable function called in each worker to create the model or backend, instead of loading model_path.
+            startup_timeout_secs: float (default 300). Longest time to wait for all workers to load their model.
+            generator_settings: Other ChordGenerator parameters used for every session, at least sequence_length and tonic.
+        """
+
+        # By default, one worker per CPU set, or per available CPU
+        if num_workers is None:
+            num_workers = len(cpu_sets) if cpu_sets is not None else len(get_cpu_sets(1)[0])
+        if cpu_sets is None:
+            cpu_sets = get_cpu_sets(num_workers)
+        if len(cpu_sets) != num_workers:
+            raise ValueError(f"Expected one CPU set per worker, received {len(cpu_sets)} CPU sets for {num_workers} workers")
+
+        self.MODEL_PATH = model_path
+        self.NUM_WORKERS = num_workers
+        self.CPU_SETS = cpu_sets
+        self.INTRA_OP_THREADS = intra_op_threads
+        self.INTER_OP_THREADS = inter_op_threads
+
+        self.session_workers = {}
+        self.__futures = {}
+        self.__futures_lock = threading.Lock()
+        self.__next_request_id = 0
+        self.__round_trip_ms = [[] for _ in range(num_workers)]
+        # Worker index -> exit code of workers which exited while running
+        self.__exited_workers = {}
+
+        # Start workers, with the thread count environment variables set as they start, and wait for each to load the model
+        context = multiprocessing.get_context("spawn")
+        self.request_queues = [context.Queue() for _ in range(num_workers)]
+        self.response_queues = [context.Queue() for _ in range(num_workers)]
+        self.workers = []
+        original_environment = {variable: os.environ.get(variable) for variable in THREAD_COUNT_ENVIRONMENT_VARIABLES + ["TF_NUM_INTEROP_THREADS"]}
+        try:
+            for variable in THREAD_COUNT_ENVIRONMENT_VARIABLES:
+                os.environ[variable] = str(intra_op_threads)
+            os.environ["TF_NUM_INTEROP_THREADS"] = str(inter_op_threads)
+
+            for worker_index in range(num_workers):
+                worker = context.Process(
+                    target=_run_worker,
+                    args=(worker_index, cpu_sets[worker_index], intra_op_threads, inter_op_threads, model_path, model_factory,
+                          generator_settings, self.request_queues[worker_index], self.response_queues[worker_index]),
+                    name=f"inference_worker_{worker_index}",
+                    daemon=True
+                )
+                worker.start()
+                self.workers.append(worker)
+        finally:
+            for variable, value in original_environment.items():
+                if value is None:
+                    os.environ.pop(variable, None)
+                else:
+                    os.environ[variable] = value
+
+        self.__wait_for_workers(startup_timeout_secs)
+        print(f"Started {num_workers} inference workers on CPU sets {cpu_sets}, with {intra_op_threads} intra-op and {inter_op_threads} inter-op threads each")
+
+        # Resolve the futures of each worker's requests as their responses arrive
+        self.start_time = time.perf_counter()
+        self.response_threads = [threading.Thread(target=self.__receive_responses, args=(worker_index,), daemon=True) for worker_index in range(num_workers)]
+        for response_thread in self.response_threads:
+            response_thread.start()
+
+    def create_session(self, session_id: any, seed: int = None) -> int:
+        """Create a session on the worker with the fewest sessions, returning its seed."""
+        session_counts = [list(self.session_workers.values()).count(worker_index) for worker_index in range(self.NUM_WORKERS)]
+        self.session_workers[session_id] = int(np.argmin(session_counts))
+        return self.__submit("create_session", session_id, seed).result()
+
+    def close_session(self, session_id: any) -> None:
+        self.__submit("close_session", session_id).result()
+        del self.session_workers[session_id]
+
+    def submit_note(self, session_id: any, melody_note_midi_number: int, intensity: float) -> Future:
+        """
+        Send a melody note to the worker of its session without waiting, returning a Future of the chord as a dict of its
+        chroma histogram, thresholded chroma histogram and voiced chord. Notes of one session are generated in order.
+        """
+        return self.__submit("note", session_id, melody_note_midi_number, intensity)
+
+    def get_chord(self, session_id: any, melody_note_midi_number: int, intensity: float) -> dict:
+        return self.submit_note(session_id, melody_note_midi_number, intensity).result()
+
+    def set_tonic(self, session_id: any, new_tonic: int) -> None:
+        self.__submit("set_tonic", session_id, new_tonic).result()
+
+    def set_chord_note_threshold(self, session_id: any, new_threshold: float) -> None:
+        self.__submit("set_chord_note_threshold", session_id, new_threshold).result()
+
+    def set_threshold_input_sequence(self, session_id: any, new_state: bool) -> None:
+        self.__submit("set_threshold_input_sequence", session_id, new_state).result()
+
+    def get_utilisation_report(self) -> list[dict]:
+        """
+        Get the utilisation of each worker since the pool started or the previous report: the share of the time spent
+        generating chords, and the time to generate each chord (service time) and to receive it (round trip time).
+        """
+        elapsed_secs = time.perf_counter() - self.start_time
+        worker_stats = [self.__submit("stats", worker_index=worker_index) for worker_index in range(self.NUM_WORKERS)]
+
+        report = []
+        for worker_index, stats_future in enumerate(worker_stats):
+            stats = stats_future.result()
+            with self.__futures_lock:
+                round_trip_ms, self.__round_trip_ms[worker_index] = self.__round_trip_ms[worker_index], []
+            report.append({
+                "worker": worker_index,
+                "cpus": self.CPU_SETS[worker_index],
+                "sessions": stats["sessions"],
+                "notes": stats["notes"],
+                "busy_secs": stats["busy_secs"],
+                "utilisation": stats["busy_secs"] / elapsed_secs if elapsed_secs > 0 else 0.0,
+                "mean_service_ms": float(np.mean(stats["service_ms"])) if len(stats["service_ms"]) > 0 else 0.0,
+                "p99_service_ms": float(np.percentile(stats["service_ms"], 99)) if len(stats["service_ms"]) > 0 else 0.0,
+                "mean_round_trip_ms": float(np.mean(round_trip_ms)) if len(round_trip_ms) > 0 else 0.0,
+                "p99_round_trip_ms": float(np.percentile(round_trip_ms, 99)) if len(round_trip_ms) > 0 else 0.0
+            })
+        return report
+
+    def print_utilisation_report(self, report: list[dict] = None) -> None:
+        if report is None:
+            report = self.get_utilisation_report()
+        print(f"{'worker':>6} {'cpus':<12} {'sessions':>8} {'notes':>8} {'util %':>7} {'service ms':>11} {'p99':>8} {'round trip ms':>14} {'p99':>8}")
+        for worker in report:
+            cpus = ",".join(str(cpu) for cpu in worker["cpus"])
+            print(f"{worker['worker']:>6} {cpus:<12} {worker['sessions']:>8} {worker['notes']:>8} {worker['utilisation'] * 100:>7.1f} "
+                  f"{worker['mean_service_ms']:>11.3f} {worker['p99_service_ms']:>8.3f} {worker['mean_round_trip_ms']:>14.3f} {worker['p99_round_trip_ms']:>8.3f}")
+
+    def __wait_for_workers(self, startup_timeout_secs: float) -> None:
+        """Wait for each worker to load its model, stopping all workers and raising if one fails, exits or takes too long."""
+        deadline = time.perf_counter() + startup_timeout_secs
+        for worker_index, worker in enumerate(self.workers):
+            while True:
+                try:
+                    _, result = self.response_queues[worker_index].get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    if not worker.is_alive():
+                        result = RuntimeError(f"Inference worker {worker_index} exited with code {worker.exitcode} while loading its model")
+                        break
+                    if time.perf_counter() > deadline:
+                        result = TimeoutError(f"Inference worker {worker_index} didn't load its model within {startup_timeout_secs} secs")
+                        break
+
+            if isinstance(result, Exception):
+                for other_worker in self.workers:
+                    if other_worker.is_alive():
+                        other_worker.terminate()
+                    other_worker.join()
+                raise result
+
+    def close(self) -> None:
+        """Stop the workers, which finish the requests already sent to them first."""
+        for request_queue in self.request_queues:
+            request_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        for response_queue in self.response_queues:
+            response_queue.put(None)
+        for response_thread in self.response_threads:
+            response_thread.join()
+
+    def __submit(self, request_type: str, session_id: any = None, *values, worker_index: int = None) -> Future:
+        if worker_index is None:
+            worker_index = self.session_workers[session_id]
+
+        future = Future()
+        with self.__futures_lock:
+            if worker_index in self.__exited_workers:
+                future.set_exception(self.__get_exited_error(worker_index))
+                return future
+            request_id = self.__next_request_id
+            self.__next_request_id += 1
+            self.__futures[request_id] = (future, worker_index, request_type, time.perf_counter())
+        self.request_queues[worker_index].put((request_id, request_type, session_id, values))
+        return future
+
+    def __receive_responses(self, worker_index: int) -> None:
+        while (response := self.__get_response(worker_index)) is not None:
+            request_id, result = response
+            with self.__futures_lock:
+                future, _, request_type, submit_time = self.__futures.pop(request_id)
+                if request_type == "note":
+                    self.__round_trip_ms[worker_index].append((time.perf_counter() - submit_time) * 1000)
+
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def __get_response(self, worker_index: int) -> tuple | None:
+        """Wait for a worker's next response, or fail its pending requests and return None if it has exited without one."""
+        while True:
+            try:
+                return self.response_queues[worker_index].get(timeout=0.5)
+            except queue.Empty:
+                if self.workers[worker_index].is_alive():
+                    continue
+
+            # Responses sent just before the worker exited may still be on their way
+            try:
+                return self.response_queues[worker_index].get(timeout=0.5)
+            except queue.Empty:
+                self.__fail_exited_worker(worker_index)
+                return None
+
+    def __fail_exited_worker(self, worker_index: int) -> None:
+        with self.__futures_lock:
+            self.__exited_workers[worker_index] = self.workers[worker_index].exitcode
+            pending_request_ids = [request_id for request_id, (_, request_worker_index, _, _) in self.__futures.items() if request_worker_index == worker_index]
+            pending_futures = [self.__futures.pop(request_id)[0] for request_id in pending_request_ids]
+
+        for future in pending_futures:
+            future.set_exception(self.__get_exited_error(worker_index))
+        if len(pending_futures) > 0:
+            print(f"Inference worker {worker_index} exited with code {self.__exited_workers[worker_index]}, failed its {len(pending_futures)} pending requests")
+
+    def __get_exited_error(self, worker_index: int) -> RuntimeError:
+        return RuntimeError(f"Inference worker {worker_index} exited with code {self.__exited_workers[worker_index]}")
+
+if __name__ == "__main__":
+
+    # Generate chords for several sessions at once, and print the utilisation of each worker
+    inference_pool = InferencePool("./src/trained_model/chroma_histogram_generator_model",
+                                   num_workers=2,
+                                   sequence_length=8,
+                                   tonic=0,
+                                   chord_note_threshold=0.14)
+
+    for session_id in range(8):
+        inference_pool.create_session(session_id, seed=session_id)
+
+    for step in range(50):
+        futures = [inference_pool.submit_note(session_id, 60 + (step * 7) % 12, 0.5) for session_id in range(8)]
+        chords = [future.result() for future in futures]
+
+    inference_pool.print_utilisation_report()
+    inference_pool.close()
\ No newline at end of file
@@ -1,16 +1,24 @@
 import numpy as np
+from .histogram_kernels import normalise_histograms
 
 class InputSequence:
     def __init__(
             self,
             sequence_length: int = 8,
             init_type: str = "rand",
-            update_direction: str = "append"
+            update_direction: str = "append",
+            seed: int = None
         ) -> None:
 
         """
         A data-focussed class which keeps track of the input sequence for the chord prediction model.
         It is used internally as a component in the ChordGenerator object.
+
+        Parameters:
+            sequence_length:    int (default 8). The number of steps in the input sequence.
+            init_type:          str (default "rand"). How to initialise the chroma histogram history, only "rand" is possible.
+            update_direction:   str (default "append"). Whether new values are added at the end ("append") or start ("prepend").
+            seed:               int (default None). Seed for the random initial chroma histogram history, None for a different one every time.
         """
 
         # Store the sequence length to be used
@@ -21,9 +29,7 @@ class InputSequence:
 
         # Init the chroma histogram history using random numbers
         if init_type == "rand":
-            self.chroma_histogram_history = np.random.rand(self.SEQUENCE_LENGTH, 12) 
-            for i, chord in enumerate(self.chroma_histogram_history): # Iterate over chroma histograms
-                self.chroma_histogram_history[i] = chord/chord.sum()
+            self.chroma_histogram_history = normalise_histograms(np.random.RandomState(seed).rand(self.SEQUENCE_LENGTH, 12))
         else:
             raise NotImplementedError("Only possible init_type is 'rand'")
         
@@ -61,6 +67,18 @@ class InputSequence:
         
         return input_sequence
     
+def update_histories(histories: np.ndarray[float], new_values: np.ndarray[float], update_direction: str = "append") -> None:
+    """
+    Update a batch of histories of shape (batch size, sequence length, ...) in place with a new value each, dropping the oldest,
+    in the same way as InputSequence. Used to update many input sequences at once, e.g., input_sequences[:, :, 0] for melody chromas.
+    """
+    if update_direction == "append":
+        histories[:, :-1] = histories[:, 1:].copy()
+        histories[:, -1] = new_values
+    elif update_direction == "prepend":
+        histories[:, 1:] = histories[:, :-1].copy()
+        histories[:, 0] = new_values
+
 if __name__ == "__main__":
 
     # Tests of the object
@@ -0,0 +1,230 @@
+import json
+import multiprocessing
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+def _hash_window_chunk(index_dir: str, start: int, stop: int) -> None:
+    """Hash the windows start:stop of an index being built into its memory-mapped keys, in a worker process."""
+    neighbour_chord_model = NeighbourChordModel(index_dir, is_built=False)
+    keys = np.load(os.path.join(index_dir, "keys.npy"), mmap_mode="r+")
+    keys[:, start:stop] = neighbour_chord_model.get_keys(neighbour_chord_model.get_window_features(np.arange(start, stop)))[0].T
+    keys.flush()
+
+class NeighbourChordModel:
+    def __init__(self, index_dir: str, num_neighbours: int = 8, max_candidates: int = 256, num_probes: int = 2, is_built: bool = True) -> None:
+
+        """
+        A model-free chord prediction backend, called like the model, which predicts the chroma histogram of an input
+        sequence as the mean of the targets of its nearest training windows, so that chords can be generated without a
+        neural network, e.g., as the fallback model of a DeadlineScheduler on a heavily loaded or low-power host.
+
+        Each window of sequence_length (melody chroma, chroma histogram) rows is compared as its melody chromas one-hot
+        encoded, followed by its histograms. Windows are found with random hyperplane locality-sensitive hashing: each
+        of num_tables tables hashes a window to the signs of its projections onto num_bits random directions, and
+        windows whose hash matches the input's, or differs in one of the num_probes least certain bits, are candidates.
+        The num_neighbours candidates closest to the input are then found exactly.
+
+        Only the input and output rows and the start row of every window are stored, with the sorted hashes of each
+        table, all opened memory-mapped, so processes serving chords share one copy from the page cache.
+        The target of a window is the output row at its start, as in ChordsDatasetManager.
+        Build an index with NeighbourChordModel.build().
+
+        Parameters:
+            index_dir:          str. Directory of an index built with NeighbourChordModel.build().
+            num_neighbours:     int (default 8). Nearest windows whose targets are averaged.
+            max_candidates:     int (default 256). Most windows of each hash compared exactly, to bound the latency of common hashes.
+            num_probes:         int (default 2). Least certain bits of each table's hash flipped to find more candidates.
+            is_built:           bool (default True). Whether the hash tables are built, False only while building.
+        """
+
+        self.INDEX_DIR = index_dir
+        self.NUM_NEIGHBOURS = num_neighbours
+        self.MAX_CANDIDATES = max_candidates
+        self.NUM_PROBES = num_probes
+
+        with open(os.path.join(index_dir, "meta.json" if is_built else "build_meta.json")) as meta_file:
+            self.META = json.load(meta_file)
+        self.SEQUENCE_LENGTH = self.META["sequence_length"]
+        self.NUM_TABLES = self.META["num_tables"]
+        self.NUM_BITS = self.META["num_bits"]
+
+        self.input_rows = np.load(os.path.join(index_dir, "input_rows.npy"), mmap_mode="r")
+        self.output_rows = np.load(os.path.join(index_dir, "output_rows.npy"), mmap_mode="r")
+        self.window_starts = np.load(os.path.join(index_dir, "window_starts.npy"), mmap_mode="r")
+        self.projections = np.load(os.path.join(index_dir, "projections.npy"))
+        self.feature_means = np.load(os.path.join(index_dir, "feature_means.npy"))
+        self.mean_output = np.load(os.path.join(index_dir, "mean_output.npy"))
+
+        if is_built:
+            self.sorted_keys = np.load(os.path.join(index_dir, "sorted_keys.npy"), mmap_mode="r")
+            self.sorted_windows = np.load(os.path.join(index_dir, "sorted_windows.npy"), mmap_mode="r")
+
+        self.__window_offsets = np.arange(self.SEQUENCE_LENGTH)
+        self.__bit_values = np.left_shift(np.uint32(1), np.arange(self.NUM_BITS, dtype=np.uint32))
+        self.__one_hot_chromas = np.eye(12, dtype=np.float32)
+
+    @classmethod
+    def build(
+            cls,
+            index_dir: str,
+            input_rows: np.ndarray[float],
+            output_rows: np.ndarray[float],
+            window_starts: np.ndarray[int],
+            sequence_length: int,
+            num_tables: int = 8,
+            num_bits: int = 16,
+            num_workers: int = 0,
+            chunk_windows: int = 100000,
+            seed: int = 0
+        ) -> "NeighbourChordModel":
+
+        """
+        Build an index in index_dir over the windows of sequence_length rows starting at window_starts, e.g., the training
+        windows of a WindowCache, whose arrays may be memory-mapped. The windows are hashed chunk_windows at a time,
+        by num_workers worker processes writing to the memory-mapped hashes if num_workers > 0, then each table is sorted.
+        """
+        if not 1 <= num_bits <= 32:
+            raise ValueError(f"Bits per hash must be between 1 and 32, so that hashes fit in a uint32. Received {num_bits}.")
+        os.makedirs(index_dir, exist_ok=True)
+
+        # Rows and window starts are copied into the index, so that it doesn't depend on where they came from
+        np.save(os.path.join(index_dir, "input_rows.npy"), np.asarray(input_rows, dtype=np.float32))
+        np.save(os.path.join(index_dir, "output_rows.npy"), np.asarray(output_rows, dtype=np.float32))
+        window_starts = np.asarray(window_starts, dtype=np.int64)
+        np.save(os.path.join(index_dir, "window_starts.npy"), window_starts)
+        np.save(os.path.join(index_dir, "mean_output.npy"), np.asarray(output_rows[window_starts[:100000]], dtype=np.float64).mean(axis=0))
+
+        # Hyperplanes through the mean of a sample of windows, so that each bit splits the windows about evenly
+        rng = np.random.default_rng(seed)
+        num_features = sequence_length * 24
+        # Zero until the sample's mean is computed, with the index opened unbuilt to gather the sample's features
+        np.save(os.path.join(index_dir, "feature_means.npy"), np.zeros(num_features, dtype=np.float32))
+        np.save(os.path.join(index_dir, "projections.npy"), rng.standard_normal((num_tables, num_bits, num_features)).astype(np.float32))
+        build_meta = {"sequence_length": sequence_length, "num_tables": num_tables, "num_bits": num_bits, "num_windows": len(window_starts), "seed": seed}
+        with open(os.path.join(index_dir, "build_meta.json"), "w") as meta_file:
+            json.dump(build_meta, meta_file, indent=2)
+
+        sample_windows = np.sort(rng.choice(len(window_starts), min(len(window_starts), 100000), replace=False))
+        np.save(os.path.join(index_dir, "feature_means.npy"), cls(index_dir, is_built=False).get_window_features(sample_windows).mean(axis=0))
+
+        # Hash every window, in chunks written straight to the memory-mapped keys
+        keys = np.lib.format.open_memmap(os.path.join(index_dir, "keys.npy"), mode="w+", dtype=np.uint32, shape=(num_tables, len(window_starts)))
+        del keys
+        chunk_starts = range(0, len(window_starts), chunk_windows)
+        if num_workers > 0:
+            with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                for future in [executor.submit(_hash_window_chunk, index_dir, start, min(start + chunk_windows, len(window_starts))) for start in chunk_starts]:
+                    future.result()
+        else:
+            for start in chunk_starts:
+                _hash_window_chunk(index_dir, start, min(start + chunk_windows, len(window_starts)))
+        print(f"Hashed {len(window_starts)} windows into {num_tables} tables of {num_bits} bits")
+
+        # Sort each table's hashes, keeping the window of each, so that windows with a hash are found by binary search
+        keys = np.load(os.path.join(index_dir, "keys.npy"), mmap_mode="r")
+        window_dtype = np.int32 if len(window_starts) < 2**31 else np.int64
+        sorted_keys = np.lib.format.open_memmap(os.path.join(index_dir, "sorted_keys.npy"), mode="w+", dtype=np.uint32, shape=keys.shape)
+        sorted_windows = np.lib.format.open_memmap(os.path.join(index_dir, "sorted_windows.npy"), mode="w+", dtype=window_dtype, shape=keys.shape)
+        for table in range(num_tables):
+            table_keys = np.asarray(keys[table])
+            order = np.argsort(table_keys, kind="stable")
+            sorted_keys[table] = table_keys[order]
+            sorted_windows[table] = order
+        sorted_keys.flush()
+        sorted_windows.flush()
+        del keys, sorted_keys, sorted_windows
+        os.remove(os.path.join(index_dir, "keys.npy"))
+
+        # Written last, so that an index whose build was interrupted isn't mistaken for a complete one
+        os.replace(os.path.join(index_dir, "build_meta.json"), os.path.join(index_dir, "meta.json"))
+        print(f"Saved neighbour index to {index_dir}")
+
+        return cls(index_dir)
+
+    def get_features(self, input_sequences: np.ndarray[float]) -> np.ndarray[float]:
+        """Get the features of input sequences of shape (batch size, sequence length, 13): the one-hot melody chromas and the histograms of each row."""
+        input_sequences = np.asarray(input_sequences, dtype=np.float32)
+        melody_chromas = self.__one_hot_chromas[np.rint(input_sequences[:, :, 0]).astype(np.int64) % 12]
+        return np.concatenate([melody_chromas, input_sequences[:, :, 1:]], axis=2).reshape(len(input_sequences), input_sequences.shape[1] * 24)
+
+    def get_window_features(self, windows: np.ndarray[int]) -> np.ndarray[float]:
+        """Get the features of indexed windows, gathered from the memory-mapped rows."""
+        return self.get_features(self.input_rows[np.asarray(self.window_starts[windows])[:, np.newaxis] + self.__window_offsets])
+
+    def get_keys(self, features: np.ndarray[float]) -> tuple[np.ndarray[int], np.ndarray[float]]:
+        """Get the hash of each of the features in each table, of shape (batch size, num tables), and the projections onto each table's directions."""
+        projections = np.einsum("bf,tkf->btk", features - self.feature_means, self.projections)
+        return ((projections > 0) * self.__bit_values).sum(axis=2, dtype=np.uint32), projections
+
+    def get_candidates(self, key: np.ndarray[int], projections: np.ndarray[float]) -> np.ndarray[int]:
+        """Get the windows sharing a table's hash with an input, or differing in one of its num_probes least certain bits, up to max_candidates per hash."""
+        candidates = []
+        for table in range(self.NUM_TABLES):
+            flipped_bits = self.__bit_values[np.argsort(np.abs(projections[table]))[:self.NUM_PROBES]]
+            probe_keys = np.concatenate([key[table:table + 1], key[table] ^ flipped_bits])
+            table_keys = self.sorted_keys[table]
+            for first, last in zip(np.searchsorted(table_keys, probe_keys, side="left"), np.searchsorted(table_keys, probe_keys, side="right")):
+                candidates.append(self.sorted_windows[table][first:min(last, first + self.MAX_CANDIDATES)])
+        return np.unique(np.concatenate(candidates))
+
+    def get_neighbours(self, input_sequences: np.ndarray[float]) -> list[np.ndarray[int]]:
+        """Get the num_neighbours nearest indexed windows of each input sequence, among its candidates, nearest first."""
+        features = self.get_features(input_sequences)
+        keys, projections = self.get_keys(features)
+
+        neighbours = []
+        for feature, key, key_projections in zip(features, keys, projections):
+            candidates = self.get_candidates(key, key_projections)
+            distances = ((self.get_window_features(candidates) - feature) ** 2).sum(axis=1)
+            if len(candidates) > self.NUM_NEIGHBOURS:
+                nearest = np.argpartition(distances, self.NUM_NEIGHBOURS)[:self.NUM_NEIGHBOURS]
+            else:
+                nearest = np.arange(len(candidates))
+            neighbours.append(candidates[nearest[np.argsort(distances[nearest])]])
+        return neighbours
+
+    def __call__(self, input_sequences: np.ndarray[float]) -> np.ndarray[float]:
+        """Predict the chroma histograms of a batch of input sequences of shape (batch size, sequence length, 13), of shape (batch size, 12)."""
+        predictions = np.empty((len(input_sequences), 12), dtype=np.float32)
+        for prediction, neighbours in zip(predictions, self.get_neighbours(np.asarray(input_sequences))):
+            # Inputs without candidates, in none of the windows' buckets, get the mean target
+            prediction[:] = self.output_rows[np.asarray(self.window_starts[neighbours])].mean(axis=0) if len(neighbours) > 0 else self.mean_output
+        return predictions
+
+    def get_footprint(self) -> dict[str, int]:
+        """Get the bytes of each file of the index, and their total, which is what is mapped into memory when serving."""
+        footprint = {file_name: os.path.getsize(os.path.join(self.INDEX_DIR, file_name)) for file_name in sorted(os.listdir(self.INDEX_DIR)) if file_name.endswith(".npy")}
+        footprint["total"] = sum(footprint.values())
+        return footprint
+
+if __name__ == "__main__":
+
+    # Check that exact neighbours are found on windows of random rows: python -m chord_generation_utils.neighbour_chord_model <index dir>
+
+    import sys
+    import time
+
+    rng = np.random.default_rng(0)
+    input_rows = np.concatenate([rng.integers(0, 12, (50000, 1)), rng.dirichlet(np.full(12, 0.2), 50000)], axis=1)
+    output_rows = np.roll(input_rows[:, 1:], -1, axis=0)
+    window_starts = np.arange(len(input_rows) - 8)
+
+    start_time = time.perf_counter()
+    neighbour_chord_model = NeighbourChordModel.build(sys.argv[1], input_rows, output_rows, window_starts, 8, num_workers=2, chunk_windows=10000)
+    print(f"Built index in {round(time.perf_counter() - start_time, 2)} secs, {round(neighbour_chord_model.get_footprint()['total'] / 1024**2, 2)} MB")
+
+    # Indexed windows, slightly changed, should find themselves as their nearest neighbour
+    windows = rng.choice(len(window_starts), 500, replace=False)
+    input_windows = input_rows[window_starts[windows][:, np.newaxis] + np.arange(8)].copy()
+    input_windows[:, :, 1:] += rng.normal(0, 0.01, input_windows[:, :, 1:].shape)
+    neighbours = neighbour_chord_model.get_neighbours(input_windows)
+    print(f"Nearest neighbour is the changed window: {np.mean([len(window_neighbours) > 0 and window_neighbours[0] == window for window_neighbours, window in zip(neighbours, windows)]):.3f}")
+
+    predictions = neighbour_chord_model(input_windows)
+    print(f"Predictions of shape {predictions.shape}, all finite: {np.all(np.isfinite(predictions))}")
+
+    start_time = time.perf_counter()
+    for input_window in input_windows:
+        neighbour_chord_model(input_window[np.newaxis])
+    print(f"Single window prediction: {round((time.perf_counter() - start_time) / len(input_windows) * 1000, 3)} ms")
\ No newline at end of file
@@ -0,0 +1,204 @@
+import collections
+import threading
+import time
+from .chord_generator import ChordGenerator
+from .chord import Chord
+
+# Ways a chord can be chosen for a note, in the order they are tried when the model can't meet the note's deadline
+MODEL = "model"
+FALLBACK_MODEL = "fallback_model"
+CACHE = "cache"
+PREVIOUS = "previous"
+
+class DeadlineScheduler:
+    def __init__(
+            self,
+            chord_generator: ChordGenerator,
+            on_chord: callable,
+            deadline_ms: float = 50.0,
+            coalesce: bool = True,
+            fallbacks: tuple[str] = (FALLBACK_MODEL, CACHE, PREVIOUS),
+            fallback_model: any = None,
+            latency_smoothing: float = 0.2,
+            probe_interval_secs: float = 1.0
+        ) -> None:
+
+        """
+        An action-focussed class which generates chords for incoming melody notes on its own thread, giving each note a
+        deadline from when it was received, so that chords are not played late when generation falls behind the music.
+
+        - A note whose deadline has passed before it can be started is skipped.
+        - If coalesce is set, only the newest of the notes waiting is generated, as its chord would replace the others' at once.
+        - If the model is expected to miss the deadline, based on its recent generation times, a cheaper fallback is used instead:
+          a smaller model, the chord last generated by the model for the same melody chroma, or a repeat of the previous chord.
+          Fallback chords are also added to the input sequence, so generation continues from what was played.
+          While no notes arrive, a model expected to miss the deadline is timed again every probe_interval_secs,
+          so a single slow generation doesn't keep the model from being used once it is fast again.
+
+        Counters of each outcome are kept in self.counters.
+
+        Parameters:
+            chord_generator:    ChordGenerator. The chord generator to use.
+            on_chord:           callable. Called on the scheduler's thread with (melody note, intensity, chord, source) for each chord, where source is how it was chosen.
+            deadline_ms:        float (default 50.0). Time after a note is received by which its chord should be ready.
+            coalesce:           bool (default True). Whether to only generate the newest of several waiting notes.
+            fallbacks:          tuple[str] (default ("fallback_model", "cache", "previous")). Fallbacks to try, in order, when the model would be late.
+            fallback_model:     any (default None). A cheaper model or backend with the same inputs and outputs as the model, for the "fallback_model" fallback.
+            latency_smoothing:  float (default 0.2). Weight of the newest generation time in the running estimates of the model's generation times.
+            probe_interval_secs: float (default 1.0). Secs without notes after which models expected to miss the deadline are timed again.
+        """
+
+        self.chord_generator = chord_generator
+        self.on_chord = on_chord
+        self.DEADLINE_MS = deadline_ms
+        self.COALESCE = coalesce
+        self.FALLBACKS = list(fallbacks)
+        self.fallback_model = fallback_model
+        self.LATENCY_SMOOTHING = latency_smoothing
+        self.PROBE_INTERVAL_SECS = probe_interval_secs
+
+        # Running estimates of the generation time of each model in ms, None until it has been used
+        self.expected_ms = {MODEL: None, FALLBACK_MODEL: None}
+
+        # Most recent model chord of each melody chroma, and the previous chord played
+        self.chord_cache = {}
+        self.previous_chord = None
+
+        self.counters = collections.Counter({
+            "received": 0,
+            "skipped_stale": 0,
+            "coalesced": 0,
+            MODEL: 0,
+            FALLBACK_MODEL: 0,
+            CACHE: 0,
+            PREVIOUS: 0,
+            "late": 0
+        })
+
+        # Notes waiting as (melody note, intensity, deadline)
+        self.waiting_notes = collections.deque()
+        self.condition = threading.Condition()
+        self.is_running = True
+        self.thread = threading.Thread(target=self.__run, name="deadline_scheduler", daemon=True)
+        self.thread.start()
+
+    def submit(self, melody_note_midi_number: int, intensity: float) -> None:
+        """Receive a melody note, to be generated on the scheduler's thread before its deadline."""
+        deadline = time.perf_counter() + self.DEADLINE_MS / 1000
+        with self.condition:
+            self.waiting_notes.append((melody_note_midi_number, intensity, deadline))
+            self.counters["received"] += 1
+            self.condition.notify()
+
+    def stop(self) -> None:
+        """Stop the scheduler's thread, dropping any notes still waiting."""
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def get_counters(self) -> dict:
+        with self.condition:
+            return dict(self.counters)
+
+    def print_counters(self) -> None:
+        counters = self.get_counters()
+        print(", ".join(f"{name}: {count}" for name, count in counters.items()))
+
+    def __run(self) -> None:
+        while True:
+            with self.condition:
+                if self.is_running and len(self.waiting_notes) == 0:
+                    self.condition.wait(timeout=self.PROBE_INTERVAL_SECS)
+                if not self.is_running:
+                    return
+                is_idle = len(self.waiting_notes) == 0
+
+            # Time slow models again while there is nothing else to do
+            if is_idle:
+                self.__probe_models()
+                continue
+
+            with self.condition:
+                # Only keep the newest note if several are waiting
+                if self.COALESCE and len(self.waiting_notes) > 1:
+                    self.counters["coalesced"] += len(self.waiting_notes) - 1
+                    note = self.waiting_notes.pop()
+                    self.waiting_notes.clear()
+                else:
+                    note = self.waiting_notes.popleft()
+
+            melody_note_midi_number, intensity, deadline = note
+
+            # Skip notes which are already too late to be played
+            remaining_ms = (deadline - time.perf_counter()) * 1000
+            if remaining_ms < 0:
+                self.__count("skipped_stale")
+                continue
+
+            chord, source = self.__get_chord(melody_note_midi_number, remaining_ms)
+
+            self.__count(source)
+            if time.perf_counter() > deadline:
+                self.__count("late")
+            self.previous_chord = chord
+
+            self.on_chord(melody_note_midi_number, intensity, chord, source)
+
+    def __get_chord(self, melody_note_midi_number: int, remaining_ms: float) -> tuple[Chord, str]:
+        """Get the chord of a note with the model if it is expected to finish in time, or else with the first possible fallback."""
+
+        if self.__is_expected_in_time(MODEL, remaining_ms):
+            return self.__generate_chord(melody_note_midi_number, MODEL), MODEL
+
+        for fallback in self.FALLBACKS:
+            if fallback == FALLBACK_MODEL and self.fallback_model is not None and self.__is_expected_in_time(FALLBACK_MODEL, remaining_ms):
+                return self.__generate_chord(melody_note_midi_number, FALLBACK_MODEL), FALLBACK_MODEL
+
+            elif fallback == CACHE and self.__get_cache_key(melody_note_midi_number) in self.chord_cache:
+                chord = self.chord_cache[self.__get_cache_key(melody_note_midi_number)]
+                self.chord_generator.record_chord(melody_note_midi_number, chord)
+                return chord, CACHE
+
+            elif fallback == PREVIOUS and self.previous_chord is not None:
+                self.chord_generator.record_chord(melody_note_midi_number, self.previous_chord)
+                return self.previous_chord, PREVIOUS
+
+        # Use the model even if it will be late when no fallback is possible
+        return self.__generate_chord(melody_note_midi_number, MODEL), MODEL
+
+    def __generate_chord(self, melody_note_midi_number: int, source: str) -> Chord:
+        generation_start_time = time.perf_counter()
+        chord = self.chord_generator.get_chord(melody_note_midi_number, model=self.fallback_model if source == FALLBACK_MODEL else None)
+        generation_ms = (time.perf_counter() - generation_start_time) * 1000
+
+        # Update the running estimate of the generation time
+        if self.expected_ms[source] is None:
+            self.expected_ms[source] = generation_ms
+        else:
+            self.expected_ms[source] += self.LATENCY_SMOOTHING * (generation_ms - self.expected_ms[source])
+
+        if source == MODEL:
+            self.chord_cache[self.__get_cache_key(melody_note_midi_number)] = chord
+
+        return chord
+
+    def __probe_models(self) -> None:
+        """Time models expected to miss the deadline on the current input sequence, without changing it."""
+        for source, model in [(MODEL, None), (FALLBACK_MODEL, self.fallback_model)]:
+            if self.expected_ms[source] is None or self.expected_ms[source] <= self.DEADLINE_MS or (source == FALLBACK_MODEL and model is None):
+                continue
+            probe_start_time = time.perf_counter()
+            self.chord_generator.predict_chroma_histograms(self.chord_generator.input_sequence.get(), model)
+            self.expected_ms[source] = (time.perf_counter() - probe_start_time) * 1000
+
+    def __is_expected_in_time(self, source: str, remaining_ms: float) -> bool:
+        return self.expected_ms[source] is None or self.expected_ms[source] <= remaining_ms
+
+    def __get_cache_key(self, melody_note_midi_number: int) -> tuple:
+        # Chords are voiced with the tonic and threshold they were generated with, so those are part of the key
+        return ((melody_note_midi_number - self.chord_generator.TONIC) % 12, self.chord_generator.TONIC, self.chord_generator.CHORD_NOTE_THRESHOLD)
+
+    def __count(self, name: str) -> None:
+        with self.condition:
+            self.counters[name] += 1
\ No newline at end of file
@@ -0,0 +1,132 @@
+import numpy as np
+
+class NumpyChordGeneratorModel:
+    def __init__(
+            self,
+            lstm_weights: list[tuple[np.ndarray, np.ndarray, np.ndarray]],
+            dense_kernel: np.ndarray,
+            dense_bias: np.ndarray,
+            dtype: type = np.float32
+        ) -> None:
+
+        """
+        A Numpy-only re-implementation of the forward pass of a trained ChordGeneratorModel, called like the model, so
+        chords can be generated without TensorFlow at runtime, e.g., in processes forked after the weights are loaded,
+        which TensorFlow doesn't support. The weights are plain contiguous arrays, so forked processes share them
+        copy-on-write instead of each holding its own copy.
+
+        Use NumpyChordGeneratorModel.load() to load a model exported with export_chord_generator_model(), or
+        NumpyChordGeneratorModel.from_keras_model() to convert a loaded model directly.
+        Each LSTM layer follows Keras' defaults: gates in the order input, forget, cell, output, with sigmoid
+        recurrent activations and tanh activations. Dropout is only applied in training, so it is left out.
+
+        Parameters:
+            lstm_weights:   list[tuple[np.ndarray, np.ndarray, np.ndarray]]. Kernel (inputs, 4*units), recurrent kernel (units, 4*units) and bias (4*units,) of each LSTM layer.
+            dense_kernel:   np.ndarray of shape (units, num_outputs). Kernel of the output layer.
+            dense_bias:     np.ndarray of shape (num_outputs,). Bias of the output layer.
+            dtype:          type (default np.float32). Dtype of the weights and computations, float32 as in TensorFlow.
+        """
+
+        self.DTYPE = dtype
+        self.lstm_weights = [tuple(np.ascontiguousarray(weights, dtype=dtype) for weights in layer_weights) for layer_weights in lstm_weights]
+        self.dense_kernel = np.ascontiguousarray(dense_kernel, dtype=dtype)
+        self.dense_bias = np.ascontiguousarray(dense_bias, dtype=dtype)
+
+    @classmethod
+    def load(cls, npz_path: str, dtype: type = np.float32) -> "NumpyChordGeneratorModel":
+        """Load a model exported with export_chord_generator_model()."""
+        with np.load(npz_path, allow_pickle=False) as arrays:
+            num_lstm_layers = int(arrays["num_lstm_layers"])
+            lstm_weights = [(arrays[f"lstm{i}_kernel"], arrays[f"lstm{i}_recurrent_kernel"], arrays[f"lstm{i}_bias"]) for i in range(num_lstm_layers)]
+            return cls(lstm_weights, arrays["dense_kernel"], arrays["dense_bias"], dtype=dtype)
+
+    @classmethod
+    def from_keras_model(cls, model: any, dtype: type = np.float32) -> "NumpyChordGeneratorModel":
+        """Convert a loaded ChordGeneratorModel, whose weights are three (kernel, recurrent kernel, bias) triples per LSTM layer followed by the output layer's kernel and bias."""
+        weights = model.get_weights()
+        if len(weights) < 5 or (len(weights) - 2) % 3 != 0:
+            raise ValueError(f"Expected the weights of LSTM layers followed by a dense layer. Received {len(weights)} weight arrays.")
+        lstm_weights = [tuple(weights[i:i + 3]) for i in range(0, len(weights) - 2, 3)]
+        return cls(lstm_weights, weights[-2], weights[-1], dtype=dtype)
+
+    def __call__(self, inputs: np.ndarray[float]) -> np.ndarray[float]:
+        """Predict the output of a batch of input sequences of shape (batch size, sequence length, inputs), of shape (batch size, num_outputs)."""
+        sequences = np.asarray(inputs, dtype=self.DTYPE)
+        for kernel, recurrent_kernel, bias in self.lstm_weights:
+            sequences = self.__run_lstm(sequences, kernel, recurrent_kernel, bias)
+
+        # Only the last step of the last LSTM layer is returned to the output layer
+        return sequences[:, -1] @ self.dense_kernel + self.dense_bias
+
+    def get_num_bytes(self) -> int:
+        """Get the size of the weights in bytes."""
+        return sum(weights.nbytes for layer_weights in self.lstm_weights for weights in layer_weights) + self.dense_kernel.nbytes + self.dense_bias.nbytes
+
+    @staticmethod
+    def __run_lstm(sequences: np.ndarray[float], kernel: np.ndarray[float], recurrent_kernel: np.ndarray[float], bias: np.ndarray[float]) -> np.ndarray[float]:
+        batch_size, sequence_length, _ = sequences.shape
+        units = recurrent_kernel.shape[0]
+
+        # Project the inputs of every step at once, leaving only the recurrent projections in the loop
+        input_projections = sequences @ kernel + bias
+
+        hidden_state = np.zeros((batch_size, units), dtype=sequences.dtype)
+        cell_state = np.zeros((batch_size, units), dtype=sequences.dtype)
+        hidden_states = np.empty((batch_size, sequence_length, units), dtype=sequences.dtype)
+        for step in range(sequence_length):
+            gates = input_projections[:, step] + hidden_state @ recurrent_kernel
+
+            # Sigmoid as tanh, which doesn't overflow for large negative inputs
+            input_gate = 0.5 * (np.tanh(0.5 * gates[:, :units]) + 1)
+            forget_gate = 0.5 * (np.tanh(0.5 * gates[:, units:2 * units]) + 1)
+            cell_candidate = np.tanh(gates[:, 2 * units:3 * units])
+            output_gate = 0.5 * (np.tanh(0.5 * gates[:, 3 * units:]) + 1)
+
+            cell_state = forget_gate * cell_state + input_gate * cell_candidate
+            hidden_state = output_gate * np.tanh(cell_state)
+            hidden_states[:, step] = hidden_state
+
+        return hidden_states
+
+def export_chord_generator_model(model: any, npz_path: str) -> None:
+    """Export the weights of a loaded ChordGeneratorModel for use with NumpyChordGeneratorModel."""
+    numpy_model = NumpyChordGeneratorModel.from_keras_model(model, dtype=np.float32)
+    np.savez(
+        npz_path,
+        num_lstm_layers=np.array(len(numpy_model.lstm_weights)),
+        dense_kernel=numpy_model.dense_kernel,
+        dense_bias=numpy_model.dense_bias,
+        **{f"lstm{i}_{name}": weights
+           for i, layer_weights in enumerate(numpy_model.lstm_weights)
+           for name, weights in zip(["kernel", "recurrent_kernel", "bias"], layer_weights)}
+    )
+
+if __name__ == "__main__":
+
+    # Export a saved model and check that predictions match: python -m chord_generation_utils.numpy_chord_generator_model <model path> <npz path>
+
+    import os
+    import sys
+    import time
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+    os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+    import tensorflow as tf
+
+    model_path, npz_path = sys.argv[1], sys.argv[2]
+
+    model = tf.keras.models.load_model(model_path)
+    export_chord_generator_model(model, npz_path)
+    numpy_model = NumpyChordGeneratorModel.load(npz_path)
+
+    rng = np.random.default_rng(0)
+    input_sequences = np.concatenate([rng.integers(0, 12, (1000, 8, 1)), rng.dirichlet(np.full(12, 0.3), (1000, 8))], axis=2)
+    max_difference = np.abs(np.array(model(input_sequences)) - numpy_model(input_sequences)).max()
+    print(f"Exported {round(numpy_model.get_num_bytes() / 2**20, 2)} MB of weights to {npz_path}, largest difference from the model over {len(input_sequences)} random inputs: {max_difference:.2e}")
+
+    # Time of a single prediction, as when generating a chord
+    for name, backend in [("TensorFlow", model), ("NumPy", numpy_model)]:
+        backend(input_sequences[:1])
+        start_time = time.perf_counter()
+        for input_sequence in input_sequences[:200]:
+            backend(input_sequence[np.newaxis])
+        print(f"{name}: {round((time.perf_counter() - start_time) / 200 * 1000, 3)} ms per prediction")
\ No newline at end of file
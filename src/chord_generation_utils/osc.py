@@ -2,13 +2,19 @@ from pythonosc import udp_client, osc_server
 from pythonosc.dispatcher import Dispatcher
 from .chord_generator import ChordGenerator
 from .chord import Chord
+from .session_log import SessionLogWriter
+from .note_scheduler import DeadlineScheduler
+from .chord_transitions import get_chord_transition, SUSTAIN
 import time
 
 class OSCHandler:
-    def __init__(self, chord_generator: ChordGenerator, ip: str = "127.0.0.1", server_port: int = 10000, client_port: int = 11000, verbose: bool = False) -> None:
+    def __init__(self, chord_generator: ChordGenerator, ip: str = "127.0.0.1", server_port: int = 10000, client_port: int = 11000, verbose: bool = False, session_log: SessionLogWriter = None, deadline_ms: float = None,
+                 differential_transitions: bool = False, velocity_policy: str = SUSTAIN, velocity_tolerance: int = 0, fallback_model: any = None, allow_model_loading: bool = True) -> None:
         
         # Create necessary attributes
         self.chord_generator = chord_generator
+        self.session_log = session_log
+        self.logged_model_path = chord_generator.MODEL_PATH
         self.IP = ip
         self.CLIENT_PORT = client_port
         self.SERVER_PORT = server_port
@@ -17,6 +23,22 @@ class OSCHandler:
         # Init previous chord variable, used for cancelling active notes before starting a new chord.
         self.previous_chord = None
 
+        # Only stop and start the notes which differ between chords if set, keeping common tones sounding,
+        # in which case previous_chord holds the notes sounding, with the velocities they were started with
+        self.DIFFERENTIAL_TRANSITIONS = differential_transitions
+        self.VELOCITY_POLICY = velocity_policy
+        self.VELOCITY_TOLERANCE = velocity_tolerance
+        if differential_transitions:
+            print(f"Only sending the notes which change between chords, with common tones whose velocity changes handled by: {velocity_policy}")
+
+        # Generate chords on a scheduler's thread if notes have a deadline, skipping notes or using fallback chords when falling behind
+        self.scheduler = None
+        if deadline_ms is not None:
+            if session_log is not None:
+                raise ValueError("Sessions with a note deadline can't be logged, as the skipped notes and fallback chords depend on timing.")
+            self.scheduler = DeadlineScheduler(chord_generator, self.send_scheduled_chord, deadline_ms=deadline_ms, fallback_model=fallback_model)
+            print(f"Scheduling chords with a deadline of {deadline_ms} ms after each note.")
+
         # Start OSC client
         self.client = udp_client.SimpleUDPClient("127.0.0.1", self.CLIENT_PORT)
         print(f"Started OSC client at: {self.IP}:{self.CLIENT_PORT}")
@@ -29,6 +51,11 @@ class OSCHandler:
         self.dispatcher.map("/set_tonic",                       self.set_chord_generator_tonic_from_OSC)
         self.dispatcher.map("/set_threshold",                   self.set_chord_generator_chord_note_threshold_from_OSC)
         self.dispatcher.map("/set_threshold_input_sequence",    self.set_threshold_input_sequence_from_OSC)
+        # Loading a model starts TensorFlow, which can't be used in forked processes, so workers of a pre-fork server refuse it
+        if allow_model_loading:
+            self.dispatcher.map("/load_model",                  self.load_model_from_OSC)
+        else:
+            self.dispatcher.map("/load_model",                  self.refuse_model_load_from_OSC)
 
         # Start OSC server (blocks)
         self.server = osc_server.BlockingOSCUDPServer((ip, server_port), self.dispatcher)
@@ -42,6 +69,8 @@ class OSCHandler:
         if len(args) == 1:
             if type(args[0]) == int:
                 self.chord_generator.set_tonic(args[0])
+                if self.session_log is not None:
+                    self.session_log.log_tonic(args[0])
             else:
                 raise TypeError(f"New tonic must be set using int type. Received {type(args[0])}")
         else:
@@ -51,6 +80,8 @@ class OSCHandler:
         if len(args) == 1:
             if type(args[0]) == float or type(args[0]) == int:
                 self.chord_generator.set_chord_note_threshold(args[0])
+                if self.session_log is not None:
+                    self.session_log.log_chord_note_threshold(args[0])
             else:
                 raise TypeError(f"New chord note threshold must be set using float or int. Received {type(args[0])}")
         else:
@@ -66,11 +97,42 @@ class OSCHandler:
                 else:
                     raise ValueError(f"New threshold output state must be 0 or 1. Received {args[0]}")
                 self.chord_generator.set_threshold_input_sequence(new_threshold_state)
+                if self.session_log is not None:
+                    self.session_log.log_threshold_input_sequence(new_threshold_state)
             else:
                 raise TypeError(f"New threshold output state must be int 0 or 1. Received {type(args[0])}")
         else:
             raise ValueError(f"New threshold state must be OSC message of list with length 1. Received list with length {len(args)}")
 
+    def load_model_from_OSC(self, address: str, *args) -> None:
+        """
+        Loads a new model in the background while chords keep being generated with the current one,
+        swapping it in between notes once loaded and warmed up. Sends the result back as
+        /model_loaded [model path, load secs, first inference ms] or /model_load_failed [model path, error].
+        """
+        if len(args) == 1:
+            if type(args[0]) == str:
+                model_path = args[0]
+                print(f"Loading model in the background from: {model_path}")
+                self.chord_generator.load_model_in_background(model_path, on_swapped=lambda report: self.report_model_swap(model_path, report))
+            else:
+                raise TypeError(f"Model path must be str. Received {type(args[0])}")
+        else:
+            raise ValueError(f"list[str] required to load a new model. Received list of length {len(args)}")
+
+    def refuse_model_load_from_OSC(self, address: str, *args) -> None:
+        model_path = str(args[0]) if len(args) > 0 else ""
+        print(f"Not loading model from: {model_path}, as models can't be loaded by this server, keeping the current model")
+        self.client.send_message("/model_load_failed", [model_path, "Models can't be loaded by this server"])
+
+    def report_model_swap(self, model_path: str, report: dict | Exception) -> None:
+        if isinstance(report, Exception):
+            print(f"Unable to load model from: {model_path} ({report}), keeping the current model")
+            self.client.send_message("/model_load_failed", [model_path, str(report)])
+        else:
+            print(f"Swapped in model from: {model_path}, took {round(report['load_secs'], 3)} secs to load and {round(report['first_inference_ms'], 3)} ms for the first inference")
+            self.client.send_message("/model_loaded", [model_path, report["load_secs"], report["first_inference_ms"]])
+
     def stop_chord(self, previous_chord: list[int, int]) -> None:
         if type(previous_chord) == list:
             for note in previous_chord:
@@ -86,29 +148,87 @@ class OSCHandler:
         then returns the notes of that chord back over OSC.
         """
 
+        # Leave the note to the scheduler if there is one
+        if self.scheduler is not None:
+            self.scheduler.submit(args[0], args[1])
+            return
+
+        # Record the allocations of the whole note if the chord generator has a profiler
+        with self.chord_generator.profile_note():
+            self.__handle_melody_note(*args)
+
+    def __handle_melody_note(self, *args) -> None:
+        profile = self.chord_generator.profile
         handler_start_time = time.time()
 
-        # Stop notes from the previous chord
-        self.stop_chord(self.previous_chord)
+        # Stop notes from the previous chord, unless only the notes which change are sent once the new chord is known
+        if not self.DIFFERENTIAL_TRANSITIONS:
+            with profile("stop_chord"):
+                self.stop_chord(self.previous_chord)
 
-        # Predict the new chord
+        # Log the received note
         melody_midi_note_number = args[0]
+        if self.session_log is not None:
+            self.session_log.log_note(melody_midi_note_number, args[1])
+
+        # Predict the new chord
+        chord_generation_start_time = time.perf_counter()
         chord = self.chord_generator.get_chord(melody_midi_note_number)
+        chord_generation_ms = (time.perf_counter() - chord_generation_start_time) * 1000
 
         # Send notes for new chord
-        voiced_chord = chord.get_voiced_chord(intensity=args[1])
-        for note in voiced_chord:
-            self.client.send_message("/chord_note", note)
-        
-        # Send chroma histogram of predicted chord
-        self.client.send_message("/histogram", chord.get_thresholded_chroma_histogram().tolist())
+        with profile("voicing"):
+            voiced_chord = chord.get_voiced_chord(intensity=args[1])
+        with profile("send"):
+            note_messages_count = self.send_chord_notes(voiced_chord)
+
+            # Send chroma histogram of predicted chord
+            self.client.send_message("/histogram", chord.get_thresholded_chroma_histogram().tolist())
         
         # Print contents of chord if in verbose mode
         if self.VERBOSE:
-            print(f"Took {round((time.time() - handler_start_time)*1000, 3)} ms to voice chord with {len(voiced_chord)} notes: {voiced_chord}")
+            print(f"Took {round((time.time() - handler_start_time)*1000, 3)} ms to voice chord with {len(voiced_chord)} notes in {note_messages_count} note messages: {voiced_chord}")
+
+        # Log the generated chord, after the model it was generated with if that was swapped in since the previous chord
+        if self.session_log is not None:
+            if self.chord_generator.last_chord_model_path != self.logged_model_path:
+                self.session_log.log_model_swap(self.chord_generator.last_chord_model_path)
+                self.logged_model_path = self.chord_generator.last_chord_model_path
+            self.session_log.log_chord(chord, voiced_chord, chord_generation_ms)
+
+    def send_scheduled_chord(self, melody_midi_note_number: int, intensity: float, chord: Chord, source: str) -> None:
+        """Sends a chord generated by the scheduler, in place of the previous chord."""
+
+        # Stop notes from the previous chord
+        if not self.DIFFERENTIAL_TRANSITIONS:
+            self.stop_chord(self.previous_chord)
 
-        # Update previous chord with newly generated chord, for stopping notes on next callback of this method
-        self.previous_chord = voiced_chord
+        # Send notes and chroma histogram of the new chord
+        voiced_chord = chord.get_voiced_chord(intensity=intensity)
+        note_messages_count = self.send_chord_notes(voiced_chord)
+        self.client.send_message("/histogram", chord.get_thresholded_chroma_histogram().tolist())
+
+        if self.VERBOSE:
+            print(f"Sent chord ({source}) with {len(voiced_chord)} notes in {note_messages_count} note messages: {voiced_chord}")
+
+    def send_chord_notes(self, voiced_chord: list[list[int, int]]) -> int:
+        """
+        Send the notes of a new chord, and update previous chord with it, for stopping notes on the next chord.
+        With differential transitions, also stops the notes of the previous chord not in the new one, and only starts those not already sounding.
+        Returns the number of note messages sent.
+        """
+        if not self.DIFFERENTIAL_TRANSITIONS:
+            for note in voiced_chord:
+                self.client.send_message("/chord_note", note)
+            self.previous_chord = voiced_chord
+            return len(voiced_chord)
+
+        note_offs, note_ons, self.previous_chord = get_chord_transition(self.previous_chord, voiced_chord, self.VELOCITY_POLICY, self.VELOCITY_TOLERANCE)
+        for pitch in note_offs:
+            self.client.send_message("/note_off", [pitch, 0])
+        for note in note_ons:
+            self.client.send_message("/chord_note", note)
+        return len(note_offs) + len(note_ons)
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
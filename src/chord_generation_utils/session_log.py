@@ -0,0 +1,147 @@
+import struct
+import time
+from .chord_generator import ChordGenerator
+from .chord import Chord
+
+# Record types of a session log
+NOTE = 1
+SET_TONIC = 2
+SET_CHORD_NOTE_THRESHOLD = 3
+SET_THRESHOLD_INPUT_SEQUENCE = 4
+CHORD = 5
+MODEL_SWAP = 6
+
+# Binary layouts, all little-endian. The header is followed by the UTF-8 model path,
+# and every record starts with its type and the time in secs since the session started
+MAGIC = b"CCGS"
+VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sBBhdBBqH")
+RECORD_HEADER_FORMAT = struct.Struct("<Bd")
+RECORD_FORMATS = {
+    NOTE:                           struct.Struct("<Bd"),     # MIDI pitch, intensity
+    SET_TONIC:                      struct.Struct("<h"),      # Tonic
+    SET_CHORD_NOTE_THRESHOLD:       struct.Struct("<d"),      # Chord note threshold
+    SET_THRESHOLD_INPUT_SEQUENCE:   struct.Struct("<B"),      # 0 or 1
+    CHORD:                          struct.Struct("<d12dB"),  # Generation time in ms, unthresholded chroma histogram, number of voiced notes
+    MODEL_SWAP:                     struct.Struct("<H")       # Length of the UTF-8 model path which follows
+}
+VOICED_NOTE_FORMAT = struct.Struct("<BB") # MIDI pitch, velocity
+UPDATE_DIRECTIONS = ["append", "prepend"]
+
+class SessionLogWriter:
+    def __init__(self, log_path: str, chord_generator: ChordGenerator) -> None:
+
+        """
+        Writes a compact binary log of a chord generation session: the received melody notes, parameter changes
+        and the generated chords, along with the ChordGenerator settings and seed needed to replay it.
+
+        Parameters:
+            log_path:           str. The path of the log file to write.
+            chord_generator:    ChordGenerator. The chord generator of the session, whose settings are written to the log header.
+        """
+
+        self.LOG_PATH = log_path
+
+        self.log_file = open(log_path, "wb")
+        self.start_time = time.perf_counter()
+
+        # Write header
+        model_path = chord_generator.MODEL_PATH.encode("utf-8")
+        self.log_file.write(HEADER_FORMAT.pack(
+            MAGIC,
+            VERSION,
+            chord_generator.INPUT_SEQUENCE_LENGTH,
+            chord_generator.TONIC,
+            chord_generator.CHORD_NOTE_THRESHOLD,
+            int(chord_generator.THRESHOLD_INPUT_SEQUENCE),
+            UPDATE_DIRECTIONS.index(chord_generator.UPDATE_DIRECTION),
+            chord_generator.SEED,
+            len(model_path)
+        ))
+        self.log_file.write(model_path)
+
+    def log_note(self, melody_note_midi_number: int, intensity: float) -> None:
+        # Pitches are logged as a byte, so e.g. 60.0 received over OSC is logged as 60, but 60.5 or 128 can't be
+        pitch = int(melody_note_midi_number)
+        if pitch != melody_note_midi_number or not 0 <= pitch <= 127:
+            raise ValueError(f"Melody note must be a MIDI pitch (0-127) to be logged. Received {melody_note_midi_number}")
+        self.__write_record(NOTE, pitch, intensity)
+
+    def log_tonic(self, tonic: int) -> None:
+        self.__write_record(SET_TONIC, tonic)
+
+    def log_chord_note_threshold(self, chord_note_threshold: float) -> None:
+        self.__write_record(SET_CHORD_NOTE_THRESHOLD, chord_note_threshold)
+
+    def log_threshold_input_sequence(self, threshold_input_sequence: bool) -> None:
+        self.__write_record(SET_THRESHOLD_INPUT_SEQUENCE, int(threshold_input_sequence))
+
+    def log_chord(self, chord: Chord, voiced_chord: list[list[int, int]], generation_ms: float) -> None:
+        self.__write_record(CHORD, generation_ms, *chord.get_unthresholded_chroma_histogram(), len(voiced_chord))
+        for pitch, velocity in voiced_chord:
+            self.log_file.write(VOICED_NOTE_FORMAT.pack(pitch, velocity))
+
+    def log_model_swap(self, model_path: str) -> None:
+        model_path = model_path.encode("utf-8")
+        self.__write_record(MODEL_SWAP, len(model_path))
+        self.log_file.write(model_path)
+
+    def close(self) -> None:
+        self.log_file.close()
+
+    def __write_record(self, record_type: int, *values) -> None:
+        self.log_file.write(RECORD_HEADER_FORMAT.pack(record_type, time.perf_counter() - self.start_time))
+        self.log_file.write(RECORD_FORMATS[record_type].pack(*values))
+
+class SessionLogReader:
+    def __init__(self, log_path: str) -> None:
+
+        """
+        Reads a session log written by SessionLogWriter. The ChordGenerator settings of the session are
+        in self.header, and iterating over the reader gives the records as (record type, time, values) tuples,
+        where the values of a CHORD record are (generation time in ms, chroma histogram, voiced chord),
+        and those of a MODEL_SWAP record are (model path,).
+
+        Parameters:
+            log_path:   str. The path of the log file to read.
+        """
+
+        self.LOG_PATH = log_path
+
+        with open(log_path, "rb") as log_file:
+            self.log_bytes = log_file.read()
+
+        # Read header
+        magic, version, sequence_length, tonic, chord_note_threshold, threshold_input_sequence, update_direction, seed, model_path_length = HEADER_FORMAT.unpack_from(self.log_bytes, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{log_path} is not a version {VERSION} session log.")
+        self.records_offset = HEADER_FORMAT.size + model_path_length
+
+        self.header = {
+            "model_path": self.log_bytes[HEADER_FORMAT.size:self.records_offset].decode("utf-8"),
+            "sequence_length": sequence_length,
+            "tonic": tonic,
+            "chord_note_threshold": chord_note_threshold,
+            "threshold_input_sequence": bool(threshold_input_sequence),
+            "update_direction": UPDATE_DIRECTIONS[update_direction],
+            "seed": seed
+        }
+
+    def __iter__(self):
+        offset = self.records_offset
+        while offset < len(self.log_bytes):
+            record_type, record_time = RECORD_HEADER_FORMAT.unpack_from(self.log_bytes, offset)
+            offset += RECORD_HEADER_FORMAT.size
+            values = RECORD_FORMATS[record_type].unpack_from(self.log_bytes, offset)
+            offset += RECORD_FORMATS[record_type].size
+
+            if record_type == CHORD:
+                voiced_chord = [list(VOICED_NOTE_FORMAT.unpack_from(self.log_bytes, offset + i * VOICED_NOTE_FORMAT.size)) for i in range(values[-1])]
+                offset += values[-1] * VOICED_NOTE_FORMAT.size
+                values = (values[0], list(values[1:13]), voiced_chord)
+            elif record_type == MODEL_SWAP:
+                model_path = self.log_bytes[offset:offset + values[0]].decode("utf-8")
+                offset += values[0]
+                values = (model_path,)
+
+            yield record_type, record_time, values
\ No newline at end of file
@@ -0,0 +1,86 @@
+import time
+from .shared_memory_ring import SharedMemoryRing, get_ring_names, REQUEST_FORMAT, CHORD_FORMAT, MELODY_NOTE, SET_TONIC, SET_CHORD_NOTE_THRESHOLD, SET_THRESHOLD_INPUT_SEQUENCE
+
+class SharedMemoryClient:
+    def __init__(self, name: str = "chroma_chord_generator", connect_timeout: float = 10.0) -> None:
+
+        """
+        A client for a chord generator served by SharedMemoryHandler on the same host. Sends melody notes and
+        parameter changes as with OSC, and receives each chord as a dict of its sequence id, voiced chord as
+        list[list[pitch, velocity]] and thresholded chroma histogram.
+
+        Parameters:
+            name:               str (default "chroma_chord_generator"). Name of the transport to connect to.
+            connect_timeout:    float (default 10.0). Secs to wait for the transport to be created by the handler.
+        """
+
+        self.NAME = name
+        self.next_sequence_id = 0
+
+        # Attach to the rings, waiting for the handler to create them
+        request_ring_name, chord_ring_name = get_ring_names(name)
+        connect_start_time = time.time()
+        while True:
+            try:
+                self.request_ring = SharedMemoryRing(request_ring_name)
+                self.chord_ring = SharedMemoryRing(chord_ring_name)
+                break
+            except FileNotFoundError:
+                if time.time() - connect_start_time > connect_timeout:
+                    raise TimeoutError(f"No shared memory transport named {name} was created within {connect_timeout} secs")
+                time.sleep(0.01)
+
+    def send_melody_note(self, melody_note_midi_number: int, intensity: float) -> int:
+        """Send a melody note, returning the sequence id its chord will be returned with."""
+        return self.__send_request(MELODY_NOTE, melody_note_midi_number, intensity)
+
+    def set_tonic(self, tonic: int) -> None:
+        self.__send_request(SET_TONIC, tonic)
+
+    def set_chord_note_threshold(self, chord_note_threshold: float) -> None:
+        self.__send_request(SET_CHORD_NOTE_THRESHOLD, chord_note_threshold)
+
+    def set_threshold_input_sequence(self, threshold_input_sequence: bool) -> None:
+        self.__send_request(SET_THRESHOLD_INPUT_SEQUENCE, int(threshold_input_sequence))
+
+    def receive_chord(self, timeout: float = None) -> dict | None:
+        """
+        Receive the next chord, waiting up to timeout secs for it, or forever if timeout is None.
+        Returns None if no chord was received in time.
+        """
+        receive_start_time = time.perf_counter()
+        while True:
+            record = self.chord_ring.get()
+            if record is not None:
+                break
+            if timeout is not None and time.perf_counter() - receive_start_time > timeout:
+                return None
+
+        values = CHORD_FORMAT.unpack(record)
+        sequence_id, num_notes = values[0], values[1]
+        pitches, velocities = values[14:14 + num_notes], values[26:26 + num_notes]
+
+        return {
+            "sequence_id": sequence_id,
+            "voiced_chord": [[pitch, velocity] for pitch, velocity in zip(pitches, velocities)],
+            "chroma_histogram": list(values[2:14])
+        }
+
+    def get_chord(self, melody_note_midi_number: int, intensity: float, timeout: float = None) -> dict | None:
+        """Send a melody note and wait for its chord, skipping any chords of earlier notes not yet received."""
+        sequence_id = self.send_melody_note(melody_note_midi_number, intensity)
+        while True:
+            chord = self.receive_chord(timeout=timeout)
+            if chord is None or chord["sequence_id"] == sequence_id:
+                return chord
+
+    def close(self) -> None:
+        self.request_ring.close()
+        self.chord_ring.close()
+
+    def __send_request(self, request_type: int, value: float, intensity: float = 0.0) -> int:
+        sequence_id = self.next_sequence_id
+        self.next_sequence_id = (self.next_sequence_id + 1) % 2**32
+        if not self.request_ring.put(REQUEST_FORMAT.pack(request_type, sequence_id, value, intensity)):
+            raise BufferError(f"Request ring of {self.NAME} is full. Is the chord generator running?")
+        return sequence_id
\ No newline at end of file
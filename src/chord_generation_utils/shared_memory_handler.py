@@ -0,0 +1,135 @@
+from .chord_generator import ChordGenerator
+from .session_log import SessionLogWriter
+from .shared_memory_ring import SharedMemoryRing, get_ring_names, REQUEST_FORMAT, CHORD_FORMAT, MAX_VOICED_NOTES, MELODY_NOTE, SET_TONIC, SET_CHORD_NOTE_THRESHOLD, SET_THRESHOLD_INPUT_SEQUENCE
+import math
+import struct
+import time
+
+class SharedMemoryHandler:
+    def __init__(self, chord_generator: ChordGenerator, name: str = "chroma_chord_generator", capacity: int = 1024, poll_interval: float = 0.0001, verbose: bool = False, session_log: SessionLogWriter = None) -> None:
+
+        """
+        An alternative to OSCHandler for clients on the same host, which receives melody notes and parameter changes
+        through a shared memory ring buffer, and returns each chord through another, as fixed-size binary records.
+        This avoids the message encoding and network stack round trips of OSC. Clients connect with SharedMemoryClient.
+
+        Like OSCHandler, creating the handler starts serving requests, and blocks until interrupted.
+
+        Parameters:
+            chord_generator:    ChordGenerator. The chord generator to use.
+            name:               str (default "chroma_chord_generator"). Name of the transport, which clients connect to.
+            capacity:           int (default 1024). Number of records each ring can hold.
+            poll_interval:      float (default 0.0001). Secs to sleep when no requests are waiting, 0 to poll continuously at the cost of a full CPU core.
+            verbose:            bool (default False). Whether to print each generated chord.
+            session_log:        SessionLogWriter (default None). Log to write the session to, if any.
+        """
+
+        # Create necessary attributes
+        self.chord_generator = chord_generator
+        self.session_log = session_log
+        self.logged_model_path = chord_generator.MODEL_PATH
+        self.NAME = name
+        self.POLL_INTERVAL = poll_interval
+        self.VERBOSE = verbose
+        self.is_serving = True
+
+        # Create rings for requests from the client and chords to the client
+        request_ring_name, chord_ring_name = get_ring_names(name)
+        self.request_ring = SharedMemoryRing(request_ring_name, record_size=REQUEST_FORMAT.size, capacity=capacity, create=True)
+        self.chord_ring = SharedMemoryRing(chord_ring_name, record_size=CHORD_FORMAT.size, capacity=capacity, create=True)
+        print(f"Created shared memory transport: {name}")
+        print("Awaiting MIDI pitches...")
+
+        try:
+            self.serve_forever() # Blocks until stopped
+        finally:
+            self.request_ring.close()
+            self.chord_ring.close()
+
+    def serve_forever(self) -> None:
+        while self.is_serving:
+            request = self.request_ring.get()
+
+            # Wait for requests without spinning, unless configured to
+            if request is None:
+                if self.POLL_INTERVAL > 0:
+                    time.sleep(self.POLL_INTERVAL)
+                continue
+
+            request_type, sequence_id, value, intensity = REQUEST_FORMAT.unpack(request)
+            try:
+                if request_type == MELODY_NOTE:
+                    self.handle_melody_note(sequence_id, *self.__decode_melody_note(value, intensity))
+                elif request_type == SET_TONIC:
+                    self.chord_generator.set_tonic(int(value))
+                    if self.session_log is not None:
+                        self.session_log.log_tonic(int(value))
+                elif request_type == SET_CHORD_NOTE_THRESHOLD:
+                    self.chord_generator.set_chord_note_threshold(value)
+                    if self.session_log is not None:
+                        self.session_log.log_chord_note_threshold(value)
+                elif request_type == SET_THRESHOLD_INPUT_SEQUENCE:
+                    self.chord_generator.set_threshold_input_sequence(bool(value))
+                    if self.session_log is not None:
+                        self.session_log.log_threshold_input_sequence(bool(value))
+                else:
+                    raise ValueError(f"Unknown request type {request_type}")
+
+            # A bad request shouldn't stop the transport, as an exception in an OSC callback doesn't stop the OSC server
+            except (ValueError, TypeError, OverflowError, struct.error) as e:
+                print(f"Unable to handle request {sequence_id}: {e}")
+
+    def stop(self) -> None:
+        self.is_serving = False
+
+    def __decode_melody_note(self, value: float, intensity: float) -> tuple[int, float]:
+        """Get the MIDI pitch and intensity of a melody note request, clamping the intensity to 0-1, so that velocities fit in the chord record."""
+        if not 0 <= value <= 127 or int(value) != value:
+            raise ValueError(f"Melody note must be a MIDI pitch (0-127). Received {value}")
+        if math.isnan(intensity):
+            raise ValueError(f"Intensity must be a number between 0 and 1. Received {intensity}")
+        return int(value), min(max(intensity, 0.0), 1.0)
+
+    def handle_melody_note(self, sequence_id: int, melody_midi_note_number: int, intensity: float) -> None:
+        """
+        Uses the ChordGenerator object to predict a chord for a received melody note, and then writes the
+        voiced chord and thresholded chroma histogram to the chord ring, with the sequence id of the request.
+        """
+
+        handler_start_time = time.time()
+
+        # Log the received note
+        if self.session_log is not None:
+            self.session_log.log_note(melody_midi_note_number, intensity)
+
+        # Predict the new chord
+        chord_generation_start_time = time.perf_counter()
+        chord = self.chord_generator.get_chord(melody_midi_note_number)
+        chord_generation_ms = (time.perf_counter() - chord_generation_start_time) * 1000
+
+        # Send the voiced chord and chroma histogram as one record, padding the notes to a fixed number
+        voiced_chord = chord.get_voiced_chord(intensity=intensity)
+        padding = [0] * (MAX_VOICED_NOTES - len(voiced_chord))
+        chord_record = CHORD_FORMAT.pack(
+            sequence_id,
+            len(voiced_chord),
+            *chord.get_thresholded_chroma_histogram(),
+            *[note[0] for note in voiced_chord], *padding,
+            *[note[1] for note in voiced_chord], *padding
+        )
+        if not self.chord_ring.put(chord_record):
+            print(f"Chord ring is full, dropping chord {sequence_id}. Is the client reading chords?")
+
+        # Print contents of chord if in verbose mode
+        if self.VERBOSE:
+            print(f"Took {round((time.time() - handler_start_time)*1000, 3)} ms to voice chord with {len(voiced_chord)} notes: {voiced_chord}")
+
+        # Log the generated chord, after the model it was generated with if that was swapped in since the previous chord
+        if self.session_log is not None:
+            if self.chord_generator.last_chord_model_path != self.logged_model_path:
+                self.session_log.log_model_swap(self.chord_generator.last_chord_model_path)
+                self.logged_model_path = self.chord_generator.last_chord_model_path
+            self.session_log.log_chord(chord, voiced_chord, chord_generation_ms)
+
+if __name__ == "__main__":
+    pass
\ No newline at end of file
@@ -0,0 +1,125 @@
+import numpy as np
+import struct
+import sys
+from multiprocessing import shared_memory, resource_tracker
+
+# Request records, sent from clients to the chord generator
+MELODY_NOTE = 1
+SET_TONIC = 2
+SET_CHORD_NOTE_THRESHOLD = 3
+SET_THRESHOLD_INPUT_SEQUENCE = 4
+REQUEST_FORMAT = struct.Struct("<BIdd")              # Request type, sequence id, MIDI pitch or parameter value, intensity
+
+# Chord records, sent back for each melody note. Chords have at most one voiced note per chroma, padded with zeros
+MAX_VOICED_NOTES = 12
+CHORD_FORMAT = struct.Struct("<IB12d12B12B")         # Sequence id, number of voiced notes, thresholded chroma histogram, pitches, velocities
+
+# The write and read indices are kept on separate cache lines, so the producer and consumer don't invalidate each other's
+HEADER_SIZE = 128
+WRITE_INDEX = 0
+CAPACITY = 1
+RECORD_SIZE = 2
+READ_INDEX = 8
+
+class SharedMemoryRing:
+    def __init__(self, name: str, record_size: int = None, capacity: int = 1024, create: bool = False) -> None:
+
+        """
+        A lock-free ring buffer of fixed-size records in a multiprocessing.shared_memory block, for passing records
+        between two processes on the same host. It is safe for exactly one producer, calling put(), and one consumer,
+        calling get(), as each of the two indices in the header is only ever written by one side.
+
+        Parameters:
+            name:           str. Name of the shared memory block.
+            record_size:    int (default None). Bytes per record, required when creating the ring, and read from the ring when attaching.
+            capacity:       int (default 1024). Number of records the ring can hold, only used when creating the ring.
+            create:         bool (default False). Whether to create the ring, or attach to a ring created by another process.
+        """
+
+        self.NAME = name
+        self.CREATED = create
+
+        if create:
+            # Replace any block left behind by a process which didn't clean up
+            try:
+                stale_block = shared_memory.SharedMemory(name)
+                stale_block.close()
+                stale_block.unlink()
+            except FileNotFoundError:
+                pass
+
+            self.shared_memory = shared_memory.SharedMemory(name, create=True, size=HEADER_SIZE + record_size * capacity)
+            self.__header = np.ndarray(HEADER_SIZE // 8, dtype=np.uint64, buffer=self.shared_memory.buf)
+            self.__header[:] = 0
+            self.__header[CAPACITY] = capacity
+            self.__header[RECORD_SIZE] = record_size
+        else:
+            self.shared_memory = attach_shared_memory(name)
+            self.__header = np.ndarray(HEADER_SIZE // 8, dtype=np.uint64, buffer=self.shared_memory.buf)
+
+        self.CAPACITY = int(self.__header[CAPACITY])
+        self.RECORD_SIZE = int(self.__header[RECORD_SIZE])
+        self.buffer = self.shared_memory.buf
+
+    def put(self, record: bytes) -> bool:
+        """Write a record to the ring, returning False without writing it if the ring is full."""
+        write_index = int(self.__header[WRITE_INDEX])
+        if write_index - int(self.__header[READ_INDEX]) >= self.CAPACITY:
+            return False
+
+        # Write the record before publishing it by moving the write index on
+        offset = HEADER_SIZE + (write_index % self.CAPACITY) * self.RECORD_SIZE
+        self.buffer[offset:offset + self.RECORD_SIZE] = record
+        self.__header[WRITE_INDEX] = write_index + 1
+        return True
+
+    def get(self) -> bytes | None:
+        """Read the oldest record from the ring, or None if the ring is empty."""
+        read_index = int(self.__header[READ_INDEX])
+        if read_index == int(self.__header[WRITE_INDEX]):
+            return None
+
+        # Copy the record out before freeing its slot by moving the read index on
+        offset = HEADER_SIZE + (read_index % self.CAPACITY) * self.RECORD_SIZE
+        record = bytes(self.buffer[offset:offset + self.RECORD_SIZE])
+        self.__header[READ_INDEX] = read_index + 1
+        return record
+
+    def close(self) -> None:
+        """Detach from the ring, and remove it if this process created it."""
+        self.__header = None
+        self.buffer = None
+        self.shared_memory.close()
+        if self.CREATED:
+            self.shared_memory.unlink()
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing shared memory block without registering it with the resource tracker, so only its creator unlinks it."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+
+    # Before Python 3.13, attaching always registers the block, and the resource tracker unlinks it when this process exits
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+def get_ring_names(name: str) -> tuple[str, str]:
+    """Get the names of the request and chord rings of a shared memory transport."""
+    return f"{name}_requests", f"{name}_chords"
+
+if __name__ == "__main__":
+
+    # Simple tests of the ring
+    producer = SharedMemoryRing("shared_memory_ring_test", record_size=REQUEST_FORMAT.size, capacity=4, create=True)
+    consumer = SharedMemoryRing("shared_memory_ring_test")
+
+    for i in range(6):
+        print(f"Put {i}: {producer.put(REQUEST_FORMAT.pack(MELODY_NOTE, i, 60 + i, 0.5))}")
+    while (record := consumer.get()) is not None:
+        print(REQUEST_FORMAT.unpack(record))
+
+    consumer.close()
+    producer.close()
\ No newline at end of file
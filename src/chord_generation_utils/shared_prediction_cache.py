@@ -0,0 +1,347 @@
+import hashlib
+import os
+import sys
+import tempfile
+import numpy as np
+from contextlib import contextmanager
+from multiprocessing import shared_memory, resource_tracker
+from .shared_memory_ring import attach_shared_memory
+
+# Header fields, as uint64s. The clock hand is the only field written after the cache is created
+MAGIC = 0
+CAPACITY = 1
+KEY_SIZE = 2
+NUM_OUTPUTS = 3
+QUANTIZATION_LEVELS = 4
+MAX_PROCESSES = 5
+SEQUENCE_LENGTH = 6
+CLOCK_HAND = 7
+HEADER_SIZE = 128
+CACHE_MAGIC = int.from_bytes(b"CHRMCACH", "little")
+
+# Hit-rate statistics of each process attached, each row only ever written by its own process
+PROCESS_PID = 0
+PROCESS_LOOKUPS = 1
+PROCESS_HITS = 2
+PROCESS_INSERTS = 3
+PROCESS_EVICTIONS = 4
+PROCESS_FIELDS = 8 # One cache line per process
+
+# Slots probed from a key's home slot before one is evicted
+MAX_PROBES = 8
+
+class SharedPredictionCache:
+    def __init__(
+            self,
+            name: str = "chroma_chord_generator_cache",
+            sequence_length: int = 8,
+            capacity: int = 65536,
+            quantization_levels: int = 32,
+            max_processes: int = 64
+        ) -> None:
+
+        """
+        A cache of predicted chroma histograms, keyed by quantized input windows, in a shared memory block that every
+        ChordGenerator on the host can read and write, so that material already played by one performer, in the same
+        tonic-relative space, doesn't need to be predicted again by another process. The first process to open the cache
+        creates it, and the others attach to it. The cache outlives the processes using it, until unlink() is called.
+
+        - The table is a fixed-size open-addressing table, each key being probed for in up to MAX_PROBES consecutive slots.
+        - Reads are lock-free. Each slot has a version, odd while it is being written, which a reader checks before and after
+          copying the slot, as a seqlock, so a slot overwritten while being read is a miss rather than a torn histogram.
+        - Writes, only made after a miss has been predicted, are serialised between processes by a lock file.
+        - When all the slots probed for a new key are full, one is evicted with the clock policy: slots are given a second
+          chance if they were hit since the clock hand last passed them.
+        - Lookups, hits, inserts and evictions are counted for each process attached (see get_stats()).
+
+        Windows are keyed by their melody chromas and their chroma histograms rounded to 1 / quantization_levels, along with
+        the model they are predicted with. A ChordGenerator using the cache predicts the rounded window (see quantize_window()),
+        so its chords are the same whether or not the prediction was cached, by this or any other process.
+
+        Parameters:
+            name:                   str (default "chroma_chord_generator_cache"). Name of the shared memory block.
+            sequence_length:        int (default 8). Length of the input windows, only used when creating the cache.
+            capacity:               int (default 65536). Number of slots, only used when creating the cache.
+            quantization_levels:    int (default 32). Levels each chroma histogram amount is rounded to, at most 255, only used when creating the cache.
+            max_processes:          int (default 64). Number of processes hit rate statistics are kept for, only used when creating the cache.
+        """
+
+        self.NAME = name
+        self.LOCK_PATH = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+        # Create the cache, or attach to it if another process already has, under the lock so that only one creates it
+        with self.__write_lock():
+            try:
+                self.shared_memory = attach_shared_memory(name)
+            except FileNotFoundError:
+                if not 1 <= quantization_levels <= 255:
+                    raise ValueError(f"Quantization levels must be between 1 and 255. Received {quantization_levels}.")
+                key_size = 8 * (1 + -(-sequence_length * 13 // 8)) # Model fingerprint and window, padded to whole uint64s
+                self.shared_memory = shared_memory.SharedMemory(name, create=True, size=self.__get_size(capacity, key_size, 12, max_processes))
+
+                # Keep the block after this process exits, as other processes may still be using it
+                resource_tracker.unregister(self.shared_memory._name, "shared_memory")
+
+                header = np.ndarray(HEADER_SIZE // 8, dtype=np.uint64, buffer=self.shared_memory.buf)
+                header[:] = 0
+                header[[CAPACITY, KEY_SIZE, NUM_OUTPUTS, QUANTIZATION_LEVELS, MAX_PROCESSES, SEQUENCE_LENGTH]] = [capacity, key_size, 12, quantization_levels, max_processes, sequence_length]
+                header[MAGIC] = CACHE_MAGIC
+                print(f"Created shared prediction cache {name} with {capacity} slots")
+
+            self.__header = np.ndarray(HEADER_SIZE // 8, dtype=np.uint64, buffer=self.shared_memory.buf)
+            if int(self.__header[MAGIC]) != CACHE_MAGIC:
+                raise ValueError(f"Shared memory block {name} is not a prediction cache")
+
+            self.CAPACITY = int(self.__header[CAPACITY])
+            self.KEY_SIZE = int(self.__header[KEY_SIZE])
+            self.NUM_OUTPUTS = int(self.__header[NUM_OUTPUTS])
+            self.QUANTIZATION_LEVELS = int(self.__header[QUANTIZATION_LEVELS])
+            self.MAX_PROCESSES = int(self.__header[MAX_PROCESSES])
+            self.SEQUENCE_LENGTH = int(self.__header[SEQUENCE_LENGTH])
+
+            # Views of each section of the block
+            offset = HEADER_SIZE
+            self.__process_stats = np.ndarray((self.MAX_PROCESSES, PROCESS_FIELDS), dtype=np.uint64, buffer=self.shared_memory.buf, offset=offset)
+            offset += self.__process_stats.nbytes
+            self.__versions = np.ndarray(self.CAPACITY, dtype=np.uint64, buffer=self.shared_memory.buf, offset=offset)
+            offset += self.__versions.nbytes
+            self.__hashes = np.ndarray(self.CAPACITY, dtype=np.uint64, buffer=self.shared_memory.buf, offset=offset)
+            offset += self.__hashes.nbytes
+            self.__values = np.ndarray((self.CAPACITY, self.NUM_OUTPUTS), dtype=np.float64, buffer=self.shared_memory.buf, offset=offset)
+            offset += self.__values.nbytes
+            self.__keys = np.ndarray((self.CAPACITY, self.KEY_SIZE), dtype=np.uint8, buffer=self.shared_memory.buf, offset=offset)
+            offset += self.__keys.nbytes
+            self.__references = np.ndarray(self.CAPACITY, dtype=np.uint8, buffer=self.shared_memory.buf, offset=offset)
+
+            # Claim a statistics row, reusing this process's row or that of a process which has exited
+            self.__stats_row = None
+            pids = self.__process_stats[:, PROCESS_PID]
+            for row in [*np.flatnonzero(pids == os.getpid()), *np.flatnonzero(pids == 0), *range(self.MAX_PROCESSES)]:
+                if pids[row] in [0, os.getpid()] or not self.__is_process_alive(int(pids[row])):
+                    self.__process_stats[row] = 0
+                    self.__process_stats[row, PROCESS_PID] = os.getpid()
+                    self.__stats_row = self.__process_stats[row]
+                    break
+            if self.__stats_row is None:
+                # Count in a private row if all rows are taken by running processes
+                self.__stats_row = np.zeros(PROCESS_FIELDS, dtype=np.uint64)
+
+    def quantize_window(self, input_window: np.ndarray[float], model_path: str) -> tuple[bytes, np.ndarray[float]]:
+        """
+        Get the key of an input window of shape (sequence length, 13) predicted with the given model, and the window with its
+        chroma histograms rounded to the quantization levels of the cache, which is the window to predict for that key.
+        """
+        if input_window.shape != (self.SEQUENCE_LENGTH, 13):
+            raise ValueError(f"Expected an input window of shape {(self.SEQUENCE_LENGTH, 13)}. Received {input_window.shape}.")
+
+        melody_chromas = np.rint(input_window[:, 0]).astype(np.uint8)
+        quantized_histograms = np.rint(np.clip(input_window[:, 1:], 0, 1) * self.QUANTIZATION_LEVELS).astype(np.uint8)
+
+        key = np.zeros(self.KEY_SIZE, dtype=np.uint8)
+        key[:8] = np.frombuffer(hashlib.blake2b(model_path.encode("utf-8"), digest_size=8).digest(), dtype=np.uint8)
+        key[8:8 + input_window.size] = np.concatenate([melody_chromas[:, np.newaxis], quantized_histograms], axis=1).ravel()
+
+        quantized_window = np.concatenate([melody_chromas[:, np.newaxis], quantized_histograms / self.QUANTIZATION_LEVELS], axis=1)
+        return key.tobytes(), quantized_window
+
+    def get(self, key: bytes) -> np.ndarray[float] | None:
+        """Get the chroma histogram cached for a key, or None if it isn't cached. Never waits for writers."""
+        key_hash, home_slot = self.__hash(key)
+        key = np.frombuffer(key, dtype=np.uint8)
+        self.__stats_row[PROCESS_LOOKUPS] += 1
+
+        for probe in range(MAX_PROBES):
+            slot = (home_slot + probe) % self.CAPACITY
+            version = int(self.__versions[slot])
+            if version % 2 == 1:
+                continue
+            slot_hash = self.__hashes[slot]
+            if slot_hash == 0:
+                # Slots are filled in probe order and only emptied all at once, so the key can't be further on
+                return None
+            if slot_hash != key_hash or not np.array_equal(self.__keys[slot], key):
+                continue
+
+            # Copy the histogram, and only use it if the slot wasn't written meanwhile
+            chroma_histogram = self.__values[slot].copy()
+            if int(self.__versions[slot]) != version:
+                return None
+            self.__references[slot] = 1
+            self.__stats_row[PROCESS_HITS] += 1
+            return chroma_histogram
+        return None
+
+    def put(self, key: bytes, chroma_histogram: np.ndarray[float]) -> None:
+        """Cache the chroma histogram predicted for a key, evicting another if all the slots probed for it are full."""
+        key_hash, home_slot = self.__hash(key)
+        slots = (home_slot + np.arange(MAX_PROBES)) % self.CAPACITY
+
+        with self.__write_lock():
+            # Overwrite the key if another process cached it meanwhile, or use the first free slot
+            hashes = self.__hashes[slots]
+            matches = [i for i in np.flatnonzero(hashes == key_hash) if self.__keys[slots[i]].tobytes() == key]
+            free_slots = np.flatnonzero(hashes == 0)
+            if len(matches) > 0:
+                slot = slots[matches[0]]
+            elif free_slots.size > 0:
+                slot = slots[free_slots[0]]
+            else:
+                slot = self.__evict(slots)
+                self.__stats_row[PROCESS_EVICTIONS] += 1
+
+            # Mark the slot as being written while it is written. Versions only ever increase, so a reader can't mistake a rewritten slot for the one it started reading
+            self.__versions[slot] += 1
+            self.__hashes[slot] = key_hash
+            self.__keys[slot] = np.frombuffer(key, dtype=np.uint8)
+            self.__values[slot] = chroma_histogram
+            self.__references[slot] = 0
+            self.__versions[slot] += 1
+            self.__stats_row[PROCESS_INSERTS] += 1
+
+    def get_stats(self) -> list[dict]:
+        """Get the lookups, hits, inserts and evictions of each process using the cache, and its hit rate."""
+        stats = []
+        for row in self.__process_stats:
+            if row[PROCESS_PID] == 0:
+                continue
+            lookups, hits = int(row[PROCESS_LOOKUPS]), int(row[PROCESS_HITS])
+            stats.append({
+                "pid": int(row[PROCESS_PID]),
+                "running": self.__is_process_alive(int(row[PROCESS_PID])),
+                "lookups": lookups,
+                "hits": hits,
+                "hit_rate": hits / lookups if lookups > 0 else 0.0,
+                "inserts": int(row[PROCESS_INSERTS]),
+                "evictions": int(row[PROCESS_EVICTIONS])
+            })
+        return stats
+
+    def print_stats(self, stats: list[dict] = None) -> None:
+        if stats is None:
+            stats = self.get_stats()
+        print(f"Shared prediction cache {self.NAME}: {np.count_nonzero(self.__hashes)} of {self.CAPACITY} slots used")
+        print(f"{'pid':>8} {'running':>8} {'lookups':>10} {'hits':>10} {'hit %':>7} {'inserts':>10} {'evictions':>10}")
+        for process in stats:
+            print(f"{process['pid']:>8} {str(process['running']):>8} {process['lookups']:>10} {process['hits']:>10} "
+                  f"{process['hit_rate'] * 100:>7.1f} {process['inserts']:>10} {process['evictions']:>10}")
+
+    def clear(self) -> None:
+        """Empty the cache, e.g., after retraining a model saved at the same path. Statistics are kept."""
+        with self.__write_lock():
+            # Slots are marked as being written first, so that readers miss rather than read them half-cleared
+            self.__versions[:] += 1
+            self.__hashes[:] = 0
+            self.__references[:] = 0
+            self.__versions[:] += 1
+            self.__header[CLOCK_HAND] = 0
+
+    def close(self) -> None:
+        """Detach from the cache, leaving it for other processes."""
+        self.__header = None
+        self.__process_stats = self.__versions = self.__hashes = self.__values = self.__keys = self.__references = None
+        self.__stats_row = None
+        self.shared_memory.close()
+
+    def unlink(self) -> None:
+        """Remove the cache once no process needs it anymore. Processes still attached keep their copy until they close it."""
+        self.close()
+
+        # Register the block again, as unlinking also unregisters it from the resource tracker
+        resource_tracker.register(self.shared_memory._name, "shared_memory")
+        self.shared_memory.unlink()
+        if os.path.exists(self.LOCK_PATH):
+            os.remove(self.LOCK_PATH)
+
+    def __evict(self, slots: np.ndarray[int]) -> int:
+        """Choose the slot to evict among the slots probed, as a clock starting from the clock hand, clearing the reference bits passed."""
+        clock_hand = int(self.__header[CLOCK_HAND])
+        self.__header[CLOCK_HAND] = clock_hand + 1
+        for i in range(MAX_PROBES):
+            slot = slots[(clock_hand + i) % MAX_PROBES]
+            if self.__references[slot] == 0:
+                return slot
+            self.__references[slot] = 0
+
+        # Every slot was hit since the hand last passed, so evict the first one, whose second chance is now used up
+        return slots[clock_hand % MAX_PROBES]
+
+    def __hash(self, key: bytes) -> tuple[int, int]:
+        """Get the hash of a key, the same in every process unlike hash(), never 0, and its home slot."""
+        key_hash = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") or 1
+        return key_hash, key_hash % self.CAPACITY
+
+    @contextmanager
+    def __write_lock(self):
+        """Hold an exclusive lock on the cache's lock file, shared by all processes on the host."""
+        with open(self.LOCK_PATH, "a+b") as lock_file:
+            if sys.platform == "win32":
+                import msvcrt
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def __get_size(capacity: int, key_size: int, num_outputs: int, max_processes: int) -> int:
+        return HEADER_SIZE + max_processes * PROCESS_FIELDS * 8 + capacity * (8 + 8 + num_outputs * 8 + key_size + 1)
+
+    @staticmethod
+    def __is_process_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except (PermissionError, OSError):
+            pass
+        return True
+
+def _run_test_process(name: str, seed: int, num_windows: int, num_notes: int) -> None:
+    """Look up and fill the cache as a ChordGenerator would, from windows shared between processes."""
+    cache = SharedPredictionCache(name)
+    rng = np.random.default_rng(seed)
+    windows = np.random.default_rng(0).dirichlet(np.full(13, 0.3), size=(num_windows, cache.SEQUENCE_LENGTH))
+    for _ in range(num_notes):
+        key, quantized_window = cache.quantize_window(windows[rng.integers(num_windows)], "test_model")
+        chroma_histogram = cache.get(key)
+        if chroma_histogram is None:
+            cache.put(key, quantized_window[-1, 1:])
+        elif not np.array_equal(chroma_histogram, quantized_window[-1, 1:]):
+            print(f"Process {os.getpid()} read a wrong histogram")
+    cache.close()
+
+if __name__ == "__main__":
+
+    import multiprocessing
+    import time
+    import timeit
+
+    # Several processes sharing a small cache, each reading and writing windows drawn from the same set
+    name = "shared_prediction_cache_test"
+    cache = SharedPredictionCache(name, sequence_length=8, capacity=4096)
+    cache.clear()
+    processes = [multiprocessing.Process(target=_run_test_process, args=(name, seed, 6000, 20000)) for seed in range(4)]
+    start_time = time.time()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    print(f"Took {round(time.time() - start_time, 3)} secs for {len(processes)} processes to look up 20000 windows each")
+    cache.print_stats()
+
+    # Lookup time of a single window
+    key, quantized_window = cache.quantize_window(np.random.default_rng(1).dirichlet(np.full(13, 0.3), size=8), "test_model")
+    cache.put(key, quantized_window[-1, 1:])
+    hit_secs = min(timeit.repeat(lambda: cache.get(key), number=10000, repeat=3)) / 10000
+    quantize_secs = min(timeit.repeat(lambda: cache.quantize_window(quantized_window, "test_model"), number=10000, repeat=3)) / 10000
+    print(f"A hit takes {round(hit_secs * 1e6, 2)} µs, and quantizing a window {round(quantize_secs * 1e6, 2)} µs")
+    cache.unlink()
\ No newline at end of file
@@ -0,0 +1,182 @@
+# CHROMA CHORD GENERATOR - OFFLINE HARMONIZATION
+# --------------------------
+# This script harmonizes whole melodies offline, as fast as the model allows,
+# generating the chords of many songs together in each model call.
+# It reads melody MIDI files or note lists, and writes harmonized MIDI or JSON files:
+#
+#   python src/harmonize.py <melody files or directories> --output-dir <dir> --output-format midi --seed 0
+#
+# Note lists are .json files of [pitch, intensity] pairs or {"pitch", "intensity", "start", "end"} objects,
+# or .txt files with one "pitch [intensity]" per line. Each song's chords are identical to those generated
+# live by main.py for the same notes, settings and seed.
+#
+# With --decoding sample or beam, chords are instead chosen between several candidates,
+# looking ahead over each song's next notes, one song at a time (see ChordDecoder).
+# --------------------------
+
+import argparse
+import json
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+import pretty_midi
+
+from chord_generation_utils.chord_generator import ChordGenerator
+from chord_generation_utils.batch_harmonizer import BatchHarmonizer
+from chord_generation_utils.chord_decoder import ChordDecoder
+from chord_generation_utils.chord import Chord
+from chord_generation_utils.chroma_codebook import ChromaCodebook
+
+MELODY_FILE_EXTENSIONS = (".mid", ".midi", ".json", ".txt")
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Harmonize melody MIDI files or note lists offline.")
+
+    # Input and output
+    parser.add_argument("inputs", nargs="+", help="Melody MIDI files, note list files, or directories of them.")
+    parser.add_argument("--output-dir", default="./harmonized", help="Directory to write the harmonized files to.")
+    parser.add_argument("--output-format", choices=["midi", "json"], default="midi")
+    parser.add_argument("--melody-track", type=int, default=0, help="Index of the melody instrument in MIDI files, ignoring drum tracks.")
+    parser.add_argument("--note-duration", type=float, default=0.5, help="Duration in secs of notes in note lists without start times.")
+    parser.add_argument("--default-intensity", type=float, default=0.5, help="Intensity of notes in note lists without one.")
+
+    # Chord generation, with the same defaults as main.py
+    parser.add_argument("--model-path", default="./src/trained_model/chroma_histogram_generator_model")
+    parser.add_argument("--sequence-length", type=int, default=8)
+    parser.add_argument("--tonic", type=int, default=0)
+    parser.add_argument("--chord-note-threshold", type=float, default=0.14)
+    parser.add_argument("--no-threshold-input-sequence", action="store_true", help="Feed back the unthresholded chroma histograms.")
+    parser.add_argument("--update-direction", choices=["append", "prepend"], default="append")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the initial input sequence of every song.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Maximum number of songs generated together in each model call.")
+    parser.add_argument("--codebook-path", default=None, help="Chroma codebook (.npz) to snap predicted chords to, made with chords_dataset_codebook.py.")
+
+    # Decoding, greedy being the same as main.py
+    parser.add_argument("--decoding", choices=["greedy", "sample", "beam"], default="greedy", help="How to choose between candidate chords.")
+    parser.add_argument("--num-candidates", type=int, default=4, help="Candidate chords for each note when sampling or using a beam.")
+    parser.add_argument("--temperature", type=float, default=1.0, help="Temperature of sampling, higher for more variety.")
+    parser.add_argument("--lookahead", type=int, default=2, help="Next melody notes to look ahead over when scoring candidates.")
+    parser.add_argument("--beam-width", type=int, default=2, help="Paths kept for each candidate at each look-ahead step.")
+
+    return parser.parse_args(argv)
+
+def find_melody_files(inputs: list[str]) -> list[str]:
+    """Get the melody files given, and those in the directories given, in sorted order."""
+    melody_files = []
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            for root, _, files in os.walk(input_path):
+                melody_files += [os.path.join(root, file) for file in sorted(files) if file.lower().endswith(MELODY_FILE_EXTENSIONS)]
+        else:
+            melody_files.append(input_path)
+    return melody_files
+
+def read_melody(melody_path: str, melody_track: int = 0, note_duration: float = 0.5, default_intensity: float = 0.5) -> list[dict]:
+    """
+    Read a melody as a list of notes, each a dict with "pitch", "intensity", "start" and "end".
+    In MIDI files, intensity is the velocity scaled to 0-1, and in note lists without timing, notes follow each other with note_duration.
+    """
+    if melody_path.lower().endswith((".mid", ".midi")):
+        instruments = [instrument for instrument in pretty_midi.PrettyMIDI(melody_path).instruments if not instrument.is_drum]
+        notes = sorted(instruments[melody_track].notes, key=lambda note: (note.start, note.pitch))
+        return [{"pitch": note.pitch, "intensity": note.velocity / 127, "start": note.start, "end": note.end} for note in notes]
+
+    # Get note list entries as [pitch, intensity] or dict
+    if melody_path.lower().endswith(".json"):
+        with open(melody_path) as melody_file:
+            entries = json.load(melody_file)
+    else:
+        with open(melody_path) as melody_file:
+            entries = [[float(value) for value in line.split()] for line in melody_file if line.strip() != ""]
+
+    melody = []
+    for i, entry in enumerate(entries):
+        if isinstance(entry, dict):
+            note = {"pitch": entry["pitch"], "intensity": entry.get("intensity", default_intensity),
+                    "start": entry.get("start", i * note_duration), "end": entry.get("end")}
+        else:
+            note = {"pitch": entry[0], "intensity": entry[1] if len(entry) > 1 else default_intensity,
+                    "start": i * note_duration, "end": None}
+        note["pitch"] = int(note["pitch"])
+        if note["end"] is None:
+            note["end"] = note["start"] + note_duration
+        melody.append(note)
+    return melody
+
+def write_midi(output_path: str, melody: list[dict], chords: list[Chord]) -> None:
+    """Write the melody and its chords to a MIDI file, each chord lasting until the next melody note starts."""
+    harmonized_midi = pretty_midi.PrettyMIDI()
+    melody_instrument = pretty_midi.Instrument(program=0, name="Melody")
+    chord_instrument = pretty_midi.Instrument(program=0, name="Chords")
+
+    for i, (note, chord) in enumerate(zip(melody, chords)):
+        melody_instrument.notes.append(pretty_midi.Note(velocity=max(1, int(note["intensity"] * 127)), pitch=note["pitch"], start=note["start"], end=note["end"]))
+
+        # Chords last until the next note, as when played live
+        chord_end = melody[i+1]["start"] if i+1 < len(melody) and melody[i+1]["start"] > note["start"] else note["end"]
+        for pitch, velocity in chord.get_voiced_chord(intensity=note["intensity"]):
+            chord_instrument.notes.append(pretty_midi.Note(velocity=velocity, pitch=pitch, start=note["start"], end=chord_end))
+
+    harmonized_midi.instruments += [melody_instrument, chord_instrument]
+    harmonized_midi.write(output_path)
+
+def write_json(output_path: str, melody: list[dict], chords: list[Chord]) -> None:
+    """Write each melody note with its chord, as the thresholded chroma histogram and voiced [pitch, velocity] pairs, to a JSON file."""
+    harmonized = [
+        dict(note,
+             chroma_histogram=chord.get_thresholded_chroma_histogram().tolist(),
+             voiced_chord=chord.get_voiced_chord(intensity=note["intensity"]))
+        for note, chord in zip(melody, chords)
+    ]
+    with open(output_path, "w") as output_file:
+        json.dump(harmonized, output_file)
+
+def main(argv: list[str] = None) -> None:
+    args = parse_args(argv)
+
+    # Read melodies
+    melody_paths = find_melody_files(args.inputs)
+    melodies = [read_melody(melody_path, args.melody_track, args.note_duration, args.default_intensity) for melody_path in melody_paths]
+    print(f"Read {len(melodies)} melodies with {sum(len(melody) for melody in melodies)} notes")
+
+    # Initialise the chord generator object, as in main.py
+    chord_generator = ChordGenerator(
+        model_path=args.model_path,
+        sequence_length=args.sequence_length,
+        tonic=args.tonic,
+        chord_note_threshold=args.chord_note_threshold,
+        threshold_input_sequence=not args.no_threshold_input_sequence,
+        update_direction=args.update_direction,
+        seed=args.seed,
+        codebook=ChromaCodebook.load(args.codebook_path) if args.codebook_path is not None else None
+    )
+
+    melody_note_midi_numbers = [[note["pitch"] for note in melody] for melody in melodies]
+    if args.decoding == "greedy":
+        # Harmonize all melodies together
+        batch_harmonizer = BatchHarmonizer(chord_generator, batch_size=args.batch_size, seed=args.seed)
+        chords = batch_harmonizer.harmonize(melody_note_midi_numbers)
+    else:
+        # Harmonize each melody in turn, looking ahead over its notes
+        chord_decoder = ChordDecoder(chord_generator,
+                                     strategy=args.decoding,
+                                     num_candidates=args.num_candidates,
+                                     temperature=args.temperature,
+                                     lookahead=args.lookahead,
+                                     beam_width=args.beam_width,
+                                     seed=args.seed)
+        chords = [chord_decoder.harmonize(melody) for melody in melody_note_midi_numbers]
+
+    # Write harmonized files
+    os.makedirs(args.output_dir, exist_ok=True)
+    for melody_path, melody, song_chords in zip(melody_paths, melodies, chords):
+        output_name = os.path.splitext(os.path.basename(melody_path))[0]
+        if args.output_format == "midi":
+            write_midi(os.path.join(args.output_dir, f"{output_name}_harmonized.mid"), melody, song_chords)
+        else:
+            write_json(os.path.join(args.output_dir, f"{output_name}_harmonized.json"), melody, song_chords)
+    print(f"Wrote {len(melodies)} harmonized files to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -3,23 +3,29 @@
 # This script is the core of the real-time chord generation.
 # It expects melody chroma values as integers over OSC on port 10000,
 # and returns chords as list[[pitch: int, velocity: int]] over OSC on port 11000
+# Optionally, a seed makes the generated chords reproducible, and the session
+# can be logged to a file to be replayed with replay_session.py
 # --------------------------
 # Last updated: 14 May 2024
 
 import os
 import sys
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
 
 from chord_generation_utils.chord_generator import ChordGenerator
 from chord_generation_utils.osc import OSCHandler
+from chord_generation_utils.session_log import SessionLogWriter
 
 def main() -> None:
     
+    session_log = None
+
     try:
 
         if len(sys.argv) != 1:
-            if len(sys.argv) != 4:
-                print("Expected either no arguments, or 3 arguments: <ip> <receive_port> <send_port>")
+            if len(sys.argv) not in [4, 5, 6]:
+                print("Expected either no arguments, or 3 to 5 arguments: <ip> <receive_port> <send_port> [<seed> [<session_log_path>]]")
                 return
             ip = str(sys.argv[1])
             server_port = int(sys.argv[2])
@@ -28,6 +34,8 @@ def main() -> None:
             ip = "127.0.0.1"
             server_port = 10000
             client_port = 11000
+        seed = int(sys.argv[4]) if len(sys.argv) >= 5 else None
+        session_log_path = sys.argv[5] if len(sys.argv) == 6 else None
 
         
         print("------------------------------")
@@ -44,9 +52,15 @@ def main() -> None:
             tonic=0, 
             chord_note_threshold=0.14,
             threshold_input_sequence=True,
-            update_direction="append"
+            update_direction="append",
+            seed=seed
         )
 
+        # Log the session if a path is given
+        if session_log_path is not None:
+            session_log = SessionLogWriter(session_log_path, chord_generator)
+            print(f"Logging session with seed {chord_generator.SEED} to {session_log_path}")
+
         # Initialise the OSC handler object which communicates
         # with Max, receiving melody note numbers and returning chords
         # as [pitch, velocity] pairs
@@ -55,7 +69,8 @@ def main() -> None:
             ip=ip,
             server_port=server_port,
             client_port=client_port,
-            verbose=True
+            verbose=True,
+            session_log=session_log
         )
 
     except KeyboardInterrupt:
@@ -63,5 +78,9 @@ def main() -> None:
         print("Exiting...")
         print("-----")
 
+    finally:
+        if session_log is not None:
+            session_log.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
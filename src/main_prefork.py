@@ -0,0 +1,188 @@
+# CHROMA CHORD GENERATOR - PRE-FORK SERVER
+# --------------------------
+# This script runs several real-time chord generators on one host, e.g. one per
+# performer, loading and warming up the model once in a parent process before
+# forking the workers, which share its weights copy-on-write instead of each
+# loading its own copy. Worker i receives melody notes on <receive_port> + i and
+# sends chords on <send_port> + i over OSC, as main.py, or through the shared
+# memory transport <name>_<i> with --transport shared_memory:
+#
+#   python ./src/main_prefork.py --workers 4 [--weights-path <npz path>] [--seed <seed>]
+#
+# TensorFlow can't be used in forked processes, so the workers generate chords
+# with a NumPy copy of the model's weights (see NumpyChordGeneratorModel), converted
+# from the model after loading it, or loaded from an exported .npz file without
+# importing TensorFlow at all. For the same reason, workers refuse /load_model
+# messages, answering /model_load_failed; restart the server to change the model.
+# Unix only, as it relies on os.fork().
+# --------------------------
+
+import argparse
+import gc
+import os
+import signal
+import sys
+import time
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+import numpy as np
+
+from chord_generation_utils.chord_generator import ChordGenerator
+from chord_generation_utils.numpy_chord_generator_model import NumpyChordGeneratorModel
+from chord_generation_utils.osc import OSCHandler
+from chord_generation_utils.shared_memory_handler import SharedMemoryHandler
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run several chord generators sharing one copy of the model's weights.")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes to fork, each serving one client.")
+    parser.add_argument("--model-path", default="./src/trained_model/chroma_histogram_generator_model", help="Saved model to load and convert to NumPy.")
+    parser.add_argument("--weights-path", default=None, help="Weights exported with export_chord_generator_model() to load instead of the saved model.")
+    parser.add_argument("--transport", choices=["osc", "shared_memory"], default="osc", help="Transport each worker serves its client through.")
+    parser.add_argument("--ip", default="127.0.0.1", help="IP address of the OSC servers.")
+    parser.add_argument("--receive-port", type=int, default=10000, help="OSC port worker 0 receives melody notes on, worker i on this port + i.")
+    parser.add_argument("--send-port", type=int, default=11000, help="OSC port worker 0 sends chords to, worker i to this port + i.")
+    parser.add_argument("--name", default="chroma_chord_generator", help="Name of the shared memory transports, worker i serving <name>_<i>.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of worker 0, worker i using this seed + i.")
+    parser.add_argument("--verbose", action="store_true", help="Print each generated chord.")
+    return parser.parse_args()
+
+def load_backend(args: argparse.Namespace) -> NumpyChordGeneratorModel:
+    """Load the model's weights as a NumPy backend, from the exported weights if given, or from the saved model."""
+    if args.weights_path is not None:
+        return NumpyChordGeneratorModel.load(args.weights_path)
+
+    import tensorflow as tf
+    model = tf.keras.models.load_model(args.model_path)
+    return NumpyChordGeneratorModel.from_keras_model(model)
+
+def get_memory_usage(pid: int) -> dict[str, float] | None:
+    """Get the resident, proportional, shared and private memory of a process in MB from /proc, or None where it isn't available."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as smaps_file:
+            fields = {line.split(":")[0]: int(line.split()[1]) / 1024 for line in smaps_file if line.split()[-1] == "kB"}
+    except OSError:
+        return None
+    return {
+        "rss_mb": fields.get("Rss", 0.0),
+        "pss_mb": fields.get("Pss", 0.0),
+        "shared_mb": fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0),
+        "private_mb": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0)
+    }
+
+def run_worker(worker_index: int, backend: NumpyChordGeneratorModel, args: argparse.Namespace, ready_fd: int) -> None:
+    """Serve one client with its own chord generator, using the backend inherited from the parent. Blocks until interrupted."""
+    chord_generator = ChordGenerator(
+        model_path=args.weights_path or args.model_path,
+        sequence_length=8,
+        tonic=0,
+        chord_note_threshold=0.14,
+        threshold_input_sequence=True,
+        update_direction="append",
+        seed=args.seed + worker_index if args.seed is not None else None,
+        model=backend
+    )
+
+    # Let the parent know the worker is ready before serving, which blocks
+    os.write(ready_fd, b"1")
+    os.close(ready_fd)
+
+    if args.transport == "osc":
+        OSCHandler(chord_generator, ip=args.ip, server_port=args.receive_port + worker_index, client_port=args.send_port + worker_index, verbose=args.verbose,
+                   allow_model_loading=False)
+    else:
+        SharedMemoryHandler(chord_generator, name=f"{args.name}_{worker_index}", verbose=args.verbose)
+
+def print_memory_report(worker_pids: list[int], args: argparse.Namespace) -> None:
+    parent_memory = get_memory_usage(os.getpid())
+    if parent_memory is None:
+        print("Memory usage is only reported where /proc/<pid>/smaps_rollup is available.")
+        return
+
+    print(f"{'process':>8} {'pid':>8} {'serving':<28} {'RSS MB':>8} {'PSS MB':>8} {'shared MB':>10} {'private MB':>11}")
+    print(f"{'parent':>8} {os.getpid():>8} {'':<28} {parent_memory['rss_mb']:>8.1f} {parent_memory['pss_mb']:>8.1f} {parent_memory['shared_mb']:>10.1f} {parent_memory['private_mb']:>11.1f}")
+    total_pss_mb, total_rss_mb = parent_memory["pss_mb"], parent_memory["rss_mb"]
+    for worker_index, pid in enumerate(worker_pids):
+        memory = get_memory_usage(pid)
+        if memory is None:
+            continue
+        serving = f"{args.ip}:{args.receive_port + worker_index}->{args.send_port + worker_index}" if args.transport == "osc" else f"{args.name}_{worker_index}"
+        print(f"{'worker ' + str(worker_index):>8} {pid:>8} {serving:<28} {memory['rss_mb']:>8.1f} {memory['pss_mb']:>8.1f} {memory['shared_mb']:>10.1f} {memory['private_mb']:>11.1f}")
+        total_pss_mb += memory["pss_mb"]
+        total_rss_mb += memory["rss_mb"]
+
+    # PSS splits each shared page between the processes sharing it, so its total is the memory actually used
+    print(f"Total memory used (PSS): {round(total_pss_mb, 1)} MB, against {round(total_rss_mb, 1)} MB if no pages were shared")
+
+def main() -> None:
+    args = parse_args()
+    if not hasattr(os, "fork"):
+        print("The pre-fork server requires os.fork(), which isn't available on this platform. Run main.py for each client instead.")
+        return
+
+    print("------------------------------")
+    print("--- CHROMA-CHORD-GENERATOR ---")
+    print("------------------------------")
+    print("---- Press ctrl+c to exit ----")
+    print("------------------------------")
+
+    # Load and warm up the model once, in the parent
+    start_time = time.time()
+    backend = load_backend(args)
+    load_secs = time.time() - start_time
+    warm_up_start_time = time.time()
+    backend(np.zeros((1, 8, 13)))
+    warm_up_ms = (time.time() - warm_up_start_time) * 1000
+    print(f"Took {round(load_secs, 3)} secs to load {round(backend.get_num_bytes() / 2**20, 2)} MB of weights from {args.weights_path or args.model_path}, and {round(warm_up_ms, 3)} ms to warm up")
+
+    # Move the objects created so far out of reach of the garbage collector, which would otherwise
+    # write to their headers in each worker, copying the pages they are on
+    gc.collect()
+    gc.freeze()
+
+    # Fork the workers, each telling the parent when it is ready through a pipe
+    worker_pids = []
+    ready_fds = []
+    for worker_index in range(args.workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            exit_code = 0
+            try:
+                run_worker(worker_index, backend, args, write_fd)
+            except KeyboardInterrupt:
+                pass
+            except BaseException as e:
+                print(f"Worker {worker_index} stopped: {e}")
+                exit_code = 1
+            finally:
+                # Skip the parent's exit handlers, which aren't the worker's to run
+                sys.stdout.flush()
+                os._exit(exit_code)
+        os.close(write_fd)
+        worker_pids.append(pid)
+        ready_fds.append(read_fd)
+
+    for read_fd in ready_fds:
+        os.read(read_fd, 1)
+        os.close(read_fd)
+    print(f"Started {args.workers} workers in {round(time.time() - start_time, 3)} secs, sharing one copy of the weights")
+    print_memory_report(worker_pids, args)
+
+    try:
+        for _ in worker_pids:
+            os.wait()
+    except KeyboardInterrupt:
+        print("-----")
+        print("Exiting...")
+        print("-----")
+    finally:
+        for pid in worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
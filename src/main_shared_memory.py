@@ -0,0 +1,72 @@
+# CHROMA CHORD GENERATOR - SHARED MEMORY TRANSPORT
+# --------------------------
+# This script runs the real-time chord generation for clients on the same host,
+# receiving melody notes and returning chords through shared memory ring buffers
+# instead of OSC. Clients connect using SharedMemoryClient from chord_generation_utils:
+#
+#   python ./src/main_shared_memory.py [<name> [<seed> [<session_log_path>]]]
+# --------------------------
+
+import os
+import sys
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+from chord_generation_utils.chord_generator import ChordGenerator
+from chord_generation_utils.shared_memory_handler import SharedMemoryHandler
+from chord_generation_utils.session_log import SessionLogWriter
+
+def main() -> None:
+
+    session_log = None
+
+    try:
+
+        if len(sys.argv) > 4:
+            print("Expected 0 to 3 arguments: [<name> [<seed> [<session_log_path>]]]")
+            return
+        name = sys.argv[1] if len(sys.argv) >= 2 else "chroma_chord_generator"
+        seed = int(sys.argv[2]) if len(sys.argv) >= 3 else None
+        session_log_path = sys.argv[3] if len(sys.argv) == 4 else None
+
+        print("------------------------------")
+        print("--- CHROMA-CHORD-GENERATOR ---")
+        print("------------------------------")
+        print("---- Press ctrl+c to exit ----")
+        print("------------------------------")
+
+        # Initialise the chord generator object, with the same settings as main.py
+        chord_generator = ChordGenerator(
+            model_path="./src/trained_model/chroma_histogram_generator_model",
+            sequence_length=8,
+            tonic=0,
+            chord_note_threshold=0.14,
+            threshold_input_sequence=True,
+            update_direction="append",
+            seed=seed
+        )
+
+        # Log the session if a path is given
+        if session_log_path is not None:
+            session_log = SessionLogWriter(session_log_path, chord_generator)
+            print(f"Logging session with seed {chord_generator.SEED} to {session_log_path}")
+
+        # Initialise the shared memory handler, which blocks while serving clients
+        shared_memory_handler = SharedMemoryHandler(
+            chord_generator,
+            name=name,
+            verbose=True,
+            session_log=session_log
+        )
+
+    except KeyboardInterrupt:
+        print("-----")
+        print("Exiting...")
+        print("-----")
+
+    finally:
+        if session_log is not None:
+            session_log.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,183 @@
+# CHROMA CHORD GENERATOR - SESSION REPLAY
+# --------------------------
+# This script replays a session log written by main.py through a ChordGenerator
+# as fast as possible, with the session's settings and seed, and diffs the
+# replayed chords against the logged ones. It also compares the chord generation
+# times, so performance changes can be checked against reference sessions:
+#
+#   python src/replay_session.py <session log> [--model-path <model>] [--output-log <path>]
+#
+# Models swapped in during the session are loaded as they were, unless --model-path
+# is given, in which case the whole session is replayed with that model.
+#
+# Exits with code 1 if any replayed chord differs from the logged one.
+# --------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+import numpy as np
+
+from chord_generation_utils.chord_generator import ChordGenerator
+from chord_generation_utils.session_log import SessionLogReader, SessionLogWriter, NOTE, SET_TONIC, SET_CHORD_NOTE_THRESHOLD, SET_THRESHOLD_INPUT_SEQUENCE, CHORD, MODEL_SWAP
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay a session log through a ChordGenerator and diff the chords.")
+    parser.add_argument("log_path", help="Path of the session log to replay.")
+    parser.add_argument("--model-path", default=None, help="Model to replay the whole session with, ignoring models swapped in during it. By default the models the session was logged with.")
+    parser.add_argument("--output-log", default=None, help="Also write the replayed session to this log, e.g. as a new reference.")
+    parser.add_argument("--report-path", default=None, help="Also write the replay report to this JSON file.")
+
+    return parser.parse_args(argv)
+
+def get_latency_stats(latencies_ms: list[float]) -> dict:
+    if len(latencies_ms) == 0:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    return {
+        "mean_ms": float(np.mean(latencies_ms)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(np.max(latencies_ms))
+    }
+
+def replay_session(log_reader: SessionLogReader, chord_generator: ChordGenerator, output_log: SessionLogWriter = None, follow_model_swaps: bool = True) -> dict:
+    """
+    Replay the records of a session log through chord_generator, which should have the session's settings and seed,
+    comparing each generated chord to the logged one. Models swapped in during the session are loaded as they were
+    if follow_model_swaps, else skipped. Returns a report of the differences and generation times.
+    """
+
+    note = None
+    num_chords = 0
+    skipped_model_swaps = []
+    histogram_mismatches = []
+    voicing_mismatches = []
+    max_histogram_difference = 0.0
+    logged_latencies_ms = []
+    replay_latencies_ms = []
+
+    replay_start_time = time.perf_counter()
+
+    for record_type, _, values in log_reader:
+
+        # Hold each received note until its chord record, as a model swapped in before the chord is logged in between
+        if record_type == NOTE:
+            note = values
+            if output_log is not None:
+                output_log.log_note(*note)
+
+        # Generate the chord of the received note and compare it to the logged one
+        elif record_type == CHORD:
+            melody_note_midi_number, intensity = note
+            chord_generation_start_time = time.perf_counter()
+            chord = chord_generator.get_chord(melody_note_midi_number)
+            chord_generation_ms = (time.perf_counter() - chord_generation_start_time) * 1000
+            voiced_chord = chord.get_voiced_chord(intensity=intensity)
+            replay_latencies_ms.append(chord_generation_ms)
+
+            logged_ms, logged_histogram, logged_voiced_chord = values
+            if output_log is not None:
+                output_log.log_chord(chord, voiced_chord, chord_generation_ms)
+
+            histogram = np.asarray(chord.get_unthresholded_chroma_histogram(), dtype=np.float64)
+            if not np.array_equal(histogram, logged_histogram):
+                histogram_mismatches.append(num_chords)
+                max_histogram_difference = max(max_histogram_difference, float(np.abs(histogram - logged_histogram).max()))
+            if voiced_chord != logged_voiced_chord:
+                voicing_mismatches.append(num_chords)
+
+            logged_latencies_ms.append(logged_ms)
+            num_chords += 1
+
+        # Load models swapped in during the session, before the first chord generated with them
+        elif record_type == MODEL_SWAP:
+            if not follow_model_swaps:
+                skipped_model_swaps.append(values[0])
+                continue
+            chord_generator.load_model(values[0])
+            if output_log is not None:
+                output_log.log_model_swap(values[0])
+
+        # Apply parameter changes as they happened in the session
+        elif record_type == SET_TONIC:
+            chord_generator.set_tonic(values[0])
+            if output_log is not None:
+                output_log.log_tonic(values[0])
+        elif record_type == SET_CHORD_NOTE_THRESHOLD:
+            chord_generator.set_chord_note_threshold(values[0])
+            if output_log is not None:
+                output_log.log_chord_note_threshold(values[0])
+        elif record_type == SET_THRESHOLD_INPUT_SEQUENCE:
+            chord_generator.set_threshold_input_sequence(bool(values[0]))
+            if output_log is not None:
+                output_log.log_threshold_input_sequence(bool(values[0]))
+
+    replay_secs = time.perf_counter() - replay_start_time
+
+    return {
+        "num_chords": num_chords,
+        "skipped_model_swaps": skipped_model_swaps,
+        "histogram_mismatches": histogram_mismatches,
+        "voicing_mismatches": voicing_mismatches,
+        "max_histogram_difference": max_histogram_difference,
+        "replay_secs": replay_secs,
+        "chords_per_sec": num_chords / replay_secs if replay_secs > 0 else 0.0,
+        "logged_latency": get_latency_stats(logged_latencies_ms),
+        "replay_latency": get_latency_stats(replay_latencies_ms)
+    }
+
+def print_report(report: dict) -> None:
+    print(f"Replayed {report['num_chords']} chords in {round(report['replay_secs'], 3)} secs ({round(report['chords_per_sec'], 1)} chords/sec)")
+    print(f"Chroma histogram mismatches: {len(report['histogram_mismatches'])} (max difference {report['max_histogram_difference']})")
+    print(f"Voiced chord mismatches: {len(report['voicing_mismatches'])}")
+    if len(report["skipped_model_swaps"]) > 0:
+        print(f"Model swaps not followed, as a model was given: {report['skipped_model_swaps']}")
+    if len(report["histogram_mismatches"]) > 0:
+        print(f"First mismatching chord: {report['histogram_mismatches'][0]}")
+
+    print(f"{'chord generation':<18} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name in ["logged", "replay"]:
+        stats = report[f"{name}_latency"]
+        print(f"{name:<18} {stats['mean_ms']:>9.3f} {stats['p50_ms']:>9.3f} {stats['p99_ms']:>9.3f} {stats['max_ms']:>9.3f}")
+
+def main(argv: list[str] = None) -> None:
+    args = parse_args(argv)
+
+    log_reader = SessionLogReader(args.log_path)
+    print(f"Replaying {args.log_path} with settings: {log_reader.header}")
+
+    # Initialise the chord generator object with the session's settings and seed
+    chord_generator = ChordGenerator(
+        model_path=args.model_path if args.model_path is not None else log_reader.header["model_path"],
+        sequence_length=log_reader.header["sequence_length"],
+        tonic=log_reader.header["tonic"],
+        chord_note_threshold=log_reader.header["chord_note_threshold"],
+        threshold_input_sequence=log_reader.header["threshold_input_sequence"],
+        update_direction=log_reader.header["update_direction"],
+        seed=log_reader.header["seed"]
+    )
+
+    output_log = SessionLogWriter(args.output_log, chord_generator) if args.output_log is not None else None
+    try:
+        report = replay_session(log_reader, chord_generator, output_log, follow_model_swaps=args.model_path is None)
+    finally:
+        if output_log is not None:
+            output_log.close()
+
+    print_report(report)
+
+    if args.report_path is not None:
+        with open(args.report_path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Saved replay report to {args.report_path}")
+
+    if len(report["histogram_mismatches"]) > 0 or len(report["voicing_mismatches"]) > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
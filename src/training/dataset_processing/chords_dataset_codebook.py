@@ -0,0 +1,138 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from chord_generation_utils.chroma_codebook import ChromaCodebook
+
+CHROMA_COLUMNS = ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11"]
+MISSING_MELODY_CHROMA = 255
+
+def read_chunks(csv_path: str, chunk_rows: int = 500000) -> any:
+    """Read a chords dataset CSV shard chunk_rows rows at a time, as CorpusStatistics does."""
+    return pd.read_csv(csv_path, chunksize=chunk_rows, dtype={**{column: np.float64 for column in ["melody_chroma", *CHROMA_COLUMNS]}, "song_id": str})
+
+def fit_codebook(csv_paths: list[str], max_error: float = 0.02, max_codes: int = 65536, chunk_rows: int = 500000) -> ChromaCodebook:
+    """Learn a codebook from the harmony chroma histograms of chords dataset CSV shards, streamed a chunk at a time."""
+    histogram_chunks = (chunk[CHROMA_COLUMNS].to_numpy(dtype=np.float64) for csv_path in csv_paths for chunk in read_chunks(csv_path, chunk_rows))
+    return ChromaCodebook.fit_chunks(histogram_chunks, max_error=max_error, max_codes=max_codes)
+
+def compress_shard(codebook: ChromaCodebook, csv_path: str, output_path: str, keep_residuals: bool = True, chunk_rows: int = 500000) -> dict:
+    """
+    Compress a chords dataset CSV shard to a .npz file of the melody chroma of each row as a uint8, the code ID of its
+    harmony histogram, and, if keep_residuals, its int8 residuals (see ChromaCodebook.compress()), with each row's song as
+    an index into the song names and its segment ID. Rows whose histogram has NaN values are kept as such.
+    Returns the number of rows and the largest error of the decompressed histograms.
+    """
+    arrays = {"melody_chromas": [], "codes": [], "residuals": [], "nan_rows": [], "song_codes": [], "segment_ids": []}
+    song_names = {}
+    rows = 0
+    largest_error = 0.0
+
+    for chunk in read_chunks(csv_path, chunk_rows):
+        histograms = chunk[CHROMA_COLUMNS].to_numpy(dtype=np.float64)
+        is_nan_row = np.isnan(histograms).any(axis=1)
+        histograms[is_nan_row] = 0
+
+        codes, residuals = codebook.compress(histograms)
+        decompressed = codebook.decompress(codes, residuals if keep_residuals else None)
+        largest_error = max(largest_error, float(np.abs(decompressed - histograms)[~is_nan_row].max(initial=0)))
+
+        melody_chromas = chunk["melody_chroma"].to_numpy(dtype=np.float64)
+        arrays["melody_chromas"].append(np.where(np.isnan(melody_chromas), MISSING_MELODY_CHROMA, melody_chromas).astype(np.uint8))
+        arrays["codes"].append(codes)
+        arrays["residuals"].append(residuals)
+        arrays["nan_rows"].append(np.flatnonzero(is_nan_row) + rows)
+        if "song_id" in chunk.columns:
+            arrays["song_codes"].append(np.array([song_names.setdefault(song_name, len(song_names)) for song_name in chunk["song_id"]], dtype=np.int32))
+        if "segment_id" in chunk.columns:
+            arrays["segment_ids"].append(chunk["segment_id"].to_numpy(dtype=np.int32))
+        rows += len(chunk)
+
+    if not keep_residuals:
+        del arrays["residuals"]
+    arrays = {name: np.concatenate(chunks) for name, chunks in arrays.items() if len(chunks) > 0}
+    if song_names:
+        arrays["song_names"] = np.array(list(song_names), dtype=str)
+
+    np.savez_compressed(output_path, **arrays)
+    return {"rows": rows, "largest_error": largest_error}
+
+def decompress_shard(codebook: ChromaCodebook, npz_path: str, csv_path: str) -> int:
+    """Restore a chords dataset CSV shard from a .npz file written by compress_shard(), returning the number of rows."""
+    with np.load(npz_path, allow_pickle=False) as arrays:
+        histograms = codebook.decompress(arrays["codes"], arrays["residuals"] if "residuals" in arrays else None)
+        histograms[arrays["nan_rows"]] = np.nan
+
+        melody_chromas = arrays["melody_chromas"].astype(np.float64)
+        melody_chromas[arrays["melody_chromas"] == MISSING_MELODY_CHROMA] = np.nan
+
+        dataset = pd.DataFrame(histograms, columns=CHROMA_COLUMNS)
+        dataset.insert(0, "melody_chroma", pd.array(melody_chromas, dtype="Int64") if not np.isnan(melody_chromas).any() else melody_chromas)
+        if "song_codes" in arrays:
+            dataset["song_id"] = arrays["song_names"][arrays["song_codes"]]
+        if "segment_ids" in arrays:
+            dataset["segment_id"] = arrays["segment_ids"]
+
+    dataset.to_csv(csv_path, index=False)
+    return len(dataset)
+
+def get_output_path(input_path: str, output_dir: str, extension: str) -> str:
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(input_path))[0] + extension)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Learn a codebook of the chroma histograms of chords dataset shards, and store shards as compact codes plus residuals.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fit_parser = subparsers.add_parser("fit", help="Learn a codebook from CSV shards.")
+    fit_parser.add_argument("shard_paths", nargs="+", help="Chords dataset CSV shards, e.g. ./chords_datasets/chords_dataset_idx-*.csv")
+    fit_parser.add_argument("--codebook-path", required=True, help="Path to save the codebook .npz to.")
+    fit_parser.add_argument("--max-error", type=float, default=0.02, help="Largest difference of any chroma amount of the shards from its codeword.")
+    fit_parser.add_argument("--max-codes", type=int, default=65536, help="Fail if more codes than this are needed for the max error.")
+    fit_parser.add_argument("--chunk-rows", type=int, default=500000, help="Rows read from a shard at a time.")
+
+    compress_parser = subparsers.add_parser("compress", help="Compress CSV shards to .npz files of codes and residuals.")
+    compress_parser.add_argument("shard_paths", nargs="+", help="Chords dataset CSV shards.")
+    compress_parser.add_argument("--codebook-path", required=True, help="Codebook .npz learnt with fit.")
+    compress_parser.add_argument("--output-dir", required=True, help="Directory to write the compressed .npz shards to.")
+    compress_parser.add_argument("--no-residuals", action="store_true", help="Only keep the code of each histogram, restoring it to its codeword.")
+    compress_parser.add_argument("--chunk-rows", type=int, default=500000, help="Rows read from a shard at a time.")
+
+    decompress_parser = subparsers.add_parser("decompress", help="Restore CSV shards from compressed .npz shards.")
+    decompress_parser.add_argument("shard_paths", nargs="+", help="Compressed .npz shards.")
+    decompress_parser.add_argument("--codebook-path", required=True, help="Codebook .npz the shards were compressed with.")
+    decompress_parser.add_argument("--output-dir", required=True, help="Directory to write the CSV shards to.")
+
+    args = parser.parse_args()
+    start_time = time.perf_counter()
+
+    if args.command == "fit":
+        codebook = fit_codebook(args.shard_paths, max_error=args.max_error, max_codes=args.max_codes, chunk_rows=args.chunk_rows)
+        codebook.save(args.codebook_path)
+        print(f"Learnt {len(codebook)} codes with a max error of {codebook.MAX_ERROR} in {round(time.perf_counter() - start_time, 2)} secs")
+        print(f"Codebook saved at: {args.codebook_path}")
+
+    elif args.command == "compress":
+        codebook = ChromaCodebook.load(args.codebook_path)
+        os.makedirs(args.output_dir, exist_ok=True)
+        csv_bytes = 0
+        npz_bytes = 0
+        for shard_path in args.shard_paths:
+            output_path = get_output_path(shard_path, args.output_dir, ".npz")
+            report = compress_shard(codebook, shard_path, output_path, keep_residuals=not args.no_residuals, chunk_rows=args.chunk_rows)
+            csv_bytes += os.path.getsize(shard_path)
+            npz_bytes += os.path.getsize(output_path)
+            print(f"{shard_path}: {report['rows']} rows, {round(os.path.getsize(shard_path) / 1024**2, 2)} MB -> {round(os.path.getsize(output_path) / 1024**2, 2)} MB, largest error {report['largest_error']:.5f}")
+        print(f"Compressed {len(args.shard_paths)} shards from {round(csv_bytes / 1024**2, 2)} MB to {round(npz_bytes / 1024**2, 2)} MB ({round(csv_bytes / max(npz_bytes, 1), 1)}x) in {round(time.perf_counter() - start_time, 2)} secs")
+
+    else:
+        codebook = ChromaCodebook.load(args.codebook_path)
+        os.makedirs(args.output_dir, exist_ok=True)
+        for shard_path in args.shard_paths:
+            output_path = get_output_path(shard_path, args.output_dir, ".csv")
+            rows = decompress_shard(codebook, shard_path, output_path)
+            print(f"{shard_path}: {rows} rows restored to {output_path}")
\ No newline at end of file
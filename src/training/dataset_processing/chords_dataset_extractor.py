@@ -0,0 +1,327 @@
+import pretty_midi as pm
+import numpy as np
+import pandas as pd
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import timedelta
+from midi_file_processor import MIDIFileProcessor
+from midi_note_loader import MIDINotes, load_midi_notes
+from extraction_cache import ExtractionCache
+
+# Key classifier of each key prediction worker process, set once per worker by its initializer
+_worker_key_classifier = None
+
+def _init_key_prediction_worker(key_classifier: any) -> None:
+    global _worker_key_classifier
+    _worker_key_classifier = key_classifier
+
+def _predict_key_numbers(histograms: np.ndarray) -> np.ndarray:
+    return _worker_key_classifier.predict(histograms)
+
+class ChordsDatasetExtractor:
+    def __init__(self,
+                 processor: MIDIFileProcessor,
+                 cache: ExtractionCache = None,
+                 key_prediction_batch_size: int = 256,
+                 num_key_prediction_workers: int = 0
+                 ) -> None:
+
+        """
+        Drives a MIDIFileProcessor over a directory of MIDI files to build a chords dataset.
+
+        If a cache is given, the result of each extraction stage is stored per file, keyed by the file's
+        content hash and the processor configuration for that stage. Unchanged files are then skipped
+        entirely on re-runs, and only the stages whose configuration changed are recomputed.
+
+        During extract(), files without key signature metadata are set aside until key_prediction_batch_size
+        of them are pending, then their key signatures are predicted in one batch. With num_key_prediction_workers
+        above 0, each batch is split across that many worker processes, which receive the key classifier once on start.
+
+        If the processor has a profiler, the extractor also records loading, key prediction and DataFrame assembly
+        stages in it, attributes each file's time to the file, and records skipped files by exception class.
+
+        Parameters:
+            processor:                      MIDIFileProcessor. The processor used to extract chords from each file.
+            cache:                          ExtractionCache (default None). Optional cache of per-file stage results.
+            key_prediction_batch_size:      int (default 256). Number of files to predict key signatures for at once.
+            num_key_prediction_workers:     int (default 0). Number of worker processes for key prediction, 0 to predict in this process.
+        """
+
+        self.processor = processor
+        self.cache = cache
+
+        self.KEY_PREDICTION_BATCH_SIZE = key_prediction_batch_size
+        self.NUM_KEY_PREDICTION_WORKERS = num_key_prediction_workers
+        self.__key_prediction_pool = None
+
+        self.CHROMA_COLUMNS = ["melody_chroma", "0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11"]
+
+        # song_id and segment_id record where each song and key signature segment starts and ends,
+        # so that training sequences are never built across unrelated bars
+        self.DF_COLUMNS = self.CHROMA_COLUMNS + ["song_id", "segment_id"]
+
+        self.EXCLUDED = [".DS_Store", "midiindx.htm", ".gitattributes", "LICENSE", "README.md"]
+
+    def __profile(self, stage: str) -> any:
+        """Time the with block as the given stage if the processor has a profiler, otherwise do nothing."""
+        if self.processor.profiler is None:
+            return nullcontext()
+        return self.processor.profiler.stage(stage)
+
+    def __profile_file(self, song_id: str) -> any:
+        if self.processor.profiler is None:
+            return nullcontext()
+        return self.processor.profiler.file(song_id)
+
+    def __finish_profiled_file(self, song_id: str, exception: Exception = None) -> None:
+        if self.processor.profiler is not None:
+            self.processor.profiler.finish_file(song_id, exception)
+
+    def __get_cached(self, file_hash: str, stage: str, fingerprints: dict[str, str]) -> dict[str, np.ndarray] | None:
+        if self.cache is None:
+            return None
+        with self.__profile("cache.get"):
+            return self.cache.get(file_hash, stage, fingerprints[stage])
+
+    def __put_cached(self, file_hash: str, stage: str, fingerprints: dict[str, str], arrays: dict[str, np.ndarray]) -> None:
+        if self.cache is not None:
+            with self.__profile("cache.put"):
+                self.cache.put(file_hash, stage, fingerprints[stage], arrays)
+
+    def __start_file(self, midi_file_path: str) -> dict[str, any]:
+        """
+        Run the extraction stages of a file up to key signatures, returning the file's extraction state.
+        If the file's key signature has to be predicted, its pitch class histogram is added to the state instead.
+        """
+
+        state = {
+            "fingerprints": self.processor.get_stage_fingerprints(),
+            "file_hash": None
+        }
+        if self.cache is not None:
+            with self.__profile("cache.hash"):
+                state["file_hash"] = ExtractionCache.hash_file(midi_file_path)
+        fingerprints, file_hash = state["fingerprints"], state["file_hash"]
+
+        # Skip the file entirely if its chords are cached for the current configuration
+        cached_chords = self.__get_cached(file_hash, "chords", fingerprints)
+        if cached_chords is not None:
+            print(f"    Loaded {cached_chords['chords'].shape[0]} chroma histograms from cache.")
+            state["chords"], state["segment_ids"] = cached_chords["chords"], cached_chords["segment_ids"]
+            return state
+
+        # Load the file's notes as arrays, skipping MIDI parsing if already cached
+        cached_notes = self.__get_cached(file_hash, "notes", fingerprints)
+        with self.__profile("notes"):
+            if cached_notes is not None:
+                midi_notes = MIDINotes.from_arrays(cached_notes)
+            else:
+                midi_notes = load_midi_notes(midi_file_path)
+                self.__put_cached(file_hash, "notes", fingerprints, midi_notes.to_arrays())
+        state["midi_notes"] = midi_notes
+        if self.processor.profiler is not None:
+            self.processor.profiler.add_count("instruments", len(midi_notes.instruments))
+            self.processor.profiler.add_count("notes", sum(instrument.notes.size for instrument in midi_notes.instruments))
+
+        # Find melody instrument, cached as its index in the file's instrument list
+        cached_melody = self.__get_cached(file_hash, "melody", fingerprints)
+        if cached_melody is not None:
+            state["melody_instrument"] = midi_notes.instruments[int(cached_melody["instrument_idx"])]
+        else:
+            state["melody_instrument"] = self.processor.get_melody_instrument(midi_notes)
+            self.__put_cached(file_hash, "melody", fingerprints, {
+                "instrument_idx": np.array(midi_notes.instruments.index(state["melody_instrument"]))
+            })
+
+        # Get key signatures, cached as rows of [key_number, time], unless they have to be predicted
+        cached_key_signatures = self.__get_cached(file_hash, "key_signatures", fingerprints)
+        if cached_key_signatures is not None:
+            state["key_signatures"] = [pm.KeySignature(int(key_number), float(ks_time)) for key_number, ks_time in cached_key_signatures["key_signatures"]]
+        elif self.processor.needs_key_signature_prediction(midi_notes):
+            with self.__profile("key_signatures.histogram"):
+                state["key_signature_histogram"] = self.processor.get_key_signature_histogram(midi_notes)
+        else:
+            state["key_signatures"] = self.processor.get_key_signatures(midi_notes)
+
+        return state
+
+    def __finish_file(self, state: dict[str, any], predicted_key_signature: pm.KeySignature = None) -> tuple[np.ndarray, np.ndarray]:
+        """Run the remaining extraction stages of a file started with __start_file(), returning its chords and segment ids."""
+
+        if "chords" in state:
+            return state["chords"], state["segment_ids"]
+
+        fingerprints, file_hash, midi_notes = state["fingerprints"], state["file_hash"], state["midi_notes"]
+
+        # Get key signatures from the file or the prediction made for it, if not loaded from cache
+        if "key_signatures" not in state:
+            state["key_signatures"] = self.processor.get_key_signatures(midi_notes, predicted_key_signature)
+            self.__put_cached(file_hash, "key_signatures", fingerprints, {
+                "key_signatures": np.array([[ks.key_number, ks.time] for ks in state["key_signatures"]], dtype=float).reshape(-1, 2)
+            })
+
+        # Get chords
+        midi_file_chords_array, midi_file_segment_ids = self.processor.get_chords_as_array(midi_notes, state["melody_instrument"], state["key_signatures"], return_segment_ids=True)
+        self.__put_cached(file_hash, "chords", fingerprints, {
+            "chords": midi_file_chords_array,
+            "segment_ids": midi_file_segment_ids
+        })
+
+        return midi_file_chords_array, midi_file_segment_ids
+
+    def get_chords_from_file(self, midi_file_path: str) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the (x,13) chords array and (x,) segment ids for the given MIDI file, reusing cached stages where possible."""
+        return self.__finish_file(self.__start_file(midi_file_path))
+
+    def __get_chords_df(self, midi_file_chords_array: np.ndarray, midi_file_segment_ids: np.ndarray, song_id: str) -> pd.DataFrame:
+        with self.__profile("dataframe"):
+            midi_file_chords_df = pd.DataFrame.from_records(midi_file_chords_array, columns=self.CHROMA_COLUMNS, coerce_float=True)
+            midi_file_chords_df["song_id"] = song_id
+            midi_file_chords_df["segment_id"] = midi_file_segment_ids
+        return midi_file_chords_df
+
+    def __predict_key_signatures(self, histograms: np.ndarray) -> list[pm.KeySignature]:
+        """Predict key signatures for a batch of histograms, split across the worker processes if enabled."""
+
+        if self.NUM_KEY_PREDICTION_WORKERS <= 0:
+            return self.processor.predict_key_signatures(histograms)
+
+        # Start the workers on first use, passing the classifier once to each
+        if self.__key_prediction_pool is None:
+            self.__key_prediction_pool = ProcessPoolExecutor(
+                max_workers=self.NUM_KEY_PREDICTION_WORKERS,
+                initializer=_init_key_prediction_worker,
+                initargs=(self.processor.key_classifier,))
+
+        histograms_chunks = np.array_split(histograms, min(self.NUM_KEY_PREDICTION_WORKERS, histograms.shape[0]))
+        key_numbers = np.concatenate(list(self.__key_prediction_pool.map(_predict_key_numbers, histograms_chunks)))
+        return [pm.KeySignature(int(key_number), 0) for key_number in key_numbers]
+
+    def __finish_pending_files(self, pending_files: list[tuple[int, str, dict]], midi_file_chords_dfs: list[pd.DataFrame]) -> int:
+        """
+        Predict the key signatures of the pending files in one batch, then finish their extraction,
+        storing each DataFrame at its file's index in midi_file_chords_dfs. Returns the number of files finished.
+        """
+
+        if len(pending_files) == 0:
+            return 0
+
+        print(f"  Predicting key signatures of {len(pending_files)} files...")
+        histograms = np.stack([state["key_signature_histogram"] for _, _, state in pending_files])
+        with self.__profile("key_prediction_batch"):
+            predicted_key_signatures = self.__predict_key_signatures(histograms)
+
+        files_finished = 0
+        for (df_idx, song_id, state), predicted_key_signature in zip(pending_files, predicted_key_signatures):
+            try:
+                with self.__profile_file(song_id):
+                    midi_file_chords_array, midi_file_segment_ids = self.__finish_file(state, predicted_key_signature)
+                    midi_file_chords_dfs[df_idx] = self.__get_chords_df(midi_file_chords_array, midi_file_segment_ids, song_id)
+                files_finished += 1
+                self.__finish_profiled_file(song_id)
+            except Exception as e:
+                print(f"    Error processing {song_id}: {e.__class__}, skipping file.")
+                self.__finish_profiled_file(song_id, e)
+
+        pending_files.clear()
+        return files_finished
+
+    def get_chords_df_from_file(self, midi_file_path: str, song_id: str) -> pd.DataFrame:
+        """Returns the chords of the given MIDI file as a DataFrame with self.DF_COLUMNS."""
+        midi_file_chords_array, midi_file_segment_ids = self.get_chords_from_file(midi_file_path)
+        return self.__get_chords_df(midi_file_chords_array, midi_file_segment_ids, song_id)
+
+    def extract(self, dataset_root_dir: str, af_start_idx: int = 0, af_end_idx: int = None) -> pd.DataFrame:
+        """
+        Extract the chords of all MIDI files in the artist folders af_start_idx to af_end_idx (exclusive)
+        of dataset_root_dir, which is expected to be laid out as <artist folder>/<MIDI file>.
+        """
+
+        start_time = time.time()
+
+        artist_folders = os.listdir(dataset_root_dir)
+        artist_folders_count = len(artist_folders)
+
+        if af_end_idx is None:
+            af_end_idx = artist_folders_count
+
+        midi_files_processed = 0
+
+        # Collect per-file DataFrames and concatenate once at the end. Files waiting for
+        # key prediction hold a None slot until their batch is predicted, so file order is kept
+        midi_file_chords_dfs = []
+        pending_files = []
+
+        af_subsection = artist_folders[af_start_idx:af_end_idx]
+
+        try:
+            for af_idx, artist_folder in enumerate(af_subsection):
+                artist_folder_path = os.path.join(dataset_root_dir, artist_folder)
+                # Skip non-directories and excluded files
+                if artist_folder in self.EXCLUDED or not os.path.isdir(artist_folder_path):
+                    continue
+                print(f"Artist folder {af_idx+af_start_idx+1} of {artist_folders_count}: {artist_folder}")
+
+                artist_midi_files = os.listdir(artist_folder_path)
+                artist_midi_files_count = len(artist_midi_files)
+
+                # Loop through files in artist folder
+                for mf_idx, midi_file_name in enumerate(artist_midi_files):
+                    song_id = f"{artist_folder}/{midi_file_name}"
+                    try:
+                        if not midi_file_name.lower().endswith(".mid"):
+                            continue
+                        print(f"  MIDI file {mf_idx+1} of {artist_midi_files_count}: {midi_file_name}")
+                        midi_file_path = os.path.join(artist_folder_path, midi_file_name)
+
+                        with self.__profile_file(song_id):
+                            state = self.__start_file(midi_file_path)
+
+                            # Set files that need key prediction aside until a full batch is pending
+                            if "key_signature_histogram" in state:
+                                print("    No valid key signature, queued for key prediction.")
+                                pending_files.append((len(midi_file_chords_dfs), song_id, state))
+                                midi_file_chords_dfs.append(None)
+                                continue
+
+                            midi_file_chords_array, midi_file_segment_ids = self.__finish_file(state)
+                            midi_file_chords_dfs.append(self.__get_chords_df(midi_file_chords_array, midi_file_segment_ids, song_id))
+
+                        # Update iterator for counting total files processed
+                        midi_files_processed += 1
+                        self.__finish_profiled_file(song_id)
+
+                    except Exception as e:
+                        print(f"    Error processing {midi_file_name}: {e.__class__}, skipping file.")
+                        self.__finish_profiled_file(song_id, e)
+
+                    finally:
+                        if len(pending_files) >= self.KEY_PREDICTION_BATCH_SIZE:
+                            midi_files_processed += self.__finish_pending_files(pending_files, midi_file_chords_dfs)
+
+                print("-----")
+
+            # Predict the last, partial batch
+            midi_files_processed += self.__finish_pending_files(pending_files, midi_file_chords_dfs)
+
+        finally:
+            if self.__key_prediction_pool is not None:
+                self.__key_prediction_pool.shutdown()
+                self.__key_prediction_pool = None
+
+        midi_file_chords_dfs = [df for df in midi_file_chords_dfs if df is not None]
+        if len(midi_file_chords_dfs) > 0:
+            chords_df = pd.concat(midi_file_chords_dfs, ignore_index=True)
+        else:
+            chords_df = pd.DataFrame(columns=self.DF_COLUMNS)
+
+        print(f"COMPLETED dataset processing from artist folder {af_start_idx}-{af_end_idx-1} of {artist_folders_count} in {timedelta(seconds=(round(time.time() - start_time, 3)))}")
+        print(f"Total MIDI files processed: {midi_files_processed}")
+        if self.cache is not None:
+            print(f"Cache hits: {self.cache.hits}, misses: {self.cache.misses}, size: {round(self.cache.get_size() / 1024**2, 1)} MB")
+        if self.processor.profiler is not None:
+            self.processor.profiler.print_report()
+
+        return chords_df
\ No newline at end of file
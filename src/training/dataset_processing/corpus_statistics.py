@@ -0,0 +1,345 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from itertools import repeat
+from extraction_cache import ExtractionCache
+
+def _compute_shard_arrays(shard_path: str, chord_note_threshold: float, chunk_rows: int) -> dict[str, np.ndarray]:
+    """Compute the statistics of one shard in a worker process, returned as arrays to merge in the main process."""
+    corpus_statistics = CorpusStatistics(chord_note_threshold=chord_note_threshold, chunk_rows=chunk_rows)
+    corpus_statistics.update_shard(shard_path)
+    return corpus_statistics.to_arrays()
+
+class CorpusStatistics:
+    def __init__(self,
+                 chord_note_threshold: float = 0.14,
+                 chunk_rows: int = 500000
+                 ) -> None:
+
+        """
+        Statistics of a chords dataset, computed in one streaming pass over its shards, CSV files read chunk_rows rows
+        at a time or memory-mapped .npy files, so memory stays bounded however large the dataset is. All statistics are
+        sums and counts, so those of separate shards are merged exactly by adding them (see merge()), which lets shards
+        be computed in parallel and cached separately (see compute_shards()).
+
+        - Per-chroma sums and sums of squares of the harmony chroma histograms, as plotted in the extraction notebook.
+        - The distribution of melody chromas.
+        - Histogram sparsity: the number of non-zero chromas, and of chord notes above chord_note_threshold, per histogram.
+        - Chords, as the set of chord notes above chord_note_threshold, and the transitions between consecutive chords
+          of a key signature segment, counted sparsely, as only a small share of the 4096 x 4096 possible ones occur.
+        - Transitions between the strongest chroma of consecutive histograms, as a 12 x 12 matrix.
+
+        Rows with NaN values, and empty bars without melody or harmony, are counted and left out of everything else.
+        A segment's rows may be split between chunks, as the last row of each chunk is carried over to the next.
+
+        Parameters:
+            chord_note_threshold:   float (default 0.14). Share of a histogram above which a chroma is a chord note, as when generating chords.
+            chunk_rows:             int (default 500000). Rows read from a shard at a time.
+        """
+
+        self.CHORD_NOTE_THRESHOLD = chord_note_threshold
+        self.CHUNK_ROWS = chunk_rows
+
+        self.CHROMA_COLUMNS = ["melody_chroma", "0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11"]
+        self.CHROMA_LABELS = ["T", "m2", "M2", "m3", "M3", "P4", "a4", "P5", "m6", "M6", "m7", "M7"]
+        self.COUNT_NAMES = ["rows", "nan_rows", "empty_rows", "songs", "segments", "transitions", "chord_changes"]
+        self.NUM_CHORDS = 2**12
+
+        self.reset()
+
+    def reset(self) -> None:
+        self.counts = {count_name: 0 for count_name in self.COUNT_NAMES}
+        self.chroma_sums = np.zeros(12)
+        self.chroma_squared_sums = np.zeros(12)
+        self.chroma_note_counts = np.zeros(12, dtype=np.int64)
+        self.melody_chroma_counts = np.zeros(12, dtype=np.int64)
+        self.nonzero_chroma_counts = np.zeros(13, dtype=np.int64)
+        self.chord_note_counts = np.zeros(13, dtype=np.int64)
+        self.chord_counts = np.zeros(self.NUM_CHORDS, dtype=np.int64)
+        self.strongest_chroma_transitions = np.zeros((12, 12), dtype=np.int64)
+
+        # Sparse chord transition counts, keyed by previous chord * NUM_CHORDS + next chord, kept sorted by key
+        self.chord_transition_keys = np.zeros(0, dtype=np.int64)
+        self.chord_transition_counts = np.zeros(0, dtype=np.int64)
+
+        # Song, segment, chord and strongest chroma of the last row seen, continued by the next chunk of the same shard
+        self.__previous_row = None
+
+    def update(self, chromas: np.ndarray[float], song_ids: np.ndarray = None, segment_ids: np.ndarray = None) -> None:
+        """
+        Add a chunk of consecutive rows of a shard, each the melody chroma followed by the 12 harmony chromas, with the song
+        and segment of each row, or None for datasets without them, whose rows are all treated as one segment.
+        """
+        chromas = np.asarray(chromas, dtype=np.float64).reshape(-1, 13)
+        if song_ids is None:
+            song_ids = np.zeros(len(chromas), dtype=np.int64)
+        if segment_ids is None:
+            segment_ids = np.zeros(len(chromas), dtype=np.int64)
+
+        # Leave out rows with NaN values and empty bars
+        nan_rows = np.isnan(chromas).any(axis=1)
+        empty_rows = ~nan_rows & (chromas[:, 1:].sum(axis=1) == 0)
+        kept = ~(nan_rows | empty_rows)
+        self.counts["nan_rows"] += int(np.count_nonzero(nan_rows))
+        self.counts["empty_rows"] += int(np.count_nonzero(empty_rows))
+        if not kept.any():
+            return
+
+        melody_chromas = chromas[kept, 0].astype(np.int64) % 12
+        harmonies = chromas[kept, 1:]
+        song_ids = np.asarray(song_ids)[kept]
+        segment_ids = np.asarray(segment_ids)[kept]
+        self.counts["rows"] += len(harmonies)
+
+        # Per-chroma sums, the melody distribution and sparsity
+        self.chroma_sums += harmonies.sum(axis=0)
+        self.chroma_squared_sums += np.square(harmonies).sum(axis=0)
+        self.melody_chroma_counts += np.bincount(melody_chromas, minlength=12)
+        self.nonzero_chroma_counts += np.bincount(np.count_nonzero(harmonies, axis=1), minlength=13)
+
+        # Chords as 12-bit masks of their chord notes
+        chord_notes = harmonies > self.CHORD_NOTE_THRESHOLD
+        self.chroma_note_counts += chord_notes.sum(axis=0)
+        self.chord_note_counts += np.bincount(chord_notes.sum(axis=1), minlength=13)
+        chords = chord_notes @ (1 << np.arange(12, dtype=np.int64))
+        self.chord_counts += np.bincount(chords, minlength=self.NUM_CHORDS)
+        strongest_chromas = harmonies.argmax(axis=1)
+
+        # Find the rows starting a song or segment, the first row continuing the previous chunk's last row if from the same segment
+        song_starts = np.ones(len(harmonies), dtype=bool)
+        song_starts[1:] = song_ids[1:] != song_ids[:-1]
+        segment_starts = song_starts.copy()
+        segment_starts[1:] |= segment_ids[1:] != segment_ids[:-1]
+        if self.__previous_row is not None:
+            previous_song_id, previous_segment_id, previous_chord, previous_strongest_chroma = self.__previous_row
+            song_starts[0] = song_ids[0] != previous_song_id
+            segment_starts[0] = song_starts[0] or segment_ids[0] != previous_segment_id
+            chords_from = np.append(previous_chord, chords[:-1])
+            strongest_chromas_from = np.append(previous_strongest_chroma, strongest_chromas[:-1])
+            chords_to, strongest_chromas_to, continues = chords, strongest_chromas, ~segment_starts
+        else:
+            chords_from, strongest_chromas_from = chords[:-1], strongest_chromas[:-1]
+            chords_to, strongest_chromas_to, continues = chords[1:], strongest_chromas[1:], ~segment_starts[1:]
+        self.counts["songs"] += int(np.count_nonzero(song_starts))
+        self.counts["segments"] += int(np.count_nonzero(segment_starts))
+
+        # Count the transitions between consecutive rows of the same segment
+        chords_from, chords_to = chords_from[continues], chords_to[continues]
+        self.counts["transitions"] += int(chords_from.size)
+        self.counts["chord_changes"] += int(np.count_nonzero(chords_from != chords_to))
+        transition_keys, transition_counts = np.unique(chords_from * self.NUM_CHORDS + chords_to, return_counts=True)
+        self.__add_chord_transitions(transition_keys, transition_counts)
+        self.strongest_chroma_transitions += np.bincount(strongest_chromas_from[continues] * 12 + strongest_chromas_to[continues], minlength=144).reshape(12, 12)
+
+        self.__previous_row = (song_ids[-1], segment_ids[-1], chords[-1], strongest_chromas[-1])
+
+    def __add_chord_transitions(self, transition_keys: np.ndarray[int], transition_counts: np.ndarray[int]) -> None:
+        """Add sparse chord transition counts to those kept, merging counts of the same transition."""
+        keys, inverse = np.unique(np.concatenate([self.chord_transition_keys, transition_keys]), return_inverse=True)
+        self.chord_transition_counts = np.bincount(inverse, weights=np.concatenate([self.chord_transition_counts, transition_counts]), minlength=keys.size).astype(np.int64)
+        self.chord_transition_keys = keys
+
+    def update_csv(self, csv_path: str) -> None:
+        """Add a chords dataset CSV shard, read self.CHUNK_ROWS rows at a time."""
+        for chunk in pd.read_csv(csv_path, chunksize=self.CHUNK_ROWS, dtype={**{column: np.float64 for column in self.CHROMA_COLUMNS}, "song_id": str}):
+            self.update(
+                chunk[self.CHROMA_COLUMNS].to_numpy(dtype=np.float64),
+                chunk["song_id"].to_numpy() if "song_id" in chunk.columns else None,
+                chunk["segment_id"].to_numpy() if "segment_id" in chunk.columns else None
+            )
+        self.__previous_row = None
+
+    def update_npy(self, npy_path: str) -> None:
+        """
+        Add a memory-mapped .npy shard of shape (rows, 13), the columns of a chords dataset CSV, or (rows, 15),
+        followed by integer song and segment codes, read self.CHUNK_ROWS rows at a time.
+        """
+        rows = np.load(npy_path, mmap_mode="r")
+        if rows.ndim != 2 or rows.shape[1] not in (13, 15):
+            raise ValueError(f"Expected a .npy shard of shape (rows, 13) or (rows, 15). Received {rows.shape} from {npy_path}.")
+
+        for chunk_start in range(0, rows.shape[0], self.CHUNK_ROWS):
+            chunk = np.asarray(rows[chunk_start:chunk_start + self.CHUNK_ROWS], dtype=np.float64)
+            if rows.shape[1] == 15:
+                self.update(chunk[:, :13], chunk[:, 13].astype(np.int64), chunk[:, 14].astype(np.int64))
+            else:
+                self.update(chunk)
+        self.__previous_row = None
+
+    def update_shard(self, shard_path: str) -> None:
+        if shard_path.endswith(".npy"):
+            self.update_npy(shard_path)
+        else:
+            self.update_csv(shard_path)
+
+    def merge(self, other: "CorpusStatistics") -> None:
+        """Add the statistics of another, e.g., of another shard, computed with the same chord note threshold."""
+        if other.CHORD_NOTE_THRESHOLD != self.CHORD_NOTE_THRESHOLD:
+            raise ValueError(f"Can't merge statistics computed with different chord note thresholds: {self.CHORD_NOTE_THRESHOLD} and {other.CHORD_NOTE_THRESHOLD}.")
+
+        for count_name in self.COUNT_NAMES:
+            self.counts[count_name] += other.counts[count_name]
+        self.chroma_sums += other.chroma_sums
+        self.chroma_squared_sums += other.chroma_squared_sums
+        self.chroma_note_counts += other.chroma_note_counts
+        self.melody_chroma_counts += other.melody_chroma_counts
+        self.nonzero_chroma_counts += other.nonzero_chroma_counts
+        self.chord_note_counts += other.chord_note_counts
+        self.chord_counts += other.chord_counts
+        self.strongest_chroma_transitions += other.strongest_chroma_transitions
+        self.__add_chord_transitions(other.chord_transition_keys, other.chord_transition_counts)
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Get the statistics as a dict of arrays, e.g., for caching with ExtractionCache."""
+        return {
+            "counts": np.array([self.counts[count_name] for count_name in self.COUNT_NAMES], dtype=np.int64),
+            "chroma_sums": self.chroma_sums,
+            "chroma_squared_sums": self.chroma_squared_sums,
+            "chroma_note_counts": self.chroma_note_counts,
+            "melody_chroma_counts": self.melody_chroma_counts,
+            "nonzero_chroma_counts": self.nonzero_chroma_counts,
+            "chord_note_counts": self.chord_note_counts,
+            "chord_counts": self.chord_counts,
+            "strongest_chroma_transitions": self.strongest_chroma_transitions,
+            "chord_transition_keys": self.chord_transition_keys,
+            "chord_transition_counts": self.chord_transition_counts
+        }
+
+    def merge_arrays(self, arrays: dict[str, np.ndarray]) -> None:
+        """Add statistics returned by to_arrays() of statistics computed with the same chord note threshold."""
+        other = CorpusStatistics(chord_note_threshold=self.CHORD_NOTE_THRESHOLD)
+        other.counts = dict(zip(self.COUNT_NAMES, arrays["counts"].tolist()))
+        for name, array in arrays.items():
+            if name != "counts":
+                setattr(other, name, array)
+        self.merge(other)
+
+    def compute_shards(self, shard_paths: list[str], cache: ExtractionCache = None, num_workers: int = 0) -> dict:
+        """
+        Add the statistics of the given shards, each computed in one of num_workers worker processes, or in this process if 0.
+
+        If a cache is given, the statistics of each shard are stored in it, keyed by the shard's path, size and modification
+        time, so that re-running over a growing dataset only reads the new or changed shards. Returns self.result().
+        """
+        start_time = time.time()
+        config_fingerprint = hashlib.sha256(json.dumps({"chord_note_threshold": self.CHORD_NOTE_THRESHOLD}).encode()).hexdigest()[:16]
+
+        # Merge the cached shards, leaving the others to compute
+        pending_shards = []
+        for shard_path in shard_paths:
+            shard_key = self.get_shard_key(shard_path)
+            arrays = cache.get(shard_key, "corpus_statistics", config_fingerprint) if cache is not None else None
+            if arrays is not None:
+                self.merge_arrays(arrays)
+            else:
+                pending_shards.append((shard_path, shard_key))
+        print(f"Found {len(shard_paths) - len(pending_shards)} of {len(shard_paths)} shards cached, computing the statistics of {len(pending_shards)}...")
+
+        pending_paths = [shard_path for shard_path, _ in pending_shards]
+        arguments = (pending_paths, repeat(self.CHORD_NOTE_THRESHOLD), repeat(self.CHUNK_ROWS))
+        if num_workers > 0 and len(pending_shards) > 1:
+            with ProcessPoolExecutor(max_workers=min(num_workers, len(pending_shards))) as executor:
+                self.__merge_computed_shards(pending_shards, executor.map(_compute_shard_arrays, *arguments), cache, config_fingerprint)
+        else:
+            self.__merge_computed_shards(pending_shards, map(_compute_shard_arrays, *arguments), cache, config_fingerprint)
+
+        print(f"COMPLETED statistics of {len(shard_paths)} shards in {timedelta(seconds=round(time.time() - start_time, 3))}")
+        return self.result()
+
+    def __merge_computed_shards(self, pending_shards: list[tuple[str, str]], shard_arrays: any, cache: ExtractionCache, config_fingerprint: str) -> None:
+        # Merged as each shard finishes, so only the statistics of one shard are held at a time besides the totals
+        for (shard_path, shard_key), arrays in zip(pending_shards, shard_arrays):
+            print(f"  Computed statistics of {shard_path}")
+            if cache is not None:
+                cache.put(shard_key, "corpus_statistics", config_fingerprint, arrays)
+            self.merge_arrays(arrays)
+
+    @staticmethod
+    def get_shard_key(shard_path: str) -> str:
+        """Key of a shard in the cache, from its path, size and modification time, so that unchanged shards aren't read at all."""
+        shard_stat = os.stat(shard_path)
+        return hashlib.sha256(f"{os.path.abspath(shard_path)}:{shard_stat.st_size}:{shard_stat.st_mtime_ns}".encode()).hexdigest()
+
+    def get_chord_label(self, chord: int) -> str:
+        """Label of a chord mask, as the intervals of its chord notes from the tonic."""
+        return "+".join(label for i, label in enumerate(self.CHROMA_LABELS) if chord & (1 << i)) or "-"
+
+    def result(self, top_n: int = 10) -> dict:
+        """Get the statistics as a dict of floats and lists, e.g., for saving to JSON, with the top_n most common chords and chord transitions."""
+        rows = max(self.counts["rows"], 1)
+        chroma_means = self.chroma_sums / rows
+        top_chords = np.argsort(self.chord_counts)[::-1][:top_n]
+        top_transitions = np.argsort(self.chord_transition_counts, kind="stable")[::-1][:top_n]
+
+        return {
+            "counts": dict(self.counts),
+            "chroma_shares": (self.chroma_sums / max(self.chroma_sums.sum(), 1e-12)).tolist(),
+            "chroma_means": chroma_means.tolist(),
+            "chroma_stds": np.sqrt(np.maximum(self.chroma_squared_sums / rows - np.square(chroma_means), 0)).tolist(),
+            "chroma_chord_note_shares": (self.chroma_note_counts / rows).tolist(),
+            "melody_chroma_shares": (self.melody_chroma_counts / rows).tolist(),
+            "mean_nonzero_chromas": float(self.nonzero_chroma_counts @ np.arange(13) / rows),
+            "zero_chroma_share": float(1 - self.nonzero_chroma_counts @ np.arange(13) / (12 * rows)),
+            "nonzero_chroma_count_shares": (self.nonzero_chroma_counts / rows).tolist(),
+            "mean_chord_notes": float(self.chord_note_counts @ np.arange(13) / rows),
+            "chord_note_count_shares": (self.chord_note_counts / rows).tolist(),
+            "chord_change_share": self.counts["chord_changes"] / max(self.counts["transitions"], 1),
+            "distinct_chords": int(np.count_nonzero(self.chord_counts)),
+            "distinct_chord_transitions": int(self.chord_transition_keys.size),
+            "top_chords": [
+                {"chord": self.get_chord_label(int(chord)), "share": float(self.chord_counts[chord] / rows)}
+                for chord in top_chords if self.chord_counts[chord] > 0
+            ],
+            "top_chord_transitions": [
+                {"from": self.get_chord_label(int(self.chord_transition_keys[i] // self.NUM_CHORDS)),
+                 "to": self.get_chord_label(int(self.chord_transition_keys[i] % self.NUM_CHORDS)),
+                 "share": float(self.chord_transition_counts[i] / max(self.counts["transitions"], 1))}
+                for i in top_transitions
+            ],
+            "strongest_chroma_transitions": self.strongest_chroma_transitions.tolist()
+        }
+
+    def print_summary(self, top_n: int = 10) -> None:
+        result = self.result(top_n)
+        counts = result["counts"]
+        print("---")
+        print(f"Rows:\t\t{counts['rows']} ({counts['nan_rows']} NaN and {counts['empty_rows']} empty rows left out)")
+        print(f"Songs:\t\t{counts['songs']}, in {counts['segments']} key signature segments")
+        print(f"Chroma:\t\t{''.join(f'{label:>7}' for label in self.CHROMA_LABELS)}")
+        print(f"  Share:\t{''.join(f'{share:>7.3f}' for share in result['chroma_shares'])}")
+        print(f"  Chord note:\t{''.join(f'{share:>7.3f}' for share in result['chroma_chord_note_shares'])}")
+        print(f"  Melody:\t{''.join(f'{share:>7.3f}' for share in result['melody_chroma_shares'])}")
+        print(f"Sparsity:\t{round(result['mean_nonzero_chromas'], 2)} non-zero chromas and {round(result['mean_chord_notes'], 2)} chord notes per histogram, {round(result['zero_chroma_share'] * 100, 1)}% of chromas zero")
+        print(f"Chords:\t\t{result['distinct_chords']} distinct, {result['distinct_chord_transitions']} distinct transitions, changing in {round(result['chord_change_share'] * 100, 1)}% of {counts['transitions']} transitions")
+        top_chords = ", ".join(f"{chord['chord']} ({round(chord['share'] * 100, 1)}%)" for chord in result["top_chords"])
+        top_chord_transitions = ", ".join(f"{transition['from']} -> {transition['to']} ({round(transition['share'] * 100, 1)}%)" for transition in result["top_chord_transitions"])
+        print(f"  Most common:\t{top_chords}")
+        print(f"  Transitions:\t{top_chord_transitions}")
+        print("------")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Compute the statistics of chords dataset shards in one streaming pass, caching those of each shard.")
+    parser.add_argument("shard_paths", nargs="+", help="Chords dataset CSV or .npy shards, e.g. ./chords_datasets/chords_dataset_idx-*.csv")
+    parser.add_argument("--chord-note-threshold", type=float, default=0.14, help="Share of a histogram above which a chroma is a chord note.")
+    parser.add_argument("--chunk-rows", type=int, default=500000, help="Rows read from a shard at a time.")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes computing shards in parallel, 0 to compute them in this process.")
+    parser.add_argument("--cache-dir", default=None, help="Directory to cache the statistics of each shard in, so that only new or changed shards are read on re-runs.")
+    parser.add_argument("--output-path", default=None, help="Also write the statistics to this JSON file.")
+    args = parser.parse_args()
+
+    corpus_statistics = CorpusStatistics(chord_note_threshold=args.chord_note_threshold, chunk_rows=args.chunk_rows)
+    cache = ExtractionCache(args.cache_dir) if args.cache_dir is not None else None
+    result = corpus_statistics.compute_shards(args.shard_paths, cache=cache, num_workers=args.workers)
+    corpus_statistics.print_summary()
+
+    if args.output_path is not None:
+        with open(args.output_path, "w") as output_file:
+            json.dump(result, output_file, indent=2)
+        print(f"Statistics saved at: {args.output_path}")
\ No newline at end of file
@@ -0,0 +1,198 @@
+import argparse
+import hashlib
+import os
+import time
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+
+class DatasetCleaner:
+    def __init__(self,
+                 min_segment_bars: int = 8,
+                 min_chord_changes: int = 1,
+                 chunk_rows: int = 500000
+                 ) -> None:
+
+        """
+        Cleans chords datasets extracted by ChordsDatasetExtractor before training, in one streaming pass over
+        their CSV shards, reading chunk_rows rows at a time, so memory stays bounded however large the dataset is.
+
+        - Rows with NaN values, or a harmony chroma histogram summing to 0, are dropped.
+        - Degenerate key signature segments are dropped: those with fewer than min_segment_bars bars left, which can't
+          fill a training sequence, or in which the harmony changes fewer than min_chord_changes times, e.g., a held drone.
+        - Duplicate songs are dropped, keeping the first. Songs are compared by a hash of their cleaned rows, so the same
+          song saved under different names or artist folders, as often in the Lakh MIDI dataset, is only kept once.
+
+        Each step is vectorised over a whole chunk. A song's rows are never split between chunks: the last song of each
+        chunk is carried over to the next. Counts of everything removed are kept in self.summary.
+
+        Parameters:
+            min_segment_bars:   int (default 8). Fewest bars a segment must keep, e.g., the sequence length used for training.
+            min_chord_changes:  int (default 1). Fewest times the harmony chroma histogram must change within a segment.
+            chunk_rows:         int (default 500000). Rows read from a CSV shard at a time.
+        """
+
+        self.MIN_SEGMENT_BARS = min_segment_bars
+        self.MIN_CHORD_CHANGES = min_chord_changes
+        self.CHUNK_ROWS = chunk_rows
+
+        self.CHROMA_COLUMNS = ["melody_chroma", "0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11"]
+        self.DF_COLUMNS = self.CHROMA_COLUMNS + ["song_id", "segment_id"]
+
+        self.reset()
+
+    def reset(self) -> None:
+        """Clears the summary and the hashes of the songs seen, e.g., to clean an unrelated dataset."""
+        self.__seen_song_hashes = set()
+        self.summary = {
+            "rows_in": 0,
+            "songs_in": 0,
+            "nan_rows": 0,
+            "empty_rows": 0,
+            "degenerate_segments": 0,
+            "degenerate_segment_rows": 0,
+            "duplicate_songs": 0,
+            "duplicate_song_rows": 0,
+            "rows_out": 0,
+            "songs_out": 0
+        }
+
+    def clean_csv(self, input_paths: list[str], output_path: str) -> dict:
+        """Clean the given CSV shards in order, writing all remaining rows to one CSV file. Returns the summary."""
+
+        start_time = time.time()
+        is_first_write = True
+
+        for input_path in input_paths:
+            print(f"Cleaning {input_path}...")
+            carried_rows = None
+            for chunk in pd.read_csv(input_path, chunksize=self.CHUNK_ROWS, dtype={**{column: np.float64 for column in self.CHROMA_COLUMNS}, "song_id": str}):
+                if carried_rows is not None:
+                    chunk = pd.concat([carried_rows, chunk], ignore_index=True)
+
+                # Carry the last song, which may continue in the next chunk, over to it
+                song_ids = chunk["song_id"].to_numpy()
+                last_song_start = np.flatnonzero(song_ids != song_ids[-1])
+                last_song_start = last_song_start[-1] + 1 if last_song_start.size > 0 else 0
+                carried_rows = chunk.iloc[last_song_start:]
+
+                is_first_write = self.__write(self.clean_df(chunk.iloc[:last_song_start]), output_path, is_first_write)
+
+            # The last song of the shard is complete
+            if carried_rows is not None:
+                is_first_write = self.__write(self.clean_df(carried_rows), output_path, is_first_write)
+
+        # Write the header even if no rows are left
+        if is_first_write:
+            pd.DataFrame(columns=self.DF_COLUMNS).to_csv(output_path, index=False)
+
+        print(f"COMPLETED cleaning {len(input_paths)} files in {timedelta(seconds=round(time.time() - start_time, 3))}, saved at: {output_path}")
+        self.print_summary()
+
+        return self.summary
+
+    def clean_df(self, chords_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Clean a DataFrame of whole songs with self.DF_COLUMNS, as extracted by ChordsDatasetExtractor,
+        returning the remaining rows. Songs already seen by this cleaner are dropped as duplicates.
+        """
+
+        if len(chords_df) == 0:
+            return chords_df
+
+        chromas = chords_df[self.CHROMA_COLUMNS].to_numpy(dtype=np.float64)
+        song_ids = chords_df["song_id"].to_numpy()
+        segment_ids = chords_df["segment_id"].to_numpy()
+
+        # Index songs and segments, which each span consecutive rows
+        song_starts = np.ones(len(chords_df), dtype=bool)
+        song_starts[1:] = song_ids[1:] != song_ids[:-1]
+        segment_starts = song_starts.copy()
+        segment_starts[1:] |= segment_ids[1:] != segment_ids[:-1]
+        segment_codes = np.cumsum(segment_starts) - 1
+        num_segments = segment_codes[-1] + 1
+
+        self.summary["rows_in"] += len(chords_df)
+        self.summary["songs_in"] += int(np.count_nonzero(song_starts))
+
+        # Drop rows with NaN values or no harmony notes
+        nan_rows = np.isnan(chromas).any(axis=1)
+        empty_rows = ~nan_rows & (chromas[:, 1:].sum(axis=1) == 0)
+        kept = ~(nan_rows | empty_rows)
+        self.summary["nan_rows"] += int(np.count_nonzero(nan_rows))
+        self.summary["empty_rows"] += int(np.count_nonzero(empty_rows))
+
+        # Count the bars left in each segment, and the times the harmony changes between them
+        kept_segment_codes = segment_codes[kept]
+        kept_harmonies = chromas[kept, 1:]
+        chord_changes = np.zeros(kept_segment_codes.size, dtype=bool)
+        chord_changes[1:] = (kept_segment_codes[1:] == kept_segment_codes[:-1]) & (kept_harmonies[1:] != kept_harmonies[:-1]).any(axis=1)
+        segment_bars = np.bincount(kept_segment_codes, minlength=num_segments)
+        segment_chord_changes = np.bincount(kept_segment_codes, weights=chord_changes, minlength=num_segments)
+
+        # Drop degenerate segments
+        degenerate_segments = (segment_bars > 0) & ((segment_bars < self.MIN_SEGMENT_BARS) | (segment_chord_changes < self.MIN_CHORD_CHANGES))
+        degenerate_rows = kept & degenerate_segments[segment_codes]
+        kept &= ~degenerate_rows
+        self.summary["degenerate_segments"] += int(np.count_nonzero(degenerate_segments))
+        self.summary["degenerate_segment_rows"] += int(np.count_nonzero(degenerate_rows))
+
+        # Drop songs whose cleaned rows are identical to those of a song already seen
+        kept_rows = np.flatnonzero(kept)
+        kept_song_codes = (np.cumsum(song_starts) - 1)[kept_rows]
+        kept_song_starts = np.flatnonzero(np.diff(kept_song_codes, prepend=-1) != 0)
+        kept_song_ends = np.append(kept_song_starts[1:], kept_rows.size)
+        kept_chromas = np.ascontiguousarray(chromas[kept_rows])
+        kept_segment_ids = np.ascontiguousarray(segment_ids[kept_rows], dtype=np.int64)
+        for song_start, song_end in zip(kept_song_starts, kept_song_ends):
+            song_hash = hashlib.sha1(kept_chromas[song_start:song_end].tobytes() + kept_segment_ids[song_start:song_end].tobytes()).digest()
+            if song_hash in self.__seen_song_hashes:
+                kept[kept_rows[song_start:song_end]] = False
+                self.summary["duplicate_songs"] += 1
+                self.summary["duplicate_song_rows"] += int(song_end - song_start)
+            else:
+                self.__seen_song_hashes.add(song_hash)
+                self.summary["songs_out"] += 1
+
+        self.summary["rows_out"] += int(np.count_nonzero(kept))
+
+        return chords_df[kept]
+
+    def print_summary(self) -> None:
+        summary = self.summary
+        print("---")
+        print(f"Rows:\t{summary['rows_in']} -> {summary['rows_out']} (-{summary['rows_in'] - summary['rows_out']})")
+        print(f"Songs:\t{summary['songs_in']} -> {summary['songs_out']} (-{summary['songs_in'] - summary['songs_out']})")
+        print(f"  NaN rows:\t\t{summary['nan_rows']}")
+        print(f"  Empty rows:\t\t{summary['empty_rows']}")
+        print(f"  Degenerate segments:\t{summary['degenerate_segments']} ({summary['degenerate_segment_rows']} rows)")
+        print(f"  Duplicate songs:\t{summary['duplicate_songs']} ({summary['duplicate_song_rows']} rows)")
+        print("------")
+
+    def __write(self, chords_df: pd.DataFrame, output_path: str, is_first_write: bool) -> bool:
+        """Append rows to the output CSV file, creating it with a header on the first write. Returns whether the next write is the first."""
+        if len(chords_df) == 0:
+            return is_first_write
+        chords_df.to_csv(output_path, mode="w" if is_first_write else "a", header=is_first_write, index=False)
+        return False
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Clean and deduplicate chords dataset CSV shards into one CSV file.")
+    parser.add_argument("input_paths", nargs="+", help="Chords dataset CSV shards, e.g. ./chords_datasets/chords_dataset_idx-*.csv")
+    parser.add_argument("--output-path", required=True, help="CSV file to write the cleaned dataset to.")
+    parser.add_argument("--min-segment-bars", type=int, default=8, help="Fewest bars a key signature segment must keep, e.g. the training sequence length.")
+    parser.add_argument("--min-chord-changes", type=int, default=1, help="Fewest harmony changes a key signature segment must have.")
+    parser.add_argument("--chunk-rows", type=int, default=500000, help="Rows read from a shard at a time.")
+    parser.add_argument("--summary-path", default=None, help="Also write the summary to this JSON file.")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.output_path) in [os.path.abspath(input_path) for input_path in args.input_paths]:
+        raise ValueError("The output path must not be one of the input paths.")
+
+    dataset_cleaner = DatasetCleaner(min_segment_bars=args.min_segment_bars, min_chord_changes=args.min_chord_changes, chunk_rows=args.chunk_rows)
+    summary = dataset_cleaner.clean_csv(args.input_paths, args.output_path)
+
+    if args.summary_path is not None:
+        pd.Series(summary).to_json(args.summary_path, indent=2)
+        print(f"Summary saved at: {args.summary_path}")
\ No newline at end of file
@@ -0,0 +1,120 @@
+import numpy as np
+import hashlib
+import os
+
+class ExtractionCache:
+    def __init__(self, cache_dir: str, max_size_bytes: int = 2 * 1024**3) -> None:
+
+        """
+        An on-disk cache of per-file extraction results, used to skip unchanged work when re-extracting a dataset.
+
+        Entries are keyed by the SHA-256 hash of the MIDI file contents, the name of the extraction stage,
+        and a fingerprint of the processor configuration that stage depends on. Each entry is a dict of
+        Numpy arrays stored as an .npz file. When the total size of the cache exceeds max_size_bytes,
+        the least recently used entries are evicted.
+
+        Parameters:
+            cache_dir:          str. Directory to hold the cache, created if it doesn't exist.
+            max_size_bytes:     int (default 2 GiB). Maximum total size of the cached entries.
+        """
+
+        self.CACHE_DIR = cache_dir
+        self.MAX_SIZE_BYTES = max_size_bytes
+
+        os.makedirs(self.CACHE_DIR, exist_ok=True)
+
+        # Index of entry path -> (size in bytes, last access time), rebuilt from disk on start
+        self.__entries = {}
+        for dir_path, _, file_names in os.walk(self.CACHE_DIR):
+            for file_name in file_names:
+                if file_name.endswith(".npz"):
+                    entry_path = os.path.join(dir_path, file_name)
+                    entry_stat = os.stat(entry_path)
+                    self.__entries[entry_path] = (entry_stat.st_size, entry_stat.st_mtime)
+        self.__size_bytes = sum(size for size, _ in self.__entries.values())
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """Returns the SHA-256 hex digest of the file contents."""
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def __get_entry_path(self, file_hash: str, stage: str, config_fingerprint: str) -> str:
+        return os.path.join(self.CACHE_DIR, file_hash[:2], file_hash, f"{stage}-{config_fingerprint}.npz")
+
+    def get(self, file_hash: str, stage: str, config_fingerprint: str) -> dict[str, np.ndarray] | None:
+        """Returns the cached arrays for the given file, stage and configuration, or None if not cached."""
+
+        entry_path = self.__get_entry_path(file_hash, stage, config_fingerprint)
+        if entry_path not in self.__entries:
+            self.misses += 1
+            return None
+
+        try:
+            with np.load(entry_path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError):
+            # Treat unreadable entries (e.g. from an interrupted run) as missing
+            self.__remove(entry_path)
+            self.misses += 1
+            return None
+
+        # Mark as recently used, both in the index and on disk so it survives restarts
+        os.utime(entry_path)
+        self.__entries[entry_path] = (self.__entries[entry_path][0], os.stat(entry_path).st_mtime)
+        self.hits += 1
+
+        return arrays
+
+    def put(self, file_hash: str, stage: str, config_fingerprint: str, arrays: dict[str, np.ndarray]) -> None:
+        """Stores the arrays for the given file, stage and configuration, evicting old entries if over the size limit."""
+
+        entry_path = self.__get_entry_path(file_hash, stage, config_fingerprint)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+        # Write to a temporary file first so a partially written entry is never read
+        temp_path = entry_path[:-len(".npz")] + ".tmp.npz"
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, entry_path)
+
+        if entry_path in self.__entries:
+            self.__size_bytes -= self.__entries[entry_path][0]
+        entry_stat = os.stat(entry_path)
+        self.__entries[entry_path] = (entry_stat.st_size, entry_stat.st_mtime)
+        self.__size_bytes += entry_stat.st_size
+
+        self.__evict()
+
+    def __remove(self, entry_path: str) -> None:
+        size, _ = self.__entries.pop(entry_path)
+        self.__size_bytes -= size
+        try:
+            os.remove(entry_path)
+            os.rmdir(os.path.dirname(entry_path)) # Only succeeds once a file's last entry is gone
+        except OSError:
+            pass
+
+    def __evict(self) -> None:
+        """Removes least recently used entries until the cache fits within self.MAX_SIZE_BYTES."""
+        if self.__size_bytes <= self.MAX_SIZE_BYTES:
+            return
+
+        for entry_path, _ in sorted(self.__entries.items(), key=lambda entry: entry[1][1]):
+            self.__remove(entry_path)
+            if self.__size_bytes <= self.MAX_SIZE_BYTES:
+                break
+
+    def get_size(self) -> int:
+        """Returns the total size of the cached entries in bytes."""
+        return self.__size_bytes
+
+    def clear(self) -> None:
+        """Removes all cached entries."""
+        for entry_path in list(self.__entries.keys()):
+            self.__remove(entry_path)
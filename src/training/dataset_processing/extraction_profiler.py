@@ -0,0 +1,185 @@
+import heapq
+import json
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+class ExtractionProfiler:
+    def __init__(self, slowest_files_count: int = 20) -> None:
+
+        """
+        Records where time goes during dataset extraction, for finding slow stages and pathological MIDI files.
+
+        Code being profiled wraps each stage in profiler.stage("<name>"), and each file's work in profiler.file("<song id>").
+        Stage times and counts recorded while a file is open are also attributed to that file, so the report can list the
+        slowest files along with the stage breakdown of each. Stage names are dotted, e.g. "melody.overlap" is timed within
+        "melody", so a nested stage's time is also included in its parent's.
+
+        Parameters:
+            slowest_files_count:    int (default 20). Number of slowest files to keep in the report.
+        """
+
+        self.SLOWEST_FILES_COUNT = slowest_files_count
+
+        self.reset()
+
+    def reset(self) -> None:
+        """Clears all recorded timings and counts."""
+        self.__start_time = time.perf_counter()
+
+        # Stage name -> [total seconds, calls]
+        self.__stages = {}
+        # Count name -> total, e.g. bars, notes
+        self.__counts = {}
+
+        self.files_processed = 0
+        # Exception class name -> number of files skipped
+        self.__skipped_files = {}
+
+        # Song id -> per-file record, for files not yet finished (files waiting for key prediction are timed in two parts)
+        self.__open_files = {}
+        self.__current_file = None
+
+        # Min-heap of (seconds, song id, record) holding the slowest finished files
+        self.__slowest_files = []
+
+    def __get_file_record(self, song_id: str) -> dict[str, any]:
+        if song_id not in self.__open_files:
+            self.__open_files[song_id] = {"secs": 0.0, "stages": {}, "counts": {}}
+        return self.__open_files[song_id]
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the code within the with block as the given stage, including if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stage_totals = self.__stages.setdefault(name, [0.0, 0])
+            stage_totals[0] += elapsed
+            stage_totals[1] += 1
+            if self.__current_file is not None:
+                file_stages = self.__open_files[self.__current_file]["stages"]
+                file_stages[name] = file_stages.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def file(self, song_id: str):
+        """Attribute the time, stages and counts within the with block to the given file, until finish_file() is called."""
+        file_record = self.__get_file_record(song_id)
+        previous_file = self.__current_file
+        self.__current_file = song_id
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            file_record["secs"] += time.perf_counter() - start
+            self.__current_file = previous_file
+
+    def add_count(self, name: str, count: int = 1) -> None:
+        """Add to the given count, and to the current file's count if a file is open."""
+        self.__counts[name] = self.__counts.get(name, 0) + int(count)
+        if self.__current_file is not None:
+            file_counts = self.__open_files[self.__current_file]["counts"]
+            file_counts[name] = file_counts.get(name, 0) + int(count)
+
+    def finish_file(self, song_id: str, exception: Exception = None) -> None:
+        """
+        Mark the given file as done, as processed or, if an exception is given, as skipped.
+        Processed files are then considered for the slowest files list.
+        """
+        file_record = self.__open_files.pop(song_id, None)
+
+        if exception is not None:
+            exception_class = exception.__class__
+            exception_name = exception_class.__name__ if exception_class.__module__ == "builtins" else f"{exception_class.__module__}.{exception_class.__name__}"
+            self.__skipped_files[exception_name] = self.__skipped_files.get(exception_name, 0) + 1
+            return
+
+        self.files_processed += 1
+        if file_record is None:
+            return
+
+        # Keep only the slowest files, replacing the fastest kept file once the list is full
+        heap_entry = (file_record["secs"], song_id, file_record)
+        if len(self.__slowest_files) < self.SLOWEST_FILES_COUNT:
+            heapq.heappush(self.__slowest_files, heap_entry)
+        elif file_record["secs"] > self.__slowest_files[0][0]:
+            heapq.heapreplace(self.__slowest_files, heap_entry)
+
+    def get_report(self) -> dict[str, any]:
+        """Get the recorded timings and counts as a JSON serialisable dict."""
+        return {
+            "wall_secs": time.perf_counter() - self.__start_time,
+            "files": {
+                "processed": self.files_processed,
+                "skipped": sum(self.__skipped_files.values()),
+                "skipped_by_exception": dict(sorted(self.__skipped_files.items(), key=lambda item: -item[1]))
+            },
+            "counts": dict(self.__counts),
+            "stages": {
+                name: {
+                    "total_secs": total_secs,
+                    "calls": calls,
+                    "mean_secs": total_secs / calls
+                }
+                for name, (total_secs, calls) in sorted(self.__stages.items(), key=lambda item: -item[1][0])
+            },
+            "slowest_files": [
+                {
+                    "song_id": song_id,
+                    "secs": secs,
+                    "stages": dict(sorted(file_record["stages"].items(), key=lambda item: -item[1])),
+                    "counts": file_record["counts"]
+                }
+                for secs, song_id, file_record in sorted(self.__slowest_files, key=lambda entry: -entry[0])
+            ]
+        }
+
+    def save_report(self, json_path: str) -> None:
+        """Write the report to a JSON file."""
+        with open(json_path, "w") as report_file:
+            json.dump(self.get_report(), report_file, indent=2)
+
+    def print_report(self, slowest_files_count: int = 5) -> None:
+        """Print a summary of the report, with the given number of slowest files."""
+        report = self.get_report()
+
+        print(f"EXTRACTION PROFILE ({timedelta(seconds=round(report['wall_secs'], 3))} total)")
+        print(f"Files processed: {report['files']['processed']}, skipped: {report['files']['skipped']} {report['files']['skipped_by_exception']}")
+        print(f"Counts: {report['counts']}")
+
+        print("Stages:")
+        for name, stage in report["stages"].items():
+            print(f"  {name.ljust(32)} {round(stage['total_secs'], 3):>10} secs  {stage['calls']:>8} calls  {round(stage['mean_secs'] * 1000, 3):>10} ms/call")
+
+        print("Slowest files:")
+        for slow_file in report["slowest_files"][:slowest_files_count]:
+            slowest_stage = next(iter(slow_file["stages"]), None)
+            print(f"  {round(slow_file['secs'], 3):>8} secs  {slow_file['song_id']}  (slowest stage: {slowest_stage}, {slow_file['counts']})")
+
+if __name__ == "__main__":
+
+    # Simple test with sleeps standing in for extraction stages
+
+    profiler = ExtractionProfiler(slowest_files_count=2)
+
+    for file_idx, sleep_secs in enumerate([0.01, 0.03, 0.02]):
+        song_id = f"artist/song{file_idx}.mid"
+        with profiler.file(song_id):
+            with profiler.stage("notes"):
+                time.sleep(sleep_secs)
+            profiler.add_count("bars", 10 * (file_idx + 1))
+        profiler.finish_file(song_id)
+
+    try:
+        with profiler.file("artist/broken.mid"):
+            with profiler.stage("notes"):
+                raise EOFError()
+    except EOFError as e:
+        profiler.finish_file("artist/broken.mid", exception=e)
+
+    profiler.print_report()
+
+    report = profiler.get_report()
+    print(report["stages"]["notes"]["calls"] == 4, [f["song_id"] for f in report["slowest_files"]] == ["artist/song1.mid", "artist/song2.mid"])
\ No newline at end of file
@@ -1,11 +1,21 @@
 import pretty_midi as pm
 import numpy as np
 import pandas as pd
-import time
+import hashlib
+import pickle
+import os
+import sys
+from contextlib import nullcontext
+from midi_note_loader import MIDINotes, MIDINoteTrack, MIDI_NOTE_LOADER_VERSION
+from extraction_profiler import ExtractionProfiler
+
+# Share the histogram kernels of chord generation, so that training data is normalised as chords are when generating
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from chord_generation_utils.histogram_kernels import normalise_histograms
 
 class MIDIFileProcessor:
     
-    def __init__(self, key_classifier: any) -> None:
+    def __init__(self, key_classifier: any, profiler: ExtractionProfiler = None) -> None:
         self.MELODY_KEYWORDS = [
             "solo",
             "melody",
@@ -30,116 +40,152 @@ class MIDIFileProcessor:
         ]
 
         self.key_classifier = key_classifier
+        self.__key_classifier_fingerprint = hashlib.sha1(pickle.dumps(key_classifier)).hexdigest()
 
         self.HARMONY_NOTE_CHORD_THRESHOLD = 1/16
 
+        # Optional profiler recording the time spent in each processing stage, and counts of bars and notes
+        self.profiler = profiler
+
+        # Bump the version of a stage whenever its code changes, so that cached results from the old code aren't reused
+        self.STAGE_VERSIONS = {
+            "melody": 2,
+            "key_signatures": 2,
+            "chords": 3
+        }
+
+# PROFILING
+
+    def __profile(self, stage: str) -> any:
+        """Time the with block as the given stage if profiling, otherwise do nothing."""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(stage)
+
+    def __add_count(self, name: str, count: int) -> None:
+        if self.profiler is not None:
+            self.profiler.add_count(name, count)
+
+# CONFIGURATION FINGERPRINTS
+
+    def __get_fingerprint(self, *config: any) -> str:
+        return hashlib.sha1(repr(config).encode()).hexdigest()[:16]
+
+    def get_stage_fingerprints(self) -> dict[str, str]:
+        """
+        Get a fingerprint of the configuration each extraction stage depends on, for use in cache keys.
+        Fingerprints are chained, so that a stage's fingerprint changes whenever a stage it builds on changes.
+        """
+        notes_fingerprint = self.__get_fingerprint(MIDI_NOTE_LOADER_VERSION)
+
+        melody_fingerprint = self.__get_fingerprint(
+            self.STAGE_VERSIONS["melody"],
+            notes_fingerprint,
+            self.MELODY_KEYWORDS,
+            self.MELODY_EXCLUDED)
+
+        key_signatures_fingerprint = self.__get_fingerprint(
+            self.STAGE_VERSIONS["key_signatures"],
+            notes_fingerprint,
+            self.__key_classifier_fingerprint)
+
+        chords_fingerprint = self.__get_fingerprint(
+            self.STAGE_VERSIONS["chords"],
+            melody_fingerprint,
+            key_signatures_fingerprint,
+            self.HARMONY_NOTE_CHORD_THRESHOLD)
+
+        return {
+            "notes": notes_fingerprint,
+            "melody": melody_fingerprint,
+            "key_signatures": key_signatures_fingerprint,
+            "chords": chords_fingerprint
+        }
+
 # MELODY INSTRUMENT
 
-    def __get_instrument_average_pitch(self, instrument: pm.Instrument) -> float:
-        start = time.time()
-        notes_count = 0
-        note_numbers_total = 0
-        for note in instrument.notes:
-            notes_count += 1
-            note_numbers_total += note.pitch
+    def __get_instrument_average_pitch(self, instrument: MIDINoteTrack) -> float:
+        notes_count = instrument.notes.size
+        note_numbers_total = int(instrument.notes["pitch"].sum())
         # In case of no notes, add 1 to avoid div by 0 error
         if notes_count == 0:
             notes_count = 1
         avg_pitch = note_numbers_total / notes_count
-        # print(f"  Computed average pitch in {time.time()-start} secs")
         return avg_pitch
 
-    def __get_instrument_overlap(self, instrument: pm.Instrument) -> float:
-        """Get the percentage overlap (0-1) of the given instrument."""
-        start = time.time()
-        
-        this_instrument_note_overlap_times = np.zeros((1))
-        notes_dur_sum = 0
-
-        # Check each note against all other notes and calculate overlap percentage (0-1)
-        for current_note_i, current_note in enumerate(instrument.notes): 
-            current_note_dur = current_note.get_duration()
-            notes_dur_sum += current_note_dur # Add note duration to sum of durations
-
-            # List containing (2,) overlap arrays for each overlapping note
-            current_note_overlaps = []
-
-            # Loop through all notes to if overlapping
-            for check_note_i, check_note in enumerate(instrument.notes):
-
-                # Initialise note_overlap_region array to contain [overlap_start, overlap_end]
-                note_overlap_region = np.zeros((2))
-
-                # Bypass if comparing current note against itself
-                if current_note_i == check_note_i:
-                    continue
-                # Bypass all non-overlapping notes
-                elif current_note.start >= check_note.end or current_note.end <= check_note.start: 
-                    pass  
-                # If note to check overlaps whole of current note, continue with 1 i.e., entire note is overlapped
-                elif current_note.start >=check_note.start and current_note.end <= check_note.end:
-                    note_overlap_region[1] = current_note_dur
-                # If partial overlap
-                else:
-                    # If note is overlapped at the start i.e., use note start and note_to_check end
-                    if current_note.start >= check_note.start and current_note.end > check_note.end:
-                        # print("    Start overlapped.")
-                        note_overlap_region[0] = 0 # Overlapping from start of note
-                        note_overlap_region[1] = current_note.end - check_note.end # Overlapping to this many seconds through the note
-                    # If note is overlapped at the end i.e., use note_to_check start and note end
-                    elif current_note.start < check_note.start and current_note.end <= check_note.end:
-                        # print("    End overlapped.")
-                        note_overlap_region[0] = check_note.start - current_note.start # Overlapping from this many seconds through note
-                        note_overlap_region[1] = current_note_dur # Overlapping to end of note
-                    # If note_to_check is wholly contained within the current note    
-                    elif current_note.start < check_note.start and current_note.end > check_note.end:
-                        # print("    Overlap contained inside note.")
-                        note_overlap_region[0] = check_note.start - current_note.start # Overlapping from this many seconds through note
-                        note_overlap_region[1] = current_note.end - check_note.end # Overlapping to this many seconds through note
-                    # Error case
-                    else:
-                        print("  ERROR: No partial overlap conditions met.")
-
-                # Append overlap percentage for current note to note_overlaps array
-                current_note_overlaps.append(note_overlap_region)
-
-            # Initialise overlapped time for this note to 0.
-            current_note_overlap_time = 0
-
-            # Loop through overlaps to find most overlap of current note
-            for overlap in current_note_overlaps:
-                # If note is entirely overlapped, overlap is note duration and then exit loop as max overlap duration found
-                if overlap[0] == 0 and overlap[1] == current_note_dur:
-                    current_note_overlap_time = current_note_dur
-                    break
-                # If no overlap, move onto next note
-                elif overlap[0] == 0 and overlap[1] == 0:
-                    continue
-                # If partial overlap, check if bigger than current overlap and update if so
-                elif (overlap[1] - overlap[0]) < current_note_dur:
-                    current_note_overlap_time = overlap[1] - overlap[0]   
-                # Error case
-                else:
-                    print("  ERROR: no cases met for overlap.")
-
-            # Append current note overlap time to array of overlap times for this instrument
-            this_instrument_note_overlap_times = np.append(this_instrument_note_overlap_times, current_note_overlap_time)
-            if current_note_overlap_time > current_note_dur: # Error case
-                print("  ERROR: overlap duration longer than note duration.")
-            
-            # Calculate overlap percentage in range 0-1
-            this_instrument_overlap_percentage = this_instrument_note_overlap_times.sum() / notes_dur_sum
-
-            # print(f"  Computed overlap in {time.time()-start} secs")
-            
-            return this_instrument_overlap_percentage
+    def __get_instrument_overlap(self, instrument: MIDINoteTrack) -> float:
+        """
+        Get the percentage overlap (0-1) of the given instrument.
+        As before the move to note arrays, this is measured on the first note of the instrument only.
+        """
 
-    def __get_instrument_stats(self, instrument: pm.Instrument) -> tuple[float, float]:
-        avg_pitch = self.__get_instrument_average_pitch(instrument)
-        overlap = self.__get_instrument_overlap(instrument)
+        notes = instrument.notes
+
+        # No overlap to measure without notes
+        if notes.size == 0:
+            return None
+
+        # Check the first note against all other notes
+        current_note_start = notes["start"][0]
+        current_note_end = notes["end"][0]
+        current_note_dur = current_note_end - current_note_start
+        check_note_starts = notes["start"][1:]
+        check_note_ends = notes["end"][1:]
+
+        # Overlap regions as [overlap_start, overlap_end], relative to the start of the current note
+        overlap_region_starts = np.zeros(check_note_starts.size)
+        overlap_region_ends = np.zeros(check_note_starts.size)
+
+        # Non-overlapping notes keep a [0, 0] region
+        overlapping = ~((current_note_start >= check_note_ends) | (current_note_end <= check_note_starts))
+        # Note to check overlaps whole of current note
+        whole = overlapping & (current_note_start >= check_note_starts) & (current_note_end <= check_note_ends)
+        overlap_region_ends[whole] = current_note_dur
+        partial = overlapping & ~whole
+        # Overlapped at the start, i.e., from note start to the end of the note to check
+        start_overlapped = partial & (current_note_start >= check_note_starts) & (current_note_end > check_note_ends)
+        overlap_region_ends[start_overlapped] = current_note_end - check_note_ends[start_overlapped]
+        # Overlapped at the end, i.e., from the start of the note to check to the note end
+        end_overlapped = partial & (current_note_start < check_note_starts) & (current_note_end <= check_note_ends)
+        overlap_region_starts[end_overlapped] = check_note_starts[end_overlapped] - current_note_start
+        overlap_region_ends[end_overlapped] = current_note_dur
+        # Note to check wholly contained within the current note
+        contained = partial & (current_note_start < check_note_starts) & (current_note_end > check_note_ends)
+        overlap_region_starts[contained] = check_note_starts[contained] - current_note_start
+        overlap_region_ends[contained] = current_note_end - check_note_ends[contained]
+        # Error case
+        if (partial & ~(start_overlapped | end_overlapped | contained)).any():
+            print("  ERROR: No partial overlap conditions met.")
+
+        overlap_durations = overlap_region_ends - overlap_region_starts
+
+        # If the note is entirely overlapped, the overlap is the note duration
+        if ((overlap_region_starts == 0) & (overlap_region_ends == current_note_dur)).any():
+            current_note_overlap_time = current_note_dur
+        else:
+            # Otherwise use the last partial overlap found
+            partial_overlaps = ~((overlap_region_starts == 0) & (overlap_region_ends == 0))
+            valid_overlaps = partial_overlaps & (overlap_durations < current_note_dur)
+            if (partial_overlaps & ~valid_overlaps).any():
+                print("  ERROR: no cases met for overlap.")
+            current_note_overlap_time = overlap_durations[valid_overlaps][-1] if valid_overlaps.any() else 0
+
+        if current_note_overlap_time > current_note_dur: # Error case
+            print("  ERROR: overlap duration longer than note duration.")
+
+        # Calculate overlap percentage in range 0-1
+        this_instrument_overlap_percentage = np.float64(current_note_overlap_time) / current_note_dur
+
+        return this_instrument_overlap_percentage
+
+    def __get_instrument_stats(self, instrument: MIDINoteTrack) -> tuple[float, float]:
+        with self.__profile("melody.average_pitch"):
+            avg_pitch = self.__get_instrument_average_pitch(instrument)
+        with self.__profile("melody.overlap"):
+            overlap = self.__get_instrument_overlap(instrument)
         return (avg_pitch, overlap)
 
-    def __choose_melody_instrument_from_options(self, instruments: dict) -> tuple[pm.Instrument, float, float]:
+    def __choose_melody_instrument_from_options(self, instruments: dict) -> tuple[MIDINoteTrack, float, float]:
         highest_avg_pitch = 0
         for instrument, stats in instruments.items():
             if stats[0] > highest_avg_pitch:
@@ -151,7 +197,7 @@ class MIDIFileProcessor:
             instruments[melody_instrument][1]
         )
 
-    def __is_valid_melody_instrument(self, instrument: pm.Instrument) -> bool:   
+    def __is_valid_melody_instrument(self, instrument: MIDINoteTrack) -> bool:   
         """
         Check whether an instrument is a valid option for a melody instrument.
         Returns False for drums and might-be drums, otherwise returns True."""
@@ -164,15 +210,19 @@ class MIDIFileProcessor:
                 return False
         return True
 
-    def get_melody_instrument(self, midi_file: pm.PrettyMIDI) -> pm.Instrument:
-        print(f"    # of tracks in MIDI file: {len(midi_file.instruments)}")
+    def get_melody_instrument(self, midi_notes: MIDINotes) -> MIDINoteTrack:
+        with self.__profile("melody"):
+            return self.__get_melody_instrument(midi_notes)
+
+    def __get_melody_instrument(self, midi_notes: MIDINotes) -> MIDINoteTrack:
+        print(f"    # of tracks in MIDI file: {len(midi_notes.instruments)}")
 
         melody_instrument_option_stats = {}
         melody_instrument_options = []
         named_melody_instruments = []
         
         # Get a list of possible melody instruments, and a list of named instruments
-        for instrument in midi_file.instruments:
+        for instrument in midi_notes.instruments:
             # Only continue processing valid melody instrument options
             if self.__is_valid_melody_instrument(instrument):
                 melody_instrument_options.append(instrument)
@@ -209,17 +259,17 @@ class MIDIFileProcessor:
 
 # ADDING TO DATAFRAME
 
-    def __get_harmony_instruments_list(self, midi_file: pm.PrettyMIDI, melody_instrument: pm.Instrument) -> list[pm.Instrument]:
+    def __get_harmony_instruments_list(self, midi_notes: MIDINotes, melody_instrument: MIDINoteTrack) -> list[MIDINoteTrack]:
         # Get list of harmony instruments by removing melody instrument and all drum tracks
-        harmony_instruments = midi_file.instruments.copy()
+        harmony_instruments = midi_notes.instruments.copy()
         for instrument in harmony_instruments:
             if instrument.is_drum or instrument is melody_instrument:
                 harmony_instruments.remove(instrument)
 
         return harmony_instruments
 
-    def __get_ks_downbeats_list(self, midi_file: pm.PrettyMIDI, ks_start: float, ks_end: float) -> list[float]:
-        downbeats = midi_file.get_downbeats(start_time=ks_start)
+    def __get_ks_downbeats_list(self, midi_notes: MIDINotes, ks_start: float, ks_end: float) -> list[float]:
+        downbeats = midi_notes.get_downbeats(start_time=ks_start)
         for db_idx, downbeat in enumerate(downbeats):
             if downbeat > ks_end:
                 downbeats = downbeats[:db_idx+1]
@@ -227,182 +277,221 @@ class MIDIFileProcessor:
 
         return downbeats
 
+    def __get_note_index(self, notes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Index the notes by start and by end time, so the notes in each bar can be found with binary searches."""
+        start_order = np.argsort(notes["start"], kind="stable")
+        end_order = np.argsort(notes["end"], kind="stable")
+        return (start_order, notes["start"][start_order], end_order, notes["end"][end_order])
+
+    def __get_notes_in_bar(self,
+                           note_index: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+                           bar_start: float,
+                           bar_end: float) -> np.ndarray:
+        """Get the indices, in their original order, of the notes starting or ending within the given bar."""
+        start_order, sorted_starts, end_order, sorted_ends = note_index
+        notes_starting_in_bar = start_order[np.searchsorted(sorted_starts, bar_start, side="left"):np.searchsorted(sorted_starts, bar_end, side="right")]
+        notes_ending_in_bar = end_order[np.searchsorted(sorted_ends, bar_start, side="left"):np.searchsorted(sorted_ends, bar_end, side="right")]
+        return np.union1d(notes_starting_in_bar, notes_ending_in_bar)
+
     def __get_longest_note_in_bar(self,
-                                      melody_instrument: pm.Instrument,
+                                      melody_notes: np.ndarray,
+                                      melody_note_index: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
                                       bar_start: float,
                                       bar_end: float,
-                                      bar_duration: float) -> any:
-        """Find the longest note within the given bar of the given instrument."""
+                                      bar_duration: float) -> int | None:
+        """Find the index of the longest note within the given bar of the given melody notes."""
         
-        # Init variables for the maximum bar coverage of a single note & selected note
-        melody_note_max_coverage = 0
-        selected_melody_note = None
-
-        # Loop through melody notes in bar
-        for melody_note in melody_instrument.notes:
-            # Check if note in bar
-            if bar_start <= melody_note.start <= bar_end or bar_start <= melody_note.end <= bar_end:
-                melody_note_coverage = melody_note.get_duration() / bar_duration
-                if melody_note_coverage > melody_note_max_coverage:
-                    melody_note_max_coverage = melody_note_coverage
-                    selected_melody_note = melody_note
-
-        return selected_melody_note
-
-    def __is_note_in_bar(self, note: pm.Note, bar_start: float, bar_end: float) -> bool:
-        if bar_start <= note.start <= bar_end or bar_start <= note.end <= bar_end:
-            return True
-        else:
-            return False
+        # Get the bar coverage of each melody note in the bar
+        notes_in_bar = self.__get_notes_in_bar(melody_note_index, bar_start, bar_end)
+        melody_note_coverages = (melody_notes["end"][notes_in_bar] - melody_notes["start"][notes_in_bar]) / bar_duration
+
+        # Only notes with a coverage above 0 can be selected
+        candidate_notes = np.flatnonzero(melody_note_coverages > 0)
+        if candidate_notes.size == 0:
+            return None
+
+        # Take the first note with the highest coverage
+        return notes_in_bar[candidate_notes[np.argmax(melody_note_coverages[candidate_notes])]]
 
     def __get_bar_chroma_histogram(self,
-                                   harmony_instruments: list[pm.Instrument],
+                                   harmony_notes: np.ndarray,
+                                   harmony_note_index: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
                                    bar_start: float,
                                    bar_end:float,
                                    bar_duration: float,
                                    tonic: int) -> np.ndarray:
         
-        """Compute the chroma histogram for the given list of instruments
+        """Compute the unnormalised chroma histogram, i.e., the total coverage of each chroma, for the given harmony notes
         within the given bar start and end times."""
 
-        # Init array to hold chroma histogram, and variable to hold total sum of bar
-        bar_harmony_chroma = np.zeros(12)
-        bar_coverage_sum = 0
+        # Get notes in the current bar, and their coverage of the bar
+        notes_in_bar = self.__get_notes_in_bar(harmony_note_index, bar_start, bar_end)
+        harmony_note_coverages = (harmony_notes["end"][notes_in_bar] - harmony_notes["start"][notes_in_bar]) / bar_duration
 
-        # Loop over harmony instruments
-        for harmony_instrument in harmony_instruments:
-            
-            # Loop over note within instrument
-            for harmony_note in harmony_instrument.notes:
-                
-                # Check if note is in the current bar
-                if self.__is_note_in_bar(harmony_note, bar_start, bar_end):
-                    harmony_note_coverage = harmony_note.get_duration() / bar_duration
-                    
-                    # If coverage is sufficiently high, then include in the chroma histogram
-                    if harmony_note_coverage >= self.HARMONY_NOTE_CHORD_THRESHOLD:
-                        harmony_note_chroma = (harmony_note.pitch - tonic) % 12
-                        bar_harmony_chroma[harmony_note_chroma] += harmony_note_coverage
-                        bar_coverage_sum += harmony_note_coverage
-        
-        # If coverage by harmony notes is greater > 0, i.e., there are harmony notes in the bar,
-        # normalise to sum to 1
-        if bar_coverage_sum > 0:
-            bar_harmony_chroma = bar_harmony_chroma / bar_coverage_sum
-        
-        return bar_harmony_chroma
+        # If coverage is sufficiently high, then include in the chroma histogram
+        included_notes = harmony_note_coverages >= self.HARMONY_NOTE_CHORD_THRESHOLD
+        harmony_note_coverages = harmony_note_coverages[included_notes]
+        harmony_note_chromas = (harmony_notes["pitch"][notes_in_bar][included_notes] - tonic) % 12
 
-    def __clean_midi_file_chords_array(self, midi_file_chords_array: np.ndarray) -> np.ndarray:
-        # Init list holding indices of chords to delete from array
-        chords_to_delete = []
+        # Sum coverages per chroma, normalised together with the other bars of the key signature
+        return np.bincount(harmony_note_chromas, weights=harmony_note_coverages, minlength=12)
 
-        # Find indices of chords to delete
-        for idx, melody_chord_pair in enumerate(midi_file_chords_array):
-            if melody_chord_pair[1:].sum() == 0:
-                chords_to_delete.append(idx)
+    def __clean_midi_file_chords_array(self,
+                                       midi_file_chords_array: np.ndarray,
+                                       segment_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Find indices of chords to delete, i.e., with chroma histograms summing to 0
+        chords_to_delete = np.flatnonzero(midi_file_chords_array[:, 1:].sum(axis=1) == 0)
 
-        # Delete chords using indices
+        # Delete chords using indices, keeping the segment ids aligned with the remaining rows
         if len(chords_to_delete) != 0:
             midi_file_chords_array = np.delete(midi_file_chords_array, chords_to_delete, axis=0)
+            segment_ids = np.delete(segment_ids, chords_to_delete, axis=0)
             print(f"    Purging empty chords...")
             print(f"    Chords after removal: {midi_file_chords_array.shape[0]} (-{len(chords_to_delete)})")
 
-        return midi_file_chords_array
+        return midi_file_chords_array, segment_ids
 
     def get_chords_as_array(self,
-                            midi_file: pm.PrettyMIDI,
-                            melody_instrument: pm.Instrument,
-                            key_signatures: list[pm.KeySignature]) -> None:
-        """Generate an (x,13) Numpy array representing all the chords in the provided MIDI file."""
+                            midi_notes: MIDINotes,
+                            melody_instrument: MIDINoteTrack,
+                            key_signatures: list[pm.KeySignature],
+                            return_segment_ids: bool = False) -> np.ndarray | tuple[np.ndarray, np.ndarray]:
+        """
+        Generate an (x,13) Numpy array representing all the chords in the provided MIDI file.
 
-        # Get list of harmony instruments by removing melody instrument and all drum tracks
-        harmony_instruments = self.__get_harmony_instruments_list(midi_file, melody_instrument)
+        If return_segment_ids is True, an (x,) int array is also returned holding the index of the
+        key signature segment each row was extracted from. Consecutive rows only form a continuous
+        sequence of bars when they share a segment id, which the dataset manager uses to avoid
+        building training windows across key changes.
+        """
+        with self.__profile("chords"):
+            midi_file_chords_array, midi_file_segment_ids = self.__get_chords_as_array(midi_notes, melody_instrument, key_signatures)
 
-        # Initialise array for holding all chords and melody chroma for current MIDI file
-        midi_file_chords_array = np.zeros((1, 13))
+        # Return chord array with empty chords removed
+        if return_segment_ids:
+            return midi_file_chords_array, midi_file_segment_ids
+        return midi_file_chords_array
 
-        for ks_idx, ks in enumerate(key_signatures):
+    def __get_chords_as_array(self,
+                              midi_notes: MIDINotes,
+                              melody_instrument: MIDINoteTrack,
+                              key_signatures: list[pm.KeySignature]) -> tuple[np.ndarray, np.ndarray]:
+
+        # Get list of harmony instruments by removing melody instrument and all drum tracks
+        harmony_instruments = self.__get_harmony_instruments_list(midi_notes, melody_instrument)
+
+        # Gather all harmony notes into one array, and index melody and harmony notes for finding notes in each bar
+        with self.__profile("chords.note_index"):
+            melody_notes = melody_instrument.notes
+            melody_note_index = self.__get_note_index(melody_notes)
+            harmony_notes = np.concatenate([harmony_instrument.notes for harmony_instrument in harmony_instruments] + [np.zeros(0, dtype=melody_notes.dtype)])
+            harmony_note_index = self.__get_note_index(harmony_notes)
+        self.__add_count("melody_notes", melody_notes.size)
+        self.__add_count("harmony_notes", harmony_notes.size)
+
+        # Initialise lists holding the chords and melody chroma of each key signature, concatenated once at the end
+        ks_chords_arrays = [np.zeros((0, 13))]
+        ks_segment_ids = [np.zeros(0, dtype=int)]
+
+        # Compute the melody chroma and harmony chroma histogram of every bar, per key signature
+        with self.__profile("chords.bar_histograms"):
+            for ks_idx, ks in enumerate(key_signatures):
             
-            # Get tonic of key / relative major of key
-            if ks.key_number > 11:
-                tonic = (ks.key_number + 3) % 12
-                #continue # <- THIS EXCLUDES MINOR KEY SIGNATURES WHEN UNCOMMENTED
-            else:
-                tonic = ks.key_number
-
-            # Get time range for current key signature (just end of file if only one ks or last ks in list)
-            ks_start = ks.time
-            if len(key_signatures) <= ks_idx+1:
-                ks_end = midi_file.get_end_time()
-            else:
-                ks_end = key_signatures[ks_idx+1].time
-
-            # Get list of downbeats in the current key signature range
-            downbeats = self.__get_ks_downbeats_list(midi_file, ks_start, ks_end)
-
-            # Init array to hold chroma histogram values, will be appended to df once per KS
-            ks_chroma_histograms = np.full((downbeats.size, 13), float(0))
-
-            # Loop through bars
-            for bar_idx, bar_start in enumerate(downbeats):
-                
-                # Get end of bar i.e., end of range to look at
-                # If last bar, set end time as the length of the previous interval after the last downbeat
-                if bar_idx < downbeats.size - 1:
-                    bar_end = downbeats[bar_idx+1]
+                # Get tonic of key / relative major of key
+                if ks.key_number > 11:
+                    tonic = (ks.key_number + 3) % 12
+                    #continue # <- THIS EXCLUDES MINOR KEY SIGNATURES WHEN UNCOMMENTED
                 else:
-                    bar_end = bar_start + (bar_start - downbeats[bar_idx-1])
+                    tonic = ks.key_number
+
+                # Get time range for current key signature (just end of file if only one ks or last ks in list)
+                ks_start = ks.time
+                if len(key_signatures) <= ks_idx+1:
+                    ks_end = midi_notes.get_end_time()
+                else:
+                    ks_end = key_signatures[ks_idx+1].time
+
+                # Get list of downbeats in the current key signature range
+                downbeats = self.__get_ks_downbeats_list(midi_notes, ks_start, ks_end)
+
+                # Init array to hold chroma histogram values, will be appended to df once per KS
+                ks_chroma_histograms = np.full((downbeats.size, 13), float(0))
+
+                # Loop through bars
+                for bar_idx, bar_start in enumerate(downbeats):
+                
+                    # Get end of bar i.e., end of range to look at
+                    # If last bar, set end time as the length of the previous interval after the last downbeat
+                    if bar_idx < downbeats.size - 1:
+                        bar_end = downbeats[bar_idx+1]
+                    else:
+                        bar_end = bar_start + (bar_start - downbeats[bar_idx-1])
                 
-                # Get bar duration in seconds
-                bar_duration = bar_end - bar_start
-
-                # Find longest melody note in current bar
-                selected_melody_note = self.__get_longest_note_in_bar(melody_instrument, bar_start, bar_end, bar_duration)
-
-                # Continue with found melody note
-                if selected_melody_note != None:
-                    # Find chroma of longest note, add to array in 1st index of corresponding row
-                    melody_chroma = (selected_melody_note.pitch - tonic) % 12
-                    ks_chroma_histograms[bar_idx, 0] = melody_chroma
-
-                    # Compute harmony chroma histogram for current bar
-                    bar_harmony_chroma = self.__get_bar_chroma_histogram(
-                        harmony_instruments,
-                        bar_start,
-                        bar_end,
-                        bar_duration,
-                        tonic)
-
-                    # Update ks chords array with current bar histogram
-                    for chroma_idx, chroma in enumerate(bar_harmony_chroma):
-                        ks_chroma_histograms[bar_idx, chroma_idx+1] = chroma
+                    # Get bar duration in seconds
+                    bar_duration = bar_end - bar_start
+
+                    # Find longest melody note in current bar
+                    selected_melody_note = self.__get_longest_note_in_bar(melody_notes, melody_note_index, bar_start, bar_end, bar_duration)
+
+                    # Continue with found melody note
+                    if selected_melody_note != None:
+                        # Find chroma of longest note, add to array in 1st index of corresponding row
+                        melody_chroma = (melody_notes["pitch"][selected_melody_note] - tonic) % 12
+                        ks_chroma_histograms[bar_idx, 0] = melody_chroma
+
+                        # Compute harmony chroma histogram for current bar
+                        bar_harmony_chroma = self.__get_bar_chroma_histogram(
+                            harmony_notes,
+                            harmony_note_index,
+                            bar_start,
+                            bar_end,
+                            bar_duration,
+                            tonic)
+
+                        # Update ks chords array with current bar histogram
+                        ks_chroma_histograms[bar_idx, 1:] = bar_harmony_chroma
+
+                # Normalise the harmony chroma histograms of all bars to sum to 1, leaving bars without harmony notes as zeros
+                normalise_histograms(ks_chroma_histograms[:, 1:])
             
-            midi_file_chords_array = np.append(midi_file_chords_array, ks_chroma_histograms, axis=0)
+                ks_chords_arrays.append(ks_chroma_histograms)
+                ks_segment_ids.append(np.full(downbeats.size, ks_idx))
 
-        # Trim first empty row
-        midi_file_chords_array = midi_file_chords_array[1:, :] 
+        midi_file_chords_array = np.concatenate(ks_chords_arrays, axis=0)
+        midi_file_segment_ids = np.concatenate(ks_segment_ids)
         
         print(f"    Generated {midi_file_chords_array.shape[0]} chroma histograms from file.")
+        self.__add_count("bars", midi_file_chords_array.shape[0])
         
         # Remove any rows with a chroma histogram summing to 0, i.e., no harmony notes in the bar
-        midi_file_chords_array = self.__clean_midi_file_chords_array(midi_file_chords_array)
-        
-        # Return chord array with empty chords removed
-        return midi_file_chords_array
+        with self.__profile("chords.clean"):
+            midi_file_chords_array, midi_file_segment_ids = self.__clean_midi_file_chords_array(midi_file_chords_array, midi_file_segment_ids)
+        self.__add_count("chords", midi_file_chords_array.shape[0])
+
+        return midi_file_chords_array, midi_file_segment_ids
 
 # KEY SIGNATURE EXTRACTION / PREDICTION
 
-    def print_key_signatures_in_file(self, midi_file: pm.PrettyMIDI) -> None:
-        if len(midi_file.key_signature_changes) > 0:
-            for i, ks in enumerate(midi_file.key_signature_changes):
+    def print_key_signatures_in_file(self, midi_notes: MIDINotes) -> None:
+        if len(midi_notes.key_signature_changes) > 0:
+            for i, ks in enumerate(midi_notes.key_signature_changes):
                 print(f"    Key sig {i+1}: {ks}")
         else:
             print("    NO KEY SIGNATURES")
 
-    def __predict_key_signature(self, midi_file: pm.PrettyMIDI) -> list[pm.KeySignature]:
-        midi_file_chroma_histogram = midi_file.get_pitch_class_histogram(normalize=True, use_duration=True).reshape(1,-1)
-        key_signature = int(self.key_classifier.predict(midi_file_chroma_histogram)[0]) # Prediction returns 1x1 array, so take first element and make int
-        return pm.KeySignature(key_signature, 0)
+    def get_key_signature_histogram(self, midi_notes: MIDINotes) -> np.ndarray:
+        """Get the (12,) duration weighted, normalised pitch class histogram the key classifier predicts from."""
+        return midi_notes.get_pitch_class_histogram(normalize=True, use_duration=True)
+
+    def predict_key_signatures(self, histograms: np.ndarray) -> list[pm.KeySignature]:
+        """
+        Predict a key signature at time 0 for each of a batch of (x,12) pitch class histograms,
+        in a single call to the key classifier.
+        """
+        with self.__profile("key_signatures.prediction"):
+            key_numbers = self.key_classifier.predict(np.asarray(histograms).reshape(-1, 12))
+        self.__add_count("key_predictions", len(key_numbers))
+        return [pm.KeySignature(int(key_number), 0) for key_number in key_numbers]
 
     def __is_valid_key_signature(self, ks: pm.KeySignature) -> bool:
         if ks.key_number == 0 and ks.time == 0:
@@ -419,25 +508,39 @@ class MIDIFileProcessor:
         
         return key_signatures_cleaned
 
-    def get_key_signatures(self, midi_file: pm.PrettyMIDI) -> list[pm.KeySignature]:
+    def needs_key_signature_prediction(self, midi_notes: MIDINotes) -> bool:
+        """Whether the key signature of the MIDI file has to be predicted, as it has no valid key signature metadata."""
+        if len(midi_notes.key_signature_changes) == 0:
+            return True
+        if len(midi_notes.key_signature_changes) == 1:
+            return not self.__is_valid_key_signature(midi_notes.key_signature_changes[0])
+        return False
+
+    def get_key_signatures(self, midi_notes: MIDINotes, predicted_key_signature: pm.KeySignature = None) -> list[pm.KeySignature]:
         """
         Get a list of key signatures for the MIDI file, either by getting
         directly from the file or predicting it if no key signature in included.
+
+        Parameters:
+            midi_notes:                 MIDINotes. The notes and metadata of the MIDI file.
+            predicted_key_signature:    pm.KeySignature (default None). Key signature already predicted for the file,
+                                        e.g. in a batch with predict_key_signatures(). If None, predicted here if needed.
         """
+        with self.__profile("key_signatures"):
+            return self.__get_key_signatures(midi_notes, predicted_key_signature)
+
+    def __get_key_signatures(self, midi_notes: MIDINotes, predicted_key_signature: pm.KeySignature) -> list[pm.KeySignature]:
         
-        # If none, predict the key from the chroma histogram
-        if len(midi_file.key_signature_changes) == 0:
-            return [self.__predict_key_signature(midi_file)]
+        # If none, or one invalid key signature, predict the key from the chroma histogram
+        if self.needs_key_signature_prediction(midi_notes):
+            if predicted_key_signature is None:
+                predicted_key_signature = self.predict_key_signatures(self.get_key_signature_histogram(midi_notes))[0]
+            return [predicted_key_signature]
         
-        # If one key signature
-        elif len(midi_file.key_signature_changes) == 1:
-            # If valid ks, return as list
-            if self.__is_valid_key_signature(midi_file.key_signature_changes[0]):
-                return midi_file.key_signature_changes
-            # If not valid, predict and return
-            else:
-                return [self.__predict_key_signature(midi_file)]
+        # If one valid key signature, return as list
+        elif len(midi_notes.key_signature_changes) == 1:
+            return midi_notes.key_signature_changes
         
         # If multiple key signatures in file, clean up if necessary then return
         else:
-            return self.__clean_key_signature_list(midi_file.key_signature_changes)
\ No newline at end of file
+            return self.__clean_key_signature_list(midi_notes.key_signature_changes)
\ No newline at end of file
@@ -0,0 +1,461 @@
+import pretty_midi as pm
+import numpy as np
+import struct
+
+# Bump whenever parsing changes, so that cached note arrays from older versions aren't reused
+MIDI_NOTE_LOADER_VERSION = 1
+
+# Same limit as pretty_midi, above which a file is assumed to be corrupt
+MAX_TICK = 1e7
+
+NOTE_DTYPE = np.dtype([
+    ("start", np.float64),
+    ("end", np.float64),
+    ("pitch", np.int16),
+    ("velocity", np.int16)
+])
+
+# Number of data bytes following each system common/real-time status byte
+SYSTEM_MESSAGE_LENGTHS = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0, 0xF8: 0, 0xFA: 0, 0xFB: 0, 0xFC: 0, 0xFE: 0}
+
+class MIDINoteTrack:
+    def __init__(self, notes: np.ndarray, program: int, is_drum: bool, name: str) -> None:
+        """
+        The notes of a single instrument as a structured Numpy array with NOTE_DTYPE fields (start, end, pitch, velocity).
+        Stands in for pm.Instrument, with notes in the same order as pretty_midi would give them.
+        """
+        self.notes = notes
+        self.program = program
+        self.is_drum = is_drum
+        self.name = name
+
+class MIDINotes:
+    def __init__(
+            self,
+            instruments: list[MIDINoteTrack],
+            resolution: int,
+            tick_scales: np.ndarray,
+            time_signatures: np.ndarray,
+            key_signatures: np.ndarray,
+            end_time: float
+        ) -> None:
+
+        """
+        The contents of a MIDI file needed for chord extraction, held as Numpy arrays rather than
+        pretty_midi object graphs. Mirrors the parts of the pm.PrettyMIDI interface used by MIDIFileProcessor,
+        giving the same results for beats, downbeats, key signatures and pitch class histograms.
+
+        Parameters:
+            instruments:        list[MIDINoteTrack]. Instruments in the same order as pm.PrettyMIDI.instruments.
+            resolution:         int. Ticks per quarter note.
+            tick_scales:        np.array of shape (x, 2). Rows of [tick, seconds per tick] for each tempo change.
+            time_signatures:    np.array of shape (x, 3). Rows of [numerator, denominator, time] sorted by time.
+            key_signatures:     np.array of shape (x, 2). Rows of [key number, time].
+            end_time:           float. Time of the last event in the file, as given by pm.PrettyMIDI.get_end_time().
+        """
+
+        self.instruments = instruments
+        self.resolution = resolution
+        self.tick_scales = tick_scales
+        self.time_signatures = time_signatures
+        self.key_signature_changes = [pm.KeySignature(int(key_number), float(ks_time)) for key_number, ks_time in key_signatures]
+        self.end_time = end_time
+
+    def get_end_time(self) -> float:
+        return self.end_time
+
+    def tick_to_time(self, ticks: np.ndarray) -> np.ndarray:
+        """Convert ticks to seconds, computed the same way as pretty_midi's tick to time map."""
+        return _tick_to_time(self.tick_scales, ticks)
+
+    def get_tempo_changes(self) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the times of each tempo change and the tempo in quarter notes per minute."""
+        tempo_change_times = self.tick_to_time(self.tick_scales[:, 0])
+        tempi = 60.0 / (self.tick_scales[:, 1] * self.resolution)
+        return tempo_change_times, tempi
+
+    def get_beats(self, start_time: float = 0.) -> np.ndarray:
+        """Returns beat locations in seconds according to tempo and time signature changes, as pm.PrettyMIDI.get_beats()."""
+
+        tempo_change_times, tempi = self.get_tempo_changes()
+        ts_numerators = [int(numerator) for numerator in self.time_signatures[:, 0]]
+        ts_denominators = [int(denominator) for denominator in self.time_signatures[:, 1]]
+        ts_times = self.time_signatures[:, 2]
+        ts_count = len(ts_times)
+
+        beats = [start_time]
+
+        # Move past all the tempo changes and time signature changes up to the supplied start time
+        tempo_idx = 0
+        while tempo_idx < tempo_change_times.shape[0] - 1 and beats[-1] > tempo_change_times[tempo_idx + 1]:
+            tempo_idx += 1
+        ts_idx = 0
+        while ts_idx < ts_count - 1 and beats[-1] >= ts_times[ts_idx + 1]:
+            ts_idx += 1
+
+        def get_current_bpm() -> float:
+            if ts_count > 0:
+                return pm.qpm_to_bpm(tempi[tempo_idx], ts_numerators[ts_idx], ts_denominators[ts_idx])
+            return tempi[tempo_idx]
+
+        def gt_or_close(a: float, b: float) -> bool:
+            return a > b or np.isclose(a, b)
+
+        end_time = self.get_end_time()
+        while beats[-1] < end_time:
+            bpm = get_current_bpm()
+            next_beat = beats[-1] + 60.0/bpm
+            # If the beat passes a tempo change, spread the beat across the tempo segments it covers
+            if tempo_idx < tempo_change_times.shape[0] - 1 and next_beat > tempo_change_times[tempo_idx + 1]:
+                next_beat = beats[-1]
+                beat_remaining = 1.0
+                while tempo_idx < tempo_change_times.shape[0] - 1 and next_beat + beat_remaining*60.0/bpm >= tempo_change_times[tempo_idx + 1]:
+                    overshot_ratio = (tempo_change_times[tempo_idx + 1] - next_beat)/(60.0/bpm)
+                    next_beat += overshot_ratio*60.0/bpm
+                    beat_remaining -= overshot_ratio
+                    tempo_idx = tempo_idx + 1
+                    bpm = get_current_bpm()
+                next_beat += beat_remaining*60./bpm
+            # Snap to the first time signature change if just passed
+            if ts_count > 0 and ts_idx == 0:
+                current_ts_time = ts_times[ts_idx]
+                if current_ts_time > beats[-1] and gt_or_close(next_beat, current_ts_time):
+                    next_beat = current_ts_time
+            # Snap to the next time signature change if passed
+            if ts_idx < ts_count - 1:
+                next_ts_time = ts_times[ts_idx + 1]
+                if gt_or_close(next_beat, next_ts_time):
+                    next_beat = next_ts_time
+                    ts_idx += 1
+                    bpm = get_current_bpm()
+            beats.append(next_beat)
+
+        # The last beat passes the end time, so don't include it
+        return np.array(beats[:-1])
+
+    def get_downbeats(self, start_time: float = 0.) -> np.ndarray:
+        """Returns downbeat locations in seconds, as pm.PrettyMIDI.get_downbeats()."""
+
+        beats = self.get_beats(start_time)
+
+        # If there are no time signatures or they start after the start time, assume 4/4 from the start time
+        time_signatures = [(int(numerator), float(ts_time)) for numerator, _, ts_time in self.time_signatures]
+        if len(time_signatures) == 0 or time_signatures[0][1] > start_time:
+            time_signatures.insert(0, (4, start_time))
+
+        def index(value: float, default: int) -> int:
+            idx = np.flatnonzero(np.isclose(beats, value))
+            return idx[0] if idx.size > 0 else default
+
+        def beats_per_bar(numerator: int) -> int:
+            # Compound meters count every third beat
+            if numerator % 3 == 0 and numerator != 3:
+                return numerator // 3
+            return numerator
+
+        downbeats = []
+        end_beat_idx = 0
+        for (start_numerator, start_ts_time), (_, end_ts_time) in zip(time_signatures[:-1], time_signatures[1:]):
+            start_beat_idx = index(start_ts_time, 0)
+            end_beat_idx = index(end_ts_time, start_beat_idx)
+            downbeats.append(beats[start_beat_idx:end_beat_idx:beats_per_bar(start_numerator)])
+        final_numerator, final_ts_time = time_signatures[-1]
+        start_beat_idx = index(final_ts_time, end_beat_idx)
+        downbeats.append(beats[start_beat_idx::beats_per_bar(final_numerator)])
+
+        downbeats = np.concatenate(downbeats)
+        return downbeats[downbeats >= start_time]
+
+    def get_pitch_class_histogram(self, use_duration: bool = False, normalize: bool = True) -> np.ndarray:
+        """Returns the histogram of pitch classes over all non-drum instruments, as pm.PrettyMIDI.get_pitch_class_histogram()."""
+        histogram = np.zeros(12)
+        for instrument in self.instruments:
+            if instrument.is_drum:
+                continue
+            notes = instrument.notes
+            weights = notes["end"] - notes["start"] if use_duration else np.ones(notes.size)
+            histogram += np.bincount(notes["pitch"] % 12, weights=weights, minlength=12)
+
+        if normalize:
+            histogram /= (histogram.sum() + (histogram.sum() == 0))
+
+        return histogram
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Flatten into a dict of plain Numpy arrays, e.g. for caching with np.savez."""
+        return {
+            "notes": np.concatenate([instrument.notes for instrument in self.instruments]) if self.instruments else np.zeros(0, dtype=NOTE_DTYPE),
+            "instrument_note_counts": np.array([instrument.notes.size for instrument in self.instruments], dtype=np.int64),
+            "instrument_programs": np.array([instrument.program for instrument in self.instruments], dtype=np.int64),
+            "instrument_is_drum": np.array([instrument.is_drum for instrument in self.instruments], dtype=bool),
+            "instrument_names": np.array([instrument.name for instrument in self.instruments], dtype=str),
+            "resolution": np.array(self.resolution),
+            "tick_scales": self.tick_scales,
+            "time_signatures": self.time_signatures,
+            "key_signatures": np.array([[ks.key_number, ks.time] for ks in self.key_signature_changes], dtype=float).reshape(-1, 2),
+            "end_time": np.array(self.end_time)
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "MIDINotes":
+        """Rebuild from the output of to_arrays()."""
+        instrument_notes = np.split(arrays["notes"], np.cumsum(arrays["instrument_note_counts"])[:-1]) if arrays["instrument_note_counts"].size > 0 else []
+        instruments = [
+            MIDINoteTrack(notes, int(program), bool(is_drum), str(name))
+            for notes, program, is_drum, name in zip(instrument_notes, arrays["instrument_programs"], arrays["instrument_is_drum"], arrays["instrument_names"])
+        ]
+        return cls(
+            instruments,
+            int(arrays["resolution"]),
+            arrays["tick_scales"],
+            arrays["time_signatures"],
+            arrays["key_signatures"],
+            float(arrays["end_time"])
+        )
+
+def _tick_to_time(tick_scales: np.ndarray, ticks: np.ndarray) -> np.ndarray:
+    scale_ticks = tick_scales[:, 0].astype(np.int64)
+    scales = tick_scales[:, 1]
+
+    # Time at the start of each tempo segment
+    scale_start_times = np.zeros(scales.size)
+    for i in range(1, scales.size):
+        scale_start_times[i] = scale_start_times[i-1] + scales[i-1] * (scale_ticks[i] - scale_ticks[i-1])
+
+    ticks = np.asarray(ticks, dtype=np.int64)
+    scale_idx = np.searchsorted(scale_ticks, ticks, side="right") - 1
+
+    return scale_start_times[scale_idx] + scales[scale_idx] * (ticks - scale_ticks[scale_idx])
+
+def _read_variable_int(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+def _get_key_number(sharps_flats: int, mode: int) -> int:
+    """Convert a key signature meta event's sharps/flats count and mode into a pretty_midi key number."""
+    if not -7 <= sharps_flats <= 7 or mode not in (0, 1):
+        raise ValueError(f"Could not decode key with {sharps_flats} sharps/flats and mode {mode}")
+    if mode == 0:
+        return (7 * sharps_flats) % 12
+    return 12 + (7 * sharps_flats + 9) % 12
+
+def parse_midi_notes(data: bytes) -> MIDINotes:
+    """
+    Parse the bytes of a standard MIDI file straight into a MIDINotes object, without building mido messages
+    or pretty_midi Note objects. Notes, instruments, tempo, key and time signatures are interpreted exactly as
+    pm.PrettyMIDI does, so that chords extracted from the result match those extracted from pretty_midi.
+    """
+
+    if data[:4] != b"MThd":
+        raise ValueError("MThd not found. Probably not a MIDI file")
+    header_size = struct.unpack(">L", data[4:8])[0]
+    _, tracks_count, resolution = struct.unpack(">hhh", data[8:14])
+    if resolution <= 0:
+        raise ValueError(f"Unsupported MIDI time division {resolution}")
+
+    # Tempo, key and time signature changes are only read from track 0, as pretty_midi does
+    tick_scales = [(0, 60.0/(120.0*resolution))]
+    time_signatures = []
+    key_signatures = []
+
+    # Ticks of events which count towards the end time of the file, aside from notes and tempo changes
+    event_ticks = []
+
+    # Instrument key (program, channel, track) -> [name, is_drum, program, start ticks, end ticks, pitches, velocities]
+    instrument_map = {}
+    # Control change/pitch bend events seen before an instrument exists on a (channel, track) are "stragglers",
+    # which pretty_midi shares with the first instrument later created on that channel and track
+    straggler_max_ticks = {}
+    attached_stragglers = set()
+
+    max_tick = 0
+    pos = 8 + header_size
+
+    for track_idx in range(tracks_count):
+        chunk_name, chunk_size = struct.unpack(">4sL", data[pos:pos+8])
+        if chunk_name != b"MTrk":
+            raise ValueError("No MTrk header at start of track")
+        pos += 8
+        track_end = pos + chunk_size
+
+        tick = 0
+        last_status = None
+        track_name = ""
+        current_program = [0] * 16
+        # (channel, pitch) -> list of (start tick, velocity) of open notes
+        last_note_on = {}
+
+        while pos < track_end:
+            delta, pos = _read_variable_int(data, pos)
+            tick += delta
+            status = data[pos]
+            pos += 1
+
+            # Running status, re-read the byte as data
+            if status < 0x80:
+                if last_status is None:
+                    raise ValueError("Running status without last status")
+                status = last_status
+                pos -= 1
+            elif status != 0xFF:
+                last_status = status
+
+            # Meta events
+            if status == 0xFF:
+                meta_type = data[pos]
+                length, pos = _read_variable_int(data, pos + 1)
+                meta_data = data[pos:pos+length]
+                pos += length
+
+                if meta_type == 0x03:
+                    track_name = meta_data.decode("latin1")
+                elif meta_type in (0x01, 0x05):
+                    event_ticks.append(tick)
+                elif track_idx == 0 and meta_type == 0x51:
+                    bpm = 6e7/((meta_data[0] << 16) | (meta_data[1] << 8) | meta_data[2])
+                    # Only one tempo is allowed at the beginning, repeated tempos are ignored
+                    if tick == 0:
+                        tick_scales = [(0, 60.0/(bpm*resolution))]
+                    else:
+                        tick_scale = 60.0/(bpm*resolution)
+                        if tick_scale != tick_scales[-1][1]:
+                            tick_scales.append((tick, tick_scale))
+                elif track_idx == 0 and meta_type == 0x59:
+                    sharps_flats = meta_data[0] - 256 if meta_data[0] > 127 else meta_data[0]
+                    key_signatures.append((_get_key_number(sharps_flats, meta_data[1]), tick))
+                elif track_idx == 0 and meta_type == 0x58:
+                    if meta_data[0] <= 0:
+                        raise ValueError(f"Time signature numerator must be greater than 0, but {meta_data[0]} was supplied")
+                    time_signatures.append((meta_data[0], 2 ** meta_data[1], tick))
+
+            # System exclusive events
+            elif status in (0xF0, 0xF7):
+                length, pos = _read_variable_int(data, pos)
+                pos += length
+
+            # Other system messages
+            elif status >= 0xF0:
+                if status not in SYSTEM_MESSAGE_LENGTHS:
+                    raise ValueError(f"Undefined status byte 0x{status:02x}")
+                pos += SYSTEM_MESSAGE_LENGTHS[status]
+
+            # Channel messages
+            else:
+                message_type = status & 0xF0
+                channel = status & 0x0F
+                data_1 = data[pos]
+                if message_type in (0xC0, 0xD0):
+                    data_2 = 0
+                    pos += 1
+                else:
+                    data_2 = data[pos+1]
+                    pos += 2
+                if data_1 > 127 or data_2 > 127:
+                    raise ValueError("Data byte must be in range 0..127")
+
+                if message_type == 0xC0:
+                    current_program[channel] = data_1
+
+                elif message_type == 0x90 and data_2 > 0:
+                    last_note_on.setdefault((channel, data_1), []).append((tick, data_2))
+
+                elif message_type == 0x80 or message_type == 0x90:
+                    key = (channel, data_1)
+                    if key in last_note_on:
+                        # One note-off closes all notes turned on at earlier ticks with the same channel and pitch,
+                        # notes turned on at this same tick stay open
+                        open_notes = last_note_on[key]
+                        notes_to_close = [(start_tick, velocity) for start_tick, velocity in open_notes if start_tick != tick]
+                        notes_to_keep = [(start_tick, velocity) for start_tick, velocity in open_notes if start_tick == tick]
+
+                        if len(notes_to_close) > 0:
+                            program = current_program[channel]
+                            instrument_key = (program, channel, track_idx)
+                            if instrument_key not in instrument_map:
+                                instrument_map[instrument_key] = [track_name, channel == 9, program, [], [], [], []]
+                                if (channel, track_idx) in straggler_max_ticks:
+                                    attached_stragglers.add((channel, track_idx))
+                            instrument = instrument_map[instrument_key]
+                            for start_tick, velocity in notes_to_close:
+                                instrument[3].append(start_tick)
+                                instrument[4].append(tick)
+                                instrument[5].append(data_1)
+                                instrument[6].append(velocity)
+
+                        if len(notes_to_close) > 0 and len(notes_to_keep) > 0:
+                            last_note_on[key] = notes_to_keep
+                        else:
+                            del last_note_on[key]
+
+                elif message_type == 0xB0 or message_type == 0xE0:
+                    if (current_program[channel], channel, track_idx) in instrument_map:
+                        event_ticks.append(tick)
+                    else:
+                        straggler_max_ticks[(channel, track_idx)] = max(tick, straggler_max_ticks.get((channel, track_idx), 0))
+
+        if pos > track_end:
+            raise ValueError("Track data overruns its chunk")
+        max_tick = max(max_tick, tick)
+
+    if max_tick + 1 > MAX_TICK:
+        raise ValueError(f"MIDI file has a largest tick of {max_tick + 1}, it is likely corrupt")
+
+    event_ticks += [straggler_max_ticks[straggler] for straggler in attached_stragglers]
+
+    tick_scales = np.array(tick_scales, dtype=float)
+
+    # Convert everything from ticks to seconds in one go
+    instruments = []
+    for name, is_drum, program, start_ticks, end_ticks, pitches, velocities in instrument_map.values():
+        notes = np.zeros(len(start_ticks), dtype=NOTE_DTYPE)
+        notes["start"] = _tick_to_time(tick_scales, start_ticks)
+        notes["end"] = _tick_to_time(tick_scales, end_ticks)
+        notes["pitch"] = pitches
+        notes["velocity"] = velocities
+        instruments.append(MIDINoteTrack(notes, program, is_drum, name))
+
+    time_signatures_array = np.array(time_signatures, dtype=float).reshape(-1, 3)
+    time_signatures_array[:, 2] = _tick_to_time(tick_scales, time_signatures_array[:, 2])
+    time_signatures_array = time_signatures_array[np.argsort(time_signatures_array[:, 2], kind="stable")]
+
+    key_signatures_array = np.array(key_signatures, dtype=float).reshape(-1, 2)
+    key_signatures_array[:, 1] = _tick_to_time(tick_scales, key_signatures_array[:, 1])
+
+    # End time covers note ends, control changes, pitch bends, text, signatures and tempo changes
+    end_times = [instrument.notes["end"].max() for instrument in instruments if instrument.notes.size > 0]
+    end_times += _tick_to_time(tick_scales, event_ticks).tolist()
+    end_times += time_signatures_array[:, 2].tolist() + key_signatures_array[:, 1].tolist()
+    end_times += _tick_to_time(tick_scales, tick_scales[:, 0]).tolist()
+
+    return MIDINotes(
+        instruments,
+        resolution,
+        tick_scales,
+        time_signatures_array,
+        key_signatures_array,
+        float(max(end_times)) if len(end_times) > 0 else 0.
+    )
+
+def load_midi_notes(midi_file_path: str) -> MIDINotes:
+    """Load a MIDI file from disk into a MIDINotes object."""
+    with open(midi_file_path, "rb") as midi_file:
+        return parse_midi_notes(midi_file.read())
+
+if __name__ == "__main__":
+
+    # Compare against pretty_midi for a file given on the command line
+
+    import sys
+
+    midi_file_path = sys.argv[1]
+    midi_notes = load_midi_notes(midi_file_path)
+    midi_file = pm.PrettyMIDI(midi_file_path)
+
+    print(f"Instruments: {len(midi_notes.instruments)} (pretty_midi: {len(midi_file.instruments)})")
+    print(f"End time: {midi_notes.get_end_time()} (pretty_midi: {midi_file.get_end_time()})")
+    print(f"Downbeats match: {np.array_equal(midi_notes.get_downbeats(), midi_file.get_downbeats())}")
@@ -0,0 +1,120 @@
+import numpy as np
+
+class NumpyKeyClassifier:
+    def __init__(
+            self,
+            support_vectors: np.ndarray,
+            dual_coef: np.ndarray,
+            intercept: np.ndarray,
+            n_support: np.ndarray,
+            classes: np.ndarray,
+            gamma: float
+        ) -> None:
+
+        """
+        A Numpy-only re-implementation of the prediction step of the pickled sklearn SVC key signature classifier,
+        so key signatures can be predicted without importing sklearn or unpickling the model at runtime.
+
+        Use NumpyKeyClassifier.load() to load a classifier exported with export_key_classifier().
+        Predictions follow libsvm's one-vs-one voting, and so match SVC.predict().
+
+        Parameters:
+            support_vectors:    np.array of shape (n_SV, 12). The SVC's support_vectors_.
+            dual_coef:          np.array of shape (n_classes-1, n_SV). The SVC's dual_coef_.
+            intercept:          np.array of shape (n_classes*(n_classes-1)/2,). The SVC's intercept_.
+            n_support:          np.array of shape (n_classes,). The SVC's n_support_.
+            classes:            np.array of shape (n_classes,). The SVC's classes_.
+            gamma:              float. The RBF kernel coefficient actually used by the SVC (its _gamma).
+        """
+
+        self.support_vectors = support_vectors
+        self.dual_coef = dual_coef
+        self.intercept = intercept
+        self.n_support = n_support
+        self.classes = classes
+        self.gamma = gamma
+
+        # Squared norms of the support vectors, reused by every kernel evaluation
+        self.__support_vector_sq_norms = (support_vectors ** 2).sum(axis=1)
+
+        # Class i and class j of each one-vs-one classifier, in libsvm's order, as (n_pairs, n_classes) one-hot
+        # matrices so the votes of a batch can be counted with a matrix product
+        class_pairs = [(i, j) for i in range(classes.size) for j in range(i + 1, classes.size)]
+        self.__pair_class_i = np.eye(classes.size, dtype=np.int64)[[i for i, _ in class_pairs]]
+        self.__pair_class_j = np.eye(classes.size, dtype=np.int64)[[j for _, j in class_pairs]]
+
+        # (n_SV, n_pairs) coefficients, so all one-vs-one decision values are a single matrix product with the kernel.
+        # Coefficients of class i's support vectors against class j are in row j-1 of dual_coef, and of class j's against class i in row i
+        class_sv_starts = np.append(0, np.cumsum(n_support))
+        self.__pair_coef = np.zeros((support_vectors.shape[0], len(class_pairs)))
+        for pair_idx, (i, j) in enumerate(class_pairs):
+            class_i_svs = slice(class_sv_starts[i], class_sv_starts[i+1])
+            class_j_svs = slice(class_sv_starts[j], class_sv_starts[j+1])
+            self.__pair_coef[class_i_svs, pair_idx] = dual_coef[j-1, class_i_svs]
+            self.__pair_coef[class_j_svs, pair_idx] = dual_coef[i, class_j_svs]
+
+    @classmethod
+    def load(cls, npz_path: str) -> "NumpyKeyClassifier":
+        """Load a classifier exported with export_key_classifier()."""
+        with np.load(npz_path, allow_pickle=False) as arrays:
+            return cls(
+                arrays["support_vectors"],
+                arrays["dual_coef"],
+                arrays["intercept"],
+                arrays["n_support"],
+                arrays["classes"],
+                float(arrays["gamma"])
+            )
+
+    def decision_function(self, histograms: np.ndarray) -> np.ndarray:
+        """Returns the (x, n_classes*(n_classes-1)/2) one-vs-one decision values for a batch of (x, 12) histograms."""
+
+        # RBF kernel between every histogram and every support vector
+        sq_distances = (histograms ** 2).sum(axis=1)[:, None] + self.__support_vector_sq_norms[None, :] - 2 * histograms @ self.support_vectors.T
+        kernel = np.exp(-self.gamma * np.maximum(sq_distances, 0))
+
+        return kernel @ self.__pair_coef + self.intercept
+
+    def predict(self, histograms: np.ndarray) -> np.ndarray:
+        """Predict the class of each of a batch of (x, 12) histograms by one-vs-one voting, as SVC.predict()."""
+
+        histograms = np.asarray(histograms, dtype=np.float64).reshape(-1, self.support_vectors.shape[1])
+        decision_values = self.decision_function(histograms)
+
+        # Each pair votes for class i if its decision value is positive, otherwise for class j
+        positive = (decision_values > 0).astype(np.int64)
+        votes = positive @ self.__pair_class_i + (1 - positive) @ self.__pair_class_j
+
+        # Ties go to the lowest class index, as in libsvm
+        return self.classes[np.argmax(votes, axis=1)]
+
+def export_key_classifier(classifier: any, npz_path: str) -> None:
+    """Export the parameters of a fitted sklearn SVC with an RBF kernel for use with NumpyKeyClassifier."""
+    if classifier.kernel != "rbf":
+        raise ValueError(f"Only SVCs with an 'rbf' kernel can be exported. Received kernel '{classifier.kernel}'")
+    np.savez(
+        npz_path,
+        support_vectors=classifier.support_vectors_,
+        dual_coef=classifier.dual_coef_,
+        intercept=classifier.intercept_,
+        n_support=classifier.n_support_,
+        classes=classifier.classes_,
+        gamma=np.array(classifier._gamma)
+    )
+
+if __name__ == "__main__":
+
+    # Export a pickled SVC and check that predictions match: python numpy_key_classifier.py <pkl path> <npz path>
+
+    import sys
+    import joblib
+
+    pkl_path, npz_path = sys.argv[1], sys.argv[2]
+
+    svc = joblib.load(pkl_path)
+    export_key_classifier(svc, npz_path)
+    numpy_classifier = NumpyKeyClassifier.load(npz_path)
+
+    histograms = np.random.default_rng(0).dirichlet(np.ones(12) * 0.5, size=10000)
+    matches = (svc.predict(histograms) == numpy_classifier.predict(histograms)).mean()
+    print(f"Exported to {npz_path}, predictions match SVC for {matches * 100}% of {histograms.shape[0]} random histograms")
\ No newline at end of file
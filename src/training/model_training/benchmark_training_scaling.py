@@ -0,0 +1,82 @@
+"""
+Benchmark training throughput against the number of data-parallel worker processes on this machine, by running
+train_chord_generator.py with each worker count and reading the throughput it records in the training history:
+
+    python benchmark_training_scaling.py <dataset CSV> --worker-counts 1 2 4 8 --epochs 3 --dtype float32 --unroll
+
+Arguments not recognised here are passed on to train_chord_generator.py. The batch size is per worker, so the
+global batch grows with the worker count, and samples/sec is the number to compare between worker counts.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+TRAINING_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_chord_generator.py")
+
+def parse_args(argv: list[str] = None) -> tuple[argparse.Namespace, list[str]]:
+    default_worker_counts = [count for count in [1, 2, 4, 8, 16, 32, 64] if count <= (os.cpu_count() or 1)]
+
+    parser = argparse.ArgumentParser(description="Benchmark training throughput against the number of worker processes.")
+    parser.add_argument("dataset_path", help="Path to the chords dataset CSV file.")
+    parser.add_argument("--worker-counts", type=int, nargs="+", default=default_worker_counts, help="Worker counts to benchmark.")
+    parser.add_argument("--epochs", type=int, default=3, help="Epochs per run. The first is left out of the throughput, as it includes tracing.")
+    parser.add_argument("--output-path", default=None, help="Also write the results to this JSON file.")
+
+    return parser.parse_known_args(argv)
+
+def run_training(dataset_path: str, num_workers: int, epochs: int, training_args: list[str]) -> dict:
+    """Run the training script with the given number of workers, returning the throughput recorded in its history."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        history_path = os.path.join(temp_dir, "history.json")
+        command = [sys.executable, TRAINING_SCRIPT_PATH, dataset_path,
+                   "--num-workers", str(num_workers),
+                   "--epochs", str(epochs),
+                   "--history-path", history_path,
+                   "--no-save", "--verbose", "0", "--log-every-steps", "0",
+                   # Early stopping would end runs at different epochs
+                   "--patience", str(epochs)] + training_args
+        subprocess.run(command, check=True)
+
+        with open(history_path) as history_file:
+            history = json.load(history_file)
+
+    # Leave out the first epoch if there are others, as it includes tracing and warm-up
+    steps_per_sec = history["steps_per_sec"][1:] or history["steps_per_sec"]
+    samples_per_sec = history["samples_per_sec"][1:] or history["samples_per_sec"]
+
+    return {
+        "num_workers": num_workers,
+        "steps_per_sec": sum(steps_per_sec) / len(steps_per_sec),
+        "samples_per_sec": sum(samples_per_sec) / len(samples_per_sec)
+    }
+
+def print_results(results: list[dict]) -> None:
+    baseline = results[0]
+    print(f"{'workers':>8} {'steps/sec':>12} {'samples/sec':>14} {'speedup':>9} {'efficiency':>11}")
+    for result in results:
+        speedup = result["samples_per_sec"] / baseline["samples_per_sec"]
+        efficiency = speedup / (result["num_workers"] / baseline["num_workers"])
+        print(f"{result['num_workers']:>8} {result['steps_per_sec']:>12.2f} {result['samples_per_sec']:>14.1f} {speedup:>8.2f}x {efficiency * 100:>10.1f}%")
+
+def main(argv: list[str] = None) -> None:
+    args, training_args = parse_args(argv)
+
+    results = []
+    for num_workers in args.worker_counts:
+        print(f"Benchmarking {num_workers} worker(s)...")
+        results.append(run_training(args.dataset_path, num_workers, args.epochs, training_args))
+
+    print(f"CPU cores: {os.cpu_count()}")
+    print_results(results)
+
+    if args.output_path is not None:
+        with open(args.output_path, "w") as output_file:
+            json.dump({"cpu_count": os.cpu_count(), "training_args": training_args, "results": results}, output_file, indent=2)
+        print(f"Saved results to {args.output_path}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,156 @@
+"""
+Build a model-free NeighbourChordModel index over the training windows of a chords dataset CSV, and report how it compares
+to a trained model as a degradation tier: single-note latency, fidelity to the model's chords, and memory footprint:
+
+    python build_neighbour_index.py <dataset CSV> --index-dir ./neighbour_index --model-path <saved model> --workers 4
+
+The dataset is formatted and split into windows once into a memory-mapped WindowCache, as for a hyperparameter sweep,
+and only the training windows are indexed, so the test windows it is evaluated on are held out. Windows are hashed by
+worker processes writing to memory-mapped hashes. Use the same --test-size and --sequence-length as for training the
+model; the seed of the split is read from the model's training history, so the test split holds the same songs.
+Run with --help for all options.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+import numpy as np
+import tensorflow as tf
+
+from model_training_utils.window_cache import WindowCache
+from model_training_utils.streaming_metrics import StreamingChordMetrics
+from evaluate_chord_generator import evaluate_models, get_training_random_state
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from chord_generation_utils.neighbour_chord_model import NeighbourChordModel
+from chord_generation_utils.histogram_kernels import normalise_histograms
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build a nearest-neighbour chord index over a chords dataset and compare it to a trained model.")
+
+    # Dataset, with the same defaults as train_chord_generator.py
+    parser.add_argument("dataset_path", help="Path to the chords dataset CSV file.")
+    parser.add_argument("--test-size", type=float, default=0.3, help="Share of the dataset held out for testing.")
+    parser.add_argument("--sequence-length", type=int, default=8, help="Bars per input sequence.")
+    parser.add_argument("--random-state", type=int, default=None, help="Seed of the test/train split, by default the one the model was trained with, read from its history, or drawn and saved in the report without a model.")
+    parser.add_argument("--cache-dir", default=None, help="Directory of the window cache, by default window_cache within the index directory.")
+
+    # Index
+    parser.add_argument("--index-dir", required=True, help="Directory to save the index to.")
+    parser.add_argument("--num-tables", type=int, default=8, help="Hash tables, more finding closer neighbours at a higher latency.")
+    parser.add_argument("--num-bits", type=int, default=16, help="Bits of each table's hash, more giving fewer candidates per hash.")
+    parser.add_argument("--num-neighbours", type=int, default=8, help="Nearest windows whose targets are averaged.")
+    parser.add_argument("--max-candidates", type=int, default=256, help="Most windows of each hash compared exactly.")
+    parser.add_argument("--num-probes", type=int, default=2, help="Least certain bits of each hash flipped to find more candidates.")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes hashing windows in parallel, 0 to hash them in this process.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the hash directions.")
+
+    # Evaluation
+    parser.add_argument("--model-path", default=None, help="Saved model to compare the index to.")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Test windows predicted together.")
+    parser.add_argument("--max-batches", type=int, default=None, help="Only evaluate this many batches, e.g. for a quick comparison.")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.1, 0.14, 0.2], help="Chord note thresholds to compute note precision and recall at.")
+    parser.add_argument("--latency-notes", type=int, default=200, help="Single test windows to time the prediction of.")
+    parser.add_argument("--output-path", default=None, help="Also write the report to this JSON file.")
+
+    return parser.parse_args(argv)
+
+def measure_latency(model: any, input_windows: np.ndarray[float]) -> dict:
+    """Time single-note predictions, each of one input window as ChordGenerator predicts for a melody note."""
+    # Warm up, as the first calls trace a TensorFlow model and page in an index
+    for input_window in input_windows[:10]:
+        model(input_window[np.newaxis])
+
+    latencies_ms = []
+    for input_window in input_windows:
+        start_time = time.perf_counter()
+        np.array(model(input_window[np.newaxis]))
+        latencies_ms.append((time.perf_counter() - start_time) * 1000)
+
+    return {
+        "latency_ms": float(np.median(latencies_ms)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99))
+    }
+
+def measure_fidelity(neighbour_chord_model: NeighbourChordModel, model: any, test_data: tf.data.Dataset, thresholds: list[float], max_batches: int = None) -> dict:
+    """Compare the index's normalised predictions to the model's, taking the model's as targets, so that note precision and recall are of the model's chord notes."""
+    metrics = StreamingChordMetrics(thresholds=thresholds)
+    for batch, (input_windows, _) in enumerate(test_data):
+        if max_batches is not None and batch >= max_batches:
+            break
+        model_predictions = normalise_histograms(np.array(model(input_windows), dtype=np.float64))
+        metrics.update(model_predictions, normalise_histograms(np.array(neighbour_chord_model(input_windows.numpy()), dtype=np.float64)))
+    return metrics.result()
+
+def print_report(report: dict, thresholds: list[float]) -> None:
+    print("------")
+    print(f"Index of {report['index']['num_windows']} windows built in {round(report['index']['build_secs'], 2)} secs, {round(report['index']['footprint']['total'] / 1024**2, 2)} MB mapped into memory")
+    for name, backend in report["backends"].items():
+        notes = ", ".join(f"F1@{threshold} {backend['notes'][str(threshold)]['f1']:.3f}" for threshold in thresholds)
+        print(f"{name}:\t{backend['latency_ms']:.3f} ms per note (p99 {backend['latency_p99_ms']:.3f} ms), {round(backend['bytes'] / 1024**2, 2)} MB, MSE {backend['mse']:.6f}, {notes}")
+    if "fidelity" in report:
+        fidelity = report["fidelity"]
+        notes = ", ".join(f"F1@{threshold} {fidelity['notes'][str(threshold)]['f1']:.3f}" for threshold in thresholds)
+        print(f"Against the model's chords:\tMAE {fidelity['mae']:.6f}, {notes}")
+    print("------")
+
+def main(argv: list[str] = None) -> None:
+    args = parse_args(argv)
+
+    # Split as the model was trained, so that neither is evaluated on songs it was fitted to
+    if args.model_path is not None:
+        args.random_state = get_training_random_state([args.model_path], args.random_state)
+    elif args.random_state is None:
+        args.random_state = int(np.random.randint(0, 2**31))
+    print(f"Test/train split random state: {args.random_state}")
+
+    # Format and split the dataset once, as for a sweep
+    cache_dir = args.cache_dir if args.cache_dir is not None else os.path.join(args.index_dir, "window_cache")
+    window_cache = WindowCache.open_or_create(cache_dir, args.dataset_path, [args.sequence_length], args.test_size, args.random_state)
+    train_window_starts, test_window_starts = window_cache.get_window_starts(args.sequence_length)
+
+    # Index the training windows only
+    build_start_time = time.perf_counter()
+    NeighbourChordModel.build(args.index_dir, window_cache.input_data, window_cache.output_data, train_window_starts, args.sequence_length,
+                              num_tables=args.num_tables, num_bits=args.num_bits, num_workers=args.workers, seed=args.seed)
+    build_secs = time.perf_counter() - build_start_time
+    neighbour_chord_model = NeighbourChordModel(args.index_dir, num_neighbours=args.num_neighbours, max_candidates=args.max_candidates, num_probes=args.num_probes)
+    footprint = neighbour_chord_model.get_footprint()
+
+    models = {"neighbours": neighbour_chord_model}
+    model_bytes = {"neighbours": footprint["total"]}
+    if args.model_path is not None:
+        models["model"] = tf.keras.models.load_model(args.model_path)
+        model_bytes["model"] = sum(weights.nbytes for weights in models["model"].get_weights())
+
+    # Quality against the test targets
+    test_data = window_cache.get_test_data(args.sequence_length, args.batch_size)
+    results = evaluate_models(models, test_data, args.thresholds, args.max_batches)
+
+    # Latency on real test windows, as the candidates of the index depend on them
+    window_starts = np.asarray(test_window_starts[:args.latency_notes])
+    input_windows = window_cache.input_data[window_starts[:, None] + np.arange(args.sequence_length)].astype(np.float32)
+
+    report = {
+        "index": {"num_windows": len(train_window_starts), "build_secs": build_secs, "footprint": footprint},
+        "backends": {name: dict(results["models"][name], **measure_latency(model, input_windows), bytes=model_bytes[name]) for name, model in models.items()},
+        "args": vars(args)
+    }
+    if "model" in models:
+        report["fidelity"] = measure_fidelity(neighbour_chord_model, models["model"], test_data, args.thresholds, args.max_batches)
+
+    print_report(report, args.thresholds)
+
+    if args.output_path is not None:
+        with open(args.output_path, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Saved report to {args.output_path}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,163 @@
+"""
+Evaluate one or more saved chord generator models on the test split of a chords dataset CSV, in one pass over the data:
+
+    python evaluate_chord_generator.py <dataset CSV> <model paths> --test-size 0.3 --random-state 0 --batch-size 4096
+
+Test windows are streamed in large batches, each model predicts every batch, and the metrics of each model are
+accumulated batch by batch (see StreamingChordMetrics), so no predictions are held in memory beyond the current batch.
+Use the same --test-size and --sequence-length as for training, so the test split holds the same songs. The seed of the split
+is read from the history train_chord_generator.py saves next to each model, unless given with --random-state.
+
+Predictions are normalised as ChordGenerator does before chords are generated from them, so the note precision and
+recall at each threshold are those of the chords generated live. Run with --help for all options.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+import numpy as np
+import tensorflow as tf
+
+from model_training_utils.dataset_manager import ChordsDatasetManager
+from model_training_utils.streaming_metrics import StreamingChordMetrics
+
+# Share the histogram kernels of chord generation, so that predictions are normalised as when generating
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from chord_generation_utils.histogram_kernels import normalise_histograms
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Evaluate saved chord generator models on the test split of a chords dataset CSV.")
+
+    # Dataset, with the same defaults as train_chord_generator.py
+    parser.add_argument("dataset_path", help="Path to the chords dataset CSV file.")
+    parser.add_argument("model_paths", nargs="+", help="Saved models to evaluate.")
+    parser.add_argument("--test-size", type=float, default=0.3, help="Share of the dataset held out for testing.")
+    parser.add_argument("--sequence-length", type=int, default=8, help="Bars per input sequence.")
+    parser.add_argument("--random-state", type=int, default=None, help="Seed of the test/train split, by default the one recorded in the models' training history.")
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float32", help="Dtype of the input and output data.")
+
+    # Evaluation
+    parser.add_argument("--batch-size", type=int, default=4096, help="Test windows predicted together by each model.")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.1, 0.14, 0.2], help="Chord note thresholds to compute note precision and recall at.")
+    parser.add_argument("--max-batches", type=int, default=None, help="Only evaluate this many batches, e.g. for a quick comparison.")
+    parser.add_argument("--output-path", default=None, help="Also write the results to this JSON file.")
+
+    return parser.parse_args(argv)
+
+def load_models(model_paths: list[str]) -> dict[str, any]:
+    models = {}
+    for model_path in model_paths:
+        model_load_start_time = time.time()
+        models[model_path] = tf.keras.models.load_model(model_path)
+        print(f"Took {round(time.time() - model_load_start_time, 3)} secs to load model from: {model_path}")
+    return models
+
+def get_training_args(model_path: str) -> dict | None:
+    """Get the arguments a model was trained with from the history saved next to it, in <save dir>/history/<model name>.json, or None if there is none."""
+    model_path = os.path.normpath(model_path)
+    history_path = os.path.join(os.path.dirname(model_path), "history", f"{os.path.basename(model_path)}.json")
+    try:
+        with open(history_path) as history_file:
+            return json.load(history_file).get("args")
+    except (OSError, ValueError):
+        return None
+
+def get_training_random_state(model_paths: list[str], random_state: int = None) -> int:
+    """
+    Get the seed of the test/train split the models were trained with, from their training history, so that they are tested
+    on songs they weren't trained on. Raises a ValueError if it isn't recorded for every model, or differs between them.
+    A given random_state is used as is.
+    """
+    if random_state is not None:
+        return random_state
+
+    training_random_states = {}
+    for model_path in model_paths:
+        training_args = get_training_args(model_path)
+        if training_args is None or training_args.get("random_state") is None:
+            raise ValueError(f"No random state is recorded in the training history of {model_path}. Pass the --random-state it was trained with, "
+                             "as with another split it would be tested on songs it was trained on.")
+        training_random_states[model_path] = training_args["random_state"]
+
+    if len(set(training_random_states.values())) > 1:
+        raise ValueError(f"The models were trained on different test/train splits, so can't be tested on the same songs: {training_random_states}. Evaluate them separately.")
+    return next(iter(training_random_states.values()))
+
+def evaluate_models(models: dict[str, any], test_data: tf.data.Dataset, thresholds: list[float], max_batches: int = None) -> dict:
+    """
+    Evaluate models, or any backends called like one, by name on every batch of (input windows, targets) of the test data in one pass.
+    Returns the metrics and throughput of each model, and the throughput of the whole pass including reading the data.
+    """
+
+    metrics = {name: StreamingChordMetrics(thresholds=thresholds) for name in models}
+    model_secs = {name: 0.0 for name in models}
+
+    pass_start_time = time.perf_counter()
+    num_windows = 0
+    for batch, (input_windows, targets) in enumerate(test_data):
+        if max_batches is not None and batch >= max_batches:
+            break
+        targets = targets.numpy()
+
+        for name, model in models.items():
+            prediction_start_time = time.perf_counter()
+            predictions = normalise_histograms(np.array(model(input_windows), dtype=np.float64))
+            model_secs[name] += time.perf_counter() - prediction_start_time
+            metrics[name].update(targets, predictions)
+
+        num_windows += len(targets)
+        print(f"Evaluated {num_windows} windows...", end="\r")
+    pass_secs = time.perf_counter() - pass_start_time
+    print()
+
+    return {
+        "windows": num_windows,
+        "pass_secs": pass_secs,
+        "pass_windows_per_sec": num_windows / max(pass_secs, 1e-9),
+        "models": {
+            name: dict(metrics[name].result(),
+                       model_secs=model_secs[name],
+                       windows_per_sec=num_windows / max(model_secs[name], 1e-9))
+            for name in models
+        }
+    }
+
+def print_results(results: dict, thresholds: list[float]) -> None:
+    print(f"Evaluated {results['windows']} test windows in {round(results['pass_secs'], 3)} secs ({round(results['pass_windows_per_sec'], 1)} windows/sec)")
+
+    note_columns = "".join(f" {'P/R@' + str(threshold):>14}" for threshold in thresholds)
+    print(f"{'model':<40} {'MSE':>10} {'MAE':>10} {'R²':>8}{note_columns} {'windows/sec':>12}")
+    for name, result in results["models"].items():
+        notes = "".join(f" {result['notes'][str(threshold)]['precision']:>6.3f}/{result['notes'][str(threshold)]['recall']:<7.3f}" for threshold in thresholds)
+        print(f"{name[-40:]:<40} {result['mse']:>10.6f} {result['mae']:>10.6f} {result['r2']:>8.4f}{notes} {result['windows_per_sec']:>12.1f}")
+
+    for name, result in results["models"].items():
+        print(f"Per chroma MSE of {name}: {np.round(result['chroma_mse'], 6).tolist()}")
+
+def main(argv: list[str] = None) -> None:
+    args = parse_args(argv)
+    args.random_state = get_training_random_state(args.model_paths, args.random_state)
+    print(f"Splitting with random state {args.random_state}")
+
+    # Load and split the dataset as for training
+    dataset_manager = ChordsDatasetManager(args.dataset_path, dtype=args.dtype)
+    dataset_manager.format_dataset()
+    dataset_manager.test_train_split(test_size=args.test_size, sequence_length=args.sequence_length, random_state=args.random_state)
+
+    models = load_models(args.model_paths)
+    results = evaluate_models(models, dataset_manager.get_test_data(batch_size=args.batch_size), args.thresholds, args.max_batches)
+    print_results(results, args.thresholds)
+
+    if args.output_path is not None:
+        with open(args.output_path, "w") as output_file:
+            json.dump(dict(results, args=vars(args)), output_file, indent=2)
+        print(f"Saved results to {args.output_path}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
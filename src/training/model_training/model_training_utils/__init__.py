@@ -1,4 +1,6 @@
+import os
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
 import tensorflow
 from tensorflow import keras
-from keras.models import Model 
-from keras.layers import LSTM, Dense
\ No newline at end of file
+from tensorflow.keras.models import Model 
+from tensorflow.keras.layers import LSTM, Dense
\ No newline at end of file
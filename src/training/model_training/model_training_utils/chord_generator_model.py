@@ -1,6 +1,6 @@
 import tensorflow as tf
 from tensorflow import keras
-from keras.models import Model
+from tensorflow.keras.models import Model
 from .layers import CustomLSTMLayer1, CustomLSTMLayer2, CustomLSTMLayer3, OutputLayer
 
 class ChordGeneratorModel(Model):
@@ -11,25 +11,47 @@ class ChordGeneratorModel(Model):
             lstm3_units: int,
             num_inputs: int = 13,
             num_outputs: int = 12,
-            dropout = 0.25
+            dropout = 0.25,
+            unroll: bool = False
         ) -> None:
 
+        """
+        Three stacked LSTM layers followed by a dense output layer.
+
+        The LSTM layers keep Keras' defaults for activations, bias and recurrent dropout, which is what its fused LSTM
+        kernels require. unroll=True replaces the recurrent loop with sequence_length copies of the step, which is
+        usually faster on CPU for short sequences like ours, and lets XLA fuse across time steps, at the cost of
+        requiring a fixed sequence length and more memory.
+
+        Parameters:
+            lstm1_units:    int. Units in the first LSTM layer.
+            lstm2_units:    int. Units in the second LSTM layer.
+            lstm3_units:    int. Units in the third LSTM layer.
+            num_inputs:     int (default 13). Features per time step.
+            num_outputs:    int (default 12). Size of the output chroma histogram.
+            dropout:        float (default 0.25). Input dropout of each LSTM layer.
+            unroll:         bool (default False). Whether to unroll the LSTM layers.
+        """
+
         super(ChordGeneratorModel, self).__init__()
         
         self.__lstm1 = CustomLSTMLayer1(
             lstm1_units,
             num_inputs,
-            dropout=dropout
+            dropout=dropout,
+            unroll=unroll
         )
 
         self.__lstm2 = CustomLSTMLayer2(
             lstm2_units,
-            dropout=dropout
+            dropout=dropout,
+            unroll=unroll
         )
 
         self.__lstm3 = CustomLSTMLayer3(
             lstm3_units,
-            dropout=dropout
+            dropout=dropout,
+            unroll=unroll
         )
 
         self.__output_layer = OutputLayer(
@@ -4,11 +4,12 @@ from sklearn import model_selection
 import os
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
 
 import tensorflow as tf
 
 class ChordsDatasetManager:
-    def __init__(self, dataset_path: str) -> None:
+    def __init__(self, dataset_path: str, dtype: str = "float64") -> None:
         
         """
         A class that takes in the path to a dataset, and does all the necessary processing
@@ -17,15 +18,21 @@ class ChordsDatasetManager:
 
         Parameters:
             dataset_path: str      A relative or absolute path to the dataset CSV file.
+            dtype: str             (default "float64") Dtype of the chroma columns and of the input and output
+                                   data, e.g. "float32" to halve memory use and skip the cast inside the model.
         """
 
         # The columns expected to be found in the CSV file
         self.__EXPECTED_CSV_COLUMNS = ["melody_chroma", "0", "1", "2", "3", "4",
                                      "5", "6", "7", "8", "9", "10", "11"]
 
-        # Load the dataset CSV file
+        # Optional columns recording song and key signature segment boundaries
+        self.__BOUNDARY_COLUMNS = ["song_id", "segment_id"]
+
+        # Load the dataset CSV file, parsing the chroma columns straight into the requested dtype
         self.__DATASET_PATH = dataset_path
-        self.__dataset = pd.read_csv(self.__DATASET_PATH)
+        self.__DTYPE = np.dtype(dtype)
+        self.__dataset = pd.read_csv(self.__DATASET_PATH, dtype={column_name: self.__DTYPE for column_name in self.__EXPECTED_CSV_COLUMNS})
         print("Loaded dataset from file...")
         
         # Remove rows containing NaN values
@@ -33,14 +40,20 @@ class ChordsDatasetManager:
 
         # Check that all the expected columns are in the loaded CSV file
         for column_name in self.__dataset.columns.to_list():
-            if column_name not in self.__EXPECTED_CSV_COLUMNS:
+            if column_name not in self.__EXPECTED_CSV_COLUMNS + self.__BOUNDARY_COLUMNS:
                 raise ValueError(f"Incorrect columns in loaded data frame. Expected {self.__EXPECTED_CSV_COLUMNS}, but found {self.__dataset.columns.to_list()}.")
 
+        # Datasets extracted before boundaries were recorded are treated as one long sequence
+        self.__has_boundaries = all(column_name in self.__dataset.columns for column_name in self.__BOUNDARY_COLUMNS)
+        if not self.__has_boundaries:
+            print("No song_id/segment_id columns found, falling back to row-level splitting...")
+
         # Create a copy to be modified by later processes
         self.__formatted_dataset = self.__dataset.copy()
         
         self.__is_formatted = False
         self.__is_test_train_split = False
+        self.__indexed_sequence_length = None
 
         # Define new input column names
         self.__NEW_INPUT_COLUMN_NAMES = {"0":"input_0", "1":"input_1", "2":"input_2",
@@ -63,6 +76,12 @@ class ChordsDatasetManager:
             input_chroma_columns = input_chroma_columns.shift(periods=1, fill_value=0)
             input_chroma_columns.rename(columns=self.__NEW_INPUT_COLUMN_NAMES, inplace=True)
 
+            # Don't carry the previous song's (or key segment's) last chord into the first bar of the next one
+            if self.__has_boundaries:
+                segment_start_mask = self.__get_segment_start_mask()
+                input_chroma_columns.loc[segment_start_mask] = 0
+                self.__index_segments(segment_start_mask)
+
             # Rename chroma columns to be outputs
             self.__formatted_dataset.rename(columns=self.__NEW_OUTPUT_COLUMN_NAMES, inplace=True)
 
@@ -86,8 +105,8 @@ class ChordsDatasetManager:
                         "output_6", "output_7", "output_8",
                         "output_9", "output_10", "output_11"]
 
-            self.__input_data = self.__formatted_dataset[input_cols].to_numpy()
-            self.__output_data = self.__formatted_dataset[output_cols].to_numpy()
+            self.__input_data = self.__formatted_dataset[input_cols].to_numpy(dtype=self.__DTYPE)
+            self.__output_data = self.__formatted_dataset[output_cols].to_numpy(dtype=self.__DTYPE)
 
             print("Generated input and output data arrays...")
             print(f"Input data shape:  {self.__input_data.shape}")
@@ -101,15 +120,164 @@ class ChordsDatasetManager:
         else:
             print("Dataset already formatted, bypassing...")
 
+    def __get_segment_start_mask(self) -> np.ndarray:
+        """Boolean mask of the rows which start a new song or key signature segment."""
+        song_ids = self.__formatted_dataset["song_id"].to_numpy()
+        segment_ids = self.__formatted_dataset["segment_id"].to_numpy()
+
+        segment_start_mask = np.ones(song_ids.shape[0], dtype=bool)
+        segment_start_mask[1:] = (song_ids[1:] != song_ids[:-1]) | (segment_ids[1:] != segment_ids[:-1])
+
+        return segment_start_mask
+
+    def __index_segments(self, segment_start_mask: np.ndarray) -> None:
+        """Store the start row, length and song of every segment, used to build windows inside segments only."""
+        self.__segment_starts = np.flatnonzero(segment_start_mask)
+        self.__segment_lengths = np.diff(np.append(self.__segment_starts, segment_start_mask.size))
+
+        # Integer code for the song each segment belongs to
+        song_codes, _ = pd.factorize(self.__formatted_dataset["song_id"])
+        self.__segment_songs = song_codes[self.__segment_starts]
+        self.__songs_count = self.__segment_songs.max() + 1 if self.__segment_songs.size > 0 else 0
+
+        print(f"Found {self.__songs_count} songs and {self.__segment_starts.size} key signature segments...")
+
+    def __index_windows(self, sequence_length: int) -> None:
+        """
+        Precompute the start row of every window of sequence_length rows that lies inside a single segment.
+        Windows are stored grouped by segment, so that the windows of segment i are
+        self.__window_starts[self.__window_offsets[i]:self.__window_offsets[i+1]].
+        """
+        windows_per_segment = np.maximum(self.__segment_lengths - sequence_length + 1, 0)
+        self.__window_offsets = np.append(0, np.cumsum(windows_per_segment))
+
+        # Offset of each window from the start of its own segment
+        window_segment_starts = np.repeat(self.__segment_starts, windows_per_segment)
+        window_positions = np.arange(self.__window_offsets[-1]) - np.repeat(self.__window_offsets[:-1], windows_per_segment)
+        self.__window_starts = window_segment_starts + window_positions
+
+        self.__indexed_sequence_length = sequence_length
+        print(f"Indexed {self.__window_starts.size} windows of length {sequence_length} inside segments...")
+
+    def __split_segments_by_song(self, test_size: float, rng: np.random.Generator) -> np.ndarray:
+        """Assign whole songs to the test split until it holds test_size of the windows. Returns a test mask over segments."""
+        windows_per_segment = np.diff(self.__window_offsets)
+        windows_per_song = np.bincount(self.__segment_songs, weights=windows_per_segment, minlength=self.__songs_count)
+
+        # Take songs in random order until the test split holds the requested share of windows
+        song_order = rng.permutation(self.__songs_count)
+        test_song_count = np.searchsorted(np.cumsum(windows_per_song[song_order]), test_size * windows_per_segment.sum()) + 1
+        is_test_song = np.zeros(self.__songs_count, dtype=bool)
+        is_test_song[song_order[:test_song_count]] = True
+
+        return is_test_song[self.__segment_songs]
+
+    def __get_segments_window_starts(self, segment_mask: np.ndarray) -> np.ndarray:
+        """Gather the precomputed window starts of the selected segments."""
+        selected_segments = np.flatnonzero(segment_mask)
+        if selected_segments.size == 0:
+            return np.zeros(0, dtype=self.__window_starts.dtype)
+        return np.concatenate([self.__window_starts[self.__window_offsets[i]:self.__window_offsets[i+1]] for i in selected_segments])
+
+    def __make_windowed_dataset(self, window_starts: np.ndarray, sequence_length: int, batch_size: int) -> tf.data.Dataset:
+        """
+        Create a tf.data.Dataset yielding (input window, target) batches by gathering from the full arrays.
+        As with tf.keras.utils.timeseries_dataset_from_array, the target of a window is the output row at its start.
+        """
+        window_offsets = tf.range(sequence_length, dtype=tf.int64)
+        input_tensor = self.__input_tensor
+        output_tensor = self.__output_tensor
+
+        def gather_windows(starts):
+            return (tf.gather(input_tensor, starts[:, None] + window_offsets),
+                    tf.gather(output_tensor, starts))
+
+        dataset = tf.data.Dataset.from_tensor_slices(window_starts.astype(np.int64))
+        dataset = dataset.batch(batch_size).map(gather_windows, num_parallel_calls=tf.data.AUTOTUNE)
+
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    def get_split_window_starts(
+            self,
+            test_size: float = None,
+            sequence_length: int = 8,
+            random_state: int = None
+        ) -> tuple[np.ndarray, np.ndarray]:
+
+        """
+        Split the windows of sequence_length rows by song, as test_train_split() does, without building the datasets.
+        Returns the start rows of the shuffled training windows and of the test windows, which index the arrays of
+        get_input_data() and get_output_data(), e.g., to gather windows outside of TensorFlow.
+        Only supported for datasets with song_id/segment_id columns.
+        """
+        if not self.__is_formatted:
+            raise ValueError(f"Dataset has not been formatted. Must run DatasetManager.format_dataset() first.")
+        if not self.__has_boundaries:
+            raise ValueError("Splitting windows by song requires a dataset with song_id/segment_id columns.")
+
+        # Same default as sklearn's train_test_split
+        if test_size is None:
+            test_size = 0.25
+
+        # Windows only need indexing once per sequence length
+        if self.__indexed_sequence_length != sequence_length:
+            self.__index_windows(sequence_length)
+
+        # Split by song, so no song contributes windows to both training and testing data
+        rng = np.random.default_rng(random_state)
+        test_segment_mask = self.__split_segments_by_song(test_size, rng)
+
+        train_window_starts = rng.permutation(self.__get_segments_window_starts(~test_segment_mask))
+        test_window_starts = self.__get_segments_window_starts(test_segment_mask)
+
+        print("Split dataset into training & testing data by song...")
+        print("---")
+        print(f"Train songs:\t{np.unique(self.__segment_songs[~test_segment_mask]).size}")
+        print(f"Test songs:\t{np.unique(self.__segment_songs[test_segment_mask]).size}")
+        print(f"Train windows:\t{train_window_starts.size}")
+        print(f"Test windows:\t{test_window_starts.size}")
+        print("------")
+
+        return train_window_starts, test_window_starts
+
     def test_train_split(
             self,
             test_size: float = None,
             sequence_length: int = 8,
-            batch_size: int = 64
+            batch_size: int = 64,
+            random_state: int = None
+        ) -> None:
+
+        if not self.__has_boundaries:
+            self.__row_level_test_train_split(test_size, sequence_length, batch_size, random_state)
+            return
+
+        self.__train_window_starts, self.__test_window_starts = self.get_split_window_starts(test_size, sequence_length, random_state)
+
+        # Full arrays are held once and shared between both datasets, windows are gathered per batch
+        self.__input_tensor = tf.constant(self.__input_data)
+        self.__output_tensor = tf.constant(self.__output_data)
+
+        self.__dataset_train = self.__make_windowed_dataset(self.__train_window_starts, sequence_length, batch_size)
+        self.__dataset_test = self.__make_windowed_dataset(self.__test_window_starts, sequence_length, batch_size)
+        self.__split_sequence_length = sequence_length
+        self.__split_batch_size = batch_size
+
+        self.__output_data_test = self.__output_data[self.__test_window_starts]
+
+        # Update boolean
+        self.__is_test_train_split = True
+
+    def __row_level_test_train_split(
+            self,
+            test_size: float,
+            sequence_length: int,
+            batch_size: int,
+            random_state: int
         ) -> None:
         
         # Splitting the dataset into training and testing
-        self.__input_data_train, self.__input_data_test, self.__output_data_train, self.__output_data_test = model_selection.train_test_split(self.__input_data, self.__output_data, test_size=test_size)
+        self.__input_data_train, self.__input_data_test, self.__output_data_train, self.__output_data_test = model_selection.train_test_split(self.__input_data, self.__output_data, test_size=test_size, random_state=random_state)
 
         print("Split dataset into training & testing data...")
         print("---")
@@ -143,12 +311,50 @@ class ChordsDatasetManager:
         else:
             raise ValueError(f"Dataset has not been split into training and testing data. Must run DatasetManager.format() and DatasetManager.test_train_split() first.")
         
-    def get_test_data(self) -> tf.data.Dataset:
-        if self.__is_test_train_split:
-            return self.__dataset_test
-        else:
+    def get_training_data_shard(self, num_shards: int, shard_index: int) -> tf.data.Dataset:
+        """
+        Get one of num_shards disjoint parts of the training data, batched with the batch size given to test_train_split(),
+        for data-parallel training where each worker reads only its own shard.
+
+        Every shard holds the same number of windows, dropping up to num_shards-1 windows in total, so that all workers
+        run the same number of steps per epoch. Only supported for datasets with song_id/segment_id columns.
+        """
+        if not self.__is_test_train_split:
             raise ValueError(f"Dataset has not been split into training and testing data. Must run DatasetManager.format_dataset() and DatasetManager.test_train_split() first.")
+        if not self.__has_boundaries:
+            raise ValueError("Sharding training data requires a dataset with song_id/segment_id columns.")
+
+        windows_per_shard = self.__train_window_starts.size // num_shards
+        shard_window_starts = self.__train_window_starts[shard_index::num_shards][:windows_per_shard]
+
+        return self.__make_windowed_dataset(shard_window_starts, self.__split_sequence_length, self.__split_batch_size)
+
+    def get_test_data(self, batch_size: int = None) -> tf.data.Dataset:
+        """
+        Get the test data, batched with the batch size given to test_train_split(), or another batch size, e.g., a larger one
+        for evaluation. Each batch holds the input windows and their targets, so predictions stay aligned with their targets.
+        """
+        if not self.__is_test_train_split:
+            raise ValueError(f"Dataset has not been split into training and testing data. Must run DatasetManager.format_dataset() and DatasetManager.test_train_split() first.")
+
+        if batch_size is None:
+            return self.__dataset_test
+        if self.__has_boundaries:
+            return self.__make_windowed_dataset(self.__test_window_starts, self.__split_sequence_length, batch_size)
+        return self.__dataset_test.unbatch().batch(batch_size).prefetch(tf.data.AUTOTUNE)
         
+    def get_input_data(self) -> np.ndarray:
+        """Get the input rows of the formatted dataset, the melody chroma followed by the previous chord's chroma histogram."""
+        if not self.__is_formatted:
+            raise ValueError(f"Dataset has not been formatted. Must run DatasetManager.format_dataset() first.")
+        return self.__input_data
+
+    def get_output_data(self) -> np.ndarray:
+        """Get the output rows of the formatted dataset, the chroma histogram of each bar's chord."""
+        if not self.__is_formatted:
+            raise ValueError(f"Dataset has not been formatted. Must run DatasetManager.format_dataset() first.")
+        return self.__output_data
+
     def get_raw_dataset(self) -> pd.DataFrame:
         return self.__dataset
     
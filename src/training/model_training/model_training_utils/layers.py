@@ -1,13 +1,14 @@
 import tensorflow as tf
 from tensorflow import keras
-from keras.layers import Layer, LSTM, Dense
+from tensorflow.keras.layers import Layer, LSTM, Dense
 
 class CustomLSTMLayer1(Layer):
     def __init__(
             self,
             units: int,
             num_inputs: int,
-            dropout: float
+            dropout: float,
+            unroll: bool = False
         ) -> None:
         
         super(CustomLSTMLayer1, self).__init__()
@@ -16,7 +17,8 @@ class CustomLSTMLayer1(Layer):
             units,
             return_sequences=True,
             input_shape=(None, num_inputs),
-            dropout=dropout
+            dropout=dropout,
+            unroll=unroll
         )
 
     def call(self, inputs):
@@ -26,7 +28,8 @@ class CustomLSTMLayer2(Layer):
     def __init__(
             self,
             units: int,
-            dropout: float
+            dropout: float,
+            unroll: bool = False
         ) -> None:
 
         super(CustomLSTMLayer2, self).__init__()
@@ -34,7 +37,8 @@ class CustomLSTMLayer2(Layer):
         self.lstm = LSTM(
             units,
             return_sequences=True,
-            dropout=dropout
+            dropout=dropout,
+            unroll=unroll
         )
 
     def call(self, inputs):
@@ -44,7 +48,8 @@ class CustomLSTMLayer3(Layer):
     def __init__(
             self,
             units: int,
-            dropout: float
+            dropout: float,
+            unroll: bool = False
         ) -> None:
 
         super(CustomLSTMLayer3, self).__init__()
@@ -52,7 +57,8 @@ class CustomLSTMLayer3(Layer):
         self.lstm = LSTM(
             units,
             return_sequences=False,
-            dropout=dropout
+            dropout=dropout,
+            unroll=unroll
         )
 
     def call(self, inputs):
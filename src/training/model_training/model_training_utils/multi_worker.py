@@ -0,0 +1,75 @@
+"""
+Helpers for data-parallel training with several worker processes on one machine, using
+tf.distribute.MultiWorkerMirroredStrategy. Each worker finds its place in the cluster from the
+TF_CONFIG environment variable, which launch_local_workers() sets for every process it starts.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+
+def get_free_ports(count: int) -> list[int]:
+    """Get count currently unused TCP ports on localhost."""
+    sockets = []
+    try:
+        for _ in range(count):
+            port_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            port_socket.bind(("localhost", 0))
+            sockets.append(port_socket)
+        return [port_socket.getsockname()[1] for port_socket in sockets]
+    finally:
+        for port_socket in sockets:
+            port_socket.close()
+
+def make_tf_config(worker_addresses: list[str], worker_index: int) -> dict:
+    """Get the TF_CONFIG of the worker at worker_index in a cluster of the given workers."""
+    return {
+        "cluster": {"worker": worker_addresses},
+        "task": {"type": "worker", "index": worker_index}
+    }
+
+def get_worker_index() -> int | None:
+    """Get the index of this process in the cluster from TF_CONFIG, or None if not running as a worker."""
+    if "TF_CONFIG" not in os.environ:
+        return None
+    return json.loads(os.environ["TF_CONFIG"])["task"]["index"]
+
+def is_chief() -> bool:
+    """Whether this process is the chief, i.e., worker 0 or not a worker at all, and so should save and print results."""
+    return get_worker_index() in (None, 0)
+
+def launch_local_workers(script_path: str, script_args: list[str], num_workers: int) -> int:
+    """
+    Run num_workers copies of a Python script on this machine as a MultiWorkerMirroredStrategy cluster,
+    each with its own TF_CONFIG, and wait for them to finish. If any worker fails, the others are stopped,
+    as they would otherwise wait on it forever.
+
+    Returns the first non-zero worker exit code, or 0 if all workers succeeded.
+    """
+    worker_addresses = [f"localhost:{port}" for port in get_free_ports(num_workers)]
+
+    processes = []
+    for worker_index in range(num_workers):
+        worker_env = dict(os.environ, TF_CONFIG=json.dumps(make_tf_config(worker_addresses, worker_index)))
+        processes.append(subprocess.Popen([sys.executable, script_path] + script_args, env=worker_env))
+    print(f"Launched {num_workers} workers at {', '.join(worker_addresses)}")
+
+    # Wait for all workers, stopping the rest as soon as one fails
+    exit_code = 0
+    remaining = list(processes)
+    while remaining:
+        for process in list(remaining):
+            try:
+                return_code = process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                continue
+            remaining.remove(process)
+            if return_code != 0 and exit_code == 0:
+                exit_code = return_code
+                print(f"Worker {processes.index(process)} failed with exit code {return_code}, stopping the other workers...")
+                for other_process in remaining:
+                    other_process.terminate()
+
+    return exit_code
\ No newline at end of file
@@ -0,0 +1,124 @@
+import numpy as np
+
+class StreamingChordMetrics:
+    def __init__(self, thresholds: list[float] = [0.1, 0.14, 0.2], num_outputs: int = 12) -> None:
+
+        """
+        Metrics of predicted chroma histograms against their targets, accumulated batch by batch, so that a whole
+        test split can be evaluated without holding all of its predictions in memory. Only per-chroma sums are kept.
+
+        - MSE and MAE, overall and per chroma.
+        - R² per chroma, and their mean, as sklearn.metrics.r2_score's default "uniform_average".
+          The variance of the targets is accumulated with Chan et al.'s parallel algorithm, which stays accurate over many batches.
+        - Note precision, recall and F1 at each threshold, a chroma being a chord note when above the threshold,
+          in both the prediction and the target, as when a chord is voiced.
+
+        Parameters:
+            thresholds:     list[float] (default [0.1, 0.14, 0.2]). Chord note thresholds to compute note precision and recall at.
+            num_outputs:    int (default 12). Size of the chroma histograms.
+        """
+
+        self.THRESHOLDS = thresholds
+        self.NUM_OUTPUTS = num_outputs
+        self.reset()
+
+    def reset(self) -> None:
+        self.count = 0
+        self.squared_error_sums = np.zeros(self.NUM_OUTPUTS)
+        self.absolute_error_sums = np.zeros(self.NUM_OUTPUTS)
+
+        # Running mean and sum of squared deviations of the targets, per chroma
+        self.target_means = np.zeros(self.NUM_OUTPUTS)
+        self.target_squared_deviation_sums = np.zeros(self.NUM_OUTPUTS)
+
+        # True positive, false positive and false negative chord notes at each threshold
+        self.note_counts = np.zeros((len(self.THRESHOLDS), 3), dtype=np.int64)
+
+    def update(self, targets: np.ndarray[float], predictions: np.ndarray[float]) -> None:
+        """Add a batch of targets and predictions, each of shape (batch size, num_outputs)."""
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, self.NUM_OUTPUTS)
+        predictions = np.asarray(predictions, dtype=np.float64).reshape(-1, self.NUM_OUTPUTS)
+        if targets.shape != predictions.shape:
+            raise ValueError(f"Targets and predictions must have the same shape. Received {targets.shape} and {predictions.shape}.")
+
+        batch_count = targets.shape[0]
+        if batch_count == 0:
+            return
+
+        errors = predictions - targets
+        self.squared_error_sums += (errors ** 2).sum(axis=0)
+        self.absolute_error_sums += np.abs(errors).sum(axis=0)
+
+        # Merge the batch's target mean and squared deviations into the running ones
+        batch_means = targets.mean(axis=0)
+        batch_squared_deviation_sums = ((targets - batch_means) ** 2).sum(axis=0)
+        total_count = self.count + batch_count
+        deltas = batch_means - self.target_means
+        self.target_means += deltas * batch_count / total_count
+        self.target_squared_deviation_sums += batch_squared_deviation_sums + deltas ** 2 * self.count * batch_count / total_count
+        self.count = total_count
+
+        for i, threshold in enumerate(self.THRESHOLDS):
+            predicted_notes = predictions > threshold
+            target_notes = targets > threshold
+            self.note_counts[i] += [
+                np.count_nonzero(predicted_notes & target_notes),
+                np.count_nonzero(predicted_notes & ~target_notes),
+                np.count_nonzero(~predicted_notes & target_notes)
+            ]
+
+    def result(self) -> dict:
+        """Get the metrics of all batches added so far as a dict of floats and lists, e.g., for saving to JSON."""
+        count = max(self.count, 1)
+        chroma_mse = self.squared_error_sums / count
+        chroma_mae = self.absolute_error_sums / count
+
+        # Chromas whose targets never vary have an undefined R², left out of the mean as sklearn scores them 1 or 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            chroma_r2 = 1 - self.squared_error_sums / self.target_squared_deviation_sums
+        chroma_r2[self.target_squared_deviation_sums == 0] = np.nan
+
+        notes = {}
+        for threshold, (true_positives, false_positives, false_negatives) in zip(self.THRESHOLDS, self.note_counts):
+            precision = true_positives / max(true_positives + false_positives, 1)
+            recall = true_positives / max(true_positives + false_negatives, 1)
+            notes[str(threshold)] = {
+                "precision": float(precision),
+                "recall": float(recall),
+                "f1": float(2 * precision * recall / max(precision + recall, 1e-12))
+            }
+
+        return {
+            "count": int(self.count),
+            "mse": float(chroma_mse.mean()),
+            "mae": float(chroma_mae.mean()),
+            "r2": float(np.nanmean(chroma_r2)) if not np.isnan(chroma_r2).all() else float("nan"),
+            "chroma_mse": chroma_mse.tolist(),
+            "chroma_mae": chroma_mae.tolist(),
+            "chroma_r2": chroma_r2.tolist(),
+            "notes": notes
+        }
+
+if __name__ == "__main__":
+
+    from sklearn import metrics
+
+    # Check that metrics accumulated over uneven batches match those computed on all the data at once
+    rng = np.random.default_rng(0)
+    targets = rng.dirichlet(np.full(12, 0.3), size=20000) + 1000 # Offset to check the variance stays accurate
+    predictions = targets + rng.normal(0, 0.05, targets.shape)
+
+    streaming_metrics = StreamingChordMetrics(thresholds=[1000.1, 1000.2])
+    batch_ends = np.sort(rng.choice(np.arange(1, len(targets)), size=40, replace=False))
+    for batch_targets, batch_predictions in zip(np.split(targets, batch_ends), np.split(predictions, batch_ends)):
+        streaming_metrics.update(batch_targets, batch_predictions)
+    result = streaming_metrics.result()
+
+    print(f"MSE matches: {np.isclose(result['mse'], metrics.mean_squared_error(targets, predictions))}")
+    print(f"MAE matches: {np.isclose(result['mae'], metrics.mean_absolute_error(targets, predictions))}")
+    print(f"R² matches: {np.isclose(result['r2'], metrics.r2_score(targets, predictions))}")
+    print(f"Per chroma R² matches: {np.allclose(result['chroma_r2'], metrics.r2_score(targets, predictions, multioutput='raw_values'))}")
+    for threshold in streaming_metrics.THRESHOLDS:
+        precision = metrics.precision_score((targets > threshold).ravel(), (predictions > threshold).ravel())
+        recall = metrics.recall_score((targets > threshold).ravel(), (predictions > threshold).ravel())
+        print(f"Threshold {threshold} precision and recall match: {np.isclose(result['notes'][str(threshold)]['precision'], precision) and np.isclose(result['notes'][str(threshold)]['recall'], recall)}")
\ No newline at end of file
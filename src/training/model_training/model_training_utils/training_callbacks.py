@@ -0,0 +1,64 @@
+import time
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras.callbacks import Callback
+
+class StepsPerSecondLogger(Callback):
+    def __init__(self, batch_size: int, log_every_steps: int = 100) -> None:
+
+        """
+        A callback printing training throughput in steps/sec and samples/sec every log_every_steps steps,
+        and adding each epoch's throughput to the training history as "steps_per_sec" and "samples_per_sec".
+
+        The first step of training includes tracing (and XLA compilation if enabled), so it is reported
+        separately and left out of the first epoch's throughput.
+
+        Parameters:
+            batch_size:         int. Samples per training step.
+            log_every_steps:    int (default 100). Interval in steps between throughput prints, 0 to only print per epoch.
+        """
+
+        super(StepsPerSecondLogger, self).__init__()
+
+        self.BATCH_SIZE = batch_size
+        self.LOG_EVERY_STEPS = log_every_steps
+
+        self.__is_first_step = True
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.__epoch_start_time = time.perf_counter()
+        self.__epoch_start_step = 0
+        self.__interval_start_time = self.__epoch_start_time
+        self.__interval_start_step = 0
+        self.__steps_done = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        # The batch index is that of the last step run, which also counts steps correctly with steps_per_execution > 1
+        self.__steps_done = batch + 1
+        step_end_time = time.perf_counter()
+
+        # Leave tracing/compilation time out of the throughput
+        if self.__is_first_step:
+            print(f"\nFirst step (including tracing/compilation) took {round(step_end_time - self.__epoch_start_time, 3)} secs")
+            self.__is_first_step = False
+            self.__epoch_start_time = self.__interval_start_time = step_end_time
+            self.__epoch_start_step = self.__interval_start_step = self.__steps_done
+            return
+
+        if self.LOG_EVERY_STEPS > 0 and self.__steps_done - self.__interval_start_step >= self.LOG_EVERY_STEPS:
+            steps_per_sec = (self.__steps_done - self.__interval_start_step) / (step_end_time - self.__interval_start_time)
+            print(f"\nStep {self.__steps_done}: {round(steps_per_sec, 2)} steps/sec, {round(steps_per_sec * self.BATCH_SIZE, 1)} samples/sec")
+            self.__interval_start_time = step_end_time
+            self.__interval_start_step = self.__steps_done
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_steps = self.__steps_done - self.__epoch_start_step
+        epoch_secs = time.perf_counter() - self.__epoch_start_time
+        steps_per_sec = epoch_steps / epoch_secs if epoch_secs > 0 else 0.0
+
+        print(f"\nEpoch {epoch+1}: {round(steps_per_sec, 2)} steps/sec, {round(steps_per_sec * self.BATCH_SIZE, 1)} samples/sec")
+
+        # Added to logs, so kept in the History returned by model.fit()
+        if logs is not None:
+            logs["steps_per_sec"] = steps_per_sec
+            logs["samples_per_sec"] = steps_per_sec * self.BATCH_SIZE
\ No newline at end of file
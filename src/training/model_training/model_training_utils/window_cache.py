@@ -0,0 +1,163 @@
+import json
+import os
+import numpy as np
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+import tensorflow as tf
+
+from .dataset_manager import ChordsDatasetManager
+
+class WindowCache:
+    def __init__(self, cache_dir: str) -> None:
+
+        """
+        A chords dataset formatted and split into windows once, saved as .npy files and opened memory-mapped, so that
+        many processes, e.g., the workers of a hyperparameter sweep, read the same copy of the data from the page cache
+        instead of each loading and formatting the CSV with ChordsDatasetManager.
+
+        Only the input and output rows and the start row of every window are saved, for each sequence length, so the
+        cache is barely larger than the rows themselves. Windows are gathered from the memory-mapped rows batch by batch.
+        Create a cache with WindowCache.create().
+
+        Parameters:
+            cache_dir:  str. Directory of a cache created with WindowCache.create().
+        """
+
+        self.CACHE_DIR = cache_dir
+        with open(os.path.join(cache_dir, "meta.json")) as meta_file:
+            self.META = json.load(meta_file)
+
+        self.input_data = np.load(os.path.join(cache_dir, "input_data.npy"), mmap_mode="r")
+        self.output_data = np.load(os.path.join(cache_dir, "output_data.npy"), mmap_mode="r")
+        self.__window_starts = {}
+
+    @classmethod
+    def create(
+            cls,
+            cache_dir: str,
+            dataset_path: str,
+            sequence_lengths: list[int],
+            test_size: float = None,
+            random_state: int = None,
+            dtype: str = "float32"
+        ) -> "WindowCache":
+
+        """Format a chords dataset CSV and split its windows by song for each sequence length, as ChordsDatasetManager does for training, and save them to cache_dir."""
+        os.makedirs(cache_dir, exist_ok=True)
+
+        dataset_manager = ChordsDatasetManager(dataset_path, dtype=dtype)
+        dataset_manager.format_dataset()
+        np.save(os.path.join(cache_dir, "input_data.npy"), dataset_manager.get_input_data())
+        np.save(os.path.join(cache_dir, "output_data.npy"), dataset_manager.get_output_data())
+
+        for sequence_length in sorted(set(sequence_lengths)):
+            train_window_starts, test_window_starts = dataset_manager.get_split_window_starts(test_size, sequence_length, random_state)
+            np.save(os.path.join(cache_dir, f"train_window_starts_{sequence_length}.npy"), train_window_starts.astype(np.int64))
+            np.save(os.path.join(cache_dir, f"test_window_starts_{sequence_length}.npy"), test_window_starts.astype(np.int64))
+
+        # Written last, so that a cache whose creation was interrupted isn't mistaken for a complete one
+        with open(os.path.join(cache_dir, "meta.json"), "w") as meta_file:
+            json.dump(cls.get_source(dataset_path, sequence_lengths, test_size, random_state, dtype), meta_file, indent=2)
+        print(f"Saved window cache to {cache_dir}")
+
+        return cls(cache_dir)
+
+    @classmethod
+    def open_or_create(
+            cls,
+            cache_dir: str,
+            dataset_path: str,
+            sequence_lengths: list[int],
+            test_size: float = None,
+            random_state: int = None,
+            dtype: str = "float32"
+        ) -> "WindowCache":
+
+        """Open the cache in cache_dir if it was created from the same dataset file with the same settings, or create it."""
+        try:
+            with open(os.path.join(cache_dir, "meta.json")) as meta_file:
+                is_up_to_date = json.load(meta_file) == cls.get_source(dataset_path, sequence_lengths, test_size, random_state, dtype)
+        except (OSError, ValueError):
+            is_up_to_date = False
+
+        if is_up_to_date:
+            print(f"Using window cache in {cache_dir}")
+            return cls(cache_dir)
+        return cls.create(cache_dir, dataset_path, sequence_lengths, test_size, random_state, dtype)
+
+    @staticmethod
+    def get_source(dataset_path: str, sequence_lengths: list[int], test_size: float, random_state: int, dtype: str) -> dict:
+        """Get the dataset file and settings a cache is created from, which have to match for the cache to be reused."""
+        dataset_stat = os.stat(dataset_path)
+        return {
+            "dataset_path": os.path.abspath(dataset_path),
+            "dataset_size": dataset_stat.st_size,
+            "dataset_mtime": dataset_stat.st_mtime,
+            "sequence_lengths": sorted(set(sequence_lengths)),
+            "test_size": test_size,
+            "random_state": random_state,
+            "dtype": np.dtype(dtype).name
+        }
+
+    def get_window_starts(self, sequence_length: int) -> tuple[np.ndarray, np.ndarray]:
+        """Get the start rows of the training and test windows of sequence_length rows, memory-mapped."""
+        if sequence_length not in self.META["sequence_lengths"]:
+            raise ValueError(f"The window cache in {self.CACHE_DIR} holds no windows of length {sequence_length}. Cached lengths: {self.META['sequence_lengths']}.")
+
+        if sequence_length not in self.__window_starts:
+            self.__window_starts[sequence_length] = (
+                np.load(os.path.join(self.CACHE_DIR, f"train_window_starts_{sequence_length}.npy"), mmap_mode="r"),
+                np.load(os.path.join(self.CACHE_DIR, f"test_window_starts_{sequence_length}.npy"), mmap_mode="r")
+            )
+        return self.__window_starts[sequence_length]
+
+    def get_training_data(self, sequence_length: int, batch_size: int = 64) -> tf.data.Dataset:
+        return self.__make_windowed_dataset(self.get_window_starts(sequence_length)[0], sequence_length, batch_size)
+
+    def get_test_data(self, sequence_length: int, batch_size: int = 64) -> tf.data.Dataset:
+        return self.__make_windowed_dataset(self.get_window_starts(sequence_length)[1], sequence_length, batch_size)
+
+    def __make_windowed_dataset(self, window_starts: np.ndarray, sequence_length: int, batch_size: int) -> tf.data.Dataset:
+        """
+        Create a tf.data.Dataset yielding (input window, target) batches by gathering from the memory-mapped rows,
+        as ChordsDatasetManager does from its in-memory rows, the target of a window being the output row at its start.
+        """
+        window_offsets = np.arange(sequence_length)
+        input_data = self.input_data
+        output_data = self.output_data
+
+        def gather_windows(starts):
+            return input_data[starts[:, None] + window_offsets], output_data[starts]
+
+        def gather_windows_tensors(starts):
+            input_windows, targets = tf.numpy_function(gather_windows, [starts], (input_data.dtype, output_data.dtype))
+            input_windows.set_shape((None, sequence_length, input_data.shape[1]))
+            targets.set_shape((None, output_data.shape[1]))
+            return input_windows, targets
+
+        dataset = tf.data.Dataset.from_tensor_slices(np.asarray(window_starts))
+        dataset = dataset.batch(batch_size).map(gather_windows_tensors, num_parallel_calls=tf.data.AUTOTUNE)
+
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+if __name__ == "__main__":
+
+    # Check that the cached windows match those of ChordsDatasetManager: python -m model_training_utils.window_cache <dataset CSV> <cache dir>
+
+    import sys
+
+    dataset_path, cache_dir = sys.argv[1], sys.argv[2]
+
+    window_cache = WindowCache.create(cache_dir, dataset_path, [4, 8], test_size=0.3, random_state=0)
+
+    dataset_manager = ChordsDatasetManager(dataset_path, dtype="float32")
+    dataset_manager.format_dataset()
+    dataset_manager.test_train_split(test_size=0.3, sequence_length=8, batch_size=64, random_state=0)
+
+    for name, cached_data, data in [("training", window_cache.get_training_data(8), dataset_manager.get_training_data()),
+                                    ("test", window_cache.get_test_data(8), dataset_manager.get_test_data())]:
+        matches = all(np.array_equal(cached_inputs, inputs) and np.array_equal(cached_targets, targets)
+                      for (cached_inputs, cached_targets), (inputs, targets) in zip(cached_data, data))
+        print(f"Cached {name} windows match ChordsDatasetManager's: {matches}")
\ No newline at end of file
@@ -0,0 +1,305 @@
+"""
+Sweep ChordGeneratorModel hyperparameters, training several configurations at once in worker processes, and record the
+quality, size and single-note inference latency of each, to choose a model on the latency/quality frontier:
+
+    python sweep_chord_generator.py <dataset CSV> --lstm-units 256,256,128 512,512,256 512,1024,512 --sequence-lengths 4 8 --workers 4
+
+Configurations are the grid of the given values, or are read from a JSON list of configurations with --configs-path.
+The dataset is formatted and split into windows once, for every sequence length, into a memory-mapped WindowCache that
+all workers read, instead of each loading the CSV. Each worker trains one configuration at a time with its own bounded
+thread pools, so that the workers share the cores instead of each using all of them.
+
+Latency is measured after training, one model at a time with nothing else running, by predicting single input windows
+as ChordGenerator does for each melody note. Run with --help for all options.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+import numpy as np
+import tensorflow as tf
+
+from model_training_utils.window_cache import WindowCache
+from train_chord_generator import build_model, configure_threads, now, save_history
+from evaluate_chord_generator import evaluate_models
+
+# Window cache of each worker process, opened by init_worker()
+_window_cache = None
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Train many ChordGeneratorModel configurations in parallel and record their quality, size and latency.")
+
+    # Dataset, with the same defaults as train_chord_generator.py
+    parser.add_argument("dataset_path", help="Path to the chords dataset CSV file.")
+    parser.add_argument("--test-size", type=float, default=0.3, help="Share of the dataset held out for testing.")
+    parser.add_argument("--random-state", type=int, default=0, help="Seed for the test/train split and shuffling, the same for every configuration, and saved in each model's history.")
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float32", help="Dtype of the input and output data.")
+
+    # Grid of configurations
+    parser.add_argument("--lstm-units", nargs="+", default=["512,1024,512"], help="Units of the three LSTM layers of each configuration, e.g. 256,256,128.")
+    parser.add_argument("--sequence-lengths", type=int, nargs="+", default=[8], help="Bars per input sequence.")
+    parser.add_argument("--dropouts", type=float, nargs="+", default=[0.375], help="Input dropout of each LSTM layer.")
+    parser.add_argument("--learning-rates", type=float, nargs="+", default=[0.0001])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[64], help="Sequences per training step.")
+    parser.add_argument("--configs-path", default=None,
+                        help="JSON list of configurations to train instead of the grid, each a dict of lstm_units, sequence_length, dropout, learning_rate and batch_size, missing keys taking the first grid value.")
+
+    # Training, shared by all configurations
+    parser.add_argument("--epochs", type=int, default=25)
+    parser.add_argument("--patience", type=int, default=10, help="Epochs without improvement in loss before stopping early.")
+    parser.add_argument("--unroll", action="store_true", help="Unroll the LSTM layers over the fixed sequence length.")
+    parser.add_argument("--jit-compile", action="store_true", help="Compile the train step with XLA.")
+
+    # Workers and threads, 0 threads splits the cores between the workers
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 4), help="Configurations trained at once, each in its own process.")
+    parser.add_argument("--threads-per-worker", type=int, default=0, help="Intra-op threads of each worker.")
+
+    # Evaluation
+    parser.add_argument("--threshold", type=float, default=0.14, help="Chord note threshold of the note precision, recall and F1 the configurations are compared by.")
+    parser.add_argument("--eval-batch-size", type=int, default=4096, help="Test windows predicted together when evaluating.")
+    parser.add_argument("--latency-notes", type=int, default=200, help="Single-note predictions timed per configuration.")
+    parser.add_argument("--latency-threads", type=int, default=0, help="Intra-op threads when measuring latency, 0 for TensorFlow's default, as when generating chords live.")
+
+    # Output
+    parser.add_argument("--save-dir", default="./sweeps", help="Directory to save the sweep's models and results to.")
+    parser.add_argument("--cache-dir", default=None, help="Directory of the window cache, reused while the dataset and split settings are unchanged. Defaults to <save dir>/window_cache.")
+    parser.add_argument("--no-save", action="store_true", help="Don't save the trained models, only the results.")
+    parser.add_argument("--output-path", default=None, help="Path of the results JSON file. Defaults to results.json in the sweep's directory.")
+
+    return parser.parse_args(argv)
+
+def get_configs(args: argparse.Namespace) -> list[dict]:
+    """Get the configurations to train, from the JSON file if given, or the grid of the given values."""
+    grid = {
+        "lstm_units": [[int(units) for units in lstm_units.split(",")] for lstm_units in args.lstm_units],
+        "sequence_length": args.sequence_lengths,
+        "dropout": args.dropouts,
+        "learning_rate": args.learning_rates,
+        "batch_size": args.batch_sizes
+    }
+
+    if args.configs_path is not None:
+        with open(args.configs_path) as configs_file:
+            configs = [dict({key: values[0] for key, values in grid.items()}, **config) for config in json.load(configs_file)]
+    else:
+        configs = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+    for config in configs:
+        if len(config["lstm_units"]) != 3:
+            raise ValueError(f"Expected the units of three LSTM layers. Received {config['lstm_units']}.")
+    return configs
+
+def get_config_name(config: dict) -> str:
+    return f"lstm-{'-'.join(str(units) for units in config['lstm_units'])}_sq-{config['sequence_length']}_btch-{config['batch_size']}_lr-{config['learning_rate']}_dropout-{config['dropout']}"
+
+def get_model_args(config: dict, args: argparse.Namespace) -> argparse.Namespace:
+    """Get the arguments train_chord_generator.build_model() expects for a configuration."""
+    return argparse.Namespace(
+        lstm_units=config["lstm_units"],
+        sequence_length=config["sequence_length"],
+        dropout=config["dropout"],
+        learning_rate=config["learning_rate"],
+        unroll=args.unroll,
+        jit_compile=args.jit_compile,
+        steps_per_execution=1
+    )
+
+def init_worker(intra_op_threads: int, inter_op_threads: int, cache_dir: str) -> None:
+    """Size the worker's thread pools before it runs any ops, and open the window cache it shares with the other workers."""
+    global _window_cache
+    configure_threads(intra_op_threads, inter_op_threads)
+    _window_cache = WindowCache(cache_dir)
+
+def train_config(config_index: int, config: dict, args: argparse.Namespace, sweep_dir: str) -> dict:
+    """Train and evaluate one configuration in a worker, returning its results."""
+    name = get_config_name(config)
+    print(f"Training configuration {config_index}: {name}")
+
+    model, _ = build_model(get_model_args(config, args))
+    callbacks = [tf.keras.callbacks.EarlyStopping(monitor='loss', patience=args.patience)]
+
+    start_time = time.time()
+    history = model.fit(
+        _window_cache.get_training_data(config["sequence_length"], config["batch_size"]),
+        epochs=args.epochs,
+        callbacks=callbacks,
+        verbose=0
+    )
+    train_secs = time.time() - start_time
+
+    evaluation = evaluate_models({name: model}, _window_cache.get_test_data(config["sequence_length"], args.eval_batch_size), [args.threshold])["models"][name]
+
+    num_params = int(model.count_params())
+    result = {
+        "config_index": config_index,
+        "name": name,
+        "config": config,
+        "model_path": None,
+        "train_secs": train_secs,
+        "epochs_trained": len(history.history["loss"]),
+        "loss": float(history.history["loss"][-1]),
+        "num_params": num_params,
+        "weights_mb": num_params * 4 / 2**20,
+        "mse": evaluation["mse"],
+        "r2": evaluation["r2"],
+        "precision": evaluation["notes"][str(args.threshold)]["precision"],
+        "recall": evaluation["notes"][str(args.threshold)]["recall"],
+        "f1": evaluation["notes"][str(args.threshold)]["f1"]
+    }
+
+    # A failed save keeps the configuration's results, its latency then being measured on a freshly built model
+    if not args.no_save:
+        try:
+            result["model_path"] = save_model(model, history, config, args, sweep_dir, f"{config_index}_{name}")
+        except Exception as e:
+            print(f"Configuration {config_index} trained, but its model couldn't be saved: {e}")
+            result["save_error"] = f"{type(e).__name__}: {e}"
+
+    tf.keras.backend.clear_session()
+
+    return result
+
+def save_model(model: any, history: tf.keras.callbacks.History, config: dict, args: argparse.Namespace, sweep_dir: str, run_name: str) -> str:
+    """
+    Save a configuration's model, and its history in history/<run name>.json next to it with the arguments and configuration
+    it was trained with, as train_chord_generator.py does, so that evaluate_chord_generator.py tests it on the same split.
+    Returns the model path.
+    """
+    model_path = os.path.join(sweep_dir, run_name)
+    model.save(model_path)
+
+    history_path = os.path.join(sweep_dir, "history", f"{run_name}.json")
+    os.makedirs(os.path.dirname(history_path), exist_ok=True)
+    save_history(argparse.Namespace(**dict(vars(args), **config)), history, history_path)
+
+    return model_path
+
+def measure_latency(config: dict, args: argparse.Namespace, model_path: str = None) -> dict:
+    """
+    Time single-note predictions of a configuration, each of one input window as ChordGenerator predicts for a melody note,
+    with the saved model if there is one, as it is served, or else a freshly built model of the same architecture.
+    """
+    if model_path is not None:
+        model = tf.keras.models.load_model(model_path)
+    else:
+        # Traced into a graph, as the saved model's call is, rather than run eagerly
+        model = tf.function(build_model(get_model_args(config, args))[0])
+
+    # Real input windows, as the latency of some ops depends on their values
+    _, test_window_starts = _window_cache.get_window_starts(config["sequence_length"])
+    window_starts = np.asarray(test_window_starts[:args.latency_notes])
+    input_windows = _window_cache.input_data[window_starts[:, None] + np.arange(config["sequence_length"])].astype(np.float32)
+
+    # Warm up, as the first calls trace the model
+    for input_window in input_windows[:10]:
+        model(input_window[np.newaxis])
+
+    latencies_ms = []
+    for input_window in input_windows:
+        start_time = time.perf_counter()
+        np.array(model(input_window[np.newaxis]))
+        latencies_ms.append((time.perf_counter() - start_time) * 1000)
+
+    tf.keras.backend.clear_session()
+
+    return {
+        "latency_ms": float(np.median(latencies_ms)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99))
+    }
+
+def mark_frontier(results: list[dict]) -> None:
+    """
+    Mark the configurations no other configuration beats in both latency and note F1, i.e., on the latency/quality frontier.
+    Configurations whose latency couldn't be measured are left off it.
+    """
+    measured_results = [result for result in results if not np.isnan(result["latency_ms"])]
+    for result in results:
+        result["on_frontier"] = not np.isnan(result["latency_ms"]) and not any(
+            other["latency_ms"] <= result["latency_ms"] and other["f1"] >= result["f1"] and (other["latency_ms"] < result["latency_ms"] or other["f1"] > result["f1"])
+            for other in measured_results
+        )
+
+def print_results(results: list[dict], threshold: float) -> None:
+    print(f"{'':>2} {'#':>3} {'LSTM units':<16} {'seq':>4} {'batch':>6} {'lr':>8} {'dropout':>8} {'params':>10} {'MB':>7} {'MSE':>10} {'R²':>8} {'F1@' + str(threshold):>9} {'ms':>8} {'p99 ms':>8} {'train secs':>11}")
+    for result in sorted(results, key=lambda result: (np.isnan(result["latency_ms"]), result["latency_ms"])):
+        config = result["config"]
+        print(f"{'*' if result['on_frontier'] else '':>2} {result['config_index']:>3} {','.join(str(units) for units in config['lstm_units']):<16} {config['sequence_length']:>4} {config['batch_size']:>6} {config['learning_rate']:>8} {config['dropout']:>8} "
+              f"{result['num_params']:>10} {result['weights_mb']:>7.2f} {result['mse']:>10.6f} {result['r2']:>8.4f} {result['f1']:>9.4f} {result['latency_ms']:>8.3f} {result['latency_p99_ms']:>8.3f} {result['train_secs']:>11.1f}")
+    print("* On the latency/quality frontier: no other configuration is both faster and has a higher note F1")
+
+def main(argv: list[str] = None) -> None:
+    args = parse_args(argv)
+    configs = get_configs(args)
+
+    sweep_dir = os.path.join(args.save_dir, f"{now()}_sweep")
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    # Format and window the dataset once for all configurations
+    cache_dir = args.cache_dir or os.path.join(args.save_dir, "window_cache")
+    WindowCache.open_or_create(cache_dir, args.dataset_path, [config["sequence_length"] for config in configs], args.test_size, args.random_state, args.dtype)
+
+    # Spawned rather than forked workers, as TensorFlow can't be used in forked processes
+    num_workers = max(1, min(args.workers, len(configs)))
+    threads_per_worker = args.threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+    print(f"Training {len(configs)} configurations, {num_workers} at a time with {threads_per_worker} threads each...")
+
+    start_time = time.time()
+    results = []
+    failed_configs = []
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker, initargs=(threads_per_worker, 2, cache_dir)) as executor:
+        futures = {executor.submit(train_config, config_index, config, args, sweep_dir): config_index for config_index, config in enumerate(configs)}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Configuration {futures[future]} failed: {e}")
+                failed_configs.append({"config_index": futures[future], "config": configs[futures[future]], "error": str(e)})
+                continue
+            results.append(result)
+            print(f"Trained configuration {result['config_index']} in {round(result['train_secs'], 1)} secs ({len(results) + len(failed_configs)}/{len(configs)}): MSE {round(result['mse'], 6)}, F1 {round(result['f1'], 4)}")
+    print(f"Trained {len(results)} configurations in {round(time.time() - start_time, 1)} secs")
+
+    # Measure latency one configuration at a time, so that no other work competes for the cores,
+    # keeping the results of the configurations whose latency can't be measured, with the error
+    print("Measuring single-note latency...")
+    executor = None
+    try:
+        for result in results:
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                               initializer=init_worker, initargs=(args.latency_threads, 0, cache_dir))
+            try:
+                result.update(executor.submit(measure_latency, result["config"], args, result["model_path"]).result())
+            except Exception as e:
+                print(f"Unable to measure the latency of configuration {result['config_index']}: {e}")
+                result.update(latency_ms=float("nan"), latency_p99_ms=float("nan"), latency_error=f"{type(e).__name__}: {e}")
+
+                # Start a new worker for the next configuration if this one died
+                if isinstance(e, BrokenProcessPool):
+                    executor.shutdown()
+                    executor = None
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if results:
+        mark_frontier(results)
+        print_results(results, args.threshold)
+
+    output_path = args.output_path or os.path.join(sweep_dir, "results.json")
+    with open(output_path, "w") as output_file:
+        json.dump({"args": vars(args), "results": sorted(results, key=lambda result: result["config_index"]), "failed": failed_configs}, output_file, indent=2)
+    print(f"Saved results to {output_path}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,262 @@
+"""
+Command line entry point for training ChordGeneratorModel on a chords dataset CSV, with the same defaults
+as chord_generator_model_training.ipynb, plus options for training faster on CPU-only machines:
+
+    python train_chord_generator.py <dataset CSV> --dtype float32 --jit-compile --unroll --intra-op-threads 16
+
+With --num-workers N, the script launches N copies of itself as a MultiWorkerMirroredStrategy cluster on this
+machine, each training on its own shard of the data with its own thread pools, and the chief (worker 0) saving
+the model. Run with --help for all options.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # Gets TensorFlow to shut up...
+os.environ.setdefault('TF_USE_LEGACY_KERAS', '1') # Models are Keras 2 SavedModels, loaded with tf_keras on TensorFlow >= 2.16
+
+import numpy as np
+import tensorflow as tf
+
+from model_training_utils.dataset_manager import ChordsDatasetManager
+from model_training_utils.chord_generator_model import ChordGeneratorModel
+from model_training_utils.training_callbacks import StepsPerSecondLogger
+from model_training_utils.multi_worker import get_worker_index, is_chief, launch_local_workers
+
+def now():
+    # Get current date and time and generate string
+    now = datetime.datetime.now()
+    now_string = now.strftime("%Y-%m-%d_%H-%M-%S")
+
+    return now_string
+
+def model_save_paths(save_dir, sequence_length, batch_size, learning_rate, LSTM_dropout, epochs):
+    run_name = f"{now()}_chord_generator_sq-{sequence_length}_btch-{batch_size}_lr-{learning_rate}_dropout-{LSTM_dropout}_epoch-{epochs}"
+    model_save_location = os.path.join(save_dir, run_name)
+    history_save_location = os.path.join(save_dir, "history", f"{run_name}.json")
+
+    return (model_save_location, history_save_location)
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Train a ChordGeneratorModel on a chords dataset CSV.")
+
+    # Dataset
+    parser.add_argument("dataset_path", help="Path to the chords dataset CSV file.")
+    parser.add_argument("--test-size", type=float, default=0.3, help="Share of the dataset held out for testing.")
+    parser.add_argument("--sequence-length", type=int, default=8, help="Bars per input sequence.")
+    parser.add_argument("--batch-size", type=int, default=64, help="Sequences per training step, per worker.")
+    parser.add_argument("--random-state", type=int, default=None, help="Seed for the test/train split and shuffling, drawn and saved in the history if not given.")
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float32",
+                        help="Dtype of the input and output data. float32 matches the model's weights, avoiding a cast every step.")
+
+    # Model
+    parser.add_argument("--lstm-units", type=int, nargs=3, default=[512, 1024, 512], metavar=("LSTM1", "LSTM2", "LSTM3"),
+                        help="Units in each of the three LSTM layers.")
+    parser.add_argument("--dropout", type=float, default=0.375, help="Input dropout of each LSTM layer.")
+    parser.add_argument("--unroll", action="store_true",
+                        help="Unroll the LSTM layers over the fixed sequence length, usually faster on CPU for short sequences.")
+
+    # Training
+    parser.add_argument("--epochs", type=int, default=25)
+    parser.add_argument("--learning-rate", type=float, default=0.0001)
+    parser.add_argument("--patience", type=int, default=10, help="Epochs without improvement in loss before stopping early.")
+    parser.add_argument("--jit-compile", action="store_true", help="Compile the train step with XLA.")
+    parser.add_argument("--steps-per-execution", type=int, default=1,
+                        help="Train steps run per call into the compiled train function, reducing Python overhead per step.")
+
+    # Workers and threads, 0 threads lets TensorFlow choose, or splits the cores between workers with multiple workers
+    parser.add_argument("--num-workers", type=int, default=1, help="Worker processes for data-parallel training on this machine.")
+    parser.add_argument("--intra-op-threads", type=int, default=0, help="Threads used within a single op, e.g. a matrix multiply, per worker.")
+    parser.add_argument("--inter-op-threads", type=int, default=0, help="Threads used to run independent ops in parallel, per worker.")
+
+    # Output
+    parser.add_argument("--log-every-steps", type=int, default=100, help="Interval in steps between throughput prints, 0 for per epoch only.")
+    parser.add_argument("--verbose", type=int, choices=[0, 1, 2], default=1, help="Keras fit verbosity, 2 for one line per epoch without a progress bar.")
+    parser.add_argument("--save-dir", default="./trained_models", help="Directory to save the trained model and history to.")
+    parser.add_argument("--checkpoint", action="store_true", help="Save a checkpoint of the model after every epoch.")
+    parser.add_argument("--no-save", action="store_true", help="Don't save the trained model and history, e.g. for benchmarking.")
+    parser.add_argument("--history-path", default=None, help="Also write the training history, including throughput, to this JSON file.")
+    parser.add_argument("--evaluate", action="store_true", help="Evaluate the trained model on the test data.")
+
+    return parser.parse_args(argv)
+
+def configure_threads(intra_op_threads: int, inter_op_threads: int, num_workers: int = 1) -> None:
+    """
+    Set TensorFlow's thread pool sizes. Must be called before TensorFlow runs any ops.
+    With multiple workers, unset pool sizes are chosen so the workers share the cores instead of each using all of them.
+    """
+    if num_workers > 1:
+        if intra_op_threads == 0:
+            intra_op_threads = max(1, os.cpu_count() // num_workers)
+        if inter_op_threads == 0:
+            inter_op_threads = 2
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    print(f"Intra-op threads: {tf.config.threading.get_intra_op_parallelism_threads() or 'auto'}, inter-op threads: {tf.config.threading.get_inter_op_parallelism_threads() or 'auto'}")
+
+def load_dataset(args: argparse.Namespace) -> ChordsDatasetManager:
+    # Load dataset
+    dataset_manager = ChordsDatasetManager(args.dataset_path, dtype=args.dtype)
+
+    # Format dataset
+    dataset_manager.format_dataset()
+
+    # Split dataset into train and test sections
+    dataset_manager.test_train_split(test_size=args.test_size, sequence_length=args.sequence_length, batch_size=args.batch_size, random_state=args.random_state)
+
+    return dataset_manager
+
+def build_model(args: argparse.Namespace, num_inputs: int = 13, num_outputs: int = 12) -> tuple[ChordGeneratorModel, list]:
+    # Initialise model
+    model = ChordGeneratorModel(
+        args.lstm_units[0],
+        args.lstm_units[1],
+        args.lstm_units[2],
+        num_inputs=num_inputs,
+        num_outputs=num_outputs,
+        dropout=args.dropout,
+        unroll=args.unroll
+    )
+
+    model.build((None, args.sequence_length, num_inputs))
+
+    # Define evaluation metrics, as in the training notebook
+    metrics = [
+        tf.keras.metrics.Accuracy(),
+        tf.keras.metrics.MeanAbsoluteError(),
+        tf.keras.metrics.MeanAbsolutePercentageError(),
+        tf.keras.metrics.R2Score(),
+        tf.keras.metrics.RootMeanSquaredError()
+    ]
+
+    # Compile model
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=args.learning_rate),
+        loss=tf.keras.losses.MeanSquaredLogarithmicError(),
+        metrics=metrics,
+        jit_compile=args.jit_compile,
+        steps_per_execution=args.steps_per_execution
+    )
+
+    return model, metrics
+
+def get_training_data(args: argparse.Namespace, dataset_manager: ChordsDatasetManager, strategy: tf.distribute.Strategy) -> tuple[tf.data.Dataset, int]:
+    """Get the training data and the steps per epoch, which have to be given to model.fit() with multiple workers."""
+    if args.num_workers <= 1:
+        return dataset_manager.get_training_data(), None
+
+    # Each worker reads batches of only its own shard of the training windows. Shards are the same size,
+    # so every worker runs the same number of steps. Repeated, as the steps per epoch are given explicitly
+    steps_per_epoch = int(dataset_manager.get_training_data_shard(args.num_workers, get_worker_index()).cardinality())
+    training_data = strategy.distribute_datasets_from_function(
+        lambda input_context: dataset_manager.get_training_data_shard(input_context.num_input_pipelines, input_context.input_pipeline_id).repeat())
+
+    return training_data, steps_per_epoch
+
+def get_callbacks(args: argparse.Namespace) -> list:
+    callbacks = [
+        tf.keras.callbacks.EarlyStopping(monitor='loss', patience=args.patience)
+    ]
+
+    # Throughput is reported by the chief, for the samples of all workers
+    if is_chief():
+        callbacks.append(StepsPerSecondLogger(args.batch_size * args.num_workers, log_every_steps=args.log_every_steps))
+
+    if args.checkpoint:
+        callbacks.append(tf.keras.callbacks.ModelCheckpoint(
+            filepath=os.path.join(args.save_dir, "model_checkpoints", f"{now()}_chord_generator_sql-{args.sequence_length}_btch-{args.batch_size}_lr-{args.learning_rate}_dr-{args.dropout}"),
+            verbose=1
+        ))
+
+    return callbacks
+
+def save_history(args: argparse.Namespace, history: tf.keras.callbacks.History, history_save_path: str) -> None:
+    # Save model history dict to json, along with the settings it was trained with
+    model_history_data = {key: [float(value) for value in values] for key, values in history.history.items()}
+    model_history_data["args"] = vars(args)
+    json.dump(model_history_data, open(history_save_path, "w+"))
+    print(f"Saved model history to {history_save_path}")
+
+def save_model(args: argparse.Namespace, model: ChordGeneratorModel, history: tf.keras.callbacks.History) -> None:
+    # Saving runs collective ops under MultiWorkerMirroredStrategy, so every worker saves, but only the chief keeps its copy
+    if not is_chief():
+        temp_save_path = tempfile.mkdtemp()
+        model.save(os.path.join(temp_save_path, "model"))
+        shutil.rmtree(temp_save_path, ignore_errors=True)
+        return
+
+    # Generate save paths for model and history json
+    model_save_path, history_save_path = model_save_paths(args.save_dir, args.sequence_length, args.batch_size, args.learning_rate, args.dropout, args.epochs)
+    os.makedirs(os.path.dirname(history_save_path), exist_ok=True)
+
+    # Save model
+    model.save(model_save_path)
+    print(f"Saved model to {model_save_path}")
+
+    save_history(args, history, history_save_path)
+
+def main(argv: list[str] = None) -> None:
+    args = parse_args(argv)
+
+    # Draw a seed if none is given, so that the split can be reproduced from the saved history,
+    # and so that all workers split the songs the same way and train on disjoint shards of the same training windows
+    if args.random_state is None:
+        args.random_state = int(np.random.randint(0, 2**31))
+        print(f"Splitting and shuffling with random state {args.random_state}")
+
+    # Launch the workers, each of which runs this script again as part of the cluster, with the same seed
+    if args.num_workers > 1 and get_worker_index() is None:
+        worker_args = (sys.argv[1:] if argv is None else argv) + ["--random-state", str(args.random_state)]
+        sys.exit(launch_local_workers(os.path.abspath(__file__), worker_args, args.num_workers))
+
+    configure_threads(args.intra_op_threads, args.inter_op_threads, args.num_workers)
+
+    # Collectives between worker processes on one machine run over the loopback interface with ring all-reduce
+    if args.num_workers > 1:
+        strategy = tf.distribute.MultiWorkerMirroredStrategy(
+            communication_options=tf.distribute.experimental.CommunicationOptions(
+                implementation=tf.distribute.experimental.CommunicationImplementation.RING))
+        print(f"Worker {get_worker_index()} of {strategy.num_replicas_in_sync} started")
+    else:
+        strategy = tf.distribute.get_strategy()
+
+    dataset_manager = load_dataset(args)
+
+    with strategy.scope():
+        model, metrics = build_model(args)
+    if is_chief():
+        model.summary()
+
+    # Train model
+    training_data, steps_per_epoch = get_training_data(args, dataset_manager, strategy)
+    history = model.fit(
+        training_data,
+        epochs=args.epochs,
+        steps_per_epoch=steps_per_epoch,
+        callbacks=get_callbacks(args),
+        verbose=args.verbose if is_chief() else 0
+    )
+
+    if not args.no_save:
+        save_model(args, model, history)
+    if args.history_path is not None and is_chief():
+        save_history(args, history, args.history_path)
+
+    # Print evaluation results
+    if args.evaluate:
+        score = model.evaluate(dataset_manager.get_test_data(), verbose=args.verbose if is_chief() else 0)
+        if not is_chief():
+            return
+        for i, score_result in enumerate(score):
+            if i == 0:
+                print(f"loss: {score_result}")
+            else:
+                print(f"{metrics[i-1].name}: {score_result}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file